@@ -0,0 +1,59 @@
+"""
+Microbenchmark for AVP extraction plans.
+
+Compares reading the Charging-Rule-Install and Charging-Rule-Remove AVPs of a
+RAR with one `AvpPlan` pass over the bytes of a lazily decoded message, with
+decoding the full message. Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_avp_plan.py
+"""
+import timeit
+
+from diameter.message import Message
+from diameter.message.avp.grouped import ChargingRuleInstall, ChargingRuleRemove
+from diameter.message.commands import ReAuthRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+from diameter_telecom.diameter.parse_avp import check_charging_rules
+from diameter_telecom.subscriber import Subscriber
+
+N = 100_000
+
+
+def build_rar(n_rules: int) -> ReAuthRequest:
+    rar = ReAuthRequest()
+    rar.header.application_id = APP_3GPP_GX
+    rar.header.hop_by_hop_identifier = 1
+    rar.header.end_to_end_identifier = 1
+    rar.session_id = "pcef.python.realm;1;1"
+    rar.origin_host = b"pcrf.python.realm"
+    rar.origin_realm = b"python.realm"
+    rar.destination_realm = b"python.realm"
+    rar.destination_host = b"pcef.python.realm"
+    rar.auth_application_id = APP_3GPP_GX
+    rar.re_auth_request_type = E_RE_AUTH_REQUEST_TYPE_AUTHORIZE_ONLY
+    rar.subscription_id = Subscriber(msisdn="5511999990000", imsi="724000000000000").subscription_id()
+    rar.charging_rule_install = [ChargingRuleInstall(charging_rule_name=[f"rule-{i}".encode() for i in range(n_rules)])]
+    rar.charging_rule_remove = [ChargingRuleRemove(charging_rule_name=[b"rule-old"])]
+    return rar
+
+
+def report(label: str, seconds: float, number: int):
+    print(f"{label:<32} {seconds / number * 1e9:10.1f} ns/op")
+
+
+def main():
+    for n_rules in (1, 10):
+        data = build_rar(n_rules).as_bytes()
+        lazy = DiameterMessage(data)
+
+        def decode():
+            message = Message.from_bytes(data)
+            return message.charging_rule_install, message.charging_rule_remove
+
+        report(f"plan, {n_rules} rules", timeit.timeit(lambda: check_charging_rules(lazy), number=N), N)
+        report(f"full decode, {n_rules} rules", timeit.timeit(decode, number=N // 10), N // 10)
+
+
+if __name__ == "__main__":
+    main()
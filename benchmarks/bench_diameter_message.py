@@ -0,0 +1,65 @@
+"""
+Microbenchmark for the DiameterMessage wrapper.
+
+Measures construction cost, attribute access latency, equality/hash cost and
+memory per wrapped message. Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_diameter_message.py
+"""
+import timeit
+import tracemalloc
+
+from diameter.message.commands import CreditControlRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+from diameter_telecom.subscriber import Subscriber
+
+N = 200_000
+
+
+def build_ccr(hop_by_hop_id: int) -> CreditControlRequest:
+    ccr = CreditControlRequest()
+    ccr.header.application_id = APP_3GPP_GX
+    ccr.header.hop_by_hop_identifier = hop_by_hop_id
+    ccr.header.end_to_end_identifier = hop_by_hop_id
+    ccr.session_id = f"pcef.python.realm;1;{hop_by_hop_id}"
+    ccr.origin_host = b"pcef.python.realm"
+    ccr.origin_realm = b"python.realm"
+    ccr.destination_realm = b"python.realm"
+    ccr.auth_application_id = APP_3GPP_GX
+    ccr.cc_request_type = E_CC_REQUEST_TYPE_UPDATE_REQUEST
+    ccr.cc_request_number = 1
+    ccr.subscription_id = Subscriber(msisdn="5511999990000", imsi="724000000000000").subscription_id()
+    return ccr
+
+
+def report(label: str, seconds: float, number: int):
+    print(f"{label:<32} {seconds / number * 1e9:10.1f} ns/op")
+
+
+def main():
+    ccr = build_ccr(1)
+    diameter_message = DiameterMessage(ccr)
+    diameter_message.timestamp = 1.0
+    other = DiameterMessage(build_ccr(2))
+
+    report("construct", timeit.timeit(lambda: DiameterMessage(ccr), number=N), N)
+    report("get timestamp", timeit.timeit(lambda: diameter_message.timestamp, number=N), N)
+    report("set timestamp", timeit.timeit(lambda: setattr(diameter_message, "timestamp", 2.0), number=N), N)
+    report("get hop_by_hop_id", timeit.timeit(lambda: diameter_message.hop_by_hop_id, number=N), N)
+    report("get session_id", timeit.timeit(lambda: diameter_message.session_id, number=N), N)
+    report("get cc_request_number", timeit.timeit(lambda: diameter_message.cc_request_number, number=N), N)
+    report("__eq__", timeit.timeit(lambda: diameter_message == other, number=N), N)
+    report("__hash__", timeit.timeit(lambda: hash(diameter_message), number=N), N)
+
+    messages = [build_ccr(i) for i in range(10_000)]
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    wrapped = [DiameterMessage(message) for message in messages]
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{'memory per wrapper':<32} {(after - before) / len(wrapped):10.1f} bytes")
+
+
+if __name__ == "__main__":
+    main()
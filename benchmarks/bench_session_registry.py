@@ -0,0 +1,103 @@
+"""
+Contention benchmark for the session registry.
+
+Handler threads add, look up (by Session-Id and by Framed-IP-Address) and
+remove their own sessions, the way the Gx handlers do for CCR-I/U/T. The
+sharded registry is compared with a plain dict guarded by one global lock, at
+1, 4, 16 and 64 threads. Run from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_session_registry.py
+"""
+import threading
+import time
+
+from diameter_telecom.diameter.session import GxSession, SessionRegistry
+
+THREAD_COUNTS = (1, 4, 16, 64)
+OPERATIONS = 400_000  # Split between the threads
+LOOKUPS_PER_SESSION = 4
+
+
+class GlobalLockRegistry:
+    """Sessions and their Framed-IP index behind a single lock."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.by_framed_ip_address = {}
+
+    def add(self, session):
+        with self.lock:
+            self.sessions[session.session_id] = session
+            self.by_framed_ip_address[session.framed_ip_address] = session.session_id
+
+    def get(self, session_id):
+        with self.lock:
+            return self.sessions.get(session_id)
+
+    def get_by_index(self, name, framed_ip_address):
+        with self.lock:
+            session_id = self.by_framed_ip_address.get(framed_ip_address)
+            return self.sessions.get(session_id) if session_id else None
+
+    def remove(self, session_id):
+        with self.lock:
+            session = self.sessions.pop(session_id, None)
+            if session and self.by_framed_ip_address.get(session.framed_ip_address) == session_id:
+                del self.by_framed_ip_address[session.framed_ip_address]
+
+
+def sharded_registry():
+    registry = SessionRegistry()
+    registry.add_index("framed_ip_address", lambda session: session.framed_ip_address)
+    return registry
+
+
+def build_sessions(thread: int, n: int):
+    sessions = []
+    for i in range(n):
+        session = GxSession(f"pcef.python.realm;{thread};{i}")
+        session.framed_ip_address = f"10.{thread}.{i >> 8 & 0xff}.{i & 0xff}"
+        sessions.append(session)
+    return sessions
+
+
+def worker(registry, sessions, barrier):
+    barrier.wait()
+    for session in sessions:
+        registry.add(session)
+        for _ in range(LOOKUPS_PER_SESSION):
+            registry.get(session.session_id)
+            registry.get_by_index("framed_ip_address", session.framed_ip_address)
+    for session in sessions:
+        registry.remove(session.session_id)
+
+
+def run(factory, n_threads: int) -> float:
+    operations_per_session = 2 + 2 * LOOKUPS_PER_SESSION
+    per_thread = OPERATIONS // operations_per_session // n_threads
+    registry = factory()
+    barrier = threading.Barrier(n_threads + 1)
+    threads = [threading.Thread(target=worker, args=(registry, build_sessions(t, per_thread), barrier))
+               for t in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert len(registry.sessions if isinstance(registry, GlobalLockRegistry) else registry) == 0
+    return per_thread * n_threads * operations_per_session / elapsed
+
+
+def main():
+    print(f"{'threads':>8} {'global lock':>16} {'sharded':>16}")
+    for n_threads in THREAD_COUNTS:
+        global_lock = run(GlobalLockRegistry, n_threads)
+        sharded = run(sharded_registry, n_threads)
+        print(f"{n_threads:>8} {global_lock:>12.0f} op/s {sharded:>12.0f} op/s")
+
+
+if __name__ == "__main__":
+    main()
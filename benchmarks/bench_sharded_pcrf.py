@@ -0,0 +1,124 @@
+"""
+Loopback throughput benchmark for the sharded PCRF.
+
+Client processes, each a PCEF with its own connection, send CCR-I and CCR-T
+pairs with windowed `send_many` to a single process `PCRF`, then to a
+`ShardedPCRF` with 1, 2 and 4 shards. Throughput is the total of requests
+answered over the wall time; it can only scale with the shards while the
+machine has cores for the shards, the front process and the clients. Set
+HANDLER_WORK_US to add CPU work per request, like heavier policy logic. Run
+from the repository root with:
+
+    PYTHONPATH=src python benchmarks/bench_sharded_pcrf.py
+"""
+import multiprocessing
+import os
+import time
+
+from diameter.message.avp.grouped import SubscriptionId
+from diameter.message.commands import CreditControlRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+from diameter_telecom.diameter.handle_request import handle_request_gx
+from diameter_telecom.entities_3gpp import PCEF, PCRF
+from diameter_telecom.entities_3gpp.sharded_pcrf import ShardedPCRF
+
+SHARD_COUNTS = (0, 1, 2, 4)  # 0 is the single process PCRF
+CLIENTS = 4
+SESSIONS_PER_CLIENT = 2_000
+WINDOW = 256
+HANDLER_WORK_US = 0
+BASE_PORT = 23868
+
+
+def busy_handler(app, message):
+    deadline = time.perf_counter() + HANDLER_WORK_US / 1e6
+    while time.perf_counter() < deadline:
+        pass
+    return handle_request_gx(app, message)
+
+
+def build_ccr(client: int, i: int, request_type: int) -> DiameterMessage:
+    ccr = CreditControlRequest()
+    ccr.session_id = f"pcef{client}.realm;1;{i}"
+    ccr.origin_host = f"pcef{client}.realm".encode()
+    ccr.origin_realm = b"realm"
+    ccr.destination_host = b"pcrf.realm"
+    ccr.destination_realm = b"realm"
+    ccr.auth_application_id = APP_3GPP_GX
+    ccr.service_context_id = "32251@3gpp.org"
+    ccr.cc_request_type = request_type
+    ccr.cc_request_number = 0 if request_type == E_CC_REQUEST_TYPE_INITIAL_REQUEST else 1
+    ccr.called_station_id = "internet"
+    ccr.subscription_id = [SubscriptionId(subscription_id_type=E_SUBSCRIPTION_ID_TYPE_END_USER_E164,
+                                          subscription_id_data=f"55119{client:02d}{i:06d}")]
+    if request_type == E_CC_REQUEST_TYPE_INITIAL_REQUEST:
+        ccr.framed_ip_address = bytes([10, client, i >> 8 & 0xff, i & 0xff])
+    message = DiameterMessage(ccr)
+    message.timestamp = time.time()
+    return message
+
+
+def pcef(client: int, port: int) -> PCEF:
+    return PCEF(f"pcef{client}.realm", "realm", ["127.0.0.1"], tcp_port=port + 1 + client)
+
+
+def client(index: int, port: int, barrier, results):
+    entity = pcef(index, port)
+    entity.add_peer(PCRF("pcrf.realm", "realm", ["127.0.0.1"], tcp_port=port), initiate_connection=True)
+    entity.start()
+    entity.gx_app.wait_for_ready()
+    entity.gx_app.set_request_window(WINDOW)
+    barrier.wait()
+    start = time.perf_counter()
+    answered = 0
+    for request_type in (E_CC_REQUEST_TYPE_INITIAL_REQUEST, E_CC_REQUEST_TYPE_TERMINATION_REQUEST):
+        requests = (build_ccr(index, i, request_type) for i in range(SESSIONS_PER_CLIENT))
+        for future in entity.gx_app.send_many(requests, timeout=60):
+            answered += not future.exception() and future.result().result_code == E_RESULT_CODE_DIAMETER_SUCCESS
+    results.put((answered, time.perf_counter() - start))
+    results.close()
+    results.join_thread()
+    # Stopping the node waits on its threads for seconds
+    os._exit(0)
+
+
+def run(n_shards: int, port: int) -> float:
+    handler = busy_handler if HANDLER_WORK_US else handle_request_gx
+    if n_shards:
+        server = ShardedPCRF("pcrf.realm", "realm", ["127.0.0.1"], tcp_port=port, n_shards=n_shards, request_handler=handler)
+    else:
+        server = PCRF("pcrf.realm", "realm", ["127.0.0.1"], tcp_port=port, max_threads=8, request_handler=handler)
+    for index in range(CLIENTS):
+        server.add_peer(pcef(index, port))
+    server.start()
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(CLIENTS + 1)
+    results = context.Queue()
+    clients = [context.Process(target=client, args=(index, port, barrier, results)) for index in range(CLIENTS)]
+    for process in clients:
+        process.start()
+    barrier.wait()
+    answered, elapsed = 0, 0.0
+    for _ in clients:
+        client_answered, client_elapsed = results.get()
+        answered += client_answered
+        elapsed = max(elapsed, client_elapsed)
+    for process in clients:
+        process.join()
+    assert answered == CLIENTS * SESSIONS_PER_CLIENT * 2, answered
+    server.stop()
+    return answered / elapsed
+
+
+def main():
+    print(f"{os.cpu_count()} cores, {CLIENTS} clients, {SESSIONS_PER_CLIENT} sessions each, {HANDLER_WORK_US} us of handler work")
+    print(f"{'shards':>8} {'throughput':>16}")
+    for run_index, n_shards in enumerate(SHARD_COUNTS):
+        # Fresh ports, the previous listeners may linger
+        throughput = run(n_shards, BASE_PORT + run_index * (CLIENTS + 1))
+        print(f"{n_shards or 'PCRF':>8} {throughput:>12.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,10 +13,24 @@ The module builds upon the base diameter library by:
 5. Defining telecom-specific constants and message types
 
 Key Components:
-- Applications: Gx, Rx, and Sy implementations for policy control and charging
-- Sessions: Session management for different Diameter applications
+- Applications: Gx, Rx, and Sy implementations for policy control and charging,
+  threaded or with asyncio requests, and windowed bulk sending with futures.
+  Requests are handled per thread, or by an adaptive worker pool
+- Sessions: Session management for different Diameter applications, with
+  bounded message history for long-lived sessions, idle/absolute timeouts,
+  a disk-backed store for very large session counts and Gx/Rx/Sy bindings
 - Messages: Enhanced message handling with telecom-specific attributes
 - Helpers: Utility functions for node and peer configuration
+- Pcap: Streaming extraction of Diameter messages from capture files
+- Analysis: Parallel session and latency analysis of captures
+- Recorder: Background recording of live traffic to rotating pcapng files
+- Columnar: NumPy column export of messages and sessions for vectorized reports
+- Templates: Pre-encoded requests rendered by patching their variable AVPs
+- Log: Sampled and rate limited logging for the request hot path
+- Snapshot: Compact snapshots of entity state for warm restarts
+- IP trie: Longest-prefix match indexes of Framed IPv4 addresses and IPv6 prefixes
+- Shared memory rings: Encoded messages passed between the processes of a sharded PCRF
+- Overload control: DIAMETER_TOO_BUSY admission throttling and DOIC overload reports
 - Constants: Telecom-specific Diameter message and AVP constants
 """
 
@@ -24,10 +38,28 @@ from ..subscriber import Subscriber
 
 from .helpers import create_node, add_peers, add_peer_to_node
 
-from .app import GxApplication, RxApplication, SyApplication
+from .app import GxApplication, RxApplication, SyApplication, AsyncGxApplication, AsyncRxApplication, AsyncSyApplication, RequestFuture, RequestPipeline, AdaptiveWorkerPool, OverloadControl
 
-from .session import GxSession, RxSession, SySession
+from .session import GxSession, RxSession, SySession, RetentionPolicy, MessageRecord, SessionReaper, DiskSessionStore, SessionBindings
 
 from .message import DiameterMessage
 
+from .pcap import PcapReader, read_pcap
+
+from .analysis import analyze_captures, CaptureAnalysis
+
+from .recorder import TrafficRecorder
+
+from .columnar import export_messages, export_sessions, MessageColumns
+
+from .template import MessageTemplate, CCR_FIELDS, AAR_FIELDS, STR_FIELDS
+
+from .log import LogCategory, configure_log_category, summarise_log_categories, lazy
+
+from .snapshot import write_snapshot, restore_snapshot, read_snapshot, PeriodicSnapshot
+
+from .iptrie import IpPrefixIndex, PrefixTrie, parse_ip_address, parse_framed_ipv6_prefix
+
+from .shm_ring import ShmRing
+
 from .constants import *
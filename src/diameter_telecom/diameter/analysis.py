@@ -0,0 +1,416 @@
+"""
+Parallel Capture Analysis
+
+This module turns packet captures into Diameter session timelines and
+transaction latency statistics, using every CPU core available.
+
+The analysis runs in two phases, both on a process pool:
+1. Spool: the capture files are split between reader processes. Every reader
+   streams its files with `PcapReader` and appends each Diameter PDU to one
+   spool file per shard, choosing the shard from a stable hash of the
+   Session-Id (or of the End-to-End identifier for messages without one).
+2. Analyse: every shard worker merges its spool files back into timestamp
+   order, rebuilds the Gx/Rx/Sy sessions with the regular `add_message`
+   logic and matches requests to answers by hop-by-hop and end-to-end
+   identifiers to compute response times.
+
+The per-shard results are merged into a single `CaptureAnalysis` holding
+latency histograms per request name, per answering Origin-Host and per result
+code. Histograms have a fixed relative precision, so memory does not grow
+with the number of transactions.
+
+Example:
+    >>> analysis = analyze_captures(["gx_00.pcap", "gx_01.pcap"], workers=32)
+    >>> ccr_i = analysis.summary()["message_name"]["CCR-I"]
+    >>> print(ccr_i["count"], ccr_i["p50"], ccr_i["p99"])
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from .constants import *
+from .message import DiameterMessage
+from .pcap import PcapReader, DIAMETER_PORTS
+from .session import GxSession, RxSession, SySession
+from .session._diameter_session import DiameterSession
+import heapq
+import logging
+import math
+import os
+import struct
+import tempfile
+import zlib
+
+logger = logging.getLogger(__name__)
+
+SESSION_TYPES = {
+    APP_3GPP_GX: GxSession,
+    APP_3GPP_RX: RxSession,
+    APP_3GPP_SY: SySession,
+}
+
+# Spool record header: timestamp, packet number, capture file index, length
+_SPOOL_RECORD = struct.Struct("<dIHI")
+
+# Relative precision of the latency histograms, and their smallest latency
+HISTOGRAM_PRECISION = 0.01
+HISTOGRAM_MIN_LATENCY = 1e-6
+_LOG_GROWTH = math.log1p(HISTOGRAM_PRECISION)
+
+
+def shard_of(diameter_message: DiameterMessage, n_shards: int) -> int:
+    """
+    Get the shard owning a message.
+
+    Uses a hash that is stable across processes, so every reader sends the
+    messages of a session, and the answers to its requests, to the same shard.
+
+    Args:
+        diameter_message (DiameterMessage): The message to place
+        n_shards (int): Number of shards
+
+    Returns:
+        int: The shard index
+    """
+    session_id = diameter_message.session_id
+    if session_id:
+        return zlib.crc32(session_id.encode()) % n_shards
+    return diameter_message.end_to_end_id % n_shards
+
+
+@dataclass
+class LatencyHistogram:
+    """
+    Mergeable latency histogram with logarithmic buckets.
+
+    Every recorded latency is counted in a bucket whose width is
+    HISTOGRAM_PRECISION of its value, so percentiles are accurate to within
+    that relative error regardless of the number of samples.
+
+    Attributes:
+        count (int): Number of recorded latencies
+        total (float): Sum of the recorded latencies, in seconds
+        min (float): Smallest recorded latency
+        max (float): Largest recorded latency
+        buckets (Dict[int, int]): Sample count per bucket index
+    """
+    count: int = 0
+    total: float = 0.0
+    min: float = math.inf
+    max: float = 0.0
+    buckets: Dict[int, int] = field(default_factory=dict)
+
+    def add(self, latency: float):
+        latency = max(latency, 0.0)
+        self.count += 1
+        self.total += latency
+        if latency < self.min:
+            self.min = latency
+        if latency > self.max:
+            self.max = latency
+        bucket = int(math.log(max(latency, HISTOGRAM_MIN_LATENCY) / HISTOGRAM_MIN_LATENCY) / _LOG_GROWTH)
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def merge(self, other: 'LatencyHistogram'):
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def percentile(self, percent: float) -> Optional[float]:
+        """
+        Get a latency percentile.
+
+        Args:
+            percent (float): Percentile between 0 and 100
+
+        Returns:
+            Optional[float]: The latency in seconds, or None if nothing was recorded
+        """
+        if not self.count:
+            return None
+        rank = percent / 100 * self.count
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                value = HISTOGRAM_MIN_LATENCY * math.exp((bucket + 0.5) * _LOG_GROWTH)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 99)) -> dict:
+        result = {'count': self.count, 'mean': self.mean}
+        for percent in percentiles:
+            result[f"p{percent:g}"] = self.percentile(percent)
+        result['max'] = self.max if self.count else None
+        return result
+
+
+@dataclass
+class CaptureAnalysis:
+    """
+    Result of analysing Diameter captures.
+
+    Attributes:
+        n_messages (int): Diameter messages analysed
+        n_transactions (int): Requests matched with their answer
+        n_retransmissions (int): Requests seen again with the same identifiers
+        n_unanswered (Dict[str, int]): Requests without an answer, by request name
+        n_unmatched_answers (int): Answers without a request
+        n_sessions (Dict[int, int]): Sessions seen, by application id
+        result_codes (Dict[Optional[int], int]): Answer count by result code
+        latency_by_message_name (Dict[str, LatencyHistogram]): Response time by request name
+        latency_by_origin_host (Dict[str, LatencyHistogram]): Response time by answering Origin-Host
+        latency_by_result_code (Dict[Optional[int], LatencyHistogram]): Response time by result code
+        session_duration (Dict[int, LatencyHistogram]): Duration of ended sessions, by application id
+        sessions (Dict[str, DiameterSession]): Rebuilt sessions, only kept when requested
+    """
+    n_messages: int = 0
+    n_transactions: int = 0
+    n_retransmissions: int = 0
+    n_unanswered: Dict[str, int] = field(default_factory=dict)
+    n_unmatched_answers: int = 0
+    n_sessions: Dict[int, int] = field(default_factory=dict)
+    result_codes: Dict[Optional[int], int] = field(default_factory=dict)
+    latency_by_message_name: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    latency_by_origin_host: Dict[str, LatencyHistogram] = field(default_factory=dict)
+    latency_by_result_code: Dict[Optional[int], LatencyHistogram] = field(default_factory=dict)
+    session_duration: Dict[int, LatencyHistogram] = field(default_factory=dict)
+    sessions: Dict[str, DiameterSession] = field(default_factory=dict)
+
+    def add_transaction(self, request: DiameterMessage, answer: DiameterMessage):
+        latency = answer.timestamp - request.timestamp
+        result_code = answer_result_code(answer)
+        origin_host = answer.origin_host
+        if isinstance(origin_host, bytes):
+            origin_host = origin_host.decode(errors='replace')
+        self.n_transactions += 1
+        self.result_codes[result_code] = self.result_codes.get(result_code, 0) + 1
+        for histograms, key in ((self.latency_by_message_name, request.name),
+                                (self.latency_by_origin_host, origin_host),
+                                (self.latency_by_result_code, result_code)):
+            histogram = histograms.get(key)
+            if histogram is None:
+                histogram = histograms[key] = LatencyHistogram()
+            histogram.add(latency)
+
+    def add_session(self, app_id: int):
+        self.n_sessions[app_id] = self.n_sessions.get(app_id, 0) + 1
+
+    def end_session(self, session: DiameterSession, app_id: int):
+        if session.start_time and session.end_time:
+            histogram = self.session_duration.get(app_id)
+            if histogram is None:
+                histogram = self.session_duration[app_id] = LatencyHistogram()
+            histogram.add(float(session.end_time) - float(session.start_time))
+
+    def merge(self, other: 'CaptureAnalysis'):
+        """
+        Merge the result of another shard into this one.
+
+        Args:
+            other (CaptureAnalysis): The result to merge
+        """
+        self.n_messages += other.n_messages
+        self.n_transactions += other.n_transactions
+        self.n_retransmissions += other.n_retransmissions
+        self.n_unmatched_answers += other.n_unmatched_answers
+        for mine, theirs in ((self.n_unanswered, other.n_unanswered),
+                             (self.n_sessions, other.n_sessions),
+                             (self.result_codes, other.result_codes)):
+            for key, count in theirs.items():
+                mine[key] = mine.get(key, 0) + count
+        for mine, theirs in ((self.latency_by_message_name, other.latency_by_message_name),
+                             (self.latency_by_origin_host, other.latency_by_origin_host),
+                             (self.latency_by_result_code, other.latency_by_result_code),
+                             (self.session_duration, other.session_duration)):
+            for key, histogram in theirs.items():
+                if key in mine:
+                    mine[key].merge(histogram)
+                else:
+                    mine[key] = histogram
+        self.sessions.update(other.sessions)
+
+    def summary(self, percentiles: Iterable[float] = (50, 90, 99)) -> dict:
+        """
+        Get the latency statistics as plain dictionaries.
+
+        Args:
+            percentiles (Iterable[float], optional): Percentiles to report
+
+        Returns:
+            dict: Latency summary per message name, Origin-Host and result code
+        """
+        percentiles = tuple(percentiles)
+        return {
+            'message_name': {k: v.summary(percentiles) for k, v in self.latency_by_message_name.items()},
+            'origin_host': {k: v.summary(percentiles) for k, v in self.latency_by_origin_host.items()},
+            'result_code': {k: v.summary(percentiles) for k, v in self.latency_by_result_code.items()},
+        }
+
+
+def answer_result_code(answer: DiameterMessage) -> Optional[int]:
+    """
+    Get the Result-Code of an answer, falling back to the Experimental-Result-Code.
+
+    Args:
+        answer (DiameterMessage): The answer message
+
+    Returns:
+        Optional[int]: The result code, or None if the answer has none
+    """
+    result_code = answer.result_code
+    if result_code is None:
+        experimental_result = answer.experimental_result
+        if experimental_result is not None:
+            result_code = experimental_result.experimental_result_code
+    return result_code
+
+
+def _spool_captures(filepaths: List[Tuple[int, str]], ports: Tuple[int], n_shards: int, spool_dir: str, reader_index: int) -> int:
+    """Stream captures and append every Diameter PDU to its shard spool file."""
+    spools = [open(os.path.join(spool_dir, f"{reader_index}.{shard}.spool"), 'wb', buffering=1 << 20)
+              for shard in range(n_shards)]
+    n_messages = 0
+    try:
+        for file_index, filepath in filepaths:
+            for diameter_message in PcapReader(filepath, ports):
+                raw = diameter_message.as_bytes()
+                timestamp = diameter_message.timestamp
+                spool = spools[shard_of(diameter_message, n_shards)]
+                spool.write(_SPOOL_RECORD.pack(math.nan if timestamp is None else timestamp,
+                                               diameter_message.pkt_number, file_index, len(raw)))
+                spool.write(raw)
+                n_messages += 1
+    finally:
+        for spool in spools:
+            spool.close()
+    logger.info(f"Reader {reader_index} spooled {n_messages} messages from {len(filepaths)} captures")
+    return n_messages
+
+
+def _read_spool(path: str, filepaths: List[str]) -> Iterator[DiameterMessage]:
+    with open(path, 'rb', buffering=1 << 20) as spool:
+        while True:
+            record = spool.read(_SPOOL_RECORD.size)
+            if len(record) < _SPOOL_RECORD.size:
+                return
+            timestamp, pkt_number, file_index, length = _SPOOL_RECORD.unpack(record)
+            diameter_message = DiameterMessage(spool.read(length))
+            diameter_message.timestamp = None if math.isnan(timestamp) else timestamp
+            diameter_message.pkt_number = pkt_number
+            diameter_message.pcap_filepath = filepaths[file_index]
+            yield diameter_message
+
+
+def _analyse_shard(spool_paths: List[str], filepaths: List[str], keep_sessions: bool) -> CaptureAnalysis:
+    """Rebuild the sessions and transactions of one shard, in timestamp order."""
+    analysis = CaptureAnalysis()
+    sessions: Dict[str, DiameterSession] = {}
+    pending: Dict[Tuple[int, int], DiameterMessage] = {}
+    # Sessions ended by a request (CCR-T, STR), kept until its answer
+    ending: Dict[Tuple[int, int], str] = {}
+    messages = heapq.merge(*(_read_spool(path, filepaths) for path in spool_paths),
+                           key=lambda m: m.timestamp if m.timestamp is not None else -math.inf)
+    for diameter_message in messages:
+        analysis.n_messages += 1
+        key = (diameter_message.hop_by_hop_id, diameter_message.end_to_end_id)
+        if diameter_message.is_request:
+            if key in pending:
+                analysis.n_retransmissions += 1
+            else:
+                pending[key] = diameter_message
+        else:
+            request = pending.pop(key, None)
+            if request is None:
+                analysis.n_unmatched_answers += 1
+            elif request.timestamp is not None and diameter_message.timestamp is not None:
+                analysis.add_transaction(request, diameter_message)
+
+        session_type = SESSION_TYPES.get(diameter_message.app_id)
+        session_id = diameter_message.session_id
+        if session_type is None or not session_id:
+            continue
+        session = sessions.get(session_id)
+        if session is None:
+            session = sessions[session_id] = session_type(session_id)
+            analysis.add_session(diameter_message.app_id)
+        was_active = session.active
+        session.add_message(diameter_message)
+        if was_active and not session.active:
+            analysis.end_session(session, diameter_message.app_id)
+            if keep_sessions:
+                continue
+            if diameter_message.is_request:
+                # Dropped once answered, otherwise the answer would start a new session
+                ending[key] = session_id
+            else:
+                del sessions[session_id]
+        elif not keep_sessions and not diameter_message.is_request and ending.get(key) == session_id:
+            del ending[key]
+            del sessions[session_id]
+
+    for request in pending.values():
+        analysis.n_unanswered[request.name] = analysis.n_unanswered.get(request.name, 0) + 1
+    if keep_sessions:
+        analysis.sessions = sessions
+    return analysis
+
+
+def analyze_captures(filepaths: Iterable[str],
+                     ports: Iterable[int] = DIAMETER_PORTS,
+                     workers: Optional[int] = None,
+                     shards: Optional[int] = None,
+                     keep_sessions: bool = False,
+                     spool_dir: Optional[str] = None) -> CaptureAnalysis:
+    """
+    Analyse Diameter captures in parallel.
+
+    Capture files are split between the reader processes in order, so they
+    should be passed in chronological order. A single capture file is always
+    read by a single process; rotated captures parallelise better.
+
+    Args:
+        filepaths (Iterable[str]): pcap/pcapng files, in chronological order
+        ports (Iterable[int], optional): Diameter ports. Defaults to 3868
+        workers (int, optional): Worker processes. Defaults to the CPU count
+        shards (int, optional): Session shards. Defaults to the worker count
+        keep_sessions (bool, optional): Return the rebuilt sessions as well.
+            Sessions are otherwise dropped as soon as they end. Defaults to False
+        spool_dir (str, optional): Directory for the temporary spool files.
+            Defaults to the system temporary directory
+
+    Returns:
+        CaptureAnalysis: The merged analysis of every shard
+
+    Example:
+        >>> analysis = analyze_captures(sorted(glob.glob("/captures/gx_*.pcap")))
+        >>> print(analysis.n_transactions, analysis.summary()["result_code"])
+    """
+    filepaths = list(filepaths)
+    ports = tuple(ports)
+    workers = workers or os.cpu_count() or 1
+    shards = shards or workers
+    n_readers = max(1, min(len(filepaths), workers))
+    # Contiguous runs of files per reader keep each spool file in time order
+    indexed = list(enumerate(filepaths))
+    reader_files = [indexed[len(indexed) * i // n_readers:len(indexed) * (i + 1) // n_readers]
+                    for i in range(n_readers)]
+
+    analysis = CaptureAnalysis()
+    with tempfile.TemporaryDirectory(dir=spool_dir, prefix="diameter_spool_") as directory, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        spooled = executor.map(_spool_captures, reader_files, [ports] * n_readers,
+                               [shards] * n_readers, [directory] * n_readers, range(n_readers))
+        logger.info(f"Spooled {sum(spooled)} messages from {len(filepaths)} captures into {shards} shards")
+        shard_spools = [[os.path.join(directory, f"{reader}.{shard}.spool") for reader in range(n_readers)]
+                        for shard in range(shards)]
+        for result in executor.map(_analyse_shard, shard_spools, [filepaths] * shards, [keep_sessions] * shards):
+            analysis.merge(result)
+    return analysis
@@ -3,7 +3,7 @@ import socket
 import struct
 from collections import deque
 import ipaddress
-from typing import Union, Tuple, Iterator
+from typing import Union, Tuple, Iterator, Iterable
 from dataclasses import dataclass, field
 
 def ip_to_bytes(ip: str) -> bytes:
@@ -213,6 +213,26 @@ class APN:
             self._allocated_ips.remove(ip)
             self.ip_queue.put_ip(ip)
 
+    def restore_allocations(self, ips: Iterable[str]) -> None:
+        """
+        Mark IP addresses as allocated, e.g. when restoring a snapshot.
+
+        Args:
+            ips (Iterable[str]): The IP addresses allocated before the restart
+
+        Example:
+            >>> apn = APN("internet", "10.0.0.0/30")
+            >>> apn.restore_allocations(['10.0.0.1'])
+            >>> apn.available_ips
+            3
+        """
+        ips = set(ips) - self._allocated_ips
+        if not ips:
+            return
+        with self.ip_queue.mutex:
+            self.ip_queue.queue = deque(ip for ip in self.ip_queue.queue if ip not in ips)
+        self._allocated_ips.update(ips)
+
     @property
     def allocated_ips(self) -> set[str]:
         """
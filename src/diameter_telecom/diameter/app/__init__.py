@@ -3,3 +3,7 @@ from .custom_simple_threading_application import CustomSimpleThreadingApplicatio
 from .gx import GxApplication
 from .rx import RxApplication
 from .sy import SyApplication
+from .asyncio_application import AsyncioApplicationMixin, AsyncGxApplication, AsyncRxApplication, AsyncSyApplication
+from .pipeline import RequestFuture, RequestPipeline
+from .worker_pool import AdaptiveWorkerPool
+from .overload import OverloadControl, TokenBucket
@@ -0,0 +1,143 @@
+"""
+asyncio Gx, Rx and Sy Applications
+
+The `send_request_custom` of the threaded applications blocks its thread until
+the answer arrives, so every transaction in flight costs an OS thread. The
+applications of this module have a `send_request_custom` coroutine instead:
+requests are routed and written to the peer right away, and the coroutine
+waits on a future in a pending answer table keyed by hop-by-hop identifier.
+Answers are read by the node thread, which resolves the futures on their event
+loop, so a single loop can keep tens of thousands of transactions in flight.
+
+Session bookkeeping is the same as in the threaded applications: the request
+and the answer are added to the session (framed IP indexing, subscribers,
+PCC rules, removal when the session ends). Incoming requests are still handled
+by the handler threads of `CustomSimpleThreadingApplication`.
+
+Example:
+    >>> pcef.gx_app = AsyncGxApplication()
+    >>> pcef.start()
+    >>> answers = await asyncio.gather(*(pcef.gx_app.send_request_custom(ccr) for ccr in ccrs))
+"""
+
+from typing import Dict
+from diameter.message import Message
+from ..message import DiameterMessage
+from .gx import GxApplication
+from .rx import RxApplication
+from .sy import SyApplication
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _set_answer(future: asyncio.Future, answer: Message):
+    # Runs on the loop of the future; it may have timed out meanwhile
+    if not future.done():
+        future.set_result(answer)
+
+
+def _call_soon(future: asyncio.Future, callback, *args) -> bool:
+    # From another thread; False if the loop of the future was closed
+    # without waiting for it
+    loop = future.get_loop()
+    if loop.is_closed():
+        return False
+    try:
+        loop.call_soon_threadsafe(callback, *args)
+    except RuntimeError:
+        # Closed in the meantime
+        return False
+    return True
+
+
+class AsyncioApplicationMixin:
+    """
+    Awaitable requests for a `CustomSimpleThreadingApplication`.
+
+    Requests sent with the blocking `send_request` still work, and wait for
+    their answers like before.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._answer_futures: Dict[int, asyncio.Future] = {}
+
+    @property
+    def n_pending(self) -> int:
+        """
+        Number of requests sent with a coroutine, waiting for their answer.
+        """
+        return len(self._answer_futures)
+
+    def receive_answer(self, message: Message):
+        future = self._answer_futures.get(message.header.hop_by_hop_identifier)
+        if future is None:
+            super().receive_answer(message)
+            return
+        if self.recorder:
+            self.recorder.record(message, inbound=True)
+        if not _call_soon(future, _set_answer, future, message):
+            self._answer_futures.pop(message.header.hop_by_hop_identifier, None)
+            logger.warning(f"Dropped answer {message.header.hop_by_hop_identifier}, its event loop is closed")
+
+    async def send_request_async(self, message: Message, timeout: float = 30) -> Message:
+        """
+        Send a request and wait for its answer without blocking the event loop.
+
+        Raises:
+            TimeoutError: If the answer does not arrive within `timeout` seconds
+        """
+        if not message.header.end_to_end_identifier:
+            message.header.end_to_end_identifier = self.node.end_to_end_seq.next_sequence()
+        if not message.header.application_id:
+            message.header.application_id = self.application_id
+        # Assigns the hop-by-hop identifier
+        peer, _ = self.node.route_request(self, message)
+        hop_by_hop_id = message.header.hop_by_hop_identifier
+        future = asyncio.get_running_loop().create_future()
+        # Registered before sending, so the answer can not arrive unexpected
+        self._answer_futures[hop_by_hop_id] = future
+        try:
+            if self.recorder:
+                self.recorder.record(message, inbound=False)
+            self.node.send_message(peer, message)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Timed out waiting for answer") from None
+        finally:
+            self._answer_futures.pop(hop_by_hop_id, None)
+
+    async def _send_request_custom(self, diameter_message: DiameterMessage, timeout: float) -> DiameterMessage:
+        request = self._prepare_request(diameter_message)
+        answer = await self.send_request_async(request, timeout)
+        return self._wrap_answer(answer)
+
+    async def send_request_custom(self, request: DiameterMessage, timeout: float = 5) -> DiameterMessage:
+        session = self._track_request(request)
+        try:
+            answer = await self._send_request_custom(request, timeout)
+        except BaseException:
+            self._untrack_request(request)
+            raise
+        self._track_answer(session, request, answer)
+        return answer
+
+    def stop(self):
+        for future in list(self._answer_futures.values()):
+            _call_soon(future, future.cancel)
+        self._answer_futures.clear()
+        super().stop()
+
+
+class AsyncGxApplication(AsyncioApplicationMixin, GxApplication):
+    pass
+
+
+class AsyncRxApplication(AsyncioApplicationMixin, RxApplication):
+    pass
+
+
+class AsyncSyApplication(AsyncioApplicationMixin, SyApplication):
+    pass
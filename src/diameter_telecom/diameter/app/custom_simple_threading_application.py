@@ -1,11 +1,22 @@
-from diameter.node.application import SimpleThreadingApplication
+from diameter.node.application import EmptyAnswer, SimpleThreadingApplication, WaitingMessage
+from diameter.message import Message
 from ..message import DiameterMessage
+from ..recorder import TrafficRecorder
+from ..log import LogCategory, lazy
 from ..session._diameter_session import DiameterSession
+from ..session.retention import RetentionPolicy
+from ..session.reaper import SessionReaper
+from ..session.registry import SessionRegistry, ShardedDict
+from ..session.binding import SessionBindings
+from .pipeline import DEFAULT_MAX_IN_FLIGHT, RequestFuture, RequestPipeline
+from .worker_pool import AdaptiveWorkerPool
+from .overload import OverloadControl
 from ..constants import *
 from .. import Subscriber
-from typing import Dict
+from typing import Dict, Iterable, Iterator, Optional
 import logging
 logger = logging.getLogger(__name__)
+_error_answer_log = LogCategory("answer.error", logger, logging.ERROR, rate=10)
 import time
 
 class CustomSimpleThreadingApplication(SimpleThreadingApplication):
@@ -14,25 +25,181 @@ class CustomSimpleThreadingApplication(SimpleThreadingApplication):
                  is_auth_application,
                  max_threads,
                  request_handler,
+                 retention: Optional[RetentionPolicy] = None,
+                 session_store: Optional[SessionRegistry] = None,
                  ):
         super().__init__(application_id, is_acct_application, is_auth_application, max_threads, request_handler)
-        self.sessions: Dict[str, DiameterSession] = {}
-        self.subscribers: Dict[str, Subscriber] = {}
+        # Shared by the handler threads: sharded, with per-shard locks. A
+        # DiskSessionStore can be passed instead for very large session counts
+        self.sessions: SessionRegistry = session_store if session_store is not None else SessionRegistry()
+        self.subscribers: ShardedDict[str, Subscriber] = ShardedDict()
+        self.recorder: Optional[TrafficRecorder] = None
+        self.retention: Optional[RetentionPolicy] = retention
+        self.reaper: Optional[SessionReaper] = None
+        # Links between the Gx sessions and the Rx and Sy sessions of the entity
+        self.bindings: Optional[SessionBindings] = None
+        # Requests sent with submit and send_many; its thread starts on first use
+        self.pipeline: RequestPipeline = RequestPipeline(self)
+        # Handles the requests instead of a thread per request, once set
+        self.worker_pool: Optional[AdaptiveWorkerPool] = None
+        # Admission control, refusing requests with DIAMETER_TOO_BUSY once set
+        self.overload: Optional[OverloadControl] = None
+
+    def receive_request(self, message: Message):
+        if self.recorder:
+            self.recorder.record(message, inbound=True)
+        if self.overload and not self._admit(message):
+            return
+        if self.worker_pool:
+            self.worker_pool.submit(message)
+            return
+        super().receive_request(message)
+
+    def receive_answer(self, message: Message):
+        if self.recorder:
+            self.recorder.record(message, inbound=True)
+        if self.pipeline.n_in_flight and self.pipeline.receive_answer(message):
+            return
+        super().receive_answer(message)
+
+    def send_answer(self, message: Message):
+        if self.overload:
+            self.overload.answered(message)
+        if self.recorder:
+            self.recorder.record(message, inbound=False)
+        super().send_answer(message)
+
+    def send_request(self, message: Message, timeout: int = 30) -> Message:
+        # As Application.send_request, with the request recorded once routing
+        # has assigned its identifiers
+        if not message.header.end_to_end_identifier:
+            message.header.end_to_end_identifier = self.node.end_to_end_seq.next_sequence()
+        if not message.header.application_id:
+            message.header.application_id = self.application_id
+        peer, _ = self.node.route_request(self, message)
+        hop_by_hop_id = message.header.hop_by_hop_identifier
+        waiting = WaitingMessage()
+        self._answer_waiting[hop_by_hop_id] = waiting
+        try:
+            if self.recorder:
+                self.recorder.record(message, inbound=False)
+            self.node.send_message(peer, message)
+            if waiting.event.wait(timeout) is not True:
+                raise TimeoutError("Timed out waiting for answer")
+            if waiting.answer is None:
+                raise EmptyAnswer("Response is None")
+            return waiting.answer
+        finally:
+            self._answer_waiting.pop(hop_by_hop_id, None)
 
     def remove_session(self, session_id):
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        session = self.sessions.remove(session_id)
+        if session is not None:
+            session.release_records()
+        if self.reaper:
+            self.reaper.forget(self, session_id)
+        if self.bindings:
+            self.bindings.unbind(self.application_id, session_id)
 
     def add_subscriber(self, subscriber: Subscriber):
-        if subscriber.msisdn in self.subscribers:
-            return
-        self.subscribers[subscriber.msisdn] = subscriber
+        self.subscribers.setdefault(subscriber.msisdn, subscriber)
 
     def send_request_custom(self, diameter_message: DiameterMessage, timeout=10):
+        request = self._prepare_request(diameter_message)
+        answer = self.send_request(request, timeout=timeout)
+        return self._wrap_answer(answer)
+
+    def set_request_window(self, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT, max_in_flight_per_peer: Optional[int] = None):
+        # Requests in flight with submit and send_many, before they block
+        if self.pipeline.n_in_flight:
+            raise ValueError(f"Can not change the request window with {self.pipeline.n_in_flight} requests in flight")
+        self.pipeline.stop()
+        self.pipeline = RequestPipeline(self, max_in_flight, max_in_flight_per_peer)
+
+    def submit(self, diameter_message: DiameterMessage, timeout=10) -> RequestFuture:
+        # Sends without waiting for the answer; the sessions are updated once it arrives
+        return self.pipeline.submit(diameter_message, timeout)
+
+    def send_many(self, requests: Iterable[DiameterMessage], timeout=10, ordered=False) -> Iterator[RequestFuture]:
+        # Futures as they are answered, or in the order of the requests
+        return self.pipeline.send_many(requests, timeout, ordered)
+
+    @property
+    def queue_depth(self) -> int:
+        # Requests received and not handled yet
+        if self.worker_pool:
+            return self.worker_pool.queue_depth
+        return self._recv_msg_queue.qsize()
+
+    def set_overload_control(self, **options) -> OverloadControl:
+        # See OverloadControl for the thresholds and token buckets
+        self.overload = OverloadControl(**options)
+        return self.overload
+
+    def _admit(self, message: Message) -> bool:
+        # Refused requests are answered from the node thread, without session processing
+        if self.overload.admit(self, message):
+            return True
+        try:
+            self.send_answer(self.overload.busy_answer(self, message))
+        except Exception as e:
+            logger.warning(f"Could not answer refused request: {e!r}")
+        return False
+
+    def set_worker_pool(self, min_workers: int = 1, max_workers: int = 64, **options) -> AdaptiveWorkerPool:
+        # Replaces max_threads with a pool resized from the queue depth and
+        # handler latency, see AdaptiveWorkerPool for the options
+        if self.worker_pool:
+            self.worker_pool.stop()
+        self.worker_pool = AdaptiveWorkerPool(self._process_recv_msg, min_workers, max_workers, name=f"{self}-workers", **options)
+        if self._recv_queue_consumer.is_alive():
+            self.worker_pool.start()
+        return self.worker_pool
+
+    def start(self):
+        if self.worker_pool:
+            self.worker_pool.start()
+        super().start()
+
+    def stop(self):
+        self.pipeline.stop()
+        if self.worker_pool:
+            self.worker_pool.stop()
+        super().stop()
+
+    def _process_recv_msg(self, message: Message):
+        # The session of the request stays in memory while it is handled
+        session_id = getattr(message, 'session_id', None)
+        if not session_id:
+            return super()._process_recv_msg(message)
+        self.sessions.pin(session_id)
+        try:
+            super()._process_recv_msg(message)
+        finally:
+            self.sessions.unpin(session_id)
+
+    def _track_request(self, request: DiameterMessage) -> Optional[DiameterSession]:
+        # Session of the request, for the applications keeping sessions. It
+        # is pinned until _track_answer or _untrack_request
+        return None
+
+    def _track_answer(self, session: Optional[DiameterSession], request: DiameterMessage, answer: DiameterMessage):
+        pass
+
+    def _untrack_request(self, request: DiameterMessage):
+        # A tracked request that will get no answer
+        if request.session_id:
+            self.sessions.unpin(request.session_id)
+
+    def _prepare_request(self, diameter_message: DiameterMessage):
         diameter_message.timestamp = time.time()
-        answer = self.send_request(diameter_message.message, timeout=timeout)
+        # Messages that were never decoded (e.g. rendered from a MessageTemplate)
+        # are sent as they are, straight from their raw bytes
+        return diameter_message.message if diameter_message.is_decoded else diameter_message
+
+    def _wrap_answer(self, answer: Message) -> DiameterMessage:
         diameter_message_answer = DiameterMessage(answer)
         diameter_message_answer.timestamp = time.time()
         if diameter_message_answer.result_code != E_RESULT_CODE_DIAMETER_SUCCESS:
-            logger.error(f"Answer with error: \n {diameter_message_answer.dump()}")
+            _error_answer_log.log("Answer with error: \n %s", lazy(diameter_message_answer.dump))
         return diameter_message_answer
\ No newline at end of file
@@ -1,50 +1,135 @@
 from .custom_simple_threading_application import CustomSimpleThreadingApplication
 from ..session import GxSession
+from ..session.pcc import PccRuleIndex
 from diameter.message.constants import APP_3GPP_GX
 from ..message import DiameterMessage
 from ..constants import *
+from ..iptrie import IpPrefixIndex, parse_framed_ipv6_prefix, parse_ip_address
 import logging
-from typing import Dict
+from typing import Dict, List, Optional, Set
 
 logger = logging.getLogger(__name__)
+
+# Keys of the multi-valued session indexes
+_SESSION_KEYS = {
+    "msisdn": lambda session: (session.subscriber.msisdn,) if session.subscriber else (),
+    "imsi": lambda session: (session.subscriber.imsi,) if session.subscriber else (),
+    "apn": lambda session: (session.called_station_id,),
+    "origin_host": lambda session: (session.origin_host,),
+}
+
 class GxApplication(CustomSimpleThreadingApplication):
-    def __init__(self, max_threads=1, request_handler=None):
-        super().__init__(application_id=APP_3GPP_GX, is_acct_application=False, is_auth_application=True, max_threads=max_threads, request_handler=request_handler)
-        self.sessions: Dict[str, GxSession] = {}
-        self.sessions_id_by_framed_ip_address: Dict[str, str] = {}
-        self.sessions_id_by_framed_ipv6_prefix: Dict[str, str] = {}
+    def __init__(self, max_threads=1, request_handler=None, retention=None, session_store=None):
+        super().__init__(application_id=APP_3GPP_GX, is_acct_application=False, is_auth_application=True, max_threads=max_threads, request_handler=request_handler, retention=retention, session_store=session_store)
+        # Longest-prefix match, so a UE address finds the session of its prefix
+        self.sessions_id_by_framed_ip_address = self.sessions.add_index(
+            "framed_ip_address", lambda session: session.framed_ip_address, IpPrefixIndex(parse_ip_address))
+        self.sessions_id_by_framed_ipv6_prefix = self.sessions.add_index(
+            "framed_ipv6_prefix", lambda session: session.framed_ipv6_prefix, IpPrefixIndex(parse_framed_ipv6_prefix))
+        for name, keys in _SESSION_KEYS.items():
+            self.sessions.add_multi_index(name, keys)
+        self.pcc_rules = PccRuleIndex()
 
     def get_session_by_id(self, session_id: str) -> GxSession:
         return self.sessions.get(session_id)
     
     def get_session_by_framed_ip_address(self, framed_ip_address: str) -> GxSession:
-        if self.sessions_id_by_framed_ip_address.get(framed_ip_address):
-            return self.sessions[self.sessions_id_by_framed_ip_address[framed_ip_address]]
-        return None
+        return self.sessions.get_by_index("framed_ip_address", framed_ip_address)
     
     def get_session_by_framed_ipv6_prefix(self, framed_ipv6_prefix: str) -> GxSession:
-        if self.sessions_id_by_framed_ipv6_prefix.get(framed_ipv6_prefix):
-            return self.sessions[self.sessions_id_by_framed_ipv6_prefix[framed_ipv6_prefix]]
-        return None
+        return self.sessions.get_by_index("framed_ipv6_prefix", framed_ipv6_prefix)
+
+    def get_session_by_ip_address(self, ip_address) -> Optional[GxSession]:
+        # UE address of either version, e.g. from the Framed-IP-Address of an AAR
+        parsed = parse_ip_address(ip_address)
+        if parsed is None:
+            return None
+        if parsed[0] == 4:
+            return self.get_session_by_framed_ip_address(ip_address)
+        return self.get_session_by_framed_ipv6_prefix(ip_address)
     
+    def get_sessions_by_msisdn(self, msisdn: str) -> List[GxSession]:
+        return self.sessions.find(msisdn=msisdn)
+
+    def get_sessions_by_imsi(self, imsi: str) -> List[GxSession]:
+        return self.sessions.find(imsi=imsi)
+
+    def get_sessions_by_apn(self, apn: str) -> List[GxSession]:
+        return self.sessions.find(apn=apn)
+
+    def get_sessions_by_origin_host(self, origin_host: str) -> List[GxSession]:
+        return self.sessions.find(origin_host=origin_host)
+
+    def get_session_ids_by_rule(self, rule: str) -> Set[str]:
+        return self.pcc_rules.session_ids(rule)
+
+    def get_sessions_by_rule(self, rule: str) -> List[GxSession]:
+        sessions = (self.sessions.get(session_id) for session_id in self.pcc_rules.session_ids(rule))
+        return [session for session in sessions if session is not None]
+
+    def get_installed_rules(self, session: GxSession) -> List[str]:
+        return self.pcc_rules.installed(session)
+
+    def find_sessions(self, msisdn: str = None, imsi: str = None, apn: str = None, origin_host: str = None, rule: str = None) -> List[GxSession]:
+        # Intersection of the sessions matching every key given
+        criteria = {name: value for name, value in (("msisdn", msisdn), ("imsi", imsi), ("apn", apn), ("origin_host", origin_host))
+                    if value is not None}
+        if not criteria:
+            if rule is None:
+                raise ValueError("At least one of msisdn, imsi, apn, origin_host and rule is required")
+            return self.get_sessions_by_rule(rule)
+        sessions = self.sessions.find(**criteria)
+        if rule is not None:
+            rule_id = self.pcc_rules.rules.id(rule)
+            sessions = [session for session in sessions if rule_id is not None and session.installed_rules >> rule_id & 1]
+        return sessions
+
+    def apply_pcc_rules(self, session: GxSession, message: DiameterMessage):
+        # Rules of a CCA or RAR, once accepted
+        self.pcc_rules.apply(session, message)
+
     def add_session(self, session: GxSession):
-        self.sessions[session.session_id] = session
-        if session.framed_ip_address:
-            self.sessions_id_by_framed_ip_address[session.framed_ip_address] = session.session_id
-        if session.framed_ipv6_prefix:
-            self.sessions_id_by_framed_ipv6_prefix[session.framed_ipv6_prefix] = session.session_id
+        # Indexed by Framed-IP-Address, Framed-IPv6-Prefix, MSISDN, IMSI,
+        # APN and Origin-Host atomically
+        self.sessions.add(session)
+        self.pcc_rules.track(session)
+        if self.retention and session.retention is None:
+            session.set_retention(self.retention)
+        if self.reaper:
+            self.reaper.track(self, session)
 
     def remove_session(self, session_id: str):
-        session = self.sessions.pop(session_id)
-        if session.framed_ip_address:
-            self.sessions_id_by_framed_ip_address.pop(session.framed_ip_address)
-        if session.framed_ipv6_prefix:
-            self.sessions_id_by_framed_ipv6_prefix.pop(session.framed_ipv6_prefix)
+        # Framed IP entries are only removed if the address was not
+        # reassigned to a newer session meanwhile
+        session = self.sessions.remove(session_id)
+        if session is not None:
+            self.pcc_rules.forget(session)
+            session.release_records()
+        if self.reaper:
+            self.reaper.forget(self, session_id)
+        self.terminate_dependents(session_id)
+
+    def terminate_dependents(self, session_id: str) -> int:
+        # Rx and Sy sessions bound to the Gx session, by their policy
+        if not self.bindings:
+            return 0
+        return self.bindings.terminate(session_id)
             
     def send_request_custom(self, request: DiameterMessage, timeout=5):
+        gx_session = self._track_request(request)
+        try:
+            answer = super().send_request_custom(request, timeout)
+        except BaseException:
+            self._untrack_request(request)
+            raise
+        self._track_answer(gx_session, request, answer)
+        return answer
+
+    def _track_request(self, request: DiameterMessage) -> GxSession:
         if not isinstance(request, DiameterMessage):
             raise ValueError("request must be an instance of DiameterMessage")
         session_id = request.session_id
+        self.sessions.pin(session_id)
         gx_session = self.get_session_by_id(session_id)
         if not gx_session:
             gx_session = GxSession(session_id)
@@ -55,8 +140,15 @@ class GxApplication(CustomSimpleThreadingApplication):
             gx_session.add_message(request)
         if request.subscriber and gx_session.subscriber:
             self.add_subscriber(gx_session.subscriber)
-        answer = super().send_request_custom(request, timeout)
-        gx_session.add_message(answer)
-        if not gx_session.active:
-            self.remove_session(session_id)
-        return answer
\ No newline at end of file
+        return gx_session
+
+    def _track_answer(self, gx_session: GxSession, request: DiameterMessage, answer: DiameterMessage):
+        try:
+            gx_session.add_message(answer)
+            if answer.result_code == E_RESULT_CODE_DIAMETER_SUCCESS:
+                # Rules pushed in a RAR, or returned in the CCA
+                self.apply_pcc_rules(gx_session, request if request.kind == MessageKind.RAR else answer)
+            if not gx_session.active:
+                self.remove_session(gx_session.session_id)
+        finally:
+            self.sessions.unpin(gx_session.session_id)
\ No newline at end of file
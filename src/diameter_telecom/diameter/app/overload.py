@@ -0,0 +1,294 @@
+"""
+Overload Control and Admission Throttling
+
+Without admission control, an application that falls behind keeps queueing
+requests until its answers arrive after the peers gave up on them, and the
+peers' retransmissions add to the load. An `OverloadControl` decides in the
+node thread, before any session processing, whether a request is handled or
+answered right away with DIAMETER_TOO_BUSY (3004):
+
+- Queue depth: requests are refused while more than `max_queue_depth` wait
+  for a handler
+- Latency: every `interval` seconds, the mean time from receiving a request
+  to sending its answer is compared with `max_latency`, and the share of
+  requests refused (the reduction) is raised while above it and lowered while
+  below, up to `max_reduction`. Requests are refused evenly, not in bursts
+- Token buckets: `origin_host_rate` and `subscriber_rate` requests per second,
+  with bursts of `origin_host_burst` and `subscriber_burst`, per Origin-Host
+  and per MSISDN (or IMSI) of the Subscription-Id
+
+Peers that advertise DOIC (RFC 7683) with OC-Supported-Features in their
+requests get OC-Supported-Features back, and while the application reduces
+its load, an OC-OLR host report with the reduction percentage, so they cut
+their traffic before sending it. Once the reduction is back to 0, OC-OLRs
+with a validity duration of 0 end the report.
+
+Example:
+    >>> pcrf.set_overload_control(max_queue_depth=500, max_latency=0.2, origin_host_rate=2000)
+    >>> pcrf.gx_app.overload.metrics()
+    {'reduction': 35, 'latency': 0.21, 'admitted': 120443, 'rejected': 28112, ...}
+"""
+
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional, Tuple
+from diameter.message import Avp, Message
+from ..constants import *
+from ..parse_avp import parse_subscription_id
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BUCKETS = 100_000
+# OC-Feature-Vector bit of the loss abatement algorithm, the only one defined
+OLR_DEFAULT_ALGO = 1
+# Requests without an answer for this long are no longer tracked
+_TRACKING_TIMEOUT = 60
+
+
+class TokenBucket:
+    """
+    Requests allowed at `rate` per second, with bursts of up to `burst`.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def take(self, now: float) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+class TokenBuckets:
+    """
+    Token buckets by key, the least recently used ones dropped beyond
+    `max_buckets`. A dropped bucket comes back full.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None, max_buckets: int = DEFAULT_MAX_BUCKETS):
+        if rate <= 0:
+            raise ValueError(f"Token bucket rate must be positive. Provided: {rate}")
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.max_buckets = max_buckets
+        self._buckets: OrderedDict[Hashable, TokenBucket] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: Hashable, now: float) -> bool:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, now)
+                if len(self._buckets) > self.max_buckets:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now)
+
+
+class OverloadControl:
+    """
+    Admission control of the requests of an application.
+
+    Attributes:
+        max_queue_depth (Optional[int]): Requests waiting for a handler above
+            which requests are refused
+        max_latency (Optional[float]): Mean seconds to answer above which the
+            reduction grows
+        max_reduction (float): Largest share of requests refused for latency
+        interval (float): Seconds between two reduction updates
+        validity_duration (int): OC-Validity-Duration of the OC-OLRs, in seconds
+        doic (bool): Whether to send OC-OLRs to the peers supporting DOIC
+        reduction (float): Share of the requests currently refused for latency
+    """
+
+    def __init__(self, max_queue_depth: Optional[int] = None, max_latency: Optional[float] = None,
+                 origin_host_rate: Optional[float] = None, origin_host_burst: Optional[float] = None,
+                 subscriber_rate: Optional[float] = None, subscriber_burst: Optional[float] = None,
+                 max_reduction: float = 0.95, interval: float = 0.5,
+                 doic: bool = True, validity_duration: int = 30,
+                 max_buckets: int = DEFAULT_MAX_BUCKETS):
+        if not 0 < max_reduction <= 1:
+            raise ValueError(f"max_reduction must be in (0, 1]. Provided: {max_reduction}")
+        self.max_queue_depth = max_queue_depth
+        self.max_latency = max_latency
+        self.max_reduction = max_reduction
+        self.interval = interval
+        self.doic = doic
+        self.validity_duration = validity_duration
+        self.origin_hosts = TokenBuckets(origin_host_rate, origin_host_burst, max_buckets) if origin_host_rate else None
+        self.subscribers = TokenBuckets(subscriber_rate, subscriber_burst, max_buckets) if subscriber_rate else None
+        self.reduction = 0.0
+        self.n_admitted = 0
+        self.n_rejected_queue_depth = 0
+        self.n_rejected_latency = 0
+        self.n_throttled_origin_host = 0
+        self.n_throttled_subscriber = 0
+        self._lock = threading.Lock()
+        # Requests being handled: hop-by-hop id -> (time received, supports DOIC)
+        self._pending: OrderedDict[int, Tuple[float, bool]] = OrderedDict()
+        self._window_start = time.monotonic()
+        self._latency_total = 0.0
+        self._n_answered = 0
+        self._latency = 0.0
+        self._credit = 0.0
+        # OC-Sequence-Number, greater than the one of any previous run
+        self._sequence_number = int(time.time())
+        self._reported_reduction = 0
+        self._report_until = 0.0
+
+    @property
+    def latency(self) -> float:
+        # Mean seconds to answer over the last interval
+        return self._latency
+
+    @property
+    def reduction_percentage(self) -> int:
+        return round(self.reduction * 100)
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "reduction": self.reduction_percentage,
+            "latency": self.latency,
+            "admitted": self.n_admitted,
+            "rejected_queue_depth": self.n_rejected_queue_depth,
+            "rejected_latency": self.n_rejected_latency,
+            "throttled_origin_host": self.n_throttled_origin_host,
+            "throttled_subscriber": self.n_throttled_subscriber,
+            "pending": len(self._pending),
+        }
+
+    def admit(self, application, message: Message) -> bool:
+        """
+        Decide whether a request is handled, from the node thread.
+
+        Args:
+            application: The application receiving it, for its queue depth
+            message (Message): The request
+
+        Returns:
+            bool: False if the request is to be answered DIAMETER_TOO_BUSY
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._window_start >= self.interval:
+                self._update(now)
+            if self.max_queue_depth is not None and application.queue_depth >= self.max_queue_depth:
+                self.n_rejected_queue_depth += 1
+                return False
+            if self.reduction:
+                # Refused evenly: one request each time the credit reaches 1
+                self._credit += self.reduction
+                if self._credit >= 1:
+                    self._credit -= 1
+                    self.n_rejected_latency += 1
+                    return False
+        if self.origin_hosts is not None and not self.origin_hosts.take(getattr(message, 'origin_host', None), now):
+            with self._lock:
+                self.n_throttled_origin_host += 1
+            return False
+        if self.subscribers is not None:
+            subscriber = self._subscriber_key(message)
+            if subscriber is not None and not self.subscribers.take(subscriber, now):
+                with self._lock:
+                    self.n_throttled_subscriber += 1
+                return False
+        supports_doic = self._supports_doic(message)
+        with self._lock:
+            self._pending[message.header.hop_by_hop_identifier] = (now, supports_doic)
+            self.n_admitted += 1
+        return True
+
+    def busy_answer(self, application, message: Message) -> Message:
+        """
+        DIAMETER_TOO_BUSY answer of a refused request.
+        """
+        answer = application.generate_answer(message, result_code=E_RESULT_CODE_DIAMETER_TOO_BUSY)
+        if self.doic and self._supports_doic(message):
+            self._add_doic_avps(answer, time.monotonic())
+        return answer
+
+    def answered(self, answer: Message):
+        """
+        Account an answer of an admitted request, adding the DOIC AVPs.
+        """
+        now = time.monotonic()
+        with self._lock:
+            pending = self._pending.pop(answer.header.hop_by_hop_identifier, None)
+            if pending is None:
+                return
+            received, supports_doic = pending
+            self._latency_total += now - received
+            self._n_answered += 1
+        # Answers sent as raw bytes (e.g. by the shards of a ShardedPCRF) are left as they are
+        if self.doic and supports_doic and isinstance(answer, Message):
+            self._add_doic_avps(answer, now)
+
+    def _update(self, now: float):
+        # Called with the lock held, once per interval
+        if self._n_answered:
+            self._latency = self._latency_total / self._n_answered
+        elif not self._pending:
+            self._latency = 0.0
+        self._window_start = now
+        self._latency_total = 0.0
+        self._n_answered = 0
+        if self.max_latency:
+            # Grows with the excess latency, shrinks as it goes below
+            load = self._latency / self.max_latency
+            reduction = min(self.max_reduction, max(0.0, self.reduction + (load - 1) / 4))
+            if reduction != self.reduction:
+                logger.debug(f"Reduction from {self.reduction:.0%} to {reduction:.0%} at {self._latency * 1000:.1f} ms")
+            self.reduction = reduction
+            if not reduction:
+                self._credit = 0.0
+        while self._pending:
+            hop_by_hop_id, (received, _) = next(iter(self._pending.items()))
+            if now - received < _TRACKING_TIMEOUT:
+                break
+            del self._pending[hop_by_hop_id]
+
+    def _add_doic_avps(self, answer: Message, now: float):
+        answer.append_avp(Avp.new(AVP_OC_SUPPORTED_FEATURES, value=[
+            Avp.new(AVP_OC_FEATURE_VECTOR, value=OLR_DEFAULT_ALGO, is_mandatory=False)], is_mandatory=False))
+        reduction = self.reduction_percentage
+        with self._lock:
+            if reduction != self._reported_reduction:
+                self._sequence_number += 1
+                self._reported_reduction = reduction
+                # A report is ended by reporting it with a validity of 0 for as
+                # long as it could still be in effect
+                self._report_until = now + self.validity_duration
+            if not reduction and now >= self._report_until:
+                return
+            sequence_number = self._sequence_number
+        answer.append_avp(Avp.new(AVP_OC_OLR, value=[
+            Avp.new(AVP_OC_SEQUENCE_NUMBER, value=sequence_number, is_mandatory=False),
+            Avp.new(AVP_OC_REPORT_TYPE, value=E_OC_REPORT_TYPE_HOST_REPORT, is_mandatory=False),
+            Avp.new(AVP_OC_REDUCTION_PERCENTAGE, value=reduction, is_mandatory=False),
+            Avp.new(AVP_OC_VALIDITY_DURATION, value=self.validity_duration if reduction else 0, is_mandatory=False),
+        ], is_mandatory=False))
+
+    @staticmethod
+    def _supports_doic(message: Message) -> bool:
+        return bool(message.find_avps((AVP_OC_SUPPORTED_FEATURES, 0)))
+
+    @staticmethod
+    def _subscriber_key(message: Message) -> Optional[str]:
+        subscription_id = getattr(message, 'subscription_id', None)
+        if not subscription_id:
+            return None
+        msisdn, imsi, _, _, _ = parse_subscription_id(subscription_id)
+        return msisdn or imsi
@@ -0,0 +1,318 @@
+"""
+Pipelined Request Submission
+
+`send_request_custom` sends one request and blocks until its answer, so the
+number of requests in flight is the number of threads sending. A
+`RequestPipeline` sends requests without waiting: each submitted request gets
+a `RequestFuture`, resolved when its answer arrives, and the number of
+requests in flight is capped per application and per peer. Submitting blocks
+while a window is full, which paces the caller to what the peers answer.
+
+Answers are matched by hop-by-hop identifier when the node receives them, and
+completed by one pipeline thread, which updates the sessions exactly like
+`send_request_custom` does and enforces the answer timeouts.
+
+Example:
+    >>> pcef.gx_app.set_request_window(max_in_flight=2000, max_in_flight_per_peer=500)
+    >>> for future in pcef.gx_app.send_many(ccr_us, timeout=10):
+    ...     if future.exception():
+    ...         failed += 1
+"""
+
+from concurrent.futures import Future, wait
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from diameter.message import Message
+from ..message import DiameterMessage
+import heapq
+import itertools
+import logging
+import queue
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_FLIGHT = 1000
+
+
+class RequestFuture(Future):
+    """
+    Future of the answer of a submitted request.
+
+    Attributes:
+        request (DiameterMessage): The request
+        sequence (Optional[int]): Order in which the request was submitted
+        completion (Optional[int]): Order in which its answer arrived, among
+            the answers of the pipeline
+        peer: The peer connection the request was routed to
+        sent_at (Optional[float]): `time.time()` the request was sent
+        answered_at (Optional[float]): `time.time()` the answer was completed
+    """
+
+    def __init__(self, request: DiameterMessage, sequence: Optional[int]):
+        super().__init__()
+        self.request = request
+        self.sequence = sequence
+        self.completion: Optional[int] = None
+        self.peer = None
+        self.sent_at: Optional[float] = None
+        self.answered_at: Optional[float] = None
+
+    @property
+    def latency(self) -> Optional[float]:
+        if self.sent_at is None or self.answered_at is None:
+            return None
+        return self.answered_at - self.sent_at
+
+
+class _Pending:
+    __slots__ = ('future', 'session', 'peer_window', 'deadline')
+
+    def __init__(self, future: RequestFuture, session: Any, peer_window: Optional[threading.Semaphore], deadline: float):
+        self.future = future
+        self.session = session
+        self.peer_window = peer_window
+        self.deadline = deadline
+
+
+class RequestPipeline:
+    """
+    Requests of an application in flight, with their futures.
+
+    Attributes:
+        max_in_flight (int): Requests in flight for the application
+        max_in_flight_per_peer (Optional[int]): Requests in flight per peer
+        n_submitted (int): Requests sent
+        n_answered (int): Answers received
+        n_timed_out (int): Requests without an answer within their timeout
+    """
+
+    def __init__(self, application, max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+                 max_in_flight_per_peer: Optional[int] = None):
+        if max_in_flight < 1:
+            raise ValueError(f"max_in_flight must be positive. Provided: {max_in_flight}")
+        if max_in_flight_per_peer is not None and max_in_flight_per_peer < 1:
+            raise ValueError(f"max_in_flight_per_peer must be positive. Provided: {max_in_flight_per_peer}")
+        self.application = application
+        self.max_in_flight = max_in_flight
+        self.max_in_flight_per_peer = max_in_flight_per_peer
+        self.n_submitted = 0
+        self.n_answered = 0
+        self.n_timed_out = 0
+        self._window = threading.BoundedSemaphore(max_in_flight)
+        self._peer_windows: Dict[Any, threading.BoundedSemaphore] = {}
+        self._pending: Dict[int, _Pending] = {}
+        self._deadlines: List[Tuple[float, int, int]] = []
+        self._lock = threading.Lock()
+        self._sequence = itertools.count()
+        self._completion = itertools.count()
+        self._completions: queue.SimpleQueue = queue.SimpleQueue()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def n_in_flight(self) -> int:
+        return len(self._pending)
+
+    def submit(self, diameter_message: DiameterMessage, timeout: float = 10) -> RequestFuture:
+        """
+        Send a request without waiting for its answer.
+
+        Blocks while the application or the peer the request is routed to
+        has its window full.
+
+        Args:
+            diameter_message (DiameterMessage): The request
+            timeout (float, optional): Seconds to wait for the answer
+
+        Returns:
+            RequestFuture: Resolved with the answer, as a DiameterMessage
+        """
+        application = self.application
+        session = application._track_request(diameter_message)
+        future = RequestFuture(diameter_message, next(self._sequence))
+        self._window.acquire()
+        peer_window = None
+        try:
+            request = application._prepare_request(diameter_message)
+            if not request.header.end_to_end_identifier:
+                request.header.end_to_end_identifier = application.node.end_to_end_seq.next_sequence()
+            if not request.header.application_id:
+                request.header.application_id = application.application_id
+            # Assigns the hop-by-hop identifier
+            peer, _ = application.node.route_request(application, request)
+            peer_window = self._peer_window(peer)
+            if peer_window is not None:
+                peer_window.acquire()
+        except BaseException:
+            self._window.release()
+            application._untrack_request(diameter_message)
+            raise
+        hop_by_hop_id = request.header.hop_by_hop_identifier
+        future.peer = peer
+        future.sent_at = time.time()
+        pending = _Pending(future, session, peer_window, time.monotonic() + timeout)
+        with self._lock:
+            self._pending[hop_by_hop_id] = pending
+            heapq.heappush(self._deadlines, (pending.deadline, future.sequence, hop_by_hop_id))
+        self._ensure_running()
+        if application.recorder:
+            application.recorder.record(request, inbound=False)
+        application.node.send_message(peer, request)
+        self.n_submitted += 1
+        return future
+
+    def send_many(self, requests: Iterable[DiameterMessage], timeout: float = 10, ordered: bool = False) -> Iterator[RequestFuture]:
+        """
+        Send requests, keeping the windows full, and yield their futures once
+        done.
+
+        The requests are submitted from a background thread, so they are
+        consumed lazily as the windows allow.
+
+        Args:
+            requests (Iterable[DiameterMessage]): The requests
+            timeout (float, optional): Seconds to wait for each answer
+            ordered (bool, optional): Yield in submission order instead of
+                completion order
+
+        Yields:
+            RequestFuture: Done futures, failed ones included
+        """
+        submitted: queue.SimpleQueue = queue.SimpleQueue()
+        done: queue.SimpleQueue = queue.SimpleQueue()
+
+        def feed():
+            n_requests = 0
+            for request in requests:
+                try:
+                    future = self.submit(request, timeout)
+                except Exception as e:
+                    future = RequestFuture(request, None)
+                    future.set_exception(e)
+                n_requests += 1
+                submitted.put(future)
+                future.add_done_callback(done.put)
+            submitted.put(None)
+            # Number of futures to expect, after the futures themselves
+            done.put(n_requests)
+
+        threading.Thread(target=feed, name=f"RequestPipeline-{self.application}", daemon=True).start()
+        if ordered:
+            while (future := submitted.get()) is not None:
+                wait([future])
+                yield future
+            return
+        n_requests = None
+        n_yielded = 0
+        while n_requests is None or n_yielded < n_requests:
+            item = done.get()
+            if isinstance(item, int):
+                n_requests = item
+                continue
+            n_yielded += 1
+            yield item
+
+    def receive_answer(self, message: Message) -> bool:
+        """
+        Take the answer of a submitted request, from the node thread.
+
+        Returns:
+            bool: False if the answer is not for a submitted request
+        """
+        with self._lock:
+            pending = self._pending.pop(message.header.hop_by_hop_identifier, None)
+        if pending is None:
+            return False
+        self._release(pending)
+        self._completions.put((pending, message))
+        return True
+
+    def _peer_window(self, peer) -> Optional[threading.BoundedSemaphore]:
+        if self.max_in_flight_per_peer is None:
+            return None
+        window = self._peer_windows.get(peer)
+        if window is None:
+            with self._lock:
+                window = self._peer_windows.setdefault(peer, threading.BoundedSemaphore(self.max_in_flight_per_peer))
+        return window
+
+    def _release(self, pending: _Pending):
+        if pending.peer_window is not None:
+            pending.peer_window.release()
+        self._window.release()
+
+    def _ensure_running(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stopped.clear()
+                self._thread = threading.Thread(target=self._run, name=f"RequestPipeline-{self.application}", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            with self._lock:
+                next_deadline = self._deadlines[0][0] if self._deadlines else None
+            wait_time = 1.0 if next_deadline is None else min(1.0, max(0.0, next_deadline - time.monotonic()))
+            try:
+                pending, message = self._completions.get(timeout=wait_time)
+            except queue.Empty:
+                pass
+            else:
+                self._complete(pending, message)
+            self._expire(time.monotonic())
+
+    def _complete(self, pending: _Pending, message: Message):
+        future = pending.future
+        application = self.application
+        try:
+            answer = application._wrap_answer(message)
+        except Exception as e:
+            # Unpins the session, as for a request never answered
+            application._untrack_request(future.request)
+            logger.error(f"Could not process the answer of {future.request.session_id}: {e}")
+            future.set_exception(e)
+            return
+        try:
+            # Releases the session, whether it succeeds or not
+            application._track_answer(pending.session, future.request, answer)
+        except Exception as e:
+            logger.error(f"Could not process the answer of {future.request.session_id}: {e}")
+            future.set_exception(e)
+            return
+        future.answered_at = time.time()
+        future.completion = next(self._completion)
+        self.n_answered += 1
+        future.set_result(answer)
+
+    def _expire(self, now: float):
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                deadline, sequence, hop_by_hop_id = heapq.heappop(self._deadlines)
+                pending = self._pending.get(hop_by_hop_id)
+                # The identifier may have been reused by a later request
+                if pending is not None and pending.future.sequence == sequence:
+                    del self._pending[hop_by_hop_id]
+                    expired.append(pending)
+        for pending in expired:
+            self._release(pending)
+            self.n_timed_out += 1
+            self.application._untrack_request(pending.future.request)
+            pending.future.set_exception(TimeoutError("Timed out waiting for answer"))
+
+    def stop(self):
+        """
+        Stop the pipeline thread, failing the requests still in flight.
+        """
+        self._stopped.set()
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._deadlines.clear()
+        for entry in pending:
+            self._release(entry)
+            self.application._untrack_request(entry.future.request)
+            entry.future.set_exception(RuntimeError("Application stopped"))
@@ -8,20 +8,37 @@ import logging
 logger = logging.getLogger(__name__)
 
 class RxApplication(CustomSimpleThreadingApplication):
-    def __init__(self, max_threads=1, request_handler=None):
-        super().__init__(application_id=APP_3GPP_RX, is_acct_application=False, is_auth_application=True, max_threads=max_threads, request_handler=request_handler)
-        self.sessions: Dict[str, RxSession] = {}
+    def __init__(self, max_threads=1, request_handler=None, retention=None, session_store=None):
+        super().__init__(application_id=APP_3GPP_RX, is_acct_application=False, is_auth_application=True, max_threads=max_threads, request_handler=request_handler, retention=retention, session_store=session_store)
+        self.sessions.add_multi_index("gx_session_id", lambda session: (session.gx_session_id,))
 
     def get_session_by_id(self, session_id: str) -> RxSession:
         return self.sessions.get(session_id)
 
     def remove_session(self, session_id):
         logger.info(f"Removing Rx session {session_id}")
-        if session_id in self.sessions:
-            del self.sessions[session_id]
+        session = self.sessions.remove(session_id)
+        if session is not None:
+            session.release_records()
+        if self.reaper:
+            self.reaper.forget(self, session_id)
+        if self.bindings:
+            self.bindings.unbind(self.application_id, session_id)
     
     def add_session(self, session: RxSession):
-        self.sessions[session.session_id] = session
+        self.sessions.add(session)
+        if self.retention and session.retention is None:
+            session.set_retention(self.retention)
+        if self.reaper:
+            self.reaper.track(self, session)
+        if self.bindings and session.gx_session_id:
+            self.bindings.bind(session.gx_session_id, self.application_id, session.session_id)
+
+    def get_sessions_by_gx_session_id(self, gx_session_id: str) -> List[RxSession]:
+        if self.bindings:
+            sessions = (self.get_session_by_id(session_id) for _, session_id in self.bindings.dependents(gx_session_id, self.application_id))
+            return [session for session in sessions if session is not None]
+        return self.sessions.find(gx_session_id=gx_session_id)
 
     def get_active_sessions(self) -> List[RxSession]:
         active_sessions = []
@@ -32,9 +49,20 @@ class RxApplication(CustomSimpleThreadingApplication):
     
 
     def send_request_custom(self, request: DiameterMessage, timeout=5):
+        rx_session = self._track_request(request)
+        try:
+            answer = super().send_request_custom(request)
+        except BaseException:
+            self._untrack_request(request)
+            raise
+        self._track_answer(rx_session, request, answer)
+        return answer
+
+    def _track_request(self, request: DiameterMessage) -> RxSession:
         if not isinstance(request, DiameterMessage):
             raise ValueError("request must be an instance of DiameterMessage")
         session_id = request.session_id
+        self.sessions.pin(session_id)
         rx_session = self.get_session_by_id(session_id)
         if not rx_session:
             rx_session = RxSession(session_id)
@@ -45,18 +73,22 @@ class RxApplication(CustomSimpleThreadingApplication):
                 self.add_subscriber(rx_session.subscriber)
         else:
             rx_session.add_message(request)
-        answer = super().send_request_custom(request)
-        rx_session.add_message(answer)
-        if not rx_session.active:
-            self.remove_session(session_id)
-        return answer
+        return rx_session
+
+    def _track_answer(self, rx_session: RxSession, request: DiameterMessage, answer: DiameterMessage):
+        try:
+            rx_session.add_message(answer)
+            if not rx_session.active:
+                self.remove_session(rx_session.session_id)
+        finally:
+            self.sessions.unpin(rx_session.session_id)
     
     def terminate_session_after_successful_abort(self, session_id: str):
         rx_session = self.get_session_by_id(session_id)
         if not rx_session:
             return
         last_message = rx_session.messages[-1]
-        if last_message.name == ASA and last_message.result_code == E_RESULT_CODE_DIAMETER_SUCCESS:
+        if last_message.kind == MessageKind.ASA and last_message.result_code == E_RESULT_CODE_DIAMETER_SUCCESS:
             # Need to send STR
             # str_message = create_str_message(session_id)
             session_termination_request = SessionTerminationRequest()
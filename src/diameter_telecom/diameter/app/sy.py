@@ -2,27 +2,59 @@ from .custom_simple_threading_application import CustomSimpleThreadingApplicatio
 from ..session import SySession
 from ..constants import APP_3GPP_SY
 from ..message import DiameterMessage
-from typing import Dict
+from typing import Dict, List
 
 class SyApplication(CustomSimpleThreadingApplication):
-    def __init__(self, max_threads=1, request_handler=None):
-        super().__init__(application_id=APP_3GPP_SY, is_acct_application=False, is_auth_application=True, max_threads=max_threads, request_handler=request_handler)
-        self.sessions: Dict[str, SySession] = {}
+    def __init__(self, max_threads=1, request_handler=None, retention=None, session_store=None):
+        super().__init__(application_id=APP_3GPP_SY, is_acct_application=False, is_auth_application=True, max_threads=max_threads, request_handler=request_handler, retention=retention, session_store=session_store)
+        self.sessions.add_multi_index("gx_session_id", lambda session: (session.gx_session_id,))
 
     def get_session_by_id(self, session_id: str) -> SySession:
         return self.sessions.get(session_id)
     
     def add_session(self, session: SySession):
-        self.sessions[session.session_id] = session
+        self.sessions.add(session)
+        if self.retention and session.retention is None:
+            session.set_retention(self.retention)
+        if self.reaper:
+            self.reaper.track(self, session)
+        if self.bindings and session.gx_session_id:
+            self.bindings.bind(session.gx_session_id, self.application_id, session.session_id)
+
+    def get_sessions_by_gx_session_id(self, gx_session_id: str) -> List[SySession]:
+        if self.bindings:
+            sessions = (self.get_session_by_id(session_id) for _, session_id in self.bindings.dependents(gx_session_id, self.application_id))
+            return [session for session in sessions if session is not None]
+        return self.sessions.find(gx_session_id=gx_session_id)
 
     def send_request_custom(self, request: DiameterMessage, timeout=5):
+        sy_session = self._track_request(request)
+        try:
+            answer = super().send_request_custom(request, timeout)
+        except BaseException:
+            self._untrack_request(request)
+            raise
+        self._track_answer(sy_session, request, answer)
+        return answer
+
+    def _track_request(self, request: DiameterMessage) -> SySession:
         if not isinstance(request, DiameterMessage):
             raise ValueError("request must be an instance of DiameterMessage")
         session_id = request.session_id
+        self.sessions.pin(session_id)
         sy_session = self.get_session_by_id(session_id)
         if not sy_session:
             sy_session = SySession(session_id)
             self.add_session(sy_session)
         sy_session.add_message(request)
+        return sy_session
+
+    def _track_answer(self, sy_session: SySession, request: DiameterMessage, answer: DiameterMessage):
+        try:
+            sy_session.add_message(answer)
+            if not sy_session.active:
+                self.remove_session(sy_session.session_id)
+        finally:
+            self.sessions.unpin(sy_session.session_id)
 
 
@@ -0,0 +1,236 @@
+"""
+Adaptive Request Handler Pool
+
+`SimpleThreadingApplication` starts a thread per request, up to a fixed
+`max_threads`. With a small limit, one slow handler backs the whole queue up
+during a CCR-I storm; with a large one, bursts start hundreds of threads. An
+`AdaptiveWorkerPool` handles the requests in long-lived worker threads, and
+resizes itself between `min_workers` and `max_workers` from what it observes:
+
+- It grows when requests wait in the queue longer than `target_wait`, by half
+  its size at a time, and to the number of workers the arrival rate needs at
+  the measured handler latency (Little's law)
+- It shrinks, a few workers at a time, once the queue has been empty with
+  workers idle for `idle_period` seconds
+
+Example:
+    >>> pcrf.set_worker_pool(min_workers=2, max_workers=64)
+    >>> pcrf.gx_app.worker_pool.metrics()
+    {'size': 8, 'busy': 3, 'queue_depth': 0, 'queue_wait': 0.0004, ...}
+"""
+
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveWorkerPool:
+    """
+    Worker threads calling `handler` for each submitted item.
+
+    Attributes:
+        min_workers (int): Workers kept when idle
+        max_workers (int): Upper bound of the pool size
+        target_wait (float): Queue wait, in seconds, above which the pool grows
+        interval (float): Seconds between two resizing decisions
+        idle_period (float): Seconds without queueing before the pool shrinks
+        n_handled (int): Items handled
+        n_grown (int): Workers started by resizing
+        n_shrunk (int): Workers retired by resizing
+    """
+
+    def __init__(self, handler: Callable[[Any], Any], min_workers: int = 1, max_workers: int = 64,
+                 target_wait: float = 0.01, interval: float = 0.25, idle_period: float = 5,
+                 name: str = "AdaptiveWorkerPool"):
+        if min_workers < 1:
+            raise ValueError(f"min_workers must be positive. Provided: {min_workers}")
+        if max_workers < min_workers:
+            raise ValueError(f"max_workers must be at least min_workers. Provided: {max_workers} < {min_workers}")
+        self.handler = handler
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_wait = target_wait
+        self.interval = interval
+        self.idle_period = idle_period
+        self.name = name
+        self.n_handled = 0
+        self.n_grown = 0
+        self.n_shrunk = 0
+        # (item, time.monotonic() it was queued)
+        self._items: Deque[Tuple[Any, float]] = deque()
+        self._condition = threading.Condition()
+        self._size = 0
+        self._busy = 0
+        self._retiring = 0
+        self._worker_seq = 0
+        self._stopped = True
+        self._controller: Optional[threading.Thread] = None
+        # Sums over the current interval, and averages of the last one
+        self._n_submitted = 0
+        self._n_done = 0
+        self._wait_total = 0.0
+        self._latency_total = 0.0
+        self._queue_wait = 0.0
+        self._handler_latency = 0.0
+        self._arrival_rate = 0.0
+        self._last_saturated = time.monotonic()
+
+    @property
+    def size(self) -> int:
+        return self._size - self._retiring
+
+    @property
+    def busy(self) -> int:
+        return self._busy
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._items)
+
+    @property
+    def queue_wait(self) -> float:
+        """
+        Seconds requests wait in the queue: the mean over the last interval,
+        or the age of the oldest queued request if larger, so a pool whose
+        workers are all stuck still reports it.
+        """
+        try:
+            oldest = time.monotonic() - self._items[0][1]
+        except IndexError:
+            oldest = 0.0
+        return max(self._queue_wait, oldest)
+
+    @property
+    def handler_latency(self) -> float:
+        # Mean seconds per handled request over the last interval
+        return self._handler_latency
+
+    @property
+    def arrival_rate(self) -> float:
+        return self._arrival_rate
+
+    def metrics(self) -> Dict[str, float]:
+        return {
+            "size": self.size,
+            "busy": self.busy,
+            "queue_depth": self.queue_depth,
+            "queue_wait": self.queue_wait,
+            "handler_latency": self.handler_latency,
+            "arrival_rate": self.arrival_rate,
+            "handled": self.n_handled,
+            "grown": self.n_grown,
+            "shrunk": self.n_shrunk,
+        }
+
+    def submit(self, item: Any):
+        with self._condition:
+            self._items.append((item, time.monotonic()))
+            self._n_submitted += 1
+            self._condition.notify()
+
+    def start(self):
+        with self._condition:
+            if not self._stopped:
+                return
+            self._stopped = False
+            self._resize(self.min_workers)
+        self._controller = threading.Thread(target=self._control, name=f"{self.name}-controller", daemon=True)
+        self._controller.start()
+
+    def stop(self):
+        """
+        Stop the workers once the queued items are handled.
+        """
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._controller:
+            self._controller.join(self.interval * 2)
+            self._controller = None
+
+    def _resize(self, target: int):
+        # Called with the condition held
+        target = min(max(target, self.min_workers), self.max_workers)
+        size = self.size
+        if target > size:
+            # Retiring workers that did not exit yet are kept instead
+            kept = min(self._retiring, target - size)
+            self._retiring -= kept
+            for _ in range(target - size - kept):
+                self._worker_seq += 1
+                self._size += 1
+                threading.Thread(target=self._work, name=f"{self.name}-{self._worker_seq}", daemon=True).start()
+            self.n_grown += target - size - kept
+            self.n_shrunk -= kept
+        elif target < size:
+            self._retiring += size - target
+            self.n_shrunk += size - target
+            self._condition.notify_all()
+        if target != size:
+            logger.debug(f"{self.name} resized from {size} to {target} workers")
+
+    def _work(self):
+        condition = self._condition
+        while True:
+            with condition:
+                while not self._items and not self._retiring and not self._stopped:
+                    condition.wait()
+                if self._retiring and not self._items or self._stopped and not self._items:
+                    if self._retiring:
+                        self._retiring -= 1
+                    self._size -= 1
+                    return
+                item, queued_at = self._items.popleft()
+                self._busy += 1
+            started = time.monotonic()
+            try:
+                self.handler(item)
+            except Exception as e:
+                logger.error(f"{self.name} handler failed: {e!r}")
+            finished = time.monotonic()
+            with condition:
+                self._busy -= 1
+                self._n_done += 1
+                self.n_handled += 1
+                self._wait_total += started - queued_at
+                self._latency_total += finished - started
+
+    def _control(self):
+        last = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+            with self._condition:
+                if self._stopped:
+                    return
+                now = time.monotonic()
+                elapsed = now - last
+                last = now
+                if self._n_done:
+                    self._queue_wait = self._wait_total / self._n_done
+                    self._handler_latency = self._latency_total / self._n_done
+                else:
+                    self._queue_wait = 0.0
+                self._arrival_rate = self._n_submitted / elapsed
+                self._n_submitted = self._n_done = 0
+                self._wait_total = self._latency_total = 0.0
+                self._resize(self._target_size(now))
+
+    def _target_size(self, now: float) -> int:
+        size = self.size
+        # Workers needed to keep up with the arrivals at the current latency
+        needed = math.ceil(self._arrival_rate * self._handler_latency)
+        if self._items or self._busy >= size:
+            self._last_saturated = now
+        if self._items and self.queue_wait > self.target_wait:
+            return max(needed, size + max(1, size // 2))
+        if needed > size:
+            return needed
+        if now - self._last_saturated >= self.idle_period:
+            # Gradually, in case the load comes back
+            return max(needed, size - max(1, (size - needed) // 4))
+        return size
@@ -0,0 +1,352 @@
+"""
+Columnar Export of Diameter Messages and Sessions
+
+This module turns collections of messages or sessions into NumPy column
+arrays, so that reports over millions of messages can be computed with
+vectorized operations instead of Python loops over `DiameterMessage` objects.
+
+Every message becomes one row. Strings (Session-Id, MSISDN, APN) are interned
+into tables and stored as integer ids, -1 meaning "not present", and the
+message kind is stored as its `MessageKind` code.
+
+The exported columns come with vectorized helpers for the usual reports:
+- TPS over time
+- Request/answer latency, matched by hop-by-hop and end-to-end identifiers
+- Error rate by APN
+
+NumPy is an optional dependency, only required when exporting.
+
+Example:
+    >>> columns = export_sessions(gx_app.sessions.values())
+    >>> bins, tps = columns.tps(interval=1.0)
+    >>> columns.latency_percentiles()["CCR-I"]
+    {50: 0.0042, 90: 0.011, 99: 0.034}
+    >>> columns.error_rate_by_apn()["internet"]
+    0.0021
+"""
+
+from array import array
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+from .analysis import answer_result_code
+from .constants import *
+from .message import DiameterMessage
+from .session._diameter_session import DiameterSession
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("Columnar export requires numpy. Install it with: pip install numpy")
+
+
+class StringTable:
+    """
+    Interns strings into consecutive integer ids.
+
+    Attributes:
+        values (List[str]): The interned strings, indexed by id
+    """
+
+    def __init__(self):
+        self.values: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def intern(self, value) -> int:
+        """
+        Get the id of a string, adding it to the table if needed.
+
+        Args:
+            value: The string, or None. Bytes are decoded as UTF-8
+
+        Returns:
+            int: The id of the string, or -1 for None
+        """
+        if value is None:
+            return -1
+        string_id = self._ids.get(value)
+        if string_id is None:
+            if isinstance(value, bytes):
+                string_id = self.intern(value.decode(errors='replace'))
+            else:
+                string_id = len(self.values)
+                self.values.append(value)
+            self._ids[value] = string_id
+        return string_id
+
+
+@dataclass
+class MessageColumns:
+    """
+    Messages as NumPy column arrays, one row per message.
+
+    Attributes:
+        timestamp (np.ndarray): float64 seconds since the epoch, NaN if unknown
+        kind (np.ndarray): uint8 `MessageKind` codes
+        is_request (np.ndarray): bool
+        app_id (np.ndarray): uint32 application ids
+        result_code (np.ndarray): int32 Result-Code (or Experimental-Result-Code), 0 if none
+        hop_by_hop_id (np.ndarray): uint32 hop-by-hop identifiers
+        end_to_end_id (np.ndarray): uint32 end-to-end identifiers
+        session (np.ndarray): int32 ids into `session_ids`
+        msisdn (np.ndarray): int32 ids into `msisdns`, -1 if unknown
+        apn (np.ndarray): int32 ids into `apns`, -1 if unknown
+        session_ids (List[str]): Session-Id table
+        msisdns (List[str]): MSISDN table
+        apns (List[str]): APN table
+    """
+    timestamp: 'np.ndarray'
+    kind: 'np.ndarray'
+    is_request: 'np.ndarray'
+    app_id: 'np.ndarray'
+    result_code: 'np.ndarray'
+    hop_by_hop_id: 'np.ndarray'
+    end_to_end_id: 'np.ndarray'
+    session: 'np.ndarray'
+    msisdn: 'np.ndarray'
+    apn: 'np.ndarray'
+    session_ids: List[str] = field(default_factory=list)
+    msisdns: List[str] = field(default_factory=list)
+    apns: List[str] = field(default_factory=list)
+
+    def __len__(self) -> int:
+        return len(self.timestamp)
+
+    def as_dict(self) -> Dict[str, 'np.ndarray']:
+        """
+        Get the columns by name, e.g. to build a pandas DataFrame.
+
+        Returns:
+            Dict[str, np.ndarray]: Every column array
+        """
+        return {name: getattr(self, name) for name in _COLUMNS}
+
+    def tps(self, interval: float = 1.0, requests_only: bool = True,
+            kinds: Optional[Iterable[MessageKind]] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Count messages per time interval.
+
+        Args:
+            interval (float, optional): Bucket width in seconds. Defaults to 1
+            requests_only (bool, optional): Only count requests. Defaults to True
+            kinds (Iterable[MessageKind], optional): Only count these message kinds
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Start time of every bucket and the
+                messages per second in it
+        """
+        mask = ~np.isnan(self.timestamp)
+        if requests_only:
+            mask &= self.is_request
+        if kinds is not None:
+            mask &= np.isin(self.kind, np.fromiter(kinds, dtype=np.uint8))
+        timestamps = self.timestamp[mask]
+        if not len(timestamps):
+            return np.empty(0), np.empty(0)
+        start = np.floor(timestamps.min() / interval) * interval
+        buckets = ((timestamps - start) // interval).astype(np.int64)
+        counts = np.bincount(buckets)
+        return start + np.arange(len(counts)) * interval, counts / interval
+
+    def transactions(self) -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Match every answer with its request.
+
+        An answer is matched with the closest earlier request having the same
+        hop-by-hop and end-to-end identifiers, so retransmitted requests are
+        measured from their last transmission.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Row indices of the matched requests
+                and of their answers
+        """
+        key = self.hop_by_hop_id.astype(np.uint64) << np.uint64(32) | self.end_to_end_id
+        order = np.lexsort((~self.is_request, self.timestamp, key))
+        key = key[order]
+        is_request = self.is_request[order]
+        matched = (key[1:] == key[:-1]) & is_request[:-1] & ~is_request[1:]
+        answers = np.flatnonzero(matched) + 1
+        return order[answers - 1], order[answers]
+
+    def latency(self) -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Get the response time of every transaction.
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Row index of every matched request and
+                its latency in seconds
+        """
+        requests, answers = self.transactions()
+        return requests, self.timestamp[answers] - self.timestamp[requests]
+
+    def latency_percentiles(self, percentiles: Iterable[float] = (50, 90, 99)) -> Dict[str, Dict[float, float]]:
+        """
+        Get latency percentiles by request name.
+
+        Args:
+            percentiles (Iterable[float], optional): Percentiles to report
+
+        Returns:
+            Dict[str, Dict[float, float]]: Percentile to latency, by request name
+        """
+        percentiles = tuple(percentiles)
+        requests, latencies = self.latency()
+        kinds = self.kind[requests]
+        report = {}
+        for kind in np.unique(kinds):
+            values = np.percentile(latencies[kinds == kind], percentiles)
+            report[MESSAGE_KIND_NAMES[MessageKind(kind)]] = dict(zip(percentiles, values.tolist()))
+        return report
+
+    def latency_histogram(self, bins: int = 50, kind: Optional[MessageKind] = None) -> Tuple['np.ndarray', 'np.ndarray']:
+        """
+        Get the latency distribution on logarithmic bins.
+
+        Args:
+            bins (int, optional): Number of bins. Defaults to 50
+            kind (MessageKind, optional): Only use requests of this kind
+
+        Returns:
+            Tuple[np.ndarray, np.ndarray]: Transaction count per bin and the
+                bin edges in seconds
+        """
+        requests, latencies = self.latency()
+        if kind is not None:
+            latencies = latencies[self.kind[requests] == kind]
+        latencies = latencies[latencies > 0]
+        if not len(latencies):
+            return np.zeros(bins, dtype=np.int64), np.zeros(bins + 1)
+        edges = np.geomspace(latencies.min(), latencies.max(), bins + 1)
+        counts, edges = np.histogram(latencies, bins=edges)
+        return counts, edges
+
+    def error_rate_by_apn(self) -> Dict[Optional[str], float]:
+        """
+        Get the share of answers with a non-2xxx result code, by APN.
+
+        Returns:
+            Dict[Optional[str], float]: Error rate by APN, None for answers
+                without a known APN
+        """
+        answers = ~self.is_request & (self.result_code != 0)
+        apn = self.apn[answers] + 1
+        errors = (self.result_code[answers] // 1000) != 2
+        totals = np.bincount(apn, minlength=len(self.apns) + 1)
+        failed = np.bincount(apn, weights=errors, minlength=len(self.apns) + 1)
+        names = [None] + self.apns
+        return {names[i]: float(failed[i] / totals[i]) for i in np.flatnonzero(totals)}
+
+
+_COLUMNS = ('timestamp', 'kind', 'is_request', 'app_id', 'result_code', 'hop_by_hop_id',
+            'end_to_end_id', 'session', 'msisdn', 'apn')
+
+
+class _ColumnBuilder:
+    """Appends rows into typed arrays, which NumPy then wraps without copying."""
+
+    def __init__(self):
+        self.timestamp = array('d')
+        self.kind = array('B')
+        self.is_request = array('B')
+        self.app_id = array('I')
+        self.result_code = array('i')
+        self.hop_by_hop_id = array('I')
+        self.end_to_end_id = array('I')
+        self.session = array('i')
+        self.msisdn = array('i')
+        self.apn = array('i')
+        self.session_ids = StringTable()
+        self.msisdns = StringTable()
+        self.apns = StringTable()
+
+    def add(self, diameter_message: DiameterMessage, session_id: int, msisdn: int, apn: int):
+        timestamp = diameter_message.timestamp
+        is_request = diameter_message.is_request
+        result_code = None if is_request else answer_result_code(diameter_message)
+        self.timestamp.append(float(timestamp) if timestamp else float('nan'))
+        self.kind.append(diameter_message.kind)
+        self.is_request.append(is_request)
+        self.app_id.append(diameter_message.app_id)
+        self.result_code.append(result_code or 0)
+        self.hop_by_hop_id.append(diameter_message.hop_by_hop_id)
+        self.end_to_end_id.append(diameter_message.end_to_end_id)
+        self.session.append(session_id)
+        self.msisdn.append(msisdn)
+        self.apn.append(apn)
+
+    def build(self) -> MessageColumns:
+        columns = {name: np.frombuffer(getattr(self, name), dtype=dtype) for name, dtype in (
+            ('timestamp', np.float64), ('app_id', np.uint32), ('result_code', np.int32),
+            ('hop_by_hop_id', np.uint32), ('end_to_end_id', np.uint32), ('session', np.int32),
+            ('msisdn', np.int32), ('apn', np.int32), ('kind', np.uint8),
+        )}
+        columns['is_request'] = np.frombuffer(self.is_request, dtype=np.uint8).astype(np.bool_)
+        return MessageColumns(**columns, session_ids=self.session_ids.values,
+                              msisdns=self.msisdns.values, apns=self.apns.values)
+
+
+def export_messages(messages: Iterable[DiameterMessage]) -> MessageColumns:
+    """
+    Export messages into column arrays.
+
+    The MSISDN comes from the subscriber attached to each message and the APN
+    from its called_station_id attribute.
+
+    Args:
+        messages (Iterable[DiameterMessage]): The messages to export
+
+    Returns:
+        MessageColumns: One row per message, in iteration order
+
+    Raises:
+        ImportError: If numpy is not installed
+    """
+    _require_numpy()
+    builder = _ColumnBuilder()
+    for diameter_message in messages:
+        builder.add(diameter_message,
+                    builder.session_ids.intern(diameter_message.session_id),
+                    builder.msisdns.intern(diameter_message.msisdn),
+                    builder.apns.intern(diameter_message.apn))
+    return builder.build()
+
+
+def export_sessions(sessions: Iterable[DiameterSession]) -> MessageColumns:
+    """
+    Export the messages of sessions into column arrays.
+
+    Every message gets the MSISDN of its session's subscriber and the APN of
+    its session (for Gx sessions), when the message does not carry its own.
+
+    Args:
+        sessions (Iterable[DiameterSession]): The sessions to export
+
+    Returns:
+        MessageColumns: One row per message, session by session
+
+    Raises:
+        ImportError: If numpy is not installed
+    """
+    _require_numpy()
+    builder = _ColumnBuilder()
+    for session in sessions:
+        session_id = builder.session_ids.intern(session.session_id)
+        session_msisdn = builder.msisdns.intern(session.subscriber.msisdn if session.subscriber else None)
+        session_apn = builder.apns.intern(getattr(session, 'apn', None))
+        for diameter_message in session.messages:
+            msisdn = diameter_message.msisdn
+            apn = diameter_message.apn
+            builder.add(diameter_message, session_id,
+                        session_msisdn if msisdn is None else builder.msisdns.intern(msisdn),
+                        session_apn if apn is None else builder.apns.intern(apn))
+    return builder.build()
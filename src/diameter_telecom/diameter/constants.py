@@ -15,9 +15,13 @@ The constants are organized by message type:
 - Spending Status Notification (SSNR/SSNA): Spending status messages
 - Device Watchdog (DWR/DWA): Connection monitoring messages
 - Capabilities Exchange (CER/CEA): Node capability exchange messages
+
+Every message name also has an integer counterpart in `MessageKind`, which is
+cheaper to compare on hot paths than the name strings.
 """
 
 from diameter.message.constants import *
+from enum import IntEnum
 
 # Credit Control Messages
 CCR_I = "CCR-I"  # Credit Control Request - Initial
@@ -60,3 +64,66 @@ DWA = "DWA"  # Device Watchdog Answer
 # Capabilities Exchange Messages
 CER = "CER"  # Capabilities Exchange Request
 CEA = "CEA"  # Capabilities Exchange Answer
+
+
+class MessageKind(IntEnum):
+    """
+    Integer identifiers for the Diameter message types named above.
+
+    `UNKNOWN` is used for every message that does not map to a known name.
+    """
+    UNKNOWN = 0
+    CCR_I = 1
+    CCA_I = 2
+    CCR_U = 3
+    CCA_U = 4
+    CCR_T = 5
+    CCA_T = 6
+    CCR_E = 7
+    CCA_E = 8
+    RAR = 9
+    RAA = 10
+    AAR = 11
+    AAA = 12
+    STR = 13
+    STA = 14
+    ASR = 15
+    ASA = 16
+    SLR = 17
+    SLA = 18
+    SSNR = 19
+    SSNA = 20
+    DWR = 21
+    DWA = 22
+    CER = 23
+    CEA = 24
+
+
+# Message name for each message kind
+MESSAGE_KIND_NAMES = {
+    MessageKind.UNKNOWN: None,
+    MessageKind.CCR_I: CCR_I,
+    MessageKind.CCA_I: CCA_I,
+    MessageKind.CCR_U: CCR_U,
+    MessageKind.CCA_U: CCA_U,
+    MessageKind.CCR_T: CCR_T,
+    MessageKind.CCA_T: CCA_T,
+    MessageKind.CCR_E: CCR_E,
+    MessageKind.CCA_E: CCA_E,
+    MessageKind.RAR: RAR,
+    MessageKind.RAA: RAA,
+    MessageKind.AAR: AAR,
+    MessageKind.AAA: AAA,
+    MessageKind.STR: STR,
+    MessageKind.STA: STA,
+    MessageKind.ASR: ASR,
+    MessageKind.ASA: ASA,
+    MessageKind.SLR: SLR,
+    MessageKind.SLA: SLA,
+    MessageKind.SSNR: SSNR,
+    MessageKind.SSNA: SSNA,
+    MessageKind.DWR: DWR,
+    MessageKind.DWA: DWA,
+    MessageKind.CER: CER,
+    MessageKind.CEA: CEA,
+}
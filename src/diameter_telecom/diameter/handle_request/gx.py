@@ -36,6 +36,7 @@ def handle_rar(app: GxApplication, message: ReAuthRequest):
         session.add_message(req_diameter_message)
         answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
         session.add_message(answer)
+        app.apply_pcc_rules(session, req_diameter_message)
     return answer
 
 def handle_asr(app: GxApplication, message: AbortSessionRequest):
@@ -55,6 +56,7 @@ def handle_asr(app: GxApplication, message: AbortSessionRequest):
         session.add_message(req_diameter_message)
         answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
         session.add_message(answer)
+        app.terminate_dependents(session_id)
     return answer
 
 
@@ -80,6 +82,8 @@ def handle_ccr(app: GxApplication, message: CreditControlRequest):
         # apn = message.called_station_id
         # gx_session = GxSession(subscriber, message.session_id, framed_ip_address, apn)
         gx_session = GxSession(message.session_id, subscriber=subscriber)
+        # Sets the APN, Origin-Host and framed IPs the session is indexed by
+        gx_session.add_message(DiameterMessage(message))
         app.add_session(gx_session)
         answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
         gx_session.start()
@@ -88,6 +92,7 @@ def handle_ccr(app: GxApplication, message: CreditControlRequest):
         gx_session = app.get_session_by_id(message.session_id)
         if not gx_session:
             raise ValueError(f"Session {message.session_id} not found")
+        gx_session.touch()
         answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
     elif message.cc_request_type == E_CC_REQUEST_TYPE_TERMINATION_REQUEST:
         # Find the session
@@ -96,4 +101,5 @@ def handle_ccr(app: GxApplication, message: CreditControlRequest):
             raise ValueError(f"Session {message.session_id} not found")
         answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
         gx_session.end()
+        app.terminate_dependents(message.session_id)
     return answer
\ No newline at end of file
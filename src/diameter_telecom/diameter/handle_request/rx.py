@@ -4,11 +4,13 @@ from diameter.message.avp.grouped import *
 from ..app import RxApplication
 from ..session import RxSession
 from ..message import DiameterMessage
+from ..log import LogCategory
 import logging
 logger = logging.getLogger(__name__)
+_received_log = LogCategory("rx.received", logger, logging.INFO, rate=50)
 
 def handle_request_rx(app: RxApplication, message: Message):
-    logger.info(f"Received message: {message}")
+    _received_log.log("Received message: %s", message)
     answer = None
     rx_session = app.get_session_by_id(message.session_id)
     if not rx_session:
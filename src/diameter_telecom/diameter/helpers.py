@@ -9,7 +9,7 @@ The functions support both TCP and SCTP transport protocols and provide
 flexible configuration options for node and peer management.
 """
 
-from typing import List, Dict
+from typing import List, Dict, Type
 from diameter.node import Node
 from diameter.node.node import Peer
 
@@ -18,7 +18,8 @@ def create_node(origin_host: str,
                 ip_addresses: List[str],
                 port: int,
                 sctp: bool = False,
-                vendor_ids=[]) -> Node:
+                vendor_ids=[],
+                node_class: Type[Node] = Node) -> Node:
     """
     Create a new Diameter node with specified configuration.
     
@@ -32,6 +33,7 @@ def create_node(origin_host: str,
         port (int): Port number for the connection
         sctp (bool, optional): Whether to use SCTP instead of TCP. Defaults to False
         vendor_ids (list, optional): List of vendor IDs supported by this node
+        node_class (Type[Node], optional): `Node` subclass to create. Defaults to Node
         
     Returns:
         Node: A configured Diameter node instance
@@ -41,9 +43,9 @@ def create_node(origin_host: str,
         >>> node = create_node("pcrf.example.com", "example.com", ["192.168.1.1"], 3868, sctp=True)
     """
     if not sctp:
-        node = Node(origin_host, realm_name, ip_addresses=ip_addresses, tcp_port=port, vendor_ids=vendor_ids)
+        node = node_class(origin_host, realm_name, ip_addresses=ip_addresses, tcp_port=port, vendor_ids=vendor_ids)
     else:
-        node = Node(origin_host, realm_name, ip_addresses=ip_addresses, sctp_port=port, vendor_ids=vendor_ids)
+        node = node_class(origin_host, realm_name, ip_addresses=ip_addresses, sctp_port=port, vendor_ids=vendor_ids)
     return node
 
 def add_peers(node: Node, peers_list: List[Dict]) -> List[Peer]:
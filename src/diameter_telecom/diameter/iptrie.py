@@ -0,0 +1,361 @@
+"""
+Longest-Prefix-Match Indexes for Framed IP Addresses
+
+Binding an Rx session to its Gx session goes through the UE IP address. An
+AAR usually carries the full IPv6 address of the UE, which lies inside the
+prefix delegated in the CCR-I, so an exact match on the stored prefix misses.
+
+This module stores IPv4 addresses and IPv6 prefixes as integers in binary
+radix (Patricia) tries. Insertion, deletion and longest-prefix match walk at
+most one node per prefix bit, whatever the number of prefixes stored.
+
+Keys are accepted in the forms the applications see them:
+- Framed-IP-Address: 4 raw bytes, or an IPv4 string
+- Framed-IPv6-Prefix: RFC 3162 bytes (reserved, prefix length, prefix), or
+  an IPv6 prefix or address string
+- 16 raw bytes of an IPv6 address, `ipaddress` addresses and networks
+
+Example:
+    >>> index = IpPrefixIndex(parse_framed_ipv6_prefix)
+    >>> index["2001:db8:0:1::/64"] = "pcef;1;1"
+    >>> index.get("2001:db8:0:1::abcd")
+    'pcef;1;1'
+"""
+
+from typing import Any, Callable, Iterator, List, Optional, Tuple, Union
+import ipaddress
+import threading
+
+# (IP version, prefix as integer, prefix length)
+IpPrefix = Tuple[int, int, int]
+
+_EMPTY = object()
+_NETWORKS = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+
+def _parse_string(value: str) -> IpPrefix:
+    network = ipaddress.ip_network(value.strip(), strict=False)
+    return network.version, int(network.network_address), network.prefixlen
+
+
+def parse_ip_address(value: Union[bytes, str, ipaddress.IPv4Address, ipaddress.IPv6Address,
+                                  ipaddress.IPv4Network, ipaddress.IPv6Network]) -> Optional[IpPrefix]:
+    """
+    Parse an IP address or prefix key.
+
+    Args:
+        value: 4 or 16 raw bytes, a string, or an `ipaddress` object
+
+    Returns:
+        Optional[IpPrefix]: Version, integer and length of the prefix, or None
+            if the value is empty
+
+    Raises:
+        ValueError: If the value is not an IP address or prefix
+    """
+    if not value:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        if len(value) == 4:
+            return 4, int.from_bytes(value, 'big'), 32
+        if len(value) == 16:
+            return 6, int.from_bytes(value, 'big'), 128
+        raise ValueError(f"Invalid IP address bytes {value.hex()}")
+    if isinstance(value, str):
+        return _parse_string(value)
+    if isinstance(value, (ipaddress.IPv4Address, ipaddress.IPv6Address)):
+        return value.version, int(value), value.max_prefixlen
+    if isinstance(value, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return value.version, int(value.network_address), value.prefixlen
+    raise ValueError(f"Invalid IP address {value!r}")
+
+
+def parse_framed_ipv6_prefix(value: Union[bytes, str, ipaddress.IPv6Address, ipaddress.IPv6Network]) -> Optional[IpPrefix]:
+    """
+    Parse a Framed-IPv6-Prefix key.
+
+    Args:
+        value: RFC 3162 bytes, a string, or an `ipaddress` object. The bytes
+            must have a reserved first byte of 0, and hold either just the
+            prefix bytes or a full 16-byte prefix field
+
+    Returns:
+        Optional[IpPrefix]: Version, integer and length of the prefix, or None
+            if the value is empty
+
+    Raises:
+        ValueError: If the value is not an IPv6 prefix
+    """
+    if not value:
+        return None
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = bytes(value)
+        if (len(value) < 2 or value[0] or value[1] > 128
+                or len(value) not in (2 + (value[1] + 7) // 8, 18)):
+            raise ValueError(f"Invalid Framed-IPv6-Prefix {value.hex()}")
+        length = value[1]
+        prefix = int.from_bytes(value[2:18].ljust(16, b"\x00"), 'big')
+        return 6, prefix >> (128 - length) << (128 - length), length
+    return parse_ip_address(value)
+
+
+class _Node:
+    __slots__ = ('prefix', 'length', 'value', 'children')
+
+    def __init__(self, prefix: int, length: int, value: Any):
+        self.prefix = prefix
+        self.length = length
+        self.value = value
+        self.children: List[Optional[_Node]] = [None, None]
+
+
+class PrefixTrie:
+    """
+    Path-compressed binary trie of prefixes of a fixed bit width.
+
+    Attributes:
+        bits (int): Address width, 32 for IPv4 and 128 for IPv6
+    """
+
+    def __init__(self, bits: int):
+        self.bits = bits
+        self._root: Optional[_Node] = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _mask(self, value: int, length: int) -> int:
+        shift = self.bits - length
+        return value >> shift << shift
+
+    def _bit(self, value: int, position: int) -> int:
+        return (value >> (self.bits - 1 - position)) & 1
+
+    def _common_length(self, a: int, a_length: int, b: int, b_length: int) -> int:
+        length = min(a_length, b_length)
+        difference = a ^ b
+        if difference:
+            length = min(length, self.bits - difference.bit_length())
+        return length
+
+    def _check(self, prefix: int, length: int):
+        if not 0 <= length <= self.bits:
+            raise ValueError(f"Invalid prefix length {length} for {self.bits} bit addresses")
+        if not 0 <= prefix < 1 << self.bits:
+            raise ValueError(f"Invalid prefix {prefix} for {self.bits} bit addresses")
+
+    def insert(self, prefix: int, length: int, value: Any):
+        """
+        Insert or replace the value of a prefix.
+        """
+        self._check(prefix, length)
+        prefix = self._mask(prefix, length)
+        parent, side, node = None, 0, self._root
+        while True:
+            if node is None:
+                self._attach(parent, side, _Node(prefix, length, value))
+                self._size += 1
+                return
+            common = self._common_length(prefix, length, node.prefix, node.length)
+            if common == node.length:
+                if common == length:
+                    if node.value is _EMPTY:
+                        self._size += 1
+                    node.value = value
+                    return
+                parent, side = node, self._bit(prefix, node.length)
+                node = node.children[side]
+                continue
+            # The new prefix diverges from the node, or is a shorter prefix of it
+            if common == length:
+                new = _Node(prefix, length, value)
+                new.children[self._bit(node.prefix, length)] = node
+            else:
+                new = _Node(self._mask(prefix, common), common, _EMPTY)
+                new.children[self._bit(node.prefix, common)] = node
+                new.children[self._bit(prefix, common)] = _Node(prefix, length, value)
+            self._attach(parent, side, new)
+            self._size += 1
+            return
+
+    def _attach(self, parent: Optional[_Node], side: int, node: Optional[_Node]):
+        if parent is None:
+            self._root = node
+        else:
+            parent.children[side] = node
+
+    def _find(self, prefix: int, length: int) -> List[Tuple[Optional[_Node], int, _Node]]:
+        # Path of (parent, side, node) down to the node of the exact prefix
+        path = []
+        parent, side, node = None, 0, self._root
+        while node is not None and node.length <= length:
+            if self._mask(prefix, node.length) != node.prefix:
+                return []
+            path.append((parent, side, node))
+            if node.length == length:
+                return path if node.value is not _EMPTY else []
+            parent, side = node, self._bit(prefix, node.length)
+            node = node.children[side]
+        return []
+
+    def get(self, prefix: int, length: int, default: Any = None) -> Any:
+        """
+        Get the value of an exact prefix.
+        """
+        self._check(prefix, length)
+        path = self._find(self._mask(prefix, length), length)
+        return path[-1][2].value if path else default
+
+    def delete(self, prefix: int, length: int) -> bool:
+        """
+        Delete a prefix.
+
+        Returns:
+            bool: True if the prefix was present
+        """
+        self._check(prefix, length)
+        path = self._find(self._mask(prefix, length), length)
+        if not path:
+            return False
+        parent, side, node = path[-1]
+        node.value = _EMPTY
+        self._size -= 1
+        children = [child for child in node.children if child is not None]
+        if len(children) == 2:
+            return True
+        self._attach(parent, side, children[0] if children else None)
+        # A branch node left with a single child is not needed anymore
+        if not children and parent is not None and parent.value is _EMPTY:
+            grandparent, parent_side = (path[-2][0], path[-2][1]) if len(path) >= 2 else (None, 0)
+            remaining = parent.children[0] or parent.children[1]
+            self._attach(grandparent, parent_side, remaining)
+        return True
+
+    def longest_match(self, address: int, length: Optional[int] = None) -> Optional[Tuple[int, int, Any]]:
+        """
+        Find the longest stored prefix containing an address or prefix.
+
+        Args:
+            address (int): The address
+            length (int, optional): Only match prefixes up to this length,
+                when looking up a prefix rather than an address
+
+        Returns:
+            Optional[Tuple[int, int, Any]]: Prefix, length and value of the
+                match, or None
+        """
+        if length is None:
+            length = self.bits
+        self._check(address, length)
+        best = None
+        node = self._root
+        while node is not None and node.length <= length:
+            if self._mask(address, node.length) != node.prefix:
+                break
+            if node.value is not _EMPTY:
+                best = node
+            if node.length == length:
+                break
+            node = node.children[self._bit(address, node.length)]
+        return (best.prefix, best.length, best.value) if best else None
+
+    def items(self) -> Iterator[Tuple[int, int, Any]]:
+        stack = [self._root] if self._root else []
+        while stack:
+            node = stack.pop()
+            if node.value is not _EMPTY:
+                yield node.prefix, node.length, node.value
+            stack.extend(child for child in reversed(node.children) if child is not None)
+
+    def clear(self):
+        self._root = None
+        self._size = 0
+
+
+class IpPrefixIndex:
+    """
+    Secondary session index resolving keys by longest-prefix match.
+
+    Implements the index interface of `SessionRegistry`, so it can replace the
+    exact-match index of a Framed IP key. Stored keys are parsed with `parse`
+    and lookups accept any form `parse_ip_address` or `parse` understands.
+
+    Entries are only a few integers, so a `DiskSessionStore` keeps them for
+    the sessions it evicts to disk (`retains_evicted`).
+    """
+
+    retains_evicted = True
+
+    def __init__(self, parse: Callable[[Any], Optional[IpPrefix]] = parse_ip_address):
+        self.parse = parse
+        self._tries = {4: PrefixTrie(32), 6: PrefixTrie(128)}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(len(trie) for trie in self._tries.values())
+
+    def __repr__(self) -> str:
+        return f"IpPrefixIndex({dict(self.items())})"
+
+    def __setitem__(self, key, session_id: str):
+        version, prefix, length = self.parse(key)
+        with self._lock:
+            self._tries[version].insert(prefix, length, session_id)
+
+    def __contains__(self, key) -> bool:
+        return self.get(key) is not None
+
+    def _parse_lookup(self, key) -> Optional[IpPrefix]:
+        # 16 raw bytes are an address, even where they could pass for RFC 3162 bytes
+        if isinstance(key, (bytes, bytearray, memoryview)) and len(key) == 16:
+            return parse_ip_address(key)
+        try:
+            return self.parse(key)
+        except ValueError:
+            return parse_ip_address(key)
+
+    def get(self, key, default: Any = None) -> Any:
+        """
+        Get the Session-Id of the longest prefix containing an address.
+        """
+        parsed = self._parse_lookup(key)
+        if parsed is None:
+            return default
+        version, prefix, length = parsed
+        with self._lock:
+            match = self._tries[version].longest_match(prefix, length)
+        return match[2] if match else default
+
+    def get_exact(self, key, default: Any = None) -> Any:
+        parsed = self._parse_lookup(key)
+        if parsed is None:
+            return default
+        version, prefix, length = parsed
+        with self._lock:
+            return self._tries[version].get(prefix, length, default)
+
+    def pop_if(self, key, session_id: str) -> bool:
+        """
+        Remove a prefix only if it still maps to a Session-Id.
+        """
+        parsed = self.parse(key)
+        if parsed is None:
+            return False
+        version, prefix, length = parsed
+        with self._lock:
+            trie = self._tries[version]
+            if trie.get(prefix, length, _EMPTY) != session_id:
+                return False
+            return trie.delete(prefix, length)
+
+    def items(self) -> List[Tuple[str, str]]:
+        with self._lock:
+            return [(str(_NETWORKS[version]((prefix, length))), value)
+                    for version, trie in self._tries.items() for prefix, length, value in trie.items()]
+
+    def clear(self):
+        with self._lock:
+            for trie in self._tries.values():
+                trie.clear()
@@ -0,0 +1,211 @@
+"""
+Bounded Logging for the Request Hot Path
+
+This module keeps the cost of logging bounded when every request logs
+something, e.g. during a storm of error answers.
+
+Hot path log calls go through a `LogCategory`, which:
+1. Returns before doing anything when its level is disabled
+2. Keeps 1 in `sample_every` records
+3. Rate limits the records kept with a token bucket
+4. Counts every record it drops, and reports the count in a summary line at
+   most once per `summary_interval` seconds
+
+Formatting is always deferred to the logging module: arguments are passed
+%-style, and expensive ones (like message dumps) are wrapped with `lazy`, so
+they are only computed for records that are actually emitted.
+
+Categories are registered by name and can be tuned at runtime.
+
+Example:
+    >>> configure_log_category("answer.error", sample_every=100, rate=5)
+    >>> configure_log_category("session.lifecycle", rate=0)  # Only summaries
+"""
+
+from typing import Callable, Dict, Optional
+import itertools
+import logging
+import threading
+import time
+
+LOG_CATEGORIES: Dict[str, 'LogCategory'] = {}
+
+
+class lazy:
+    """
+    Defers a call until the value is formatted into a log record.
+
+    Example:
+        >>> logger.error("Answer with error:\\n%s", lazy(answer.dump))
+    """
+    __slots__ = ('function', 'args')
+
+    def __init__(self, function: Callable, *args):
+        self.function = function
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.function(*self.args))
+
+
+class TokenBucket:
+    """
+    Allows `rate` events per second on average, in bursts of up to `burst`.
+
+    Attributes:
+        rate (float): Tokens added per second
+        burst (float): Bucket capacity
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        if burst is None:
+            burst = max(rate, 1) if rate > 0 else 0
+        self.burst = burst
+        self._tokens = self.burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        """
+        Take a token if one is available.
+
+        Returns:
+            bool: True if the event is allowed
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+            self._last = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            return False
+
+
+class LogCategory:
+    """
+    A sampled and rate limited stream of log records.
+
+    Attributes:
+        name (str): Category name, used to configure it
+        logger (logging.Logger): Logger records are emitted to
+        level (int): Level of the records
+        sample_every (int): Keep 1 in this many records
+        summary_interval (float): Minimum seconds between summary lines
+        n_emitted (int): Records emitted
+        n_suppressed (int): Records dropped by sampling or rate limiting
+    """
+
+    def __init__(self, name: str, logger: logging.Logger,
+                 level: int = logging.INFO,
+                 sample_every: int = 1,
+                 rate: Optional[float] = None,
+                 burst: Optional[float] = None,
+                 summary_interval: float = 60.0):
+        self.name = name
+        self.logger = logger
+        self.level = level
+        self.summary_interval = summary_interval
+        self.n_emitted = 0
+        self.n_suppressed = 0
+        self._pending_suppressed = 0
+        self._last_summary = time.monotonic()
+        self._lock = threading.Lock()
+        self.sample_every = 1
+        self._counter = itertools.count()
+        self._bucket: Optional[TokenBucket] = None
+        self.configure(sample_every=sample_every, rate=rate, burst=burst)
+        LOG_CATEGORIES[name] = self
+
+    def configure(self, sample_every: Optional[int] = None, rate: Optional[float] = None, burst: Optional[float] = None):
+        """
+        Change the sampling and rate limiting of the category.
+
+        Args:
+            sample_every (int, optional): Keep 1 in this many records
+            rate (float, optional): Records per second, 0 to only log summaries
+            burst (float, optional): Records allowed in a burst. Defaults to the rate
+
+        Raises:
+            ValueError: If sample_every is lower than 1 or rate is negative
+        """
+        if sample_every is not None:
+            if sample_every < 1:
+                raise ValueError(f"sample_every must be at least 1. Provided: {sample_every}")
+            self.sample_every = sample_every
+        if rate is not None:
+            if rate < 0:
+                raise ValueError(f"rate must not be negative. Provided: {rate}")
+            self._bucket = TokenBucket(rate, burst)
+
+    def is_enabled(self) -> bool:
+        return self.logger.isEnabledFor(self.level)
+
+    def log(self, msg: str, *args, **kwargs):
+        """
+        Log a record, unless it is sampled out or rate limited.
+
+        Args:
+            msg (str): %-style format string
+            *args: Format arguments, only formatted if the record is emitted
+            **kwargs: Passed to `logging.Logger.log`, e.g. exc_info
+        """
+        if not self.logger.isEnabledFor(self.level):
+            return
+        if (self.sample_every > 1 and next(self._counter) % self.sample_every) \
+                or (self._bucket is not None and not self._bucket.take()):
+            with self._lock:
+                self.n_suppressed += 1
+                self._pending_suppressed += 1
+            self._maybe_summarise()
+            return
+        with self._lock:
+            self.n_emitted += 1
+        # Attributed to the caller, not to this method
+        kwargs['stacklevel'] = kwargs.get('stacklevel', 1) + 1
+        self.logger.log(self.level, msg, *args, **kwargs)
+        self._maybe_summarise()
+
+    def _maybe_summarise(self):
+        if self._pending_suppressed and time.monotonic() - self._last_summary >= self.summary_interval:
+            self.summarise()
+
+    def summarise(self):
+        """
+        Log how many records were suppressed since the last summary, if any.
+        """
+        with self._lock:
+            now = time.monotonic()
+            suppressed = self._pending_suppressed
+            elapsed = now - self._last_summary
+            self._pending_suppressed = 0
+            self._last_summary = now
+        if suppressed:
+            self.logger.log(self.level, "Suppressed %d '%s' log records in the last %.1fs",
+                            suppressed, self.name, elapsed, stacklevel=2)
+
+
+def configure_log_category(name: str, sample_every: Optional[int] = None,
+                           rate: Optional[float] = None, burst: Optional[float] = None):
+    """
+    Change the sampling and rate limiting of a registered category.
+
+    Args:
+        name (str): The category name
+        sample_every (int, optional): Keep 1 in this many records
+        rate (float, optional): Records per second, 0 to only log summaries
+        burst (float, optional): Records allowed in a burst
+
+    Raises:
+        KeyError: If no category has this name
+    """
+    LOG_CATEGORIES[name].configure(sample_every=sample_every, rate=rate, burst=burst)
+
+
+def summarise_log_categories():
+    """
+    Log the suppressed record counts of every category, e.g. at shutdown.
+    """
+    for category in LOG_CATEGORIES.values():
+        category.summarise()
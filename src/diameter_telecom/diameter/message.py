@@ -1,13 +1,173 @@
 from diameter.message.commands import *
 from diameter.message.avp.grouped import *
-from diameter.message import Message, dump
+from diameter.message import Message, MessageHeader, dump
 from .constants import *
 from . import Subscriber
+from diameter.message.commands import all_commands
+from typing import Iterator
 import datetime
 import logging
+import struct
 
 logger = logging.getLogger(__name__)
 
+_HEADER = struct.Struct(">IIIII")
+_HEADER_IDS = struct.Struct(">III")
+_AVP_HEADER = struct.Struct(">II")
+_UINT32 = struct.Struct(">I")
+_INT32 = struct.Struct(">i")
+
+HEADER_LENGTH = 20
+AVP_FLAG_VENDOR = 0x80
+
+# Top-level AVPs that are extracted straight from the raw bytes when a message
+# is decoded lazily. Anything else triggers a full decode of the message.
+_LAZY_AVPS = {
+    AVP_SESSION_ID: ('session_id', lambda v: str(v, 'utf-8')),
+    AVP_CC_REQUEST_TYPE: ('cc_request_type', lambda v: _INT32.unpack(v)[0]),
+    AVP_RESULT_CODE: ('result_code', lambda v: _UINT32.unpack(v)[0]),
+    AVP_ORIGIN_HOST: ('origin_host', bytes),
+    AVP_ORIGIN_REALM: ('origin_realm', bytes),
+    AVP_DESTINATION_HOST: ('destination_host', bytes),
+    AVP_DESTINATION_REALM: ('destination_realm', bytes),
+}
+_LAZY_AVP_NAMES = frozenset(attr_name for attr_name, _ in _LAZY_AVPS.values())
+
+# Message kind by (command code, is request, CC-Request-Type). The
+# CC-Request-Type is only part of the key for Credit Control messages and is
+# None for every other command.
+MESSAGE_KINDS = {
+    (CreditControl.code, True, E_CC_REQUEST_TYPE_INITIAL_REQUEST): MessageKind.CCR_I,
+    (CreditControl.code, False, E_CC_REQUEST_TYPE_INITIAL_REQUEST): MessageKind.CCA_I,
+    (CreditControl.code, True, E_CC_REQUEST_TYPE_UPDATE_REQUEST): MessageKind.CCR_U,
+    (CreditControl.code, False, E_CC_REQUEST_TYPE_UPDATE_REQUEST): MessageKind.CCA_U,
+    (CreditControl.code, True, E_CC_REQUEST_TYPE_TERMINATION_REQUEST): MessageKind.CCR_T,
+    (CreditControl.code, False, E_CC_REQUEST_TYPE_TERMINATION_REQUEST): MessageKind.CCA_T,
+    (CreditControl.code, True, E_CC_REQUEST_TYPE_EVENT_REQUEST): MessageKind.CCR_E,
+    (CreditControl.code, False, E_CC_REQUEST_TYPE_EVENT_REQUEST): MessageKind.CCA_E,
+    (ReAuth.code, True, None): MessageKind.RAR,
+    (ReAuth.code, False, None): MessageKind.RAA,
+    (AbortSession.code, True, None): MessageKind.ASR,
+    (AbortSession.code, False, None): MessageKind.ASA,
+    (SpendingLimit.code, True, None): MessageKind.SLR,
+    (SpendingLimit.code, False, None): MessageKind.SLA,
+    (SpendingStatusNotification.code, True, None): MessageKind.SSNR,
+    (SpendingStatusNotification.code, False, None): MessageKind.SSNA,
+    (DeviceWatchdog.code, True, None): MessageKind.DWR,
+    (DeviceWatchdog.code, False, None): MessageKind.DWA,
+    (CapabilitiesExchange.code, True, None): MessageKind.CER,
+    (CapabilitiesExchange.code, False, None): MessageKind.CEA,
+    (SessionTermination.code, True, None): MessageKind.STR,
+    (SessionTermination.code, False, None): MessageKind.STA,
+    (Aa.code, True, None): MessageKind.AAR,
+    (Aa.code, False, None): MessageKind.AAA,
+}
+
+
+def parse_header(data: memoryview) -> MessageHeader:
+    """
+    Parse the 20-byte Diameter header from raw bytes.
+
+    Args:
+        data: Raw message bytes, at least 20 bytes long
+
+    Returns:
+        MessageHeader: The decoded message header
+
+    Raises:
+        ValueError: If the data is too short to contain a header
+    """
+    if len(data) < HEADER_LENGTH:
+        raise ValueError(f"Diameter message must be at least {HEADER_LENGTH} bytes. Provided: {len(data)}")
+    version_length, flags_code, app_id, hop_by_hop_id, end_to_end_id = _HEADER.unpack_from(data)
+    header = MessageHeader(version_length >> 24, version_length & 0x00ffffff,
+                           flags_code >> 24, flags_code & 0x00ffffff,
+                           app_id, hop_by_hop_id, end_to_end_id)
+    header.length_header = HEADER_LENGTH
+    return header
+
+
+def scan_lazy_avps(data: memoryview) -> dict:
+    """
+    Extract the lazily decoded top-level AVPs from raw message bytes.
+
+    Only AVP headers are walked; grouped AVPs are skipped over without being
+    decoded and no AVP payload is copied unless it belongs to the fast set.
+
+    Args:
+        data: Raw message bytes, exactly one Diameter message long
+
+    Returns:
+        dict: Attribute name to value for every fast AVP found in the message
+
+    Raises:
+        ValueError: If an AVP length runs past the end of the message
+    """
+    values = {}
+    position = HEADER_LENGTH
+    end = len(data)
+    while position + 8 <= end:
+        code, flags_length = _AVP_HEADER.unpack_from(data, position)
+        length = flags_length & 0x00ffffff
+        header_length = 12 if flags_length >> 24 & AVP_FLAG_VENDOR else 8
+        if length < header_length or position + length > end:
+            raise ValueError(f"Invalid AVP length {length} at offset {position}")
+        if header_length == 8 and code in _LAZY_AVPS:
+            attr_name, decode = _LAZY_AVPS[code]
+            if attr_name not in values:
+                values[attr_name] = decode(data[position + 8:position + length])
+        position += (length + 3) & ~3
+    return values
+
+
+def _message_attribute(name: str) -> property:
+    """
+    Create a property delegating to an attribute of the wrapped message.
+
+    While the message is lazily decoded, attributes of the fast AVP set are
+    taken from the values scanned out of the raw bytes; any other attribute
+    decodes the message first. Setting the property stores the value on the
+    wrapper only, without decoding or changing the wrapped message.
+    """
+    lazy = name in _LAZY_AVP_NAMES
+
+    def getter(self):
+        overrides = self._overrides
+        if overrides is not None and name in overrides:
+            return overrides[name]
+        message = self._message
+        if message is None:
+            if lazy:
+                return self._lazy_avps.get(name)
+            message = self.decode()
+        return getattr(message, name, None)
+
+    def setter(self, value):
+        if self._overrides is None:
+            self._overrides = {}
+        self._overrides[name] = value
+
+    return property(getter, setter, doc=f"Get the {name} of the wrapped message.")
+
+
+def _command_classes(command: type) -> Iterator[type]:
+    yield command
+    for subclass in command.__subclasses__():
+        yield from _command_classes(subclass)
+
+
+def _delegate_message_attributes(cls: type):
+    """
+    Add a delegating property to `cls` for every AVP attribute of every
+    command known to the diameter library, unless `cls` already defines it.
+    """
+    for command in all_commands.values():
+        for command_class in _command_classes(command):
+            for avp_def in getattr(command_class, 'avp_def', ()):
+                if not hasattr(cls, avp_def.attr_name):
+                    setattr(cls, avp_def.attr_name, _message_attribute(avp_def.attr_name))
+
+
 class DiameterMessage:
     """
     Represents a Diameter protocol message with extended functionality.
@@ -26,19 +186,45 @@ class DiameterMessage:
         framed_ipv6_prefix: Framed IPv6 prefix associated with the message
         mcc_mnc: Mobile Country Code and Mobile Network Code
         apn: Access Point Name associated with the message
+
+    Messages created from raw ``bytes``, ``bytearray`` or ``memoryview`` objects
+    are decoded lazily: only the header and a handful of top-level AVPs
+    (Session-Id, CC-Request-Type, Result-Code, Origin/Destination Host and
+    Realm) are read from the buffer, and the full ``Message`` is only built the
+    first time any other message attribute is accessed. The buffer is not
+    copied, so it must not be modified until the message has been decoded.
+
+    The wrapper uses ``__slots__`` for all of its own attributes. Every AVP
+    attribute of the commands known to the diameter library is delegated to
+    the wrapped message through a property; any other attribute is read from
+    the wrapped message as well, returning None if the message does not have it.
+    AVP attributes set on the wrapper are kept by the wrapper and returned
+    instead of those of the message, which is left untouched. Attributes that
+    are neither wrapper attributes nor AVPs cannot be set.
     """
+    __slots__ = (
+        '_message', '_header', '_raw', '_lazy_avps', '_kind', '_identity', '_overrides',
+        'timestamp', '_subscriber', 'pkt_number', 'pcap_filepath',
+        'framed_ip_address', 'framed_ipv6_prefix', 'sgsn_mcc_mnc', 'called_station_id',
+    )
     
     def __init__(self, obj):
         """
         Initialize a DiameterMessage instance.
         
         Args:
-            obj: Either a hex string representation of the message or a Message instance
+            obj: Either a hex string representation of the message, a Message
+                instance, or the raw message bytes (decoded lazily)
             
         Raises:
-            ValueError: If an invalid hex string is provided
-            TypeError: If obj is neither a string nor a Message instance
-        """
+            ValueError: If an invalid hex string or invalid message bytes are provided
+            TypeError: If obj is neither a string, bytes nor a Message instance
+        """
+        # Raw buffer and fast AVP values, only set while lazily decoded
+        self._raw = None
+        self._lazy_avps = None
+        # AVP attributes set on the wrapper
+        self._overrides = None
         if isinstance(obj, Message):
             self.message = obj
         elif isinstance(obj, str):
@@ -48,60 +234,158 @@ class DiameterMessage:
                 self.message = Message.from_bytes(message_bytes)
             except ValueError:
                 raise ValueError("Invalid hex string provided.")
+        elif isinstance(obj, (bytes, bytearray, memoryview)):
+            data = memoryview(obj)
+            if data.ndim != 1 or data.itemsize != 1:
+                data = data.cast('B')
+            header = parse_header(data)
+            if header.length < HEADER_LENGTH or header.length > len(data):
+                raise ValueError(f"Invalid message length {header.length} for {len(data)} bytes provided.")
+            data = data[:header.length]
+            self._message = None
+            self._header = header
+            self._raw = data
+            self._lazy_avps = scan_lazy_avps(data)
+            self._kind = None
+            self._identity = None
         else:
-            raise TypeError(f"Parameter must be a hex string or a Message instance. Provided: {obj},{type(obj)}")
+            raise TypeError(f"Parameter must be a hex string, bytes or a Message instance. Provided: {obj},{type(obj)}")
         
         # Initialize default attributes
-        self._attributes = {
-            'timestamp': None,
-            'subscriber': None,
-            'pkt_number': None,
-            'pcap_filepath': None,
-            'framed_ip_address': None,
-            'framed_ipv6_prefix': None,
-            'sgsn_mcc_mnc': None,
-            'called_station_id': None
-        }
+        self.timestamp = None
+        self._subscriber = None
+        self.pkt_number = None
+        self.pcap_filepath = None
+        self.framed_ip_address = None
+        self.framed_ipv6_prefix = None
+        self.sgsn_mcc_mnc = None
+        self.called_station_id = None
 
     def __getattr__(self, name):
         """
-        Custom attribute getter to handle both message and custom attributes.
+        Attribute getter for attributes not defined by the wrapper itself.
         
         Args:
             name: Name of the attribute to get
             
         Returns:
-            The requested attribute value or None if not found
+            The attribute of the wrapped message or None if not found
+        """
+        if name.startswith('_'):
+            raise AttributeError(name)
+        message = self._message
+        if message is None:
+            message = self.decode()
+        return getattr(message, name, None)
+
+    @property
+    def message(self) -> Message:
         """
-        if name in self._attributes:
-            return self._attributes[name]
-        elif hasattr(self.message, name):
-            return getattr(self.message, name)
-        else:
-            return None
+        Get the wrapped Diameter message, decoding it first if needed.
 
-    def __setattr__(self, name, value):
+        Returns:
+            Message: The wrapped Diameter message
         """
-        Custom attribute setter to handle both message and custom attributes.
-        
-        Args:
-            name: Name of the attribute to set
-            value: Value to set for the attribute
-            
-        Raises:
-            ValueError: If trying to set a subscriber that is not a Subscriber instance
-        """
-        if name == 'message' or name == '_attributes':
-            # Handle special attributes directly
-            super().__setattr__(name, value)
-        elif name == 'subscriber' and value is not None:
-            # Special handling for subscriber to ensure type checking
-            if not isinstance(value, Subscriber):
-                raise ValueError("Subscriber must be an instance of Subscriber")
-            self._attributes[name] = value
-        else:
-            # Handle all other attributes through the _attributes dict
-            self._attributes[name] = value
+        if self._message is None:
+            return self.decode()
+        return self._message
+
+    @message.setter
+    def message(self, message: Message):
+        # Replacing the wrapped message drops any lazily decoded state
+        self._message = message
+        self._header = message.header
+        self._raw = None
+        self._lazy_avps = None
+        self._kind = None
+        self._identity = None
+
+    @property
+    def subscriber(self):
+        """
+        Get the subscriber associated with the message.
+
+        Returns:
+            Subscriber or None: The associated subscriber
+        """
+        return self._subscriber
+
+    @subscriber.setter
+    def subscriber(self, value):
+        # Special handling for subscriber to ensure type checking
+        if value is not None and not isinstance(value, Subscriber):
+            raise ValueError("Subscriber must be an instance of Subscriber")
+        self._subscriber = value
+
+    session_id = _message_attribute('session_id')
+    cc_request_type = _message_attribute('cc_request_type')
+    result_code = _message_attribute('result_code')
+    origin_host = _message_attribute('origin_host')
+    origin_realm = _message_attribute('origin_realm')
+    destination_host = _message_attribute('destination_host')
+    destination_realm = _message_attribute('destination_realm')
+
+    def decode(self) -> Message:
+        """
+        Fully decode the wrapped message.
+
+        For lazily decoded messages this builds the ``Message`` from the raw
+        bytes; for every other message it simply returns the wrapped message.
+
+        Returns:
+            Message: The decoded Diameter message
+        """
+        if self._raw is not None:
+            self.message = Message.from_bytes(bytes(self._raw))
+        return self._message
+
+    @property
+    def is_decoded(self):
+        """
+        Check if the full message has been decoded.
+
+        Returns:
+            bool: False while the message is only lazily decoded, True otherwise
+        """
+        return self._raw is None
+
+    @property
+    def header(self):
+        """
+        Get the message header, without decoding the full message.
+
+        Returns:
+            MessageHeader: The message header
+        """
+        return self._header
+
+    @property
+    def command_code(self):
+        """
+        Get the command code from the message header.
+
+        Returns:
+            int: The command code
+        """
+        return self._header.command_code
+
+    @property
+    def kind(self):
+        """
+        Get the kind of the Diameter message.
+
+        The kind is resolved once and cached. It is reset when the wrapped
+        message is replaced, but not when the header or CC-Request-Type of the
+        wrapped message are changed in place.
+
+        Returns:
+            MessageKind: The message kind (e.g., MessageKind.CCR_I)
+        """
+        kind = self._kind
+        if kind is None:
+            kind = classify_diameter_message(self)
+            self._kind = kind
+        return kind
 
     @property
     def name(self):
@@ -111,7 +395,7 @@ class DiameterMessage:
         Returns:
             str: The name of the message (e.g., CCR-I, CCA-I, etc.)
         """
-        return name_diameter_message(self)
+        return MESSAGE_KIND_NAMES[self.kind]
     
     @property
     def message_name(self):
@@ -131,7 +415,7 @@ class DiameterMessage:
         Returns:
             int: The application ID
         """
-        return self.message.header.application_id
+        return self._header.application_id
     
     @property
     def is_request(self):
@@ -141,7 +425,27 @@ class DiameterMessage:
         Returns:
             bool: True if the message is a request, False if it's an answer
         """
-        return self.message.header.is_request
+        return self._header.is_request
+
+    def as_bytes(self) -> bytes:
+        """
+        Get the message in its wire format.
+
+        Lazily decoded messages return their raw bytes without decoding, with
+        the application id and hop-by-hop/end-to-end identifiers of the header
+        written back, since the node sets them while sending; decoded messages
+        are encoded by the wrapped message.
+
+        Returns:
+            bytes: The encoded message
+        """
+        if self._raw is not None:
+            header = self._header
+            data = bytearray(self._raw)
+            _HEADER_IDS.pack_into(data, 8, header.application_id,
+                                  header.hop_by_hop_identifier, header.end_to_end_identifier)
+            return bytes(data)
+        return self._message.as_bytes()
 
     @property
     def hex_string(self):
@@ -151,6 +455,8 @@ class DiameterMessage:
         Returns:
             str: The message in hexadecimal format
         """
+        if self._raw is not None:
+            return self._raw.hex()
         return self.message.as_bytes().hex()
     
     @property
@@ -193,7 +499,7 @@ class DiameterMessage:
         Returns:
             int: The hop-by-hop identifier
         """
-        return self.message.header.hop_by_hop_identifier
+        return self._header.hop_by_hop_identifier
     
     @property
     def end_to_end_id(self):
@@ -203,7 +509,7 @@ class DiameterMessage:
         Returns:
             int: The end-to-end identifier
         """
-        return self.message.header.end_to_end_identifier
+        return self._header.end_to_end_identifier
     
     @property
     def apn(self):
@@ -237,12 +543,72 @@ class DiameterMessage:
     
     def __repr__(self):
         return f"{self.time},{self.name}"
+
+    def __reduce__(self):
+        # Pickled as the encoded message, which is decoded lazily again on
+        # unpickling, plus the wrapper attributes
+        slot_state = {name: getattr(self, name) for name in _PICKLED_SLOTS}
+        return (DiameterMessage, (self.as_bytes(),), (None, slot_state))
     
+    @property
+    def identity(self):
+        """
+        Get the key identifying the message, used for equality and hashing.
+
+        The key is cached once both the hop-by-hop and end-to-end identifiers
+        have been assigned, as they no longer change after that point.
+
+        Returns:
+            tuple: (hop_by_hop_id, end_to_end_id, is_request)
+        """
+        identity = self._identity
+        if identity is None:
+            header = self._header
+            identity = (header.hop_by_hop_identifier, header.end_to_end_identifier, header.is_request)
+            if header.hop_by_hop_identifier and header.end_to_end_identifier:
+                self._identity = identity
+        return identity
+
     def __eq__(self, other):
-        return self.hop_by_hop_id == other.hop_by_hop_id and self.end_to_end_id == other.end_to_end_id and self.is_request == other.is_request
+        if not isinstance(other, DiameterMessage):
+            return NotImplemented
+        identity = self._identity
+        other_identity = other._identity
+        if identity is None or other_identity is None:
+            return self.identity == other.identity
+        return identity == other_identity
     
     def __hash__(self):
-        return hash((self.hop_by_hop_id, self.end_to_end_id, self.is_request))
+        return hash(self._identity or self.identity)
+
+
+_delegate_message_attributes(DiameterMessage)
+
+# Wrapper attributes preserved when a DiameterMessage is pickled
+_PICKLED_SLOTS = ('timestamp', '_subscriber', 'pkt_number', 'pcap_filepath',
+                  'framed_ip_address', 'framed_ipv6_prefix', 'sgsn_mcc_mnc', 'called_station_id', '_overrides')
+
+
+def classify_diameter_message(diameter_message: DiameterMessage) -> MessageKind:
+    """
+    Get the kind of a diameter message from its header and CC-Request-Type.
+
+    The kind is resolved with a single lookup in `MESSAGE_KINDS`. Only the
+    header and the CC-Request-Type are needed, so lazily decoded messages are
+    classified without a full decode.
+
+    Args:
+        diameter_message: The DiameterMessage instance to classify
+
+    Returns:
+        MessageKind: The message kind, or MessageKind.UNKNOWN if not recognized
+    """
+    command_code = diameter_message.command_code
+    if command_code == CreditControl.code:
+        key = (command_code, diameter_message.is_request, diameter_message.cc_request_type)
+    else:
+        key = (command_code, diameter_message.is_request, None)
+    return MESSAGE_KINDS.get(key, MessageKind.UNKNOWN)
 
 
 def name_diameter_message(diameter_message: DiameterMessage) -> str | None:
@@ -250,8 +616,8 @@ def name_diameter_message(diameter_message: DiameterMessage) -> str | None:
     Get the name of a diameter message based on its type and request/response status.
     
     This function determines the appropriate name for a Diameter message based on
-    its type (e.g., Credit Control, Re-Auth, etc.) and whether it's a request or
-    answer message.
+    its command code (e.g., Credit Control, Re-Auth, etc.), whether it's a
+    request or answer message and, for Credit Control, its CC-Request-Type.
     
     Args:
         diameter_message: The DiameterMessage instance to name
@@ -259,37 +625,4 @@ def name_diameter_message(diameter_message: DiameterMessage) -> str | None:
     Returns:
         str: The message name (e.g., CCR-I, CCA-I, RAR, RAA, etc.) or None if not recognized
     """
-    message = diameter_message.message
-    is_request = message.header.is_request
-
-    # Handle Credit Control messages separately due to additional type check
-    if isinstance(message, CreditControl):
-        cc_type_mapping = {
-            E_CC_REQUEST_TYPE_INITIAL_REQUEST: (CCR_I, CCA_I),
-            E_CC_REQUEST_TYPE_UPDATE_REQUEST: (CCR_U, CCA_U),
-            E_CC_REQUEST_TYPE_TERMINATION_REQUEST: (CCR_T, CCA_T)
-        }
-        cc_request_type = message.cc_request_type
-        if cc_request_type in cc_type_mapping:
-            return cc_type_mapping[cc_request_type][0 if isinstance(message, CreditControlRequest) else 1]
-        return None
-
-    # Map message types to their request/answer names
-    message_type_mapping = {
-        ReAuth: (RAR, RAA),
-        AbortSession: (ASR, ASA),
-        SpendingLimit: (SLR, SLA),
-        SpendingStatusNotification: (SSNR, SSNA),
-        DeviceWatchdog: (DWR, DWA),
-        CapabilitiesExchange: (CER, CEA),
-        SessionTermination: (STR, STA),
-        Aa: (AAR, AAA)
-    }
-
-    # Get the appropriate name based on message type and request/answer status
-    for msg_type, (req_name, ans_name) in message_type_mapping.items():
-        if isinstance(message, msg_type):
-            return req_name if is_request else ans_name
-
-    return None
-
+    return MESSAGE_KIND_NAMES[classify_diameter_message(diameter_message)]
@@ -8,16 +8,224 @@ QoS parameters, and other telecom-specific attributes.
 
 The module is designed to work with the base diameter library's message structures
 and provides telecom-specific parsing functionality.
+
+For messages that have not been fully decoded, the helpers use compiled
+extraction plans (`AvpPlan`), which pull every AVP they need out of the raw
+message bytes in a single pass, without decoding the message.
 """
 
-from typing import List, Tuple, Optional, Set
+from typing import Any, Callable, Dict, List, Tuple, Optional, Set, Union
 from diameter.message.constants import *
+from diameter.message.avp import (AvpGrouped, AvpInteger32, AvpInteger64,
+                                  AvpOctetString, AvpUnsigned32, AvpUnsigned64, AvpUtf8String)
+from diameter.message.avp.dictionary import AVP_DICTIONARY, AVP_VENDOR_DICTIONARY
 from diameter.message.avp.grouped import SubscriptionId
-from .message import DiameterMessage
+from .message import DiameterMessage, HEADER_LENGTH, AVP_FLAG_VENDOR
+import functools
+import struct
 
 import logging
 logger = logging.getLogger(__name__)
 
+_AVP_HEADER = struct.Struct(">II")
+_VENDOR_ID = struct.Struct(">I")
+_UINT32 = struct.Struct(">I")
+_INT32 = struct.Struct(">i")
+_UINT64 = struct.Struct(">Q")
+_INT64 = struct.Struct(">q")
+_VENDOR_FLAG_MASK = AVP_FLAG_VENDOR << 24
+
+# Decoders for the AVP types seen on the hot path; every other type is decoded
+# by the base library's AVP class
+_AVP_DECODERS: Dict[type, Callable[[memoryview], Any]] = {
+    AvpUnsigned32: lambda v: _UINT32.unpack(v)[0],
+    AvpInteger32: lambda v: _INT32.unpack(v)[0],
+    AvpUnsigned64: lambda v: _UINT64.unpack(v)[0],
+    AvpInteger64: lambda v: _INT64.unpack(v)[0],
+    AvpUtf8String: lambda v: str(v, 'utf-8'),
+    AvpOctetString: bytes,
+    AvpGrouped: bytes,
+}
+
+
+def _avp_decoder(avp_type: type) -> Callable[[memoryview], Any]:
+    decoder = _AVP_DECODERS.get(avp_type)
+    if decoder is None:
+        return lambda v: avp_type(payload=bytes(v)).value
+    return decoder
+
+
+@functools.lru_cache(maxsize=None)
+def _avps_by_name() -> Dict[str, Tuple[int, int, type]]:
+    """AVP name to (code, vendor id, type). Base AVPs win over 3GPP AVPs, which win over other vendors."""
+    avps = {}
+    vendors = sorted(AVP_VENDOR_DICTIONARY, key=lambda vendor: (vendor != VENDOR_TGPP, vendor))
+    for vendor in vendors:
+        for code, info in AVP_VENDOR_DICTIONARY[vendor].items():
+            avps.setdefault(info["name"], (code, vendor, info["type"]))
+    for code, info in AVP_DICTIONARY.items():
+        avps[info["name"]] = (code, 0, info["type"])
+    return avps
+
+
+@functools.lru_cache(maxsize=None)
+def _avp_by_key(key: int) -> Tuple[Union[str, int], Callable[[memoryview], Any]]:
+    """Name and decoder of an AVP by its plan key, for expanding grouped AVPs."""
+    code, vendor = key & 0xffffffff, key >> 32
+    info = AVP_VENDOR_DICTIONARY.get(vendor, {}).get(code) if vendor else AVP_DICTIONARY.get(code)
+    if info is None:
+        return code, bytes
+    return info["name"], _avp_decoder(info["type"])
+
+
+class _PlanStep:
+    __slots__ = ('decode', 'outputs', 'expand', 'children')
+
+    def __init__(self, decode: Callable[[memoryview], Any]):
+        self.decode = decode
+        self.outputs: List[int] = []
+        self.expand: List[int] = []
+        self.children: Dict[int, '_PlanStep'] = {}
+
+
+class AvpPlan:
+    """
+    A compiled set of AVP paths, extracted from raw message bytes in one pass.
+
+    Paths are AVP names separated by "/", from a top-level AVP down into
+    grouped AVPs. A path may end in "*" to get every AVP inside the grouped
+    AVPs it matches, as a dict of AVP name to value. A path ending in a
+    grouped AVP yields its raw payload.
+
+    Only the AVPs on a declared path are looked at: every other AVP is skipped
+    over using its length, without being copied or decoded.
+
+    Attributes:
+        paths (Tuple[str, ...]): The declared AVP paths
+
+    Example:
+        >>> plan = AvpPlan("Subscription-Id/*", "Charging-Rule-Install/Charging-Rule-Name",
+        ...                "Default-EPS-Bearer-QoS/QoS-Class-Identifier")
+        >>> values = plan.extract(diameter_message)
+        >>> values["Default-EPS-Bearer-QoS/QoS-Class-Identifier"]
+        [9]
+    """
+
+    def __init__(self, *paths: str):
+        """
+        Compile the AVP paths into an extraction plan.
+
+        Args:
+            *paths (str): AVP paths to extract
+
+        Raises:
+            ValueError: If a path is empty, names an unknown AVP or uses "*"
+                anywhere but at its end
+        """
+        if not paths:
+            raise ValueError("At least one AVP path is required")
+        self.paths = paths
+        self._root: Dict[int, _PlanStep] = {}
+        avps = _avps_by_name()
+        for index, path in enumerate(paths):
+            names = path.split("/")
+            expand = names[-1] == "*"
+            if expand:
+                names.pop()
+            if not names or "*" in names or "" in names:
+                raise ValueError(f"Invalid AVP path: {path}")
+            steps = self._root
+            step = None
+            for name in names:
+                if name not in avps:
+                    raise ValueError(f"Unknown AVP {name} in path {path}")
+                code, vendor, avp_type = avps[name]
+                if step is not None and step.decode is not bytes:
+                    raise ValueError(f"AVP path {path} goes through a non-grouped AVP")
+                key = vendor << 32 | code
+                step = steps.get(key)
+                if step is None:
+                    step = steps[key] = _PlanStep(bytes if avp_type is AvpGrouped else _avp_decoder(avp_type))
+                steps = step.children
+            if expand:
+                step.expand.append(index)
+            else:
+                step.outputs.append(index)
+
+    def __repr__(self) -> str:
+        return f"AvpPlan({', '.join(map(repr, self.paths))})"
+
+    def extract(self, data: Union[DiameterMessage, bytes, bytearray, memoryview]) -> Dict[str, List[Any]]:
+        """
+        Extract every declared path from a message.
+
+        Args:
+            data: A DiameterMessage, or the raw bytes of exactly one message
+
+        Returns:
+            Dict[str, List[Any]]: The values found for each path, in message
+                order. Paths that are not present map to an empty list.
+
+        Raises:
+            ValueError: If an AVP length runs past the end of its container
+        """
+        if isinstance(data, DiameterMessage):
+            # The bytes it was read from, without copying them to patch the header
+            data = data.as_bytes() if data._raw is None else data._raw
+        view = memoryview(data)
+        results = [[] for _ in self.paths]
+        _walk(view, HEADER_LENGTH, len(view), self._root, results)
+        return dict(zip(self.paths, results))
+
+
+def _walk(view: memoryview, position: int, end: int, steps: Dict[int, _PlanStep], results: List[List[Any]]):
+    unpack_header = _AVP_HEADER.unpack_from
+    get_step = steps.get
+    while position + 8 <= end:
+        code, flags_length = unpack_header(view, position)
+        length = flags_length & 0x00ffffff
+        if flags_length & _VENDOR_FLAG_MASK:
+            step = get_step(_VENDOR_ID.unpack_from(view, position + 8)[0] << 32 | code)
+            header_length = 12
+        else:
+            step = get_step(code)
+            header_length = 8
+        if length < header_length or position + length > end:
+            raise ValueError(f"Invalid AVP length {length} at offset {position}")
+        if step is not None:
+            start = position + header_length
+            stop = position + length
+            if step.outputs:
+                value = step.decode(view[start:stop])
+                for index in step.outputs:
+                    results[index].append(value)
+            if step.expand:
+                value = _expand(view, start, stop)
+                for index in step.expand:
+                    results[index].append(value)
+            if step.children:
+                _walk(view, start, stop, step.children, results)
+        position += (length + 3) & ~3
+
+
+def _expand(view: memoryview, position: int, end: int) -> Dict[Union[str, int], Any]:
+    values = {}
+    while position + 8 <= end:
+        code, flags_length = _AVP_HEADER.unpack_from(view, position)
+        length = flags_length & 0x00ffffff
+        if flags_length & _VENDOR_FLAG_MASK:
+            key = _VENDOR_ID.unpack_from(view, position + 8)[0] << 32 | code
+            header_length = 12
+        else:
+            key = code
+            header_length = 8
+        if length < header_length or position + length > end:
+            raise ValueError(f"Invalid AVP length {length} at offset {position}")
+        name, decode = _avp_by_key(key)
+        values[name] = decode(view[position + header_length:position + length])
+        position += (length + 3) & ~3
+    return values
+
 def parse_subscription_id(subscription_id: List[SubscriptionId]) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]:
     """
     Parse subscription ID AVPs to extract subscriber identifiers.
@@ -106,6 +314,67 @@ def decode_framed_ipv6(raw_bytes: bytes) -> Optional[str]:
         return None
     
 
+_CHARGING_RULE_INSTALL_PATHS = (
+    "Charging-Rule-Install",
+    "Charging-Rule-Install/Charging-Rule-Base-Name",
+    "Charging-Rule-Install/Charging-Rule-Name",
+    "Charging-Rule-Install/Charging-Rule-Definition/Charging-Rule-Name",
+)
+_CHARGING_RULE_REMOVE_PATHS = (
+    "Charging-Rule-Remove",
+    "Charging-Rule-Remove/Charging-Rule-Base-Name",
+    "Charging-Rule-Remove/Charging-Rule-Name",
+)
+_CHARGING_RULES_PLAN = AvpPlan(*_CHARGING_RULE_INSTALL_PATHS, *_CHARGING_RULE_REMOVE_PATHS)
+_QOS_PLAN = AvpPlan(
+    "Default-EPS-Bearer-QoS/QoS-Class-Identifier",
+    "Default-EPS-Bearer-QoS/Allocation-Retention-Priority/Priority-Level",
+)
+_EVENT_TRIGGER_PLAN = AvpPlan("Event-Trigger")
+_RAT_TYPE_PLAN = AvpPlan("RAT-Type")
+_SUBSCRIPTION_ID_PLAN = AvpPlan("Subscription-Id/*")
+
+
+def _charging_rules(values: Dict[str, List[Any]], paths: Tuple[str, ...]) -> Optional[Set[str]]:
+    # The rule names of a Charging-Rule-Install or Charging-Rule-Remove
+    # extracted by _CHARGING_RULES_PLAN, None if the message has none
+    if not values[paths[0]]:
+        return None
+    pcc_rules = set()
+    for path in paths[1:]:
+        pcc_rules.update(values[path])
+    return pcc_rules
+
+
+def extract_subscription_id(diameter_message: DiameterMessage) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]:
+    """
+    Extract the subscriber identifiers from the Subscription-Id AVPs of a message.
+
+    Same as `parse_subscription_id`, but works on the message itself, so
+    messages that are not fully decoded do not need to be.
+
+    Args:
+        diameter_message (DiameterMessage): The Diameter message to parse
+
+    Returns:
+        Tuple[Optional[str], Optional[str], Optional[str], Optional[str], Optional[str]]: Tuple containing
+            (msisdn, imsi, sip_uri, nai, private). Each value may be None if not present.
+
+    Example:
+        >>> msisdn, imsi, sip_uri, nai, private = extract_subscription_id(message)
+    """
+    if diameter_message.is_decoded:
+        return parse_subscription_id(diameter_message.message.subscription_id or [])
+    identifiers = {}
+    for subscription_id in _SUBSCRIPTION_ID_PLAN.extract(diameter_message)["Subscription-Id/*"]:
+        identifiers[subscription_id.get("Subscription-Id-Type")] = subscription_id.get("Subscription-Id-Data")
+    return (identifiers.get(E_SUBSCRIPTION_ID_TYPE_END_USER_E164),
+            identifiers.get(E_SUBSCRIPTION_ID_TYPE_END_USER_IMSI),
+            identifiers.get(E_SUBSCRIPTION_ID_TYPE_END_USER_SIP_URI),
+            identifiers.get(E_SUBSCRIPTION_ID_TYPE_END_USER_NAI),
+            identifiers.get(E_SUBSCRIPTION_ID_TYPE_END_USER_PRIVATE))
+
+
 def check_charging_rule_remove(diameter_message: DiameterMessage) -> Optional[Set[str]]:
     """
     Extract charging rules to be removed from a Diameter message.
@@ -125,6 +394,12 @@ def check_charging_rule_remove(diameter_message: DiameterMessage) -> Optional[Se
         >>> print(rules)
         {'rule1', 'rule2'}
     """
+    if not diameter_message.is_decoded:
+        try:
+            return _charging_rules(_CHARGING_RULES_PLAN.extract(diameter_message), _CHARGING_RULE_REMOVE_PATHS)
+        except Exception as e:
+            logger.error(f"Error then trying to remove pcc_rules from GxSession: {e}. This error is not relevant to the flow")
+            return None
     message = diameter_message.message
     pcc_rules = set()
     try:
@@ -136,7 +411,8 @@ def check_charging_rule_remove(diameter_message: DiameterMessage) -> Optional[Se
                 if i.charging_rule_name:
                     for j in i.charging_rule_name:
                         pcc_rules.add(j)
-                if i.charging_rule_definition:
+                # Not defined for every grouped AVP by the diameter library
+                if getattr(i, "charging_rule_definition", None):
                     for j in i.charging_rule_definition:
                         charging_rule_name = j.charging_rule_name
                         pcc_rules.add(charging_rule_name)
@@ -163,6 +439,12 @@ def check_charging_rule_install(diameter_message: DiameterMessage) -> Optional[S
         >>> print(rules)
         {'rule1', 'rule2'}
     """
+    if not diameter_message.is_decoded:
+        try:
+            return _charging_rules(_CHARGING_RULES_PLAN.extract(diameter_message), _CHARGING_RULE_INSTALL_PATHS)
+        except Exception as e:
+            logger.error(f"Error then trying to add pcc_rules from GxSession: {e}. This error is not relevant to the flow")
+            return None
     message = diameter_message.message
     pcc_rules = set()
     try:
@@ -174,7 +456,8 @@ def check_charging_rule_install(diameter_message: DiameterMessage) -> Optional[S
                 if i.charging_rule_name:
                     for j in i.charging_rule_name:
                         pcc_rules.add(j)
-                if i.charging_rule_definition:
+                # Not defined for every grouped AVP by the diameter library
+                if getattr(i, "charging_rule_definition", None):
                     for j in i.charging_rule_definition:
                         charging_rule_name = j.charging_rule_name
                         pcc_rules.add(charging_rule_name)
@@ -183,6 +466,30 @@ def check_charging_rule_install(diameter_message: DiameterMessage) -> Optional[S
         logger.error(f"Error then trying to add pcc_rules from GxSession: {e}. This error is not relevant to the flow")
 
 
+def check_charging_rules(diameter_message: DiameterMessage) -> Tuple[Optional[Set[str]], Optional[Set[str]]]:
+    """
+    Extract the charging rules installed and removed by a Diameter message.
+
+    Same as `check_charging_rule_install` and `check_charging_rule_remove`,
+    but reads both in a single pass over a message that is not fully decoded.
+
+    Args:
+        diameter_message (DiameterMessage): The Diameter message to parse
+
+    Returns:
+        Tuple[Optional[Set[str]], Optional[Set[str]]]: The rule names to install
+            and to remove, each None if absent or if parsing fails
+    """
+    if diameter_message.is_decoded:
+        return check_charging_rule_install(diameter_message), check_charging_rule_remove(diameter_message)
+    try:
+        values = _CHARGING_RULES_PLAN.extract(diameter_message)
+    except Exception as e:
+        logger.error(f"Error then trying to update pcc_rules from GxSession: {e}. This error is not relevant to the flow")
+        return None, None
+    return _charging_rules(values, _CHARGING_RULE_INSTALL_PATHS), _charging_rules(values, _CHARGING_RULE_REMOVE_PATHS)
+
+
 def check_qos(diameter_message: DiameterMessage) -> Optional[Tuple[int, int]]:
     """
     Extract QoS parameters from a Diameter message.
@@ -203,6 +510,17 @@ def check_qos(diameter_message: DiameterMessage) -> Optional[Tuple[int, int]]:
         ...     qci, priority = qos_params
         ...     print(f"QCI: {qci}, Priority: {priority}")
     """
+    if not diameter_message.is_decoded:
+        try:
+            values = _QOS_PLAN.extract(diameter_message)
+        except ValueError:
+            logger.error(f"Error then trying to set QoS attributes from GxSession")
+            return None
+        priority_levels = values["Default-EPS-Bearer-QoS/Allocation-Retention-Priority/Priority-Level"]
+        if not priority_levels:
+            return None
+        qos_class_identifiers = values["Default-EPS-Bearer-QoS/QoS-Class-Identifier"]
+        return (qos_class_identifiers[0] if qos_class_identifiers else None), priority_levels[0]
     message = diameter_message.message
     try:
         if hasattr(message, "default_eps_bearer_qos") and message.default_eps_bearer_qos:
@@ -233,6 +551,12 @@ def check_event_trigger(diameter_message: DiameterMessage) -> Optional[List[int]
         >>> if triggers:
         ...     print(f"Event triggers: {triggers}")
     """
+    if not diameter_message.is_decoded:
+        try:
+            return _EVENT_TRIGGER_PLAN.extract(diameter_message)["Event-Trigger"] or None
+        except ValueError:
+            logger.error(f"Error then trying to set Event Trigger from GxSession")
+            return None
     message = diameter_message.message
     event_trigger = []
     try:
@@ -262,6 +586,13 @@ def check_rat_type(diameter_message: DiameterMessage) -> Optional[int]:
         >>> if rat_type:
         ...     print(f"RAT Type: {rat_type}")
     """
+    if not diameter_message.is_decoded:
+        try:
+            rat_types = _RAT_TYPE_PLAN.extract(diameter_message)["RAT-Type"]
+        except ValueError:
+            logger.error(f"Error then trying to set RAT Type from GxSession")
+            return None
+        return rat_types[0] if rat_types and rat_types[0] else None
     message = diameter_message.message
     try:
         if hasattr(message, "rat_type") and message.rat_type:
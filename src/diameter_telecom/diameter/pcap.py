@@ -0,0 +1,499 @@
+"""
+Streaming PCAP/PCAPNG Reader for Diameter Traffic
+
+This module reads Diameter messages straight out of packet capture files. The
+capture is memory-mapped and walked packet by packet, so memory usage does not
+depend on the size of the capture.
+
+The reader:
+1. Understands classic pcap (micro- and nanosecond, both byte orders) and
+   pcapng (per-interface link type and timestamp resolution)
+2. Decodes Ethernet (with VLAN tags), Linux cooked (SLL/SLL2), raw IP and
+   BSD loopback link layers, over IPv4 and IPv6, as well as Wireshark
+   exported PDUs (as written by TrafficRecorder)
+3. Reassembles TCP streams and SCTP DATA chunks on the Diameter ports
+4. Splits the reassembled streams into Diameter PDUs using the header length
+
+Every PDU is yielded as a lazily decoded DiameterMessage, with its timestamp,
+pkt_number and pcap_filepath attributes set. The packet number and timestamp
+are the ones of the packet that completed the PDU, as shown by Wireshark.
+
+Example:
+    >>> for diameter_message in read_pcap("gx.pcapng"):
+    ...     print(diameter_message.pkt_number, diameter_message.name, diameter_message.session_id)
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from .message import DiameterMessage, HEADER_LENGTH
+import logging
+import mmap
+import struct
+
+logger = logging.getLogger(__name__)
+
+DIAMETER_PORTS = (3868,)
+
+# Largest Diameter message accepted before a stream is considered corrupt
+MAX_MESSAGE_LENGTH = 1 << 20
+# Out-of-order TCP segments kept per stream before the gap is given up on
+MAX_PENDING_SEGMENTS = 64
+
+# Link layer types
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LOOP = 108
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_WIRESHARK_UPPER_PDU = 252
+LINKTYPE_LINUX_SLL2 = 276
+
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86dd
+ETHERTYPE_VLAN = (0x8100, 0x88a8, 0x9100)
+
+IPPROTO_TCP = 6
+IPPROTO_SCTP = 132
+IPV6_EXTENSION_HEADERS = (0, 43, 60)
+IPV6_FRAGMENT_HEADER = 44
+
+TCP_FLAG_FIN = 0x01
+TCP_FLAG_SYN = 0x02
+TCP_FLAG_RST = 0x04
+
+SCTP_CHUNK_DATA = 0
+SCTP_CHUNK_ABORT = 6
+SCTP_FLAG_BEGIN = 0x02
+SCTP_FLAG_END = 0x01
+
+PCAP_MAGIC_USEC = 0xa1b2c3d4
+PCAP_MAGIC_NSEC = 0xa1b23c4d
+PCAPNG_SECTION_HEADER = 0x0a0d0d0a
+PCAPNG_BYTE_ORDER_MAGIC = 0x1a2b3c4d
+PCAPNG_INTERFACE_DESCRIPTION = 0x00000001
+PCAPNG_PACKET = 0x00000002
+PCAPNG_SIMPLE_PACKET = 0x00000003
+PCAPNG_ENHANCED_PACKET = 0x00000006
+PCAPNG_OPTION_IF_TSRESOL = 9
+
+EXP_PDU_TAG_END_OF_OPT = 0
+EXP_PDU_TAG_PROTO_NAME = 12
+
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_U16_PAIR = struct.Struct(">HH")
+_IPV4 = struct.Struct(">BxHxxHxBxx4s4s")
+_IPV6 = struct.Struct(">4xHBx16s16s")
+_TCP = struct.Struct(">HHIIBB")
+_SCTP_CHUNK = struct.Struct(">BBH")
+_SCTP_DATA = struct.Struct(">IHH")
+
+# (frame number, timestamp, link type, offset of the frame, captured length)
+Frame = Tuple[int, Optional[float], int, int, int]
+
+
+def is_diameter_header(data, offset: int = 0) -> bool:
+    """
+    Check if the bytes at offset look like the start of a Diameter message.
+
+    Args:
+        data: Buffer holding at least 8 bytes from offset
+        offset (int): Position of the candidate header
+
+    Returns:
+        bool: True for version 1, a sane length and no reserved flags set
+    """
+    version_length, flags_code = struct.unpack_from(">II", data, offset)
+    length = version_length & 0x00ffffff
+    return (version_length >> 24 == 1 and HEADER_LENGTH <= length <= MAX_MESSAGE_LENGTH
+            and length % 4 == 0 and flags_code >> 24 & 0x0f == 0)
+
+
+class _DiameterStream:
+    """
+    Splits one direction of a reassembled byte stream into Diameter PDUs.
+
+    When the stream does not start with a valid Diameter header (e.g. the
+    capture started in the middle of a message, or data was lost), chunks are
+    dropped until one starts with a valid header again.
+    """
+    __slots__ = ('buffer',)
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, payload: bytes) -> List[memoryview]:
+        """
+        Add the next chunk of the stream and return every PDU it completes.
+        """
+        if not self.buffer:
+            # Fast path: slice PDUs straight out of the packet payload
+            spans, rest = self._split(payload)
+            if rest is not None and rest < len(payload):
+                self.buffer += payload[rest:]
+            view = memoryview(payload)
+            return [view[start:end] for start, end in spans]
+        self.buffer += payload
+        spans, rest = self._split(self.buffer)
+        # Copied out before the buffer is trimmed or cleared
+        pdus = [memoryview(bytes(self.buffer[start:end])) for start, end in spans]
+        if rest is None:
+            self.buffer.clear()
+        else:
+            del self.buffer[:rest]
+        return pdus
+
+    @staticmethod
+    def _split(data) -> Tuple[List[Tuple[int, int]], Optional[int]]:
+        """
+        Find the (start, end) span of every complete PDU at the start of data.
+
+        Returns:
+            Tuple[List[Tuple[int, int]], Optional[int]]: The spans, and the
+                offset of the incomplete trailing data, or None if the framing
+                was lost after the spans and the rest of data must be dropped
+        """
+        spans = []
+        position = 0
+        end = len(data)
+        while end - position >= 8:
+            if not is_diameter_header(data, position):
+                logger.debug(f"Lost Diameter framing at stream offset {position}, resynchronising")
+                return spans, None
+            length = _U32.unpack_from(data, position)[0] & 0x00ffffff
+            if end - position < length:
+                break
+            spans.append((position, position + length))
+            position += length
+        return spans, position
+
+
+class _TcpStream:
+    """
+    Reorders the segments of one direction of a TCP connection.
+    """
+    __slots__ = ('next_seq', 'pending', 'diameter')
+
+    def __init__(self):
+        self.next_seq: Optional[int] = None
+        self.pending: Dict[int, bytes] = {}
+        self.diameter = _DiameterStream()
+
+    def feed(self, seq: int, flags: int, payload: bytes) -> List[memoryview]:
+        if flags & TCP_FLAG_SYN:
+            self.next_seq = (seq + 1) & 0xffffffff
+            seq = self.next_seq
+        if not payload:
+            return []
+        if self.next_seq is None:
+            self.next_seq = seq
+        delta = (seq - self.next_seq) & 0xffffffff
+        if delta >= 0x80000000:
+            # Retransmission, keep only the bytes that were not seen yet
+            overlap = 0x100000000 - delta
+            if overlap >= len(payload):
+                return []
+            payload = payload[overlap:]
+        elif delta:
+            self.pending[seq] = payload
+            if len(self.pending) <= MAX_PENDING_SEGMENTS:
+                return []
+            # The missing data is never coming, skip over the gap
+            logger.debug(f"TCP gap of {delta} bytes, skipping to the next buffered segment")
+            self.diameter = _DiameterStream()
+            self.next_seq = min(self.pending, key=lambda s: (s - self.next_seq) & 0xffffffff)
+            payload = self.pending.pop(self.next_seq)
+        pdus = self.diameter.feed(payload)
+        self.next_seq = (self.next_seq + len(payload)) & 0xffffffff
+        while self.next_seq in self.pending:
+            payload = self.pending.pop(self.next_seq)
+            pdus += self.diameter.feed(payload)
+            self.next_seq = (self.next_seq + len(payload)) & 0xffffffff
+        return pdus
+
+
+class _SctpStream:
+    """
+    Reassembles fragmented DATA chunks of one SCTP stream.
+    """
+    __slots__ = ('fragments', 'diameter')
+
+    def __init__(self):
+        self.fragments: List[bytes] = []
+        self.diameter = _DiameterStream()
+
+    def feed(self, flags: int, payload: bytes) -> List[memoryview]:
+        if flags & SCTP_FLAG_BEGIN:
+            self.fragments = []
+        self.fragments.append(payload)
+        if not flags & SCTP_FLAG_END:
+            return []
+        user_message = b''.join(self.fragments) if len(self.fragments) > 1 else payload
+        self.fragments = []
+        return self.diameter.feed(user_message)
+
+
+class PcapReader:
+    """
+    Streaming reader yielding the Diameter messages of a pcap/pcapng file.
+
+    Attributes:
+        filepath (str): Path of the capture file
+        ports (Tuple[int]): TCP/SCTP ports carrying Diameter traffic
+        n_packets (int): Packets read so far
+        n_messages (int): Diameter messages yielded so far
+    """
+
+    def __init__(self, filepath: str, ports: Iterable[int] = DIAMETER_PORTS):
+        """
+        Initialize a PcapReader.
+
+        Args:
+            filepath (str): Path of the pcap or pcapng file
+            ports (Iterable[int], optional): Diameter ports. Defaults to 3868
+        """
+        self.filepath = filepath
+        self.ports = frozenset(ports)
+        self.n_packets = 0
+        self.n_messages = 0
+        self._tcp_streams: Dict[tuple, _TcpStream] = {}
+        self._sctp_streams: Dict[tuple, _SctpStream] = {}
+
+    def __iter__(self) -> Iterator[DiameterMessage]:
+        with open(self.filepath, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty file
+                return
+            try:
+                yield from self._read(data)
+            finally:
+                self._tcp_streams.clear()
+                self._sctp_streams.clear()
+                data.close()
+
+    def _read(self, data: mmap.mmap) -> Iterator[DiameterMessage]:
+        if len(data) < 4:
+            raise ValueError(f"{self.filepath} is not a pcap or pcapng file")
+        magic = _U32.unpack_from(data)[0]
+        if magic == PCAPNG_SECTION_HEADER:
+            frames = self._pcapng_frames(data)
+        elif magic in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) or struct.unpack_from("<I", data)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC):
+            frames = self._pcap_frames(data)
+        else:
+            raise ValueError(f"{self.filepath} is not a pcap or pcapng file")
+        for pkt_number, timestamp, linktype, offset, caplen in frames:
+            self.n_packets = pkt_number
+            try:
+                pdus = self._decode_frame(data, linktype, offset, offset + caplen)
+            except struct.error:
+                logger.debug(f"Truncated packet {pkt_number} in {self.filepath}")
+                continue
+            for pdu in pdus:
+                try:
+                    diameter_message = DiameterMessage(pdu)
+                except ValueError as e:
+                    logger.debug(f"Invalid Diameter message in packet {pkt_number}: {e}")
+                    continue
+                diameter_message.timestamp = timestamp
+                diameter_message.pkt_number = pkt_number
+                diameter_message.pcap_filepath = self.filepath
+                self.n_messages += 1
+                yield diameter_message
+
+    def _pcap_frames(self, data: mmap.mmap) -> Iterator[Frame]:
+        endian = ">" if _U32.unpack_from(data)[0] in (PCAP_MAGIC_USEC, PCAP_MAGIC_NSEC) else "<"
+        magic, linktype = struct.unpack_from(endian + "I16xI", data)
+        divisor = 1e9 if magic == PCAP_MAGIC_NSEC else 1e6
+        linktype &= 0xffff
+        record = struct.Struct(endian + "IIII")
+        offset = 24
+        pkt_number = 0
+        end = len(data)
+        while offset + 16 <= end:
+            ts_sec, ts_frac, caplen, _ = record.unpack_from(data, offset)
+            offset += 16
+            if offset + caplen > end:
+                logger.warning(f"{self.filepath} is truncated after packet {pkt_number}")
+                return
+            pkt_number += 1
+            yield pkt_number, ts_sec + ts_frac / divisor, linktype, offset, caplen
+            offset += caplen
+
+    def _pcapng_frames(self, data: mmap.mmap) -> Iterator[Frame]:
+        endian = ">"
+        interfaces: List[Tuple[int, int, float]] = []
+        offset = 0
+        pkt_number = 0
+        end = len(data)
+        while offset + 12 <= end:
+            block_type = struct.unpack_from(endian + "I", data, offset)[0]
+            if block_type == PCAPNG_SECTION_HEADER:
+                byte_order = _U32.unpack_from(data, offset + 8)[0]
+                endian = ">" if byte_order == PCAPNG_BYTE_ORDER_MAGIC else "<"
+                interfaces = []
+            block_length = struct.unpack_from(endian + "I", data, offset + 4)[0]
+            if block_length < 12 or offset + block_length > end:
+                logger.warning(f"{self.filepath} is truncated after packet {pkt_number}")
+                return
+            body = offset + 8
+            if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+                linktype, snaplen = struct.unpack_from(endian + "H2xI", data, body)
+                interfaces.append((linktype, snaplen, self._pcapng_tsresol(data, endian, body + 8, offset + block_length - 4)))
+            elif block_type == PCAPNG_ENHANCED_PACKET:
+                interface_id, ts_high, ts_low, caplen = struct.unpack_from(endian + "IIII", data, body)
+                linktype, _, divisor = interfaces[interface_id]
+                pkt_number += 1
+                yield pkt_number, ((ts_high << 32) | ts_low) / divisor, linktype, body + 20, caplen
+            elif block_type == PCAPNG_SIMPLE_PACKET:
+                linktype, snaplen, _ = interfaces[0]
+                original_length = struct.unpack_from(endian + "I", data, body)[0]
+                caplen = min(original_length, block_length - 16, snaplen or block_length)
+                pkt_number += 1
+                yield pkt_number, None, linktype, body + 4, caplen
+            elif block_type == PCAPNG_PACKET:
+                interface_id, ts_high, ts_low, caplen = struct.unpack_from(endian + "H2xIII", data, body)
+                linktype, _, divisor = interfaces[interface_id]
+                pkt_number += 1
+                yield pkt_number, ((ts_high << 32) | ts_low) / divisor, linktype, body + 20, caplen
+            offset += block_length
+
+    @staticmethod
+    def _pcapng_tsresol(data: mmap.mmap, endian: str, offset: int, end: int) -> float:
+        """Return the timestamp divisor from the if_tsresol option of an IDB."""
+        while offset + 4 <= end:
+            code, length = struct.unpack_from(endian + "HH", data, offset)
+            if code == 0:
+                break
+            if code == PCAPNG_OPTION_IF_TSRESOL and length >= 1:
+                tsresol = data[offset + 4]
+                if tsresol & 0x80:
+                    return float(2 ** (tsresol & 0x7f))
+                return float(10 ** tsresol)
+            offset += 4 + ((length + 3) & ~3)
+        return 1e6
+
+    def _decode_frame(self, data: mmap.mmap, linktype: int, offset: int, end: int) -> List[memoryview]:
+        if linktype == LINKTYPE_ETHERNET:
+            ethertype = _U16.unpack_from(data, offset + 12)[0]
+            offset += 14
+            while ethertype in ETHERTYPE_VLAN:
+                ethertype = _U16.unpack_from(data, offset + 2)[0]
+                offset += 4
+        elif linktype == LINKTYPE_LINUX_SLL:
+            ethertype = _U16.unpack_from(data, offset + 14)[0]
+            offset += 16
+        elif linktype == LINKTYPE_LINUX_SLL2:
+            ethertype = _U16.unpack_from(data, offset)[0]
+            offset += 20
+        elif linktype in (LINKTYPE_RAW, LINKTYPE_IPV4, LINKTYPE_IPV6):
+            ethertype = ETHERTYPE_IPV6 if data[offset] >> 4 == 6 else ETHERTYPE_IPV4
+        elif linktype in (LINKTYPE_NULL, LINKTYPE_LOOP):
+            # Address family in host (NULL) or network (LOOP) byte order
+            family = data[offset] or data[offset + 3]
+            ethertype = ETHERTYPE_IPV4 if family == 2 else ETHERTYPE_IPV6
+            offset += 4
+        elif linktype == LINKTYPE_WIRESHARK_UPPER_PDU:
+            return self._decode_exported_pdu(data, offset, end)
+        else:
+            return []
+
+        if ethertype == ETHERTYPE_IPV4:
+            version_ihl, total_length, fragment, protocol, src, dst = _IPV4.unpack_from(data, offset)
+            if fragment & 0x3fff:
+                # IP fragments are not reassembled
+                return []
+            end = min(end, offset + total_length)
+            offset += (version_ihl & 0x0f) * 4
+        elif ethertype == ETHERTYPE_IPV6:
+            payload_length, protocol, src, dst = _IPV6.unpack_from(data, offset)
+            end = min(end, offset + 40 + payload_length)
+            offset += 40
+            while protocol in IPV6_EXTENSION_HEADERS:
+                protocol = data[offset]
+                offset += (data[offset + 1] + 1) * 8
+            if protocol == IPV6_FRAGMENT_HEADER:
+                return []
+        else:
+            return []
+
+        if protocol == IPPROTO_TCP:
+            return self._decode_tcp(data, offset, end, src, dst)
+        if protocol == IPPROTO_SCTP:
+            return self._decode_sctp(data, offset, end, src, dst)
+        return []
+
+    @staticmethod
+    def _decode_exported_pdu(data: mmap.mmap, offset: int, end: int) -> List[memoryview]:
+        protocol = None
+        while offset + 4 <= end:
+            tag, length = _U16_PAIR.unpack_from(data, offset)
+            offset += 4
+            if tag == EXP_PDU_TAG_END_OF_OPT:
+                break
+            if tag == EXP_PDU_TAG_PROTO_NAME:
+                protocol = data[offset:offset + length].rstrip(b"\x00")
+            offset += length
+        if protocol != b"diameter":
+            return []
+        return _DiameterStream().feed(data[offset:end])
+
+    def _decode_tcp(self, data: mmap.mmap, offset: int, end: int, src: bytes, dst: bytes) -> List[memoryview]:
+        src_port, dst_port, seq, _, data_offset, flags = _TCP.unpack_from(data, offset)
+        if src_port not in self.ports and dst_port not in self.ports:
+            return []
+        key = (src, src_port, dst, dst_port)
+        stream = self._tcp_streams.get(key)
+        if stream is None:
+            stream = self._tcp_streams[key] = _TcpStream()
+        pdus = stream.feed(seq, flags, data[offset + (data_offset >> 4) * 4:end])
+        if flags & (TCP_FLAG_FIN | TCP_FLAG_RST):
+            del self._tcp_streams[key]
+        return pdus
+
+    def _decode_sctp(self, data: mmap.mmap, offset: int, end: int, src: bytes, dst: bytes) -> List[memoryview]:
+        src_port, dst_port = struct.unpack_from(">HH", data, offset)
+        if src_port not in self.ports and dst_port not in self.ports:
+            return []
+        pdus = []
+        offset += 12
+        while offset + 4 <= end:
+            chunk_type, flags, length = _SCTP_CHUNK.unpack_from(data, offset)
+            if length < 4:
+                break
+            if chunk_type == SCTP_CHUNK_DATA and length > 16:
+                _, stream_id, _ = _SCTP_DATA.unpack_from(data, offset + 4)
+                key = (src, src_port, dst, dst_port, stream_id)
+                stream = self._sctp_streams.get(key)
+                if stream is None:
+                    stream = self._sctp_streams[key] = _SctpStream()
+                pdus += stream.feed(flags, data[offset + 16:min(offset + length, end)])
+            elif chunk_type == SCTP_CHUNK_ABORT:
+                for key in [k for k in self._sctp_streams if k[:4] in ((src, src_port, dst, dst_port), (dst, dst_port, src, src_port))]:
+                    del self._sctp_streams[key]
+            offset += (length + 3) & ~3
+        return pdus
+
+
+def read_pcap(filepath: str, ports: Iterable[int] = DIAMETER_PORTS) -> Iterator[DiameterMessage]:
+    """
+    Stream the Diameter messages out of a pcap or pcapng file.
+
+    Args:
+        filepath (str): Path of the capture file
+        ports (Iterable[int], optional): TCP/SCTP ports carrying Diameter. Defaults to 3868
+
+    Returns:
+        Iterator[DiameterMessage]: Lazily decoded messages with timestamp,
+            pkt_number and pcap_filepath set
+
+    Raises:
+        ValueError: If the file is not a pcap or pcapng capture
+
+    Example:
+        >>> for diameter_message in read_pcap("gx.pcap", ports=[3868, 3870]):
+        ...     print(diameter_message)
+    """
+    return iter(PcapReader(filepath, ports))
@@ -0,0 +1,234 @@
+"""
+Diameter Traffic Recorder
+
+This module records the Diameter messages sent and received by the
+applications of an entity into rotating pcapng files, which can be opened in
+Wireshark or read back with `PcapReader`.
+
+Messages are recorded as Wireshark "exported PDUs" tagged with the diameter
+protocol, with the packet direction set in the pcapng packet flags, so no
+fake IP/TCP headers are needed.
+
+Recording is designed to stay off the request path:
+1. `record` only appends the bytes of the message to a bounded queue, without
+   locking; when the queue is full the message is dropped and counted. The
+   message is encoded there, unless the caller already has its bytes, so
+   changes made to it afterwards (e.g. a Route-Record added to a forwarded
+   request) are not recorded as received
+2. A background thread drains the queue in batches, and writes each batch with
+   a single write call
+3. Files are rotated by size and/or age, keeping at most `max_files` of them
+
+Example:
+    >>> recorder = TrafficRecorder("/var/tmp/pcrf", prefix="pcrf")
+    >>> pcrf.set_recorder(recorder)
+    >>> pcrf.start()
+"""
+
+from collections import deque
+from typing import Deque, List, Optional, Tuple, Union
+from diameter.message import Message
+from .message import DiameterMessage
+from .pcap import (EXP_PDU_TAG_END_OF_OPT, EXP_PDU_TAG_PROTO_NAME, LINKTYPE_WIRESHARK_UPPER_PDU,
+                   PCAPNG_BYTE_ORDER_MAGIC, PCAPNG_ENHANCED_PACKET, PCAPNG_INTERFACE_DESCRIPTION,
+                   PCAPNG_SECTION_HEADER)
+import datetime
+import logging
+import os
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PCAPNG_OPTION_EPB_FLAGS = 2
+
+# Direction bits of the epb_flags option
+EPB_FLAG_INBOUND = 0x01
+EPB_FLAG_OUTBOUND = 0x02
+
+_PDU_TAGS = (struct.pack(">HH", EXP_PDU_TAG_PROTO_NAME, 8) + b"diameter"
+             + struct.pack(">HH", EXP_PDU_TAG_END_OF_OPT, 0))
+_EPB = struct.Struct("<IIIIIII")
+_EPB_OPTIONS = {
+    direction: struct.pack("<HHIHH", PCAPNG_OPTION_EPB_FLAGS, 4, direction, 0, 0)
+    for direction in (EPB_FLAG_INBOUND, EPB_FLAG_OUTBOUND)
+}
+
+
+def _pcapng_file_header() -> bytes:
+    """Section header and the single interface description of a new file."""
+    shb_body = struct.pack("<IHHq", PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1)
+    shb = struct.pack("<II", PCAPNG_SECTION_HEADER, 12 + len(shb_body)) + shb_body + struct.pack("<I", 12 + len(shb_body))
+    idb_body = struct.pack("<HHI", LINKTYPE_WIRESHARK_UPPER_PDU, 0, 0)
+    idb = struct.pack("<II", PCAPNG_INTERFACE_DESCRIPTION, 12 + len(idb_body)) + idb_body + struct.pack("<I", 12 + len(idb_body))
+    return shb + idb
+
+
+def encode_packet(message_bytes: bytes, timestamp: float, direction: int) -> bytes:
+    """
+    Encode a Diameter message as a pcapng Enhanced Packet Block.
+
+    Args:
+        message_bytes (bytes): The encoded Diameter message
+        timestamp (float): Capture time, in seconds since the epoch
+        direction (int): EPB_FLAG_INBOUND or EPB_FLAG_OUTBOUND
+
+    Returns:
+        bytes: The complete block
+    """
+    packet = _PDU_TAGS + message_bytes
+    padding = -len(packet) % 4
+    options = _EPB_OPTIONS[direction]
+    block_length = _EPB.size + len(packet) + padding + len(options) + 4
+    ts = int(timestamp * 1_000_000)
+    return b"".join((
+        _EPB.pack(PCAPNG_ENHANCED_PACKET, block_length, 0, ts >> 32, ts & 0xffffffff, len(packet), len(packet)),
+        packet, b"\x00" * padding, options, struct.pack("<I", block_length),
+    ))
+
+
+class TrafficRecorder:
+    """
+    Records Diameter messages to rotating pcapng files from a background thread.
+
+    Attributes:
+        directory (str): Directory the capture files are written to
+        prefix (str): File name prefix
+        max_file_size (int): File size in bytes after which a new file is started
+        rotate_interval (Optional[float]): Seconds after which a new file is started
+        max_files (Optional[int]): Number of files kept, older ones are deleted
+        queue_size (int): Messages queued before new messages are dropped
+        batch_size (int): Messages written per write call
+        flush_interval (float): Seconds the writer sleeps when the queue is empty
+        n_recorded (int): Messages written so far
+        n_dropped (int): Messages dropped because the queue was full
+        files (List[str]): Capture files currently kept, oldest first
+    """
+
+    def __init__(self, directory: str,
+                 prefix: str = "diameter",
+                 max_file_size: int = 100 * 1024 * 1024,
+                 rotate_interval: Optional[float] = None,
+                 max_files: Optional[int] = None,
+                 queue_size: int = 65536,
+                 batch_size: int = 1024,
+                 flush_interval: float = 0.05):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_file_size = max_file_size
+        self.rotate_interval = rotate_interval
+        self.max_files = max_files
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.n_recorded = 0
+        self.n_dropped = 0
+        self.files: List[str] = []
+        self._queue: Deque[Tuple[float, bytes, int]] = deque()
+        self._file = None
+        self._file_size = 0
+        self._file_opened_at = 0.0
+        self._n_files_opened = 0
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def record(self, message: Union[bytes, Message, DiameterMessage], inbound: bool):
+        """
+        Queue a message for recording. Never blocks.
+
+        Args:
+            message: The message sent or received, or its bytes
+            inbound (bool): True for received messages, False for sent ones
+        """
+        if len(self._queue) >= self.queue_size:
+            self.n_dropped += 1
+            return
+        if not isinstance(message, bytes):
+            try:
+                message = bytes(message) if isinstance(message, (bytearray, memoryview)) else message.as_bytes()
+            except Exception as e:
+                logger.warning(f"Could not encode message for recording: {e}")
+                return
+        self._queue.append((time.time(), message, EPB_FLAG_INBOUND if inbound else EPB_FLAG_OUTBOUND))
+
+    def start(self):
+        if self.is_running:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=f"TrafficRecorder-{self.prefix}", daemon=True)
+        self._thread.start()
+        logger.info(f"Recording Diameter traffic to {self.directory}")
+
+    def stop(self, timeout: float = 5):
+        """
+        Stop the writer thread, after writing every message still queued.
+
+        Args:
+            timeout (float, optional): Seconds to wait for the writer thread
+        """
+        if not self.is_running:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        logger.info(f"Recorded {self.n_recorded} messages, dropped {self.n_dropped}")
+
+    def _run(self):
+        try:
+            while not self._stopped.is_set() or self._queue:
+                if not self._queue:
+                    if self._file:
+                        self._file.flush()
+                    self._stopped.wait(self.flush_interval)
+                    continue
+                self._write_batch()
+        except Exception as e:
+            logger.error(f"Traffic recorder stopped: {e}")
+        finally:
+            self._close_file()
+
+    def _write_batch(self):
+        queue = self._queue
+        blocks = []
+        for _ in range(min(self.batch_size, len(queue))):
+            timestamp, data, direction = queue.popleft()
+            blocks.append(encode_packet(data, timestamp, direction))
+        if self._file is None or self._should_rotate():
+            self._open_file()
+        data = b"".join(blocks)
+        self._file.write(data)
+        self._file_size += len(data)
+        self.n_recorded += len(blocks)
+
+    def _should_rotate(self) -> bool:
+        if self._file_size >= self.max_file_size:
+            return True
+        return bool(self.rotate_interval) and time.time() - self._file_opened_at >= self.rotate_interval
+
+    def _open_file(self):
+        self._close_file()
+        self._n_files_opened += 1
+        now = datetime.datetime.now()
+        filepath = os.path.join(self.directory, f"{self.prefix}_{self._n_files_opened:05d}_{now:%Y%m%d%H%M%S}.pcapng")
+        self._file = open(filepath, "wb", buffering=1 << 20)
+        header = _pcapng_file_header()
+        self._file.write(header)
+        self._file_size = len(header)
+        self._file_opened_at = time.time()
+        self.files.append(filepath)
+        while self.max_files and len(self.files) > self.max_files:
+            oldest = self.files.pop(0)
+            try:
+                os.remove(oldest)
+            except OSError as e:
+                logger.warning(f"Could not remove old capture {oldest}: {e}")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
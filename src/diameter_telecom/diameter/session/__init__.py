@@ -1,3 +1,9 @@
 from .gx import GxSession
 from .rx import RxSession
-from .sy import SySession
\ No newline at end of file
+from .sy import SySession
+from .retention import RetentionPolicy, MessageRecord
+from .reaper import SessionReaper, TimerWheel
+from .registry import SessionRegistry, ShardedDict
+from .store import DiskSessionStore
+from .pcc import PccRuleIndex, RuleTable
+from .binding import SessionBindings, TERMINATE_DROP, TERMINATE_STR, TERMINATE_ASR
\ No newline at end of file
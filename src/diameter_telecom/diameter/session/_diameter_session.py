@@ -1,11 +1,14 @@
 from .. import Subscriber
 from ..message import DiameterMessage, Message
 from ..constants import *
-from typing import List, Optional
+from ..log import LogCategory
+from .retention import MessageRecord, RetentionPolicy
+from typing import Dict, List, Optional, Tuple
 import time
 from dataclasses import dataclass, field
 import logging
 logger = logging.getLogger(__name__)
+_lifecycle_log = LogCategory("session.lifecycle", logger, logging.INFO, rate=100)
 
 @dataclass
 class DiameterSession:
@@ -16,10 +19,62 @@ class DiameterSession:
     start_time: Optional[str] = field(default=None)
     end_time: Optional[str] = field(default=None)
     subscriber: Optional[Subscriber] = field(default=None)
+    # Messages dropped from memory by the retention policy, oldest first
+    message_records: List[MessageRecord] = field(default_factory=list, repr=False, compare=False)
+    retention: Optional[RetentionPolicy] = field(default=None, repr=False, compare=False)
+    # time.monotonic() of the creation of the session, for absolute timeouts
+    started_at: float = field(default_factory=time.monotonic, repr=False, compare=False)
+    # time.monotonic() of the last message, for idle timeouts
+    last_activity: float = field(default_factory=time.monotonic, repr=False, compare=False)
+    # Origin-Host, Origin-Realm, Destination-Host and Destination-Realm of the
+    # first request, to address requests for the session (STR, ASR) whatever
+    # the retention policy kept of its messages
+    routing: Optional[Tuple[Optional[bytes], Optional[bytes], Optional[bytes], Optional[bytes]]] = field(default=None, init=False, repr=False, compare=False)
+    # Indexes over messages, kept up to date by add_message
+    _messages_by_identity: Dict[tuple, DiameterMessage] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _messages_by_kind: Dict[MessageKind, List[DiameterMessage]] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _requests: Dict[Tuple[int, int], DiameterMessage] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _answers: Dict[Tuple[int, int], DiameterMessage] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _pending_requests: Dict[Tuple[int, int], DiameterMessage] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # Requests added before being sent, whose identifiers were not assigned yet
+    _unidentified: List[DiameterMessage] = field(default_factory=list, init=False, repr=False, compare=False)
+    # Registry the session is indexed in, to reindex it when its keys change
+    _registry: Optional[object] = field(default=None, init=False, repr=False, compare=False)
 
     def __post_init__(self):
         if not isinstance(self.session_id, str):
             raise ValueError("session_id must be a string")
+        for diameter_message in self.messages:
+            self._index_message(diameter_message)
+            self._keep_routing(diameter_message)
+
+    def __getstate__(self):
+        # Pickled without the message indexes, rebuilt from messages
+        state = self.__dict__.copy()
+        for name in _MESSAGE_INDEXES:
+            del state[name]
+        state.pop('_registry', None)
+        # Monotonic times are pickled as wall clock times, as they mean
+        # nothing to another process after a restart
+        offset = time.time() - time.monotonic()
+        for name in _MONOTONIC_TIMES:
+            state[name] += offset
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        offset = time.time() - time.monotonic()
+        for name in _MONOTONIC_TIMES:
+            setattr(self, name, getattr(self, name) - offset)
+        self._messages_by_identity = {}
+        self._messages_by_kind = {}
+        self._requests = {}
+        self._answers = {}
+        self._pending_requests = {}
+        self._unidentified = []
+        self._registry = None
+        for diameter_message in self.messages:
+            self._index_message(diameter_message)
 
     def __hash__(self) -> int:
         return hash(self.session_id)
@@ -34,7 +89,7 @@ class DiameterSession:
             else:
                 self.start_time = str(time.time())
             self.active = True
-            logger.info(f"Session {self.session_id} started at {self.start_time}")
+            _lifecycle_log.log("Session %s started at %s", self.session_id, self.start_time)
 
     def end(self, timestamp: str = None):
         if self.active:
@@ -43,7 +98,10 @@ class DiameterSession:
             else:
                 self.end_time = str(time.time())
             self.active = False
-            logger.info(f"Session {self.session_id} ended at {self.end_time}")
+            _lifecycle_log.log("Session %s ended at %s", self.session_id, self.end_time)
+
+    def touch(self):
+        self.last_activity = time.monotonic()
 
     def add_message(self, message):
         if not isinstance(message, Message) and not isinstance(message, DiameterMessage):
@@ -54,11 +112,126 @@ class DiameterSession:
             diameter_message = DiameterMessage(message)
         else:
             raise ValueError("message must be an instance of Message or DiameterMessage")
-        if diameter_message in self.messages:
+        if self._is_duplicate(diameter_message):
             return None
         self.messages.append(diameter_message)
+        self._index_message(diameter_message)
+        self._keep_routing(diameter_message)
+        self.touch()
+        if self.retention is not None and len(self.messages) > self.retention.max_messages:
+            self._compact_message(self.retention.keep_first)
         return diameter_message
 
+    def _keep_routing(self, diameter_message: DiameterMessage):
+        if self.routing is None and diameter_message.is_request:
+            self.routing = (diameter_message.origin_host, diameter_message.origin_realm,
+                            diameter_message.destination_host, diameter_message.destination_realm)
+
+    def _compact_message(self, index: int):
+        # Duplicate detection and lookups only cover the messages kept in full
+        diameter_message = self.messages.pop(index)
+        self.message_records.append(self.retention.compact(diameter_message))
+        messages = self._messages_by_kind.get(diameter_message.kind)
+        if messages:
+            for i, kept in enumerate(messages):
+                if kept is diameter_message:
+                    del messages[i]
+                    break
+        identity = diameter_message.identity
+        if self._messages_by_identity.get(identity) is diameter_message:
+            del self._messages_by_identity[identity]
+        key = identity[:2]
+        indexes = (self._requests, self._pending_requests) if identity[2] else (self._answers,)
+        for index in indexes:
+            if index.get(key) is diameter_message:
+                del index[key]
+        self._unidentified = [unidentified for unidentified in self._unidentified if unidentified is not diameter_message]
+
+    def set_retention(self, retention: Optional[RetentionPolicy]):
+        if retention is not None and not isinstance(retention, RetentionPolicy):
+            raise ValueError("retention must be an instance of RetentionPolicy")
+        self.retention = retention
+        if retention is not None:
+            while len(self.messages) > retention.max_messages:
+                self._compact_message(retention.keep_first)
+
+    def load_message(self, record: MessageRecord) -> Optional[DiameterMessage]:
+        if self.retention is None:
+            return None
+        return self.retention.load(record)
+
+    def release_records(self):
+        # Once the session is removed, its spilled messages are not loaded back
+        if self.retention is None:
+            return
+        self.retention.release(self.message_records)
+        self.message_records = [record._replace(spill_offset=None, spill_segment=None) if record.spill_segment is not None else record
+                                for record in self.message_records]
+
+    def _is_duplicate(self, diameter_message: DiameterMessage) -> bool:
+        self._index_identified()
+        identity = diameter_message.identity
+        if identity[0] and identity[1]:
+            return identity in self._messages_by_identity
+        return any(unidentified.identity == identity for unidentified in self._unidentified)
+
+    def _index_message(self, diameter_message: DiameterMessage):
+        self._messages_by_kind.setdefault(diameter_message.kind, []).append(diameter_message)
+        identity = diameter_message.identity
+        if identity[0] and identity[1]:
+            self._index_identity(diameter_message, identity)
+        else:
+            self._unidentified.append(diameter_message)
+
+    def _index_identified(self):
+        # Requests get their identifiers when sent, after being added
+        if self._unidentified:
+            unidentified = []
+            for diameter_message in self._unidentified:
+                identity = diameter_message.identity
+                if identity[0] and identity[1]:
+                    self._index_identity(diameter_message, identity)
+                else:
+                    unidentified.append(diameter_message)
+            self._unidentified = unidentified
+
+    def _index_identity(self, diameter_message: DiameterMessage, identity: tuple):
+        self._messages_by_identity.setdefault(identity, diameter_message)
+        hop_by_hop_id, end_to_end_id, is_request = identity
+        key = (hop_by_hop_id, end_to_end_id)
+        if is_request:
+            self._requests[key] = diameter_message
+            if key not in self._answers:
+                self._pending_requests[key] = diameter_message
+        else:
+            self._answers[key] = diameter_message
+            self._pending_requests.pop(key, None)
+
+    def get_message(self, hop_by_hop_id: int, end_to_end_id: int, is_request: bool) -> Optional[DiameterMessage]:
+        self._index_identified()
+        return self._messages_by_identity.get((hop_by_hop_id, end_to_end_id, is_request))
+
+    def get_messages_by_kind(self, kind: MessageKind) -> List[DiameterMessage]:
+        return self._messages_by_kind.get(kind, [])
+
+    def get_last_message_by_kind(self, kind: MessageKind) -> Optional[DiameterMessage]:
+        messages = self._messages_by_kind.get(kind)
+        return messages[-1] if messages else None
+
+    def get_answer(self, request: DiameterMessage) -> Optional[DiameterMessage]:
+        self._index_identified()
+        return self._answers.get((request.hop_by_hop_id, request.end_to_end_id))
+
+    def get_request(self, answer: DiameterMessage) -> Optional[DiameterMessage]:
+        self._index_identified()
+        return self._requests.get((answer.hop_by_hop_id, answer.end_to_end_id))
+
+    def get_pending_requests(self, kind: Optional[MessageKind] = None) -> List[DiameterMessage]:
+        self._index_identified()
+        if kind is None:
+            return list(self._pending_requests.values())
+        return [request for request in self._pending_requests.values() if request.kind == kind]
+
     def get_messages(self) -> List[DiameterMessage]:
         return self.messages
     
@@ -75,7 +248,7 @@ class DiameterSession:
     
     @property
     def n_messages(self):
-        return len(self.messages)
+        return len(self.messages) + len(self.message_records)
     
     @property
     def duration(self):
@@ -84,3 +257,8 @@ class DiameterSession:
         elif self.start_time:
             return int(time.time() - float(self.start_time))
         return None
+
+
+_MESSAGE_INDEXES = ('_messages_by_identity', '_messages_by_kind', '_requests', '_answers',
+                    '_pending_requests', '_unidentified')
+_MONOTONIC_TIMES = ('started_at', 'last_activity')
@@ -0,0 +1,251 @@
+"""
+Gx, Rx and Sy Session Bindings
+
+Rx and Sy sessions are bound to the Gx session of the same IP-CAN session
+through their `gx_session_id`, which only points from the dependent session to
+its Gx session. `SessionBindings` keeps the links in both directions for all
+the applications of an entity, so the dependents of a Gx session are found
+without scanning the Rx and Sy session tables, and are terminated along with
+it.
+
+What happens to a dependent session when its Gx session terminates is set per
+application:
+- `TERMINATE_DROP`: the session is removed locally, nothing is sent
+- `TERMINATE_STR`: an STR is sent for it, as the AF or the PCEF would
+- `TERMINATE_ASR`: an ASR is sent for it, as the PCRF would towards the AF
+
+Example:
+    >>> bindings = SessionBindings()
+    >>> bindings.set_policy(APP_3GPP_RX, TERMINATE_ASR)
+    >>> pcrf.set_bindings(bindings)
+    >>> bindings.dependents("pcef;1;1")
+    [(16777236, 'af;1;1')]
+"""
+
+from typing import Dict, List, Optional, Set, Tuple
+from diameter.message.commands import AbortSessionRequest, SessionTerminationRequest
+from ..constants import *
+from ..message import DiameterMessage
+from .registry import DEFAULT_SHARDS, ShardedDict
+import asyncio
+import functools
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+TERMINATE_DROP = "drop"
+TERMINATE_STR = "str"
+TERMINATE_ASR = "asr"
+
+_POLICIES = (TERMINATE_DROP, TERMINATE_STR, TERMINATE_ASR)
+
+# (Application-Id, Session-Id) of a dependent session
+Dependent = Tuple[int, str]
+
+
+class SessionBindings:
+    """
+    Bidirectional links between Gx sessions and their Rx and Sy sessions.
+
+    Attributes:
+        applications (Dict[int, Application]): Applications by Application-Id
+        policies (Dict[int, str]): Termination policy by Application-Id
+        background (bool): Send the STRs and ASRs of the cascades in a
+            background thread, so the thread terminating the Gx session does
+            not wait for the answers
+    """
+
+    def __init__(self, n_shards: int = DEFAULT_SHARDS, background: bool = True):
+        self.applications: Dict[int, object] = {}
+        self.policies: Dict[int, str] = {}
+        self.background = background
+        self.n_terminated = 0
+        self._gx_session_ids: ShardedDict[str, str] = ShardedDict(n_shards)
+        self._dependents: ShardedDict[str, Set[Dependent]] = ShardedDict(n_shards)
+        # Requests of asyncio applications sent from their event loop
+        self._tasks: Set[asyncio.Task] = set()
+        # Cascades to send in the background, by one worker started on demand
+        self._queue: Optional[queue.Queue] = None
+        self._worker: Optional[threading.Thread] = None
+        self._worker_lock = threading.Lock()
+
+    def attach(self, application):
+        """
+        Maintain the bindings of an application, including its current sessions.
+
+        Args:
+            application: A Gx, Rx or Sy application
+        """
+        application.bindings = self
+        self.applications[application.application_id] = application
+        for _, session in application.sessions.iter_items():
+            gx_session_id = getattr(session, 'gx_session_id', None)
+            if gx_session_id:
+                self.bind(gx_session_id, application.application_id, session.session_id)
+
+    def set_policy(self, application_id: int, policy: str):
+        if policy not in _POLICIES:
+            raise ValueError(f"Invalid termination policy {policy}. Must be one of {_POLICIES}")
+        self.policies[application_id] = policy
+
+    def bind(self, gx_session_id: str, application_id: int, session_id: str):
+        """
+        Bind an Rx or Sy session to a Gx session.
+        """
+        previous = self._gx_session_ids.get(session_id)
+        if previous is not None and previous != gx_session_id:
+            self._dependents.discard_from_set(previous, (application_id, session_id))
+        self._gx_session_ids[session_id] = gx_session_id
+        self._dependents.add_to_set(gx_session_id, (application_id, session_id))
+
+    def unbind(self, application_id: int, session_id: str) -> Optional[str]:
+        """
+        Remove the binding of an Rx or Sy session, e.g. once terminated.
+
+        Returns:
+            Optional[str]: The Session-Id of the Gx session it was bound to
+        """
+        gx_session_id = self._gx_session_ids.pop(session_id, None)
+        if gx_session_id is not None:
+            self._dependents.discard_from_set(gx_session_id, (application_id, session_id))
+        return gx_session_id
+
+    def gx_session_id(self, session_id: str) -> Optional[str]:
+        return self._gx_session_ids.get(session_id)
+
+    def dependents(self, gx_session_id: str, application_id: Optional[int] = None) -> List[Dependent]:
+        """
+        Get the sessions bound to a Gx session.
+
+        Args:
+            gx_session_id (str): Session-Id of the Gx session
+            application_id (int, optional): Only the sessions of this application
+
+        Returns:
+            List[Dependent]: Application-Id and Session-Id of each session
+        """
+        return [dependent for dependent in self._dependents.copy_set(gx_session_id)
+                if application_id is None or dependent[0] == application_id]
+
+    def terminate(self, gx_session_id: str, policy: Optional[str] = None) -> int:
+        """
+        Terminate the sessions bound to a Gx session.
+
+        Each session is only terminated once, however many times its Gx
+        session is terminated (CCR-T, ASR, timeout).
+
+        Args:
+            gx_session_id (str): Session-Id of the Gx session
+            policy (str, optional): Policy for every session, instead of the
+                policy of its application
+
+        Returns:
+            int: Number of sessions terminated
+        """
+        dependents = self._dependents.pop(gx_session_id, None)
+        if not dependents:
+            return 0
+        to_send = []
+        for application_id, session_id in dependents:
+            self._gx_session_ids.pop_if(session_id, gx_session_id)
+            application = self.applications.get(application_id)
+            if application is None:
+                continue
+            session = application.sessions.get(session_id)
+            if session is None:
+                continue
+            session_policy = policy or self.policies.get(application_id, TERMINATE_DROP)
+            if session_policy == TERMINATE_DROP:
+                application.remove_session(session_id)
+            else:
+                to_send.append((application, session, session_policy))
+        if to_send:
+            if self.background:
+                self._send_in_background(to_send)
+            else:
+                self._send_all(to_send)
+        self.n_terminated += len(dependents)
+        logger.info(f"Terminated {len(dependents)} sessions bound to Gx session {gx_session_id}")
+        return len(dependents)
+
+    def stop(self, timeout: float = 5):
+        """
+        Stop the background worker once the cascades queued so far are sent.
+        """
+        with self._worker_lock:
+            worker, self._worker = self._worker, None
+            if worker is not None:
+                self._queue.put(None)
+                self._queue = None
+        if worker is not None:
+            worker.join(timeout)
+
+    def _send_in_background(self, to_send: List[tuple]):
+        with self._worker_lock:
+            if self._worker is None:
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(target=self._work, args=(self._queue,), name="SessionBindings", daemon=True)
+                self._worker.start()
+            self._queue.put(to_send)
+
+    def _work(self, to_send_queue: queue.Queue):
+        while True:
+            to_send = to_send_queue.get()
+            if to_send is None:
+                return
+            self._send_all(to_send)
+
+    def _send_all(self, to_send: List[tuple]):
+        for application, session, policy in to_send:
+            task = None
+            try:
+                answer = application.send_request_custom(self._termination_request(application, session, policy))
+                if asyncio.iscoroutine(answer):
+                    # An asyncio application, terminating from its event loop or from another thread
+                    try:
+                        task = asyncio.get_running_loop().create_task(answer)
+                    except RuntimeError:
+                        asyncio.run(answer)
+                    else:
+                        self._tasks.add(task)
+                        task.add_done_callback(functools.partial(self._sent, application, session, policy))
+            except Exception as e:
+                logger.error(f"Could not send {policy.upper()} for session {session.session_id}: {e}")
+            if task is None:
+                self._remove(application, session)
+
+    def _sent(self, application, session, policy: str, task: asyncio.Task):
+        # The request sent by an asyncio application got its answer, or failed
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Could not send {policy.upper()} for session {session.session_id}: {task.exception()}")
+        self._remove(application, session)
+
+    @staticmethod
+    def _remove(application, session):
+        # Whatever the answer, the Gx session is gone
+        if application.sessions.get(session.session_id) is session:
+            application.remove_session(session.session_id)
+
+    def _termination_request(self, application, session, policy: str) -> DiameterMessage:
+        # The first request of the session tells who the peer is
+        if session.routing is None:
+            raise ValueError(f"Session {session.session_id} has no request to address the {policy.upper()} with")
+        origin_host, origin_realm, destination_host, destination_realm = session.routing
+        if policy == TERMINATE_STR:
+            request = SessionTerminationRequest()
+            request.termination_cause = E_TERMINATION_CAUSE_DIAMETER_ADMINISTRATIVE
+        else:
+            request = AbortSessionRequest()
+            destination_host, destination_realm = origin_host, origin_realm
+        request.header.is_proxyable = True
+        request.session_id = session.session_id
+        request.origin_host = application.node.origin_host.encode()
+        request.origin_realm = application.node.realm_name.encode()
+        if destination_host:
+            request.destination_host = destination_host
+        request.destination_realm = destination_realm
+        request.auth_application_id = application.application_id
+        return DiameterMessage(request)
@@ -1,12 +1,18 @@
 from ._diameter_session import *
 from ..parse_avp import *
 
+# AVPs read from a CCR-I that has not been fully decoded
+_CCR_INITIAL_PLAN = AvpPlan("Framed-IP-Address", "Framed-IPv6-Prefix", "Called-Station-Id", "3GPP-SGSN-MCC-MNC", "Origin-Host")
+
 @dataclass
 class GxSession(DiameterSession):
     framed_ip_address: Optional[str] = field(default=None)
     framed_ipv6_prefix: Optional[str] = field(default=None)
     called_station_id: Optional[str] = field(default=None)
     sgsn_mcc_mnc: Optional[str] = field(default=None)
+    origin_host: Optional[str] = field(default=None)
+    # Bitset of the PCC rules installed, by id in the PccRuleIndex of the app
+    installed_rules: int = field(default=0, repr=False, compare=False)
 
     @property
     def apn(self):
@@ -16,24 +22,35 @@ class GxSession(DiameterSession):
         diameter_message = super().add_message(message)
         if not diameter_message:
             return
-        if diameter_message.name == CCR_I:
+        if diameter_message.kind == MessageKind.CCR_I:
             if diameter_message.timestamp:
                 self.start(diameter_message.timestamp)
             # else:
             #     self.start()
-            if diameter_message.message.framed_ip_address:
-                self.framed_ip_address = diameter_message.message.framed_ip_address
-            if diameter_message.message.framed_ipv6_prefix:
-                self.framed_ipv6_prefix = diameter_message.message.framed_ipv6_prefix
-            if diameter_message.message.called_station_id:
-                self.called_station_id = diameter_message.message.called_station_id
-            if diameter_message.message.sgsn_mcc_mnc:
-                self.sgsn_mcc_mnc = diameter_message.message.sgsn_mcc_mnc
-            if diameter_message.message.subscription_id:
-                msisdn, imsi, sip_uri, nai, private = parse_subscription_id(diameter_message.message.subscription_id)
-                if not self.subscriber:
-                    self.subscriber = Subscriber(msisdn=msisdn, imsi=imsi)
-        elif diameter_message.name == CCR_T:
+            if diameter_message.is_decoded:
+                message = diameter_message.message
+                attributes = (message.framed_ip_address, message.framed_ipv6_prefix,
+                              message.called_station_id, message.sgsn_mcc_mnc, message.origin_host)
+            else:
+                values = _CCR_INITIAL_PLAN.extract(diameter_message)
+                attributes = tuple(values[path][0] if values[path] else None for path in _CCR_INITIAL_PLAN.paths)
+            framed_ip_address, framed_ipv6_prefix, called_station_id, sgsn_mcc_mnc, origin_host = attributes
+            if framed_ip_address:
+                self.framed_ip_address = framed_ip_address
+            if framed_ipv6_prefix:
+                self.framed_ipv6_prefix = framed_ipv6_prefix
+            if called_station_id:
+                self.called_station_id = called_station_id
+            if sgsn_mcc_mnc:
+                self.sgsn_mcc_mnc = sgsn_mcc_mnc
+            if origin_host:
+                self.origin_host = origin_host.decode() if isinstance(origin_host, bytes) else origin_host
+            msisdn, imsi, sip_uri, nai, private = extract_subscription_id(diameter_message)
+            if (msisdn or imsi) and not self.subscriber:
+                self.subscriber = Subscriber(msisdn=msisdn, imsi=imsi)
+            if self._registry is not None:
+                self._registry.reindex(self)
+        elif diameter_message.kind == MessageKind.CCR_T:
             if diameter_message.timestamp:
                 self.end(diameter_message.timestamp)
             # else:
@@ -0,0 +1,234 @@
+"""
+PCC Rule State of Gx Sessions
+
+`check_charging_rule_install` and `check_charging_rule_remove` only tell which
+rules one message installs or removes. This module keeps the resulting state:
+the rules currently installed on every Gx session, and the sessions each rule
+is installed on.
+
+Rule names are interned once per application into small integer ids, and the
+installed rules of a session are a bitset of those ids (a Python int), so a
+session with a handful of rules out of a few hundred costs a few bytes. The
+bitsets are updated incrementally from each successful CCA and RAR, and a
+reverse index maps each rule id to the Session-Ids having it installed, so
+selecting the sessions of a rule does not scan the sessions.
+
+Example:
+    >>> pcc_rules = PccRuleIndex()
+    >>> pcc_rules.update(gx_session, install=["video-hd", "default"])
+    >>> pcc_rules.installed(gx_session)
+    ['video-hd', 'default']
+    >>> pcc_rules.session_ids("video-hd")
+    {'pcef;1;1'}
+"""
+
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+from ..constants import *
+from ..message import DiameterMessage
+from ..parse_avp import check_charging_rules
+from .registry import ShardedDict
+import threading
+
+# Messages whose Charging-Rule-Install/Remove AVPs change the installed rules
+_RULE_KINDS = (MessageKind.CCA_I, MessageKind.CCA_U, MessageKind.RAR)
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    """
+    Iterate over the ids set in a bitset, lowest first.
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def translate_mask(mask: int, translation: List[int]) -> int:
+    """
+    Translate a bitset to other rule ids, e.g. those of another `RuleTable`.
+
+    Args:
+        mask (int): The bitset
+        translation (List[int]): New id of each old id
+
+    Returns:
+        int: The translated bitset
+    """
+    translated = 0
+    for rule_id in iter_bits(mask):
+        translated |= 1 << translation[rule_id]
+    return translated
+
+
+def _rule_names(names: Optional[Iterable]) -> List[str]:
+    # Charging-Rule-Name and Charging-Rule-Base-Name are OctetString AVPs
+    return [name.decode() if isinstance(name, bytes) else name for name in names or () if name]
+
+
+class RuleTable:
+    """
+    Interning table of PCC rule names.
+
+    Ids are assigned in order of first use and never reused, so bitsets built
+    with a table stay valid for its lifetime.
+    """
+
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._names: List[str] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._ids
+
+    @property
+    def names(self) -> List[str]:
+        """
+        Rule names in id order.
+        """
+        return list(self._names)
+
+    def intern(self, name: str) -> int:
+        """
+        Get the id of a rule name, assigning one if needed.
+        """
+        rule_id = self._ids.get(name)
+        if rule_id is not None:
+            return rule_id
+        with self._lock:
+            rule_id = self._ids.get(name)
+            if rule_id is None:
+                rule_id = len(self._names)
+                self._names.append(name)
+                self._ids[name] = rule_id
+            return rule_id
+
+    def id(self, name: str) -> Optional[int]:
+        """
+        Get the id of a rule name, or None if it was never interned.
+        """
+        return self._ids.get(name)
+
+    def name(self, rule_id: int) -> str:
+        return self._names[rule_id]
+
+    def mask(self, names: Iterable[str]) -> int:
+        """
+        Get the bitset of rule names, interning them.
+        """
+        mask = 0
+        for name in names:
+            mask |= 1 << self.intern(name)
+        return mask
+
+    def decode(self, mask: int) -> List[str]:
+        """
+        Get the rule names of a bitset.
+        """
+        return [self._names[rule_id] for rule_id in iter_bits(mask)]
+
+
+class PccRuleIndex:
+    """
+    Installed PCC rules of the sessions of an application.
+
+    The bitset of a session is kept in its `installed_rules` attribute, the
+    Session-Ids by rule id in a `ShardedDict`.
+
+    Attributes:
+        rules (RuleTable): The rule names interned by the application
+    """
+
+    def __init__(self, rules: Optional[RuleTable] = None):
+        self.rules = rules if rules is not None else RuleTable()
+        self._session_ids: ShardedDict[int, Set[str]] = ShardedDict()
+
+    def update(self, session, install: Optional[Iterable[str]] = None, remove: Optional[Iterable[str]] = None) -> int:
+        """
+        Install and remove rules on a session.
+
+        Removals are applied after installs, like a PCEF applying a message
+        with both Charging-Rule-Install and Charging-Rule-Remove.
+
+        Returns:
+            int: The bitset of the rules installed afterwards
+        """
+        previous = session.installed_rules
+        installed = previous | self.rules.mask(install or ())
+        for name in remove or ():
+            rule_id = self.rules.id(name)
+            if rule_id is not None:
+                installed &= ~(1 << rule_id)
+        session.installed_rules = installed
+        for rule_id in iter_bits(installed & ~previous):
+            self._session_ids.add_to_set(rule_id, session.session_id)
+        for rule_id in iter_bits(previous & ~installed):
+            self._session_ids.discard_from_set(rule_id, session.session_id)
+        return installed
+
+    def apply(self, session, diameter_message: DiameterMessage) -> int:
+        """
+        Apply the Charging-Rule-Install and Charging-Rule-Remove AVPs of a
+        CCA or RAR to a session.
+
+        Returns:
+            int: The bitset of the rules installed afterwards
+        """
+        if diameter_message.kind not in _RULE_KINDS:
+            return session.installed_rules
+        install, remove = check_charging_rules(diameter_message)
+        if not install and not remove:
+            return session.installed_rules
+        return self.update(session, _rule_names(install), _rule_names(remove))
+
+    def track(self, session):
+        """
+        Add a session whose bitset was set elsewhere, e.g. restored from a
+        snapshot, to the reverse index.
+        """
+        for rule_id in iter_bits(session.installed_rules):
+            self._session_ids.add_to_set(rule_id, session.session_id)
+
+    def forget(self, session):
+        """
+        Remove a session from the reverse index, e.g. once terminated.
+        """
+        for rule_id in iter_bits(session.installed_rules):
+            self._session_ids.discard_from_set(rule_id, session.session_id)
+
+    def installed(self, session) -> List[str]:
+        """
+        Get the names of the rules installed on a session.
+        """
+        return self.rules.decode(session.installed_rules)
+
+    def session_ids(self, rule: str) -> Set[str]:
+        """
+        Get the Session-Ids a rule is installed on.
+        """
+        rule_id = self.rules.id(rule)
+        if rule_id is None:
+            return set()
+        return self._session_ids.copy_set(rule_id)
+
+    def count(self, rule: str) -> int:
+        """
+        Get the number of sessions a rule is installed on, without copying
+        their Session-Ids.
+        """
+        rule_id = self.rules.id(rule)
+        if rule_id is None:
+            return 0
+        return len(self._session_ids.get(rule_id, ()))
+
+    def counts(self) -> Dict[str, int]:
+        """
+        Get the number of sessions of every rule installed somewhere.
+        """
+        return {self.rules.name(rule_id): len(session_ids) for rule_id, session_ids in self._session_ids.items()}
+
+    def clear(self):
+        self._session_ids.clear()
@@ -0,0 +1,311 @@
+"""
+Idle and Absolute Session Timeouts
+
+Sessions are normally removed when their CCR-T, STR or equivalent arrives.
+When that message is lost, or the peer reboots, the session and its secondary
+index entries (e.g. the Framed-IP-Address mapping of Gx sessions) would leak
+forever. A `SessionReaper` expires them after an idle timeout, an absolute
+timeout, or both.
+
+Deadlines are kept in a hierarchical timer wheel, so tracking a session and
+expiring it are O(1), and nothing ever scans the whole session table.
+Activity is not rescheduled on every message: sessions record the time of
+their last message, and when a timer fires for a session that was active
+since, it is simply rescheduled at its new deadline. The absolute timeout runs
+from the creation of the session, so it is not reset when a session is
+tracked again, e.g. after being restored from a snapshot.
+
+Example:
+    >>> reaper = SessionReaper(idle_timeout=3600, absolute_timeout=86400)
+    >>> reaper.add_callback(lambda application, session, reason: send_asr(session))
+    >>> reaper.attach(pcrf.gx_app)
+    >>> reaper.start()
+"""
+
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+from ._diameter_session import DiameterSession
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+REASON_IDLE = "idle"
+REASON_ABSOLUTE = "absolute"
+
+
+class TimerWheel:
+    """
+    Hierarchical timer wheel.
+
+    Level 0 has one slot per tick; each slot of level n covers a whole turn of
+    level n - 1. Timers far in the future sit in the higher levels and are
+    cascaded down as the wheel turns. Timers further away than the whole
+    wheel are parked in its last slot and rescheduled when they get there.
+
+    Attributes:
+        resolution (float): Seconds per tick
+        slots (int): Slots per level, a power of 2
+        levels (int): Number of levels
+    """
+
+    def __init__(self, resolution: float = 1.0, slots: int = 64, levels: int = 4, start: Optional[float] = None):
+        if resolution <= 0:
+            raise ValueError(f"resolution must be positive. Provided: {resolution}")
+        if slots < 2 or slots & (slots - 1):
+            raise ValueError(f"slots must be a power of 2. Provided: {slots}")
+        if levels < 1:
+            raise ValueError(f"levels must be at least 1. Provided: {levels}")
+        self.resolution = resolution
+        self.slots = slots
+        self.levels = levels
+        self._bits = slots.bit_length() - 1
+        self._mask = slots - 1
+        self._span = 1 << (self._bits * levels)
+        self._wheels: List[List[Dict[Hashable, int]]] = [[{} for _ in range(slots)] for _ in range(levels)]
+        self._where: Dict[Hashable, Tuple[int, int]] = {}
+        self._tick = int((time.monotonic() if start is None else start) // resolution)
+
+    def __len__(self) -> int:
+        return len(self._where)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._where
+
+    def schedule(self, key: Hashable, deadline: float):
+        """
+        Schedule a timer, replacing the previous timer with the same key.
+
+        Args:
+            key: Identifies the timer
+            deadline (float): Time at which the timer expires, on the clock
+                passed to `advance`
+        """
+        self.cancel(key)
+        self._insert(key, math.ceil(deadline / self.resolution))
+
+    def cancel(self, key: Hashable) -> bool:
+        """
+        Cancel a timer.
+
+        Returns:
+            bool: True if the timer was scheduled
+        """
+        where = self._where.pop(key, None)
+        if where is None:
+            return False
+        level, slot = where
+        del self._wheels[level][slot][key]
+        return True
+
+    def _insert(self, key: Hashable, tick: int, cascading: bool = False):
+        delta = tick - self._tick
+        if delta <= 0:
+            # Already due: cascaded timers expire with the current tick,
+            # whose slot is processed next, the others on the next tick
+            level, slot = 0, (self._tick + (0 if cascading else 1)) & self._mask
+        elif delta >= self._span:
+            level = self.levels - 1
+            slot = ((self._tick + self._span - 1) >> (self._bits * level)) & self._mask
+        else:
+            level = (delta.bit_length() - 1) // self._bits
+            slot = (tick >> (self._bits * level)) & self._mask
+        self._wheels[level][slot][key] = tick
+        self._where[key] = (level, slot)
+
+    def _cascade(self, level: int):
+        slot = (self._tick >> (self._bits * level)) & self._mask
+        timers = self._wheels[level][slot]
+        self._wheels[level][slot] = {}
+        for key, tick in timers.items():
+            self._insert(key, tick, cascading=True)
+
+    def advance(self, now: float) -> List[Hashable]:
+        """
+        Turn the wheel up to a time.
+
+        Args:
+            now (float): The current time
+
+        Returns:
+            List[Hashable]: Keys of the timers that expired, which are removed
+        """
+        target = int(now // self.resolution)
+        expired = []
+        while self._tick < target:
+            if not self._where:
+                self._tick = target
+                break
+            self._tick += 1
+            level = 1
+            while level < self.levels and (self._tick >> (self._bits * (level - 1))) & self._mask == 0:
+                self._cascade(level)
+                level += 1
+            slot = self._tick & self._mask
+            timers = self._wheels[0][slot]
+            if timers:
+                self._wheels[0][slot] = {}
+                for key, tick in timers.items():
+                    if tick <= self._tick:
+                        del self._where[key]
+                        expired.append(key)
+                    else:
+                        self._insert(key, tick)
+        return expired
+
+
+class SessionReaper:
+    """
+    Expires the sessions of applications after idle and absolute timeouts.
+
+    Callbacks are called with the application, the session and the reason
+    (REASON_IDLE or REASON_ABSOLUTE) before the session is removed, e.g. to
+    send an ASR or a RAR. They run in the reaper thread.
+
+    Attributes:
+        idle_timeout (Optional[float]): Seconds without messages before a
+            session expires
+        absolute_timeout (Optional[float]): Seconds after the creation of a
+            session at which it expires, whatever its activity
+        interval (float): Seconds between two turns of the wheel in the
+            reaper thread
+        n_reaped_idle (int): Sessions expired by the idle timeout
+        n_reaped_absolute (int): Sessions expired by the absolute timeout
+    """
+
+    def __init__(self, idle_timeout: Optional[float] = None,
+                 absolute_timeout: Optional[float] = None,
+                 resolution: float = 1.0,
+                 interval: float = 1.0):
+        if idle_timeout is None and absolute_timeout is None:
+            raise ValueError("At least one of idle_timeout and absolute_timeout is required")
+        for name, timeout in (("idle_timeout", idle_timeout), ("absolute_timeout", absolute_timeout)):
+            if timeout is not None and timeout <= 0:
+                raise ValueError(f"{name} must be positive. Provided: {timeout}")
+        self.idle_timeout = idle_timeout
+        self.absolute_timeout = absolute_timeout
+        self.interval = interval
+        self.callbacks: List[Callable] = []
+        self.n_reaped_idle = 0
+        self.n_reaped_absolute = 0
+        self._wheel = TimerWheel(resolution)
+        self._tracked: Set[tuple] = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def n_reaped(self) -> int:
+        return self.n_reaped_idle + self.n_reaped_absolute
+
+    @property
+    def n_tracked(self) -> int:
+        return len(self._tracked)
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_callback(self, callback: Callable):
+        self.callbacks.append(callback)
+
+    def attach(self, application):
+        """
+        Expire the sessions of an application, including the ones it already has.
+
+        Args:
+            application: A Gx, Rx or Sy application
+        """
+        application.reaper = self
+        for _, session in application.sessions.iter_items():
+            self.track(application, session)
+
+    def track(self, application, session: DiameterSession):
+        key = (application, session.session_id)
+        with self._lock:
+            self._tracked.add(key)
+            self._wheel.schedule(key, self._deadline(session))
+
+    def forget(self, application, session_id: str):
+        key = (application, session_id)
+        with self._lock:
+            if key in self._tracked:
+                self._tracked.discard(key)
+                self._wheel.cancel(key)
+
+    def _deadline(self, session: DiameterSession) -> float:
+        deadlines = []
+        if self.idle_timeout is not None:
+            deadlines.append(session.last_activity + self.idle_timeout)
+        if self.absolute_timeout is not None:
+            deadlines.append(session.started_at + self.absolute_timeout)
+        return min(deadlines)
+
+    def reap(self, now: Optional[float] = None) -> int:
+        """
+        Expire the sessions whose deadline passed.
+
+        Args:
+            now (float, optional): Current `time.monotonic()` time
+
+        Returns:
+            int: Number of sessions expired
+        """
+        if now is None:
+            now = time.monotonic()
+        expired = []
+        with self._lock:
+            for key in self._wheel.advance(now):
+                application, session_id = key
+                session = application.sessions.get(session_id)
+                if session is None or key not in self._tracked:
+                    self._tracked.discard(key)
+                    continue
+                if self.absolute_timeout is not None and now >= session.started_at + self.absolute_timeout:
+                    expired.append((application, session, REASON_ABSOLUTE))
+                elif self.idle_timeout is not None and now >= session.last_activity + self.idle_timeout:
+                    expired.append((application, session, REASON_IDLE))
+                else:
+                    # Active since the timer was scheduled
+                    self._wheel.schedule(key, self._deadline(session))
+        for application, session, reason in expired:
+            self._expire(application, session, reason)
+        return len(expired)
+
+    def _expire(self, application, session: DiameterSession, reason: str):
+        logger.info(f"Expiring session {session.session_id} after {reason} timeout")
+        for callback in self.callbacks:
+            try:
+                callback(application, session, reason)
+            except Exception as e:
+                logger.error(f"Session expiry callback failed for {session.session_id}: {e}")
+        if application.sessions.get(session.session_id) is session:
+            application.remove_session(session.session_id)
+        self.forget(application, session.session_id)
+        session.end()
+        if reason == REASON_IDLE:
+            self.n_reaped_idle += 1
+        else:
+            self.n_reaped_absolute += 1
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="SessionReaper", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5):
+        if not self.is_running:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        logger.info(f"Reaped {self.n_reaped_idle} idle and {self.n_reaped_absolute} expired sessions")
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.reap()
+            except Exception as e:
+                logger.error(f"Session reaper failed: {e}")
@@ -0,0 +1,412 @@
+"""
+Thread-safe Session Registry
+
+The applications handle requests in up to `max_threads` handler threads, which
+all add, look up and remove sessions concurrently. The registry splits the
+sessions into shards by Session-Id hash, each with its own lock, so threads
+working on different sessions rarely wait for each other, and compound
+operations (check-then-insert, remove with its secondary index entries) are
+atomic.
+
+Secondary indexes are sharded by their own key. They are either unique (e.g.
+Framed-IP-Address to Session-Id) or multi-valued (e.g. APN to the Session-Ids
+on it), and multi-valued ones can be queried together with `find`. A unique
+index can also be given as any object with the same interface as a
+`ShardedDict` (`__setitem__`, `get`, `pop_if`, `items`, `clear`), e.g. an
+`IpPrefixIndex` resolving Framed IP keys by longest-prefix match.
+
+Writers always take the session shard lock first and the index shard lock
+second, so they can not deadlock, and a secondary entry is only removed
+while it still points at the session being removed.
+
+Example:
+    >>> sessions = SessionRegistry()
+    >>> by_framed_ip = sessions.add_index("framed_ip_address", lambda session: session.framed_ip_address)
+    >>> sessions.add_multi_index("apn", lambda session: (session.apn,))
+    >>> sessions.add(gx_session)
+    >>> sessions.get_by_index("framed_ip_address", "10.0.0.1")
+    >>> sessions.find(apn="ims")
+"""
+
+from typing import Any, Callable, Dict, Generic, Hashable, Iterable, Iterator, List, Optional, Set, Tuple, TypeVar
+import threading
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+DEFAULT_SHARDS = 64
+
+_MISSING = object()
+
+
+class ShardedDict(Generic[K, V]):
+    """
+    A dict split into shards, each protected by its own lock.
+
+    Single key operations are atomic. Iteration and `len` work on a snapshot
+    taken one shard at a time, so they are consistent per shard only.
+
+    Attributes:
+        n_shards (int): Number of shards, a power of 2
+    """
+
+    def __init__(self, n_shards: int = DEFAULT_SHARDS):
+        if n_shards < 1 or n_shards & (n_shards - 1):
+            raise ValueError(f"n_shards must be a power of 2. Provided: {n_shards}")
+        self.n_shards = n_shards
+        self._mask = n_shards - 1
+        self._shards: List[Dict[K, V]] = [{} for _ in range(n_shards)]
+        self._locks: List[threading.Lock] = [threading.Lock() for _ in range(n_shards)]
+
+    def _shard(self, key: K) -> int:
+        return hash(key) & self._mask
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({dict(self.items())})"
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._shards[hash(key) & self._mask]
+
+    def __getitem__(self, key: K) -> V:
+        return self._shards[hash(key) & self._mask][key]
+
+    def __setitem__(self, key: K, value: V):
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            self._shards[i][key] = value
+
+    def __delitem__(self, key: K):
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            del self._shards[i][key]
+
+    def __iter__(self) -> Iterator[K]:
+        return iter(self.keys())
+
+    def get(self, key: K, default: Optional[V] = None) -> Optional[V]:
+        # A single dict lookup is atomic, no lock needed
+        return self._shards[hash(key) & self._mask].get(key, default)
+
+    def setdefault(self, key: K, value: V) -> V:
+        """
+        Insert a value unless the key is already present.
+
+        Returns:
+            The value in the dict after the call
+        """
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            return self._shards[i].setdefault(key, value)
+
+    def pop(self, key: K, default: Any = _MISSING) -> V:
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            if default is _MISSING:
+                return self._shards[i].pop(key)
+            return self._shards[i].pop(key, default)
+
+    def pop_if(self, key: K, value: V) -> bool:
+        """
+        Remove a key only if it still maps to a value.
+
+        Returns:
+            bool: True if the key was removed
+        """
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            if self._shards[i].get(key, _MISSING) == value:
+                del self._shards[i][key]
+                return True
+            return False
+
+    def add_to_set(self, key: K, member: Hashable):
+        """
+        Add a member to the set stored at a key, creating it if needed.
+        """
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            members = self._shards[i].get(key)
+            if members is None:
+                self._shards[i][key] = {member}
+            else:
+                members.add(member)
+
+    def discard_from_set(self, key: K, member: Hashable):
+        """
+        Remove a member from the set stored at a key, and the key once empty.
+        """
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            members = self._shards[i].get(key)
+            if members is not None:
+                members.discard(member)
+                if not members:
+                    del self._shards[i][key]
+
+    def copy_set(self, key: K) -> set:
+        i = hash(key) & self._mask
+        with self._locks[i]:
+            return set(self._shards[i].get(key, ()))
+
+    def keys(self) -> List[K]:
+        return [key for key, _ in self.items()]
+
+    def values(self) -> List[V]:
+        return [value for _, value in self.items()]
+
+    def items(self) -> List[Tuple[K, V]]:
+        items = []
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                items.extend(shard.items())
+        return items
+
+    def clear(self):
+        for lock, shard in zip(self._locks, self._shards):
+            with lock:
+                shard.clear()
+
+
+class SessionRegistry(ShardedDict[str, Any]):
+    """
+    Sessions by Session-Id, with atomic secondary indexes.
+
+    Unique indexes map a key to one Session-Id: when two sessions share a key,
+    the one added last wins, like with the plain dicts the applications used
+    before. Multi-valued indexes map a key to the set of Session-Ids having
+    it, and a session may have several keys in the same index.
+
+    Index keys are evaluated when a session is added, and again when it is
+    reindexed; a key of None (or an empty one) is not indexed. The keys a
+    session was indexed with are remembered, so its entries are removed even
+    if its attributes changed since.
+    """
+
+    def __init__(self, n_shards: int = DEFAULT_SHARDS):
+        super().__init__(n_shards)
+        self.indexes: Dict[str, ShardedDict[Hashable, str]] = {}
+        self.multi_indexes: Dict[str, ShardedDict[Hashable, set]] = {}
+        self._index_keys: Dict[str, Callable[[Any], Optional[Hashable]]] = {}
+        self._multi_index_keys: Dict[str, Callable[[Any], Iterable[Hashable]]] = {}
+        # Keys each session was indexed with, by shard
+        self._indexed_keys: List[Dict[str, Dict[str, Any]]] = [{} for _ in range(n_shards)]
+
+    def add_index(self, name: str, key: Callable[[Any], Optional[Hashable]], index: Any = None) -> ShardedDict[Hashable, str]:
+        """
+        Add a unique secondary index.
+
+        Args:
+            name (str): Index name
+            key (Callable): Returns the index key of a session
+            index (optional): The index object, a `ShardedDict` by default
+
+        Returns:
+            ShardedDict: The index, mapping keys to Session-Ids
+        """
+        if name in self.indexes or name in self.multi_indexes:
+            raise ValueError(f"Index {name} already exists")
+        if index is None:
+            index = ShardedDict(self.n_shards)
+        self.indexes[name] = index
+        self._index_keys[name] = key
+        self._reindex_all()
+        return index
+
+    def add_multi_index(self, name: str, keys: Callable[[Any], Iterable[Hashable]]) -> ShardedDict[Hashable, set]:
+        """
+        Add a multi-valued secondary index.
+
+        Args:
+            name (str): Index name
+            keys (Callable): Returns the index keys of a session
+
+        Returns:
+            ShardedDict: The index, mapping keys to sets of Session-Ids
+        """
+        if name in self.indexes or name in self.multi_indexes:
+            raise ValueError(f"Index {name} already exists")
+        index = ShardedDict(self.n_shards)
+        self.multi_indexes[name] = index
+        self._multi_index_keys[name] = keys
+        self._reindex_all()
+        return index
+
+    def _reindex_all(self):
+        for session in self.values():
+            self.reindex(session)
+
+    def add(self, session) -> Any:
+        """
+        Add a session and its secondary index entries atomically.
+
+        A session already registered with the same Session-Id is replaced.
+
+        Returns:
+            The session
+        """
+        i = hash(session.session_id) & self._mask
+        with self._locks[i]:
+            previous = self._shards[i].get(session.session_id)
+            if previous is not None:
+                self._unindex(previous)
+            self._shards[i][session.session_id] = session
+            self._index(session)
+        return session
+
+    def clear(self):
+        super().clear()
+        for index in list(self.indexes.values()) + list(self.multi_indexes.values()):
+            index.clear()
+        for indexed_keys in self._indexed_keys:
+            indexed_keys.clear()
+
+    def __setitem__(self, session_id: str, session):
+        if session_id != session.session_id:
+            raise ValueError(f"Session {session.session_id} can not be registered as {session_id}")
+        self.add(session)
+
+    def __delitem__(self, session_id: str):
+        if self.remove(session_id) is None:
+            raise KeyError(session_id)
+
+    def pop(self, session_id: str, default: Any = _MISSING):
+        session = self.remove(session_id)
+        if session is None:
+            if default is _MISSING:
+                raise KeyError(session_id)
+            return default
+        return session
+
+    def remove(self, session_id: str) -> Optional[Any]:
+        """
+        Remove a session and the secondary index entries still pointing at it.
+
+        Returns:
+            The session removed, or None if it was not registered
+        """
+        i = hash(session_id) & self._mask
+        with self._locks[i]:
+            session = self._shards[i].pop(session_id, None)
+            if session is not None:
+                self._unindex(session)
+        return session
+
+    def reindex(self, session):
+        """
+        Update the secondary index entries of a session whose keys changed.
+        """
+        i = hash(session.session_id) & self._mask
+        with self._locks[i]:
+            if self._shards[i].get(session.session_id) is not session:
+                return
+            self._unindex(session)
+            self._index(session)
+
+    def iter_items(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over every session. Registries keeping sessions outside of
+        memory load them one at a time instead of all at once.
+        """
+        return iter(self.items())
+
+    def pin(self, session_id: str):
+        """
+        Keep a session in memory while it is in use, e.g. from a request to
+        its answer, so updates made through a reference to it are not lost.
+        Sessions of a SessionRegistry never leave memory.
+        """
+
+    def unpin(self, session_id: str):
+        """
+        Release a pin taken with `pin`.
+        """
+
+    def get_by_index(self, name: str, index_key: Hashable) -> Optional[Any]:
+        session_id = self.indexes[name].get(index_key)
+        if session_id is None:
+            return None
+        return self.get(session_id)
+
+    def get_ids_by_index(self, name: str, index_key: Hashable) -> Set[str]:
+        """
+        Get the Session-Ids having a key in a multi-valued index.
+        """
+        return self.multi_indexes[name].copy_set(index_key)
+
+    def find(self, **criteria: Hashable) -> List[Any]:
+        """
+        Get the sessions matching every criterion, from multi-valued indexes.
+
+        The Session-Id sets are intersected from the smallest one, so the cost
+        is proportional to the number of matching sessions, not to the total.
+
+        Args:
+            **criteria: Key by index name
+
+        Returns:
+            List: The matching sessions
+
+        Example:
+            >>> sessions.find(apn="ims", origin_host="pcef-1.epc")
+        """
+        if not criteria:
+            raise ValueError("At least one criterion is required")
+        id_sets = sorted((self.get_ids_by_index(name, key) for name, key in criteria.items()), key=len)
+        session_ids = id_sets[0]
+        for id_set in id_sets[1:]:
+            if not session_ids:
+                break
+            session_ids = session_ids & id_set
+        sessions = []
+        for session_id in session_ids:
+            session = self.get(session_id)
+            if session is not None:
+                sessions.append(session)
+        return sessions
+
+    def _index(self, session):
+        # Called with the session shard lock held
+        session_id = session.session_id
+        indexed = {}
+        for name, index in self.indexes.items():
+            index_key = self._index_keys[name](session)
+            if index_key:
+                index[index_key] = session_id
+                indexed[name] = index_key
+        for name, index in self.multi_indexes.items():
+            index_keys = frozenset(key for key in self._multi_index_keys[name](session) if key)
+            for index_key in index_keys:
+                index.add_to_set(index_key, session_id)
+            if index_keys:
+                indexed[name] = index_keys
+        self._indexed_keys[hash(session_id) & self._mask][session_id] = indexed
+        session._registry = self
+
+    def _unindex(self, session, evicting: bool = False):
+        # Called with the session shard lock held. When the session is only
+        # evicted from memory, indexes retaining evicted sessions keep their
+        # entries, and the keys they were made with
+        session_id = session.session_id
+        indexed_keys = self._indexed_keys[hash(session_id) & self._mask]
+        indexed = indexed_keys.pop(session_id, None)
+        if not indexed:
+            return
+        retained = {}
+        for name, index_key in indexed.items():
+            if name in self.indexes:
+                index = self.indexes[name]
+                if evicting and getattr(index, 'retains_evicted', False):
+                    retained[name] = index_key
+                else:
+                    index.pop_if(index_key, session_id)
+            else:
+                index = self.multi_indexes[name]
+                for key in index_key:
+                    index.discard_from_set(key, session_id)
+        if retained:
+            indexed_keys[session_id] = retained
+        if getattr(session, '_registry', None) is self:
+            session._registry = None
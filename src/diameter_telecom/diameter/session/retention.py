@@ -0,0 +1,254 @@
+"""
+Bounded Message History for Sessions
+
+Long-lived sessions (e.g. always-on IoT Gx sessions sending a CCR-U every few
+minutes) would otherwise keep every message they ever exchanged. A
+`RetentionPolicy` keeps the first and the last messages of a session in full,
+and turns every message in between into a compact `MessageRecord`, optionally
+spilling its raw bytes to disk so it can still be loaded back.
+
+Spilled messages are appended to segment files of at most `segment_size`
+bytes. A segment is deleted once it is full and the sessions whose records
+refer to it were removed from their application. Segments written by an
+earlier process (e.g. referred to by sessions restored from a snapshot) are
+not counted, and are left for the operator to clean up.
+
+Example:
+    >>> pcrf.gx_app.retention = RetentionPolicy(keep_first=2, keep_last=10, spill_directory="/var/tmp/pcrf", spill_name="gx")
+    >>> pcrf.rx_app.retention = RetentionPolicy(keep_first=1, keep_last=5, spill_directory="/var/tmp/pcrf", spill_name="rx")
+"""
+
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, NamedTuple, Optional, Tuple
+from ..message import DiameterMessage
+import logging
+import os
+import re
+import struct
+import threading
+import weakref
+
+logger = logging.getLogger(__name__)
+
+_SPILL_LENGTH = struct.Struct("<I")
+
+
+class MessageRecord(NamedTuple):
+    """
+    What is kept of a message that was dropped from a session's history.
+
+    Attributes:
+        timestamp (Optional[float]): Time the message was sent or received
+        kind (int): The `MessageKind` of the message
+        result_code (Optional[int]): Result-Code of answers
+        hop_by_hop_id (int): Hop-by-hop identifier
+        end_to_end_id (int): End-to-end identifier
+        is_request (bool): True for requests
+        spill_offset (Optional[int]): Offset of the message in its spill
+            segment, if it was spilled to disk
+        spill_segment (Optional[int]): Spill segment of the message
+    """
+    timestamp: Optional[float]
+    kind: int
+    result_code: Optional[int]
+    hop_by_hop_id: int
+    end_to_end_id: int
+    is_request: bool
+    spill_offset: Optional[int] = None
+    spill_segment: Optional[int] = None
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    How many messages of a session are kept in full.
+
+    Attributes:
+        keep_first (int): Messages kept in full from the start of the session
+        keep_last (int): Most recent messages kept in full
+        spill_directory (Optional[str]): Directory where the messages dropped
+            from memory are written, None to only keep their records
+        spill_name (str): Name prefix of the spill segments in the directory,
+            which only one live policy may use
+        segment_size (int): Bytes written to a spill segment before the next
+            one is started
+    """
+    keep_first: int = 1
+    keep_last: int = 20
+    spill_directory: Optional[str] = None
+    spill_name: str = "messages"
+    segment_size: int = 64 << 20
+    _spill_file: Optional[object] = field(default=None, init=False, repr=False, compare=False)
+    _spill_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    # Current segment, and number of live records in each segment of this process
+    _segment: Optional[int] = field(default=None, init=False, repr=False, compare=False)
+    _live: Dict[int, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    def __post_init__(self):
+        if self.keep_first < 0:
+            raise ValueError(f"keep_first must not be negative. Provided: {self.keep_first}")
+        if self.keep_last < 1:
+            raise ValueError(f"keep_last must be at least 1. Provided: {self.keep_last}")
+        if self.segment_size < 1:
+            raise ValueError(f"segment_size must be positive. Provided: {self.segment_size}")
+        if self.spill_directory is not None:
+            # Each policy counts the records of its own segments, so two live
+            # policies must not spill to the same ones
+            with _policies_lock:
+                owner = _policies.setdefault(self._spill_key, self)
+            if owner is not self:
+                raise ValueError(f"Spill segments {self.spill_name} in {self.spill_directory} are already used by another "
+                                 f"RetentionPolicy. Use another spill_name or spill_directory")
+
+    def __reduce__(self):
+        # Sessions are pickled with their policy. Unpickled in the same process
+        # (e.g. loaded back from a DiskSessionStore), they share the policy
+        # spilling to the same segments, which keeps their reference counts
+        return (_shared_policy, (self.keep_first, self.keep_last, self.spill_directory, self.spill_name, self.segment_size))
+
+    @property
+    def _spill_key(self) -> Tuple[str, str]:
+        return (os.path.abspath(self.spill_directory), self.spill_name)
+
+    @property
+    def max_messages(self) -> int:
+        return self.keep_first + self.keep_last
+
+    def segment_path(self, segment: int) -> Optional[str]:
+        if self.spill_directory is None:
+            return None
+        return os.path.join(self.spill_directory, f"{self.spill_name}.{segment:06d}.spill")
+
+    def compact(self, diameter_message: DiameterMessage) -> MessageRecord:
+        """
+        Turn a message into its compact record, spilling it to disk if configured.
+
+        Args:
+            diameter_message (DiameterMessage): The message dropped from memory
+
+        Returns:
+            MessageRecord: The record kept in its place
+        """
+        spill_segment = spill_offset = None
+        if self.spill_directory is not None:
+            spill_segment, spill_offset = self._spill(diameter_message.as_bytes())
+        timestamp = diameter_message.timestamp
+        return MessageRecord(float(timestamp) if timestamp else None,
+                             diameter_message.kind,
+                             None if diameter_message.is_request else diameter_message.result_code,
+                             diameter_message.hop_by_hop_id,
+                             diameter_message.end_to_end_id,
+                             diameter_message.is_request,
+                             spill_offset,
+                             spill_segment)
+
+    def load(self, record: MessageRecord) -> Optional[DiameterMessage]:
+        """
+        Load a spilled message back from disk.
+
+        Args:
+            record (MessageRecord): The record of the message
+
+        Returns:
+            Optional[DiameterMessage]: The lazily decoded message, or None if
+                it was not spilled, or its segment was deleted
+        """
+        if record.spill_offset is None or record.spill_segment is None:
+            return None
+        with self._spill_lock:
+            if self._spill_file is not None and record.spill_segment == self._segment:
+                self._spill_file.flush()
+        try:
+            with open(self.segment_path(record.spill_segment), "rb") as f:
+                f.seek(record.spill_offset)
+                length = _SPILL_LENGTH.unpack(f.read(_SPILL_LENGTH.size))[0]
+                diameter_message = DiameterMessage(f.read(length))
+        except FileNotFoundError:
+            return None
+        diameter_message.timestamp = record.timestamp
+        return diameter_message
+
+    def release(self, records: Iterable[MessageRecord]):
+        """
+        Drop the references of records to their spill segments, deleting the
+        full segments no record refers to anymore.
+
+        Args:
+            records (Iterable[MessageRecord]): Records of a removed session
+        """
+        with self._spill_lock:
+            for record in records:
+                segment = record.spill_segment
+                live = self._live.get(segment)
+                if live is None:
+                    continue
+                if live > 1:
+                    self._live[segment] = live - 1
+                    continue
+                del self._live[segment]
+                if segment != self._segment:
+                    self._delete_segment(segment)
+
+    def _spill(self, data: bytes) -> Tuple[Optional[int], Optional[int]]:
+        with self._spill_lock:
+            try:
+                if self._spill_file is None:
+                    self._open_segment()
+                segment = self._segment
+                offset = self._spill_file.tell()
+                self._spill_file.write(_SPILL_LENGTH.pack(len(data)))
+                self._spill_file.write(data)
+                self._live[segment] = self._live.get(segment, 0) + 1
+                if offset + _SPILL_LENGTH.size + len(data) >= self.segment_size:
+                    self._close_segment()
+                return segment, offset
+            except OSError as e:
+                logger.error(f"Could not spill message to {self.segment_path(self._segment or 0)}: {e}")
+                return None, None
+
+    def _open_segment(self):
+        if self._segment is None:
+            # Segments of an earlier process are kept, sessions restored from
+            # a snapshot may still refer to them
+            os.makedirs(self.spill_directory, exist_ok=True)
+            pattern = re.compile(rf"{re.escape(self.spill_name)}\.(\d+)\.spill$")
+            segments = [int(match.group(1)) for match in map(pattern.match, os.listdir(self.spill_directory)) if match]
+            self._segment = max(segments, default=-1) + 1
+        self._spill_file = open(self.segment_path(self._segment), "ab")
+
+    def _close_segment(self):
+        # The next spill starts a new segment; this one is deleted now if no
+        # record refers to it anymore
+        self._spill_file.close()
+        self._spill_file = None
+        segment = self._segment
+        self._segment += 1
+        if segment not in self._live:
+            self._delete_segment(segment)
+
+    def _delete_segment(self, segment: int):
+        try:
+            os.remove(self.segment_path(segment))
+        except OSError as e:
+            logger.warning(f"Could not delete spill segment {self.segment_path(segment)}: {e}")
+
+    def close(self):
+        with self._spill_lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+
+_policies: "weakref.WeakValueDictionary[Tuple[str, str], RetentionPolicy]" = weakref.WeakValueDictionary()
+_policies_lock = threading.Lock()
+
+
+def _shared_policy(keep_first: int, keep_last: int, spill_directory: Optional[str],
+                   spill_name: str, segment_size: int) -> RetentionPolicy:
+    # The live policy spilling to the same segments, if any
+    if spill_directory is not None:
+        with _policies_lock:
+            policy = _policies.get((os.path.abspath(spill_directory), spill_name))
+        if policy is not None:
+            return policy
+    return RetentionPolicy(keep_first, keep_last, spill_directory, spill_name, segment_size)
@@ -7,17 +7,19 @@ class RxSession(DiameterSession):
 
     def set_gx_session_id(self, gx_session_id: str):
         self.gx_session_id = gx_session_id
+        if self._registry is not None:
+            self._registry.reindex(self)
 
     def add_message(self, message):
         diameter_message = super().add_message(message)
         if not diameter_message:
             return
-        if diameter_message.name == AAR:
+        if diameter_message.kind == MessageKind.AAR:
             if diameter_message.timestamp:
                 self.start(diameter_message.timestamp)
             else:
                 self.start()
-        elif diameter_message.name == STR:
+        elif diameter_message.kind == MessageKind.STR:
             if diameter_message.timestamp:
                 self.end(diameter_message.timestamp)
             else:
@@ -0,0 +1,339 @@
+"""
+Disk-backed Session Store
+
+A `SessionRegistry` keeps every session in memory, which does not scale to an
+installed base of tens of millions of sessions. `DiskSessionStore` is a drop-in
+replacement for it: the most recently used sessions stay in an in-memory LRU
+cache, and the others are pickled, compressed and written to an embedded
+SQLite file, indexed by Session-Id and by the secondary index keys (e.g.
+Framed-IP-Address, or APN for multi-valued indexes).
+
+Sessions move between memory and disk as a whole: an evicted session is
+written as it is at eviction time, and loaded back (and removed from the
+file) on its next lookup. References to an evicted session kept elsewhere are
+no longer part of the store, so sessions in use are pinned (`pin`) and never
+evicted until unpinned; the applications pin the session of a request from
+the moment it is sent or received until its answer is processed.
+
+Indexes that are cheap to keep in memory (`retains_evicted`, e.g. the
+longest-prefix match Framed IP indexes) keep the entries of evicted sessions,
+so lookups through them never scan the file.
+
+Example:
+    >>> store = DiskSessionStore("/var/tmp/pcrf-gx.sqlite", capacity=200_000)
+    >>> pcrf.gx_app = GxApplication(session_store=store)
+    >>> store.stats()
+    {'hot': 200000, 'cold': 19800000, 'hits': ..., 'misses': ..., 'evictions': ...}
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Set, Tuple
+from .registry import DEFAULT_SHARDS, SessionRegistry, ShardedDict
+import logging
+import pickle
+import re
+import sqlite3
+import threading
+import zlib
+
+logger = logging.getLogger(__name__)
+
+_INDEX_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+class DiskSessionStore(SessionRegistry):
+    """
+    Sessions by Session-Id, with the least recently used ones on disk.
+
+    Attributes:
+        path (str): The SQLite file
+        capacity (int): Sessions kept in memory, split evenly between the shards
+        compress (bool): Compress the sessions written to disk
+    """
+
+    def __init__(self, path: str, capacity: int = 100_000, n_shards: int = DEFAULT_SHARDS, compress: bool = True):
+        if capacity < n_shards:
+            raise ValueError(f"capacity must be at least n_shards ({n_shards}). Provided: {capacity}")
+        super().__init__(n_shards)
+        self.path = path
+        self.capacity = capacity
+        self.compress = compress
+        self._shard_capacity = capacity // n_shards
+        self._shards: List[OrderedDict] = [OrderedDict() for _ in range(n_shards)]
+        self._hits = [0] * n_shards
+        self._misses = [0] * n_shards
+        self._evictions = [0] * n_shards
+        # Pin count by Session-Id, by shard
+        self._pins: List[Dict[str, int]] = [{} for _ in range(n_shards)]
+        self._n_cold = 0
+        self._disk_lock = threading.Lock()
+        # The file is a cache of this process' sessions, not a durable database
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=OFF")
+        self._db.execute("DROP TABLE IF EXISTS sessions")
+        self._db.execute("DROP TABLE IF EXISTS multi_index")
+        self._db.execute("CREATE TABLE sessions (session_id TEXT PRIMARY KEY, data BLOB NOT NULL)")
+        self._db.execute("CREATE TABLE multi_index (name TEXT NOT NULL, key NOT NULL, session_id TEXT NOT NULL)")
+        self._db.execute("CREATE INDEX multi_index_key ON multi_index (name, key)")
+        self._db.execute("CREATE INDEX multi_index_session ON multi_index (session_id)")
+
+    @property
+    def n_hits(self) -> int:
+        return sum(self._hits)
+
+    @property
+    def n_misses(self) -> int:
+        return sum(self._misses)
+
+    @property
+    def n_evictions(self) -> int:
+        return sum(self._evictions)
+
+    @property
+    def n_hot(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
+    @property
+    def n_cold(self) -> int:
+        return self._n_cold
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hot": self.n_hot,
+            "cold": self.n_cold,
+            "hits": self.n_hits,
+            "misses": self.n_misses,
+            "evictions": self.n_evictions,
+        }
+
+    def __len__(self) -> int:
+        return self.n_hot + self._n_cold
+
+    def __contains__(self, session_id: str) -> bool:
+        if session_id in self._shards[hash(session_id) & self._mask]:
+            return True
+        with self._disk_lock:
+            return self._db.execute("SELECT 1 FROM sessions WHERE session_id = ?", (session_id,)).fetchone() is not None
+
+    def __getitem__(self, session_id: str):
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(session_id)
+        return session
+
+    def get(self, session_id: str, default: Any = None):
+        i = hash(session_id) & self._mask
+        with self._locks[i]:
+            shard = self._shards[i]
+            session = shard.get(session_id)
+            if session is not None:
+                shard.move_to_end(session_id)
+                self._hits[i] += 1
+                return session
+            self._misses[i] += 1
+            session = self._load(session_id)
+            if session is None:
+                return default
+            shard[session_id] = session
+            self._unindex(session)
+            self._index(session)
+            self._evict(i)
+            return session
+
+    def add(self, session):
+        i = hash(session.session_id) & self._mask
+        with self._locks[i]:
+            shard = self._shards[i]
+            previous = shard.get(session.session_id)
+            if previous is None:
+                self._delete(session.session_id)
+            # Also drops the retained entries of an evicted session
+            self._unindex(session if previous is None else previous)
+            shard[session.session_id] = session
+            shard.move_to_end(session.session_id)
+            self._index(session)
+            self._evict(i)
+        return session
+
+    def pin(self, session_id: str):
+        i = hash(session_id) & self._mask
+        with self._locks[i]:
+            pins = self._pins[i]
+            pins[session_id] = pins.get(session_id, 0) + 1
+
+    def unpin(self, session_id: str):
+        i = hash(session_id) & self._mask
+        with self._locks[i]:
+            pins = self._pins[i]
+            count = pins.pop(session_id, 0) - 1
+            if count > 0:
+                pins[session_id] = count
+            self._evict(i)
+
+    def remove(self, session_id: str) -> Optional[Any]:
+        i = hash(session_id) & self._mask
+        with self._locks[i]:
+            session = self._shards[i].pop(session_id, None)
+            if session is None:
+                session = self._load(session_id)
+            if session is not None:
+                self._unindex(session)
+        return session
+
+    def get_by_index(self, name: str, index_key: Hashable) -> Optional[Any]:
+        index = self.indexes[name]
+        session_id = index.get(index_key)
+        if session_id is None:
+            if self._retains_evicted(name):
+                return None
+            with self._disk_lock:
+                row = self._db.execute(f"SELECT session_id FROM sessions WHERE index_{name} = ? ORDER BY rowid DESC LIMIT 1",
+                                       (_index_value(index_key),)).fetchone()
+            if row is None:
+                return None
+            session_id = row[0]
+        return self.get(session_id)
+
+    def get_ids_by_index(self, name: str, index_key: Hashable) -> Set[str]:
+        session_ids = super().get_ids_by_index(name, index_key)
+        with self._disk_lock:
+            session_ids.update(row[0] for row in self._db.execute(
+                "SELECT session_id FROM multi_index WHERE name = ? AND key = ?", (name, _index_value(index_key))))
+        return session_ids
+
+    def add_index(self, name: str, key: Callable[[Any], Optional[Hashable]], index: Any = None) -> ShardedDict[Hashable, str]:
+        if not _INDEX_NAME.match(name):
+            raise ValueError(f"Invalid index name {name}")
+        index = super().add_index(name, key, index)
+        if self._retains_evicted(name):
+            return index
+        with self._disk_lock:
+            self._db.execute(f"ALTER TABLE sessions ADD COLUMN index_{name}")
+            self._db.execute(f"CREATE INDEX sessions_{name} ON sessions (index_{name})")
+        return index
+
+    def items(self) -> List[Tuple[str, Any]]:
+        """
+        Every session, including the ones on disk, which are loaded without
+        being moved back into memory. Use `iter_items` for large stores.
+        """
+        items = super().items()
+        with self._disk_lock:
+            rows = self._db.execute("SELECT session_id, data FROM sessions").fetchall()
+        items.extend((session_id, self._decode(data)) for session_id, data in rows)
+        return items
+
+    def keys(self) -> List[str]:
+        keys = [session_id for session_id, _ in super().items()]
+        with self._disk_lock:
+            keys.extend(row[0] for row in self._db.execute("SELECT session_id FROM sessions"))
+        return keys
+
+    def iter_items(self) -> Iterator[Tuple[str, Any]]:
+        """
+        Every session, the ones in memory first, then the ones on disk as
+        `iter_cold` loads them. A session moving between memory and disk
+        meanwhile may be missed or seen twice.
+        """
+        yield from super().items()
+        yield from self.iter_cold()
+
+    def iter_cold(self, batch_size: int = 1024) -> Iterator[Tuple[str, Any]]:
+        """
+        The sessions on disk, read in batches of `batch_size` and decoded one
+        at a time, without being moved back into memory.
+        """
+        last_rowid = 0
+        while True:
+            with self._disk_lock:
+                rows = self._db.execute("SELECT rowid, session_id, data FROM sessions WHERE rowid > ? ORDER BY rowid LIMIT ?",
+                                        (last_rowid, batch_size)).fetchall()
+            if not rows:
+                return
+            for _, session_id, data in rows:
+                yield session_id, self._decode(data)
+            last_rowid = rows[-1][0]
+
+    def hot_items(self) -> List[Tuple[str, Any]]:
+        return super().items()
+
+    def clear(self):
+        super().clear()
+        with self._disk_lock:
+            self._db.execute("DELETE FROM sessions")
+            self._db.execute("DELETE FROM multi_index")
+            self._n_cold = 0
+
+    def close(self):
+        with self._disk_lock:
+            self._db.close()
+
+    def _evict(self, i: int):
+        # Called with the lock of shard i held. Pinned sessions stay, even
+        # beyond the capacity, until unpinned
+        shard = self._shards[i]
+        excess = len(shard) - self._shard_capacity
+        if excess <= 0:
+            return
+        pins = self._pins[i]
+        evicted = []
+        for session_id in shard:
+            if session_id not in pins:
+                evicted.append(session_id)
+                if len(evicted) == excess:
+                    break
+        for session_id in evicted:
+            session = shard.pop(session_id)
+            self._unindex(session, evicting=True)
+            self._store(session)
+            self._evictions[i] += 1
+
+    def _retains_evicted(self, name: str) -> bool:
+        return getattr(self.indexes[name], 'retains_evicted', False)
+
+    def _encode(self, session) -> bytes:
+        data = pickle.dumps(session, pickle.HIGHEST_PROTOCOL)
+        return zlib.compress(data, 1) if self.compress else data
+
+    def _decode(self, data: bytes):
+        return pickle.loads(zlib.decompress(data) if self.compress else data)
+
+    def _store(self, session):
+        columns = ["session_id", "data"]
+        values = [session.session_id, self._encode(session)]
+        for name, key in self._index_keys.items():
+            if self._retains_evicted(name):
+                continue
+            columns.append(f"index_{name}")
+            values.append(_index_value(key(session) or None))
+        multi_keys = [(name, _index_value(key), session.session_id)
+                      for name, keys in self._multi_index_keys.items() for key in set(keys(session)) if key]
+        with self._disk_lock:
+            self._db.execute(f"INSERT INTO sessions ({', '.join(columns)}) VALUES ({', '.join('?' * len(values))})", values)
+            if multi_keys:
+                self._db.executemany("INSERT INTO multi_index (name, key, session_id) VALUES (?, ?, ?)", multi_keys)
+            self._n_cold += 1
+
+    def _load(self, session_id: str):
+        with self._disk_lock:
+            row = self._db.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._db.execute("DELETE FROM multi_index WHERE session_id = ?", (session_id,))
+            self._n_cold -= 1
+        return self._decode(row[0])
+
+    def _delete(self, session_id: str):
+        with self._disk_lock:
+            if self._db.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,)).rowcount:
+                self._db.execute("DELETE FROM multi_index WHERE session_id = ?", (session_id,))
+                self._n_cold -= 1
+
+
+def _index_value(index_key: Optional[Hashable]):
+    # SQLite only stores scalars; other keys are indexed by their repr
+    if index_key is None or isinstance(index_key, (str, int, float, bytes)):
+        return index_key
+    return repr(index_key)
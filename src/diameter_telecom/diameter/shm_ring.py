@@ -0,0 +1,207 @@
+"""
+Shared Memory Message Rings
+
+A `ShmRing` is a single-consumer ring buffer of variable length records in a
+`multiprocessing.shared_memory` segment, used to pass encoded Diameter
+messages between processes without pickling them or going through a pipe.
+
+Layout of the segment:
+- Bytes 0-7: write offset, bytes 64-71: read offset, each on its own cache
+  line. Offsets only ever grow; their position in the data area is the offset
+  modulo the capacity
+- From byte 128: the data area, holding records of a 4-byte length followed by
+  the payload, each padded to 8 bytes. A record that does not fit before the
+  end of the data area is preceded by a wrap marker, and written at its start
+
+Records are written before the write offset is published, and read before the
+read offset is, which relies on stores becoming visible in program order, as
+they do on x86 and x86-64. Nothing orders them on weakly ordered CPUs (e.g.
+aarch64), where a consumer could see an offset before the record behind it,
+so rings are refused on other machines. Several threads of one process may
+put records, as they are serialized by a lock; only one thread of one process
+may get them.
+
+Example:
+    >>> ring = ShmRing.create(1 << 20)
+    >>> ring.put(ccr.as_bytes())
+    True
+    >>> other = ShmRing.attach(ring.name)   # in the consumer process
+    >>> other.get_many()
+    [b'\\x01\\x00\\x00...']
+"""
+
+from multiprocessing import shared_memory
+from typing import List, Optional
+import platform
+import struct
+import threading
+import time
+
+_OFFSET = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+_WRITE = 0
+_READ = 64
+_DATA = 128
+_WRAP = 0xFFFFFFFF
+_ALIGN = 8
+# Machines whose stores become visible to other cores in program order
+_TOTAL_STORE_ORDER = ("x86_64", "amd64", "i386", "i486", "i586", "i686", "x86")
+
+
+def _check_store_order():
+    machine = platform.machine()
+    if machine.lower() not in _TOTAL_STORE_ORDER:
+        raise RuntimeError(f"ShmRing requires total store ordering (x86 or x86-64), not available on {machine}")
+
+
+def _padded(length: int) -> int:
+    return (_LENGTH.size + length + _ALIGN - 1) & ~(_ALIGN - 1)
+
+
+class ShmRing:
+    """
+    Ring buffer of byte records in shared memory.
+
+    Attributes:
+        name (str): Name of the shared memory segment, to attach to it
+        capacity (int): Size of the data area in bytes
+    """
+
+    def __init__(self, shm: shared_memory.SharedMemory, owner: bool):
+        self._shm = shm
+        self._buf = shm.buf
+        self._owner = owner
+        self.name = shm.name
+        self.capacity = shm.size - _DATA
+        self._put_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, capacity: int, name: Optional[str] = None) -> 'ShmRing':
+        """
+        Create a ring, unlinked when closed.
+
+        Args:
+            capacity (int): Size of the data area in bytes, rounded up to 8
+            name (str, optional): Name of the segment, generated by default
+
+        Raises:
+            RuntimeError: If the machine does not order stores
+        """
+        _check_store_order()
+        if capacity < 64:
+            raise ValueError(f"Ring capacity must be at least 64 bytes. Provided: {capacity}")
+        capacity = (capacity + _ALIGN - 1) & ~(_ALIGN - 1)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=_DATA + capacity)
+        _OFFSET.pack_into(shm.buf, _WRITE, 0)
+        _OFFSET.pack_into(shm.buf, _READ, 0)
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name: str) -> 'ShmRing':
+        """
+        Attach to a ring created by another process.
+
+        The process must be a `multiprocessing` child of the creator, so they
+        share the resource tracker that unlinks the segment if the creator
+        dies without closing it.
+        """
+        _check_store_order()
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    def __len__(self) -> int:
+        """
+        Bytes used by the records not read yet.
+        """
+        return _OFFSET.unpack_from(self._buf, _WRITE)[0] - _OFFSET.unpack_from(self._buf, _READ)[0]
+
+    def put(self, data: bytes) -> bool:
+        """
+        Append a record.
+
+        Returns:
+            bool: False if the ring does not have room for it
+        """
+        size = _padded(len(data))
+        capacity = self.capacity
+        if size > capacity:
+            raise ValueError(f"Record of {len(data)} bytes does not fit in a ring of {capacity} bytes")
+        buf = self._buf
+        with self._put_lock:
+            write = _OFFSET.unpack_from(buf, _WRITE)[0]
+            read = _OFFSET.unpack_from(buf, _READ)[0]
+            position = write % capacity
+            skip = capacity - position if position + size > capacity else 0
+            if write + skip + size - read > capacity:
+                return False
+            if skip:
+                _LENGTH.pack_into(buf, _DATA + position, _WRAP)
+                position = 0
+            start = _DATA + position
+            _LENGTH.pack_into(buf, start, len(data))
+            buf[start + _LENGTH.size:start + _LENGTH.size + len(data)] = data
+            _OFFSET.pack_into(buf, _WRITE, write + skip + size)
+        return True
+
+    def put_wait(self, data: bytes, timeout: Optional[float] = None) -> bool:
+        """
+        Append a record, waiting for the consumer to make room.
+
+        Returns:
+            bool: False if there was no room within `timeout` seconds
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0
+        while not self.put(data):
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(delay * 2 or 0.00005, 0.002)
+        return True
+
+    def get_many(self, max_records: int = 256) -> List[bytes]:
+        """
+        Take the records written so far, without waiting.
+        """
+        buf = self._buf
+        capacity = self.capacity
+        write = _OFFSET.unpack_from(buf, _WRITE)[0]
+        read = _OFFSET.unpack_from(buf, _READ)[0]
+        records = []
+        while read < write and len(records) < max_records:
+            position = read % capacity
+            length = _LENGTH.unpack_from(buf, _DATA + position)[0]
+            if length == _WRAP:
+                read += capacity - position
+                continue
+            start = _DATA + position + _LENGTH.size
+            records.append(bytes(buf[start:start + length]))
+            read += _padded(length)
+        if records or read != _OFFSET.unpack_from(buf, _READ)[0]:
+            _OFFSET.pack_into(buf, _READ, read)
+        return records
+
+    def get_wait(self, timeout: Optional[float] = None, max_records: int = 256) -> List[bytes]:
+        """
+        Take the records written so far, waiting for at least one.
+
+        The consumer polls with an exponential backoff, from yielding the GIL
+        up to 1 ms, so an idle ring costs little and a busy one is read
+        without any system call.
+
+        Returns:
+            List[bytes]: The records, empty if none arrived within `timeout`
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        delay = 0.0
+        while not (records := self.get_many(max_records)):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            time.sleep(delay)
+            delay = min(delay * 2 or 0.00005, 0.001)
+        return records
+
+    def close(self):
+        self._buf = None
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,373 @@
+"""
+Entity Snapshots and Warm Restart
+
+This module saves the application state of an entity (Gx/Rx/Sy sessions,
+subscriber maps, carrier subscribers, APN IP pool allocations and the PCC rule
+names interned by Gx) to a compact
+binary file, and restores it after a restart instead of replaying attach
+storms against the peers.
+
+File format (big endian):
+    magic "DTSN", version (u16)
+    records: type (u8), payload length (u32), payload
+    an END record with the number of records written before it
+
+Sessions are pickled without their message indexes (rebuilt on load);
+subscribers and APN allocations are packed by hand. The file is written to a
+temporary name and renamed when complete, so a crash during a snapshot never
+leaves a truncated file behind the previous one.
+
+Writing does not stop the handler threads: sessions are collected shard by
+shard from the registries and serialised outside the registry locks.
+Restoring is streaming: records are read and applied one at a time, and can
+run in a background thread while the node already serves requests.
+
+Example:
+    >>> write_snapshot(pcrf, "/var/lib/pcrf/state.snap")
+    >>> # After the restart
+    >>> restore_snapshot(pcrf, "/var/lib/pcrf/state.snap", background=True)
+    >>> snapshots = PeriodicSnapshot(pcrf, "/var/lib/pcrf/state.snap", interval=300)
+    >>> snapshots.start()
+"""
+
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from ..subscriber import Subscriber
+from .apn import APN
+from .session.pcc import translate_mask
+import ipaddress
+import logging
+import os
+import pickle
+import socket
+import struct
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_MAGIC = b"DTSN"
+SNAPSHOT_VERSION = 2
+
+RECORD_APPLICATION = 1
+RECORD_SUBSCRIBER = 2
+RECORD_SESSION = 3
+RECORD_CARRIER_SUBSCRIBER = 4
+RECORD_APN = 5
+RECORD_PCC_RULES = 6
+RECORD_END = 255
+
+_FILE_HEADER = struct.Struct(">4sH")
+_RECORD_HEADER = struct.Struct(">BI")
+_U16 = struct.Struct(">H")
+_U32 = struct.Struct(">I")
+_NONE_LENGTH = 0xffff
+_SUBSCRIBER_FIELDS = ('msisdn', 'imsi', 'sip_uri', 'nai', 'private_id', 'imei')
+# Packed address length by family
+_ADDRESS_LENGTHS = {socket.AF_INET: 4, socket.AF_INET6: 16}
+# Pickling a session races with handler threads adding messages to it
+_SESSION_ATTEMPTS = 3
+
+
+def _pack_string(value: Optional[str]) -> bytes:
+    if value is None:
+        return _U16.pack(_NONE_LENGTH)
+    data = value.encode('utf-8')
+    return _U16.pack(len(data)) + data
+
+
+def _unpack_string(data: bytes, offset: int) -> Tuple[Optional[str], int]:
+    length = _U16.unpack_from(data, offset)[0]
+    offset += _U16.size
+    if length == _NONE_LENGTH:
+        return None, offset
+    return data[offset:offset + length].decode('utf-8'), offset + length
+
+
+def _pack_subscriber(subscriber: Subscriber) -> bytes:
+    return b"".join(_pack_string(getattr(subscriber, name)) for name in _SUBSCRIBER_FIELDS)
+
+
+def _unpack_subscriber(data: bytes) -> Subscriber:
+    values = []
+    offset = 0
+    for _ in _SUBSCRIBER_FIELDS:
+        value, offset = _unpack_string(data, offset)
+        values.append(value)
+    return Subscriber(*values)
+
+
+def _address_family(cidr: str) -> int:
+    return socket.AF_INET6 if ipaddress.ip_network(cidr, strict=False).version == 6 else socket.AF_INET
+
+
+def _pack_apn(apn: APN) -> bytes:
+    # Allocated addresses packed back to back, in the family of the pool
+    family = _address_family(apn.ip_pool_cidr)
+    allocated = sorted(socket.inet_pton(family, ip) for ip in apn.allocated_ips)
+    return (_pack_string(apn.apn) + _pack_string(apn.ip_pool_cidr)
+            + _U32.pack(len(allocated)) + b"".join(allocated))
+
+
+def _unpack_apn(data: bytes) -> Tuple[str, str, List[str]]:
+    name, offset = _unpack_string(data, 0)
+    cidr, offset = _unpack_string(data, offset)
+    count = _U32.unpack_from(data, offset)[0]
+    offset += _U32.size
+    family = _address_family(cidr)
+    length = _ADDRESS_LENGTHS[family]
+    return name, cidr, [socket.inet_ntop(family, data[start:start + length])
+                        for start in range(offset, offset + count * length, length)]
+
+
+def _pack_strings(values: List[str]) -> bytes:
+    return _U32.pack(len(values)) + b"".join(_pack_string(value) for value in values)
+
+
+def _unpack_strings(data: bytes) -> List[str]:
+    values = []
+    offset = _U32.size
+    for _ in range(_U32.unpack_from(data, 0)[0]):
+        value, offset = _unpack_string(data, offset)
+        values.append(value)
+    return values
+
+
+def _applications(entity) -> List:
+    return [app for app in (entity.gx_app, entity.rx_app, entity.sy_app) if app is not None]
+
+
+def _pickle_session(session) -> Optional[bytes]:
+    for _ in range(_SESSION_ATTEMPTS):
+        try:
+            return pickle.dumps(session, pickle.HIGHEST_PROTOCOL)
+        except RuntimeError:
+            # Changed size during iteration: a message was added meanwhile
+            continue
+    logger.warning(f"Session {session.session_id} kept changing, not included in the snapshot")
+    return None
+
+
+def write_snapshot(entity, path: str) -> Dict[str, int]:
+    """
+    Write the application state of an entity to a snapshot file.
+
+    Args:
+        entity (DiameterEntity): The entity, e.g. a PCRF or PCEF
+        path (str): The snapshot file, replaced atomically
+
+    Returns:
+        Dict[str, int]: Number of records written by kind
+    """
+    counts = {"sessions": 0, "subscribers": 0, "apns": 0}
+    n_records = 0
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        def write(record_type: int, payload: bytes):
+            nonlocal n_records
+            f.write(_RECORD_HEADER.pack(record_type, len(payload)))
+            f.write(payload)
+            n_records += 1
+
+        f.write(_FILE_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION))
+        for apn in getattr(entity, 'apns', {}).values():
+            write(RECORD_APN, _pack_apn(apn))
+            counts["apns"] += 1
+        if entity.carrier:
+            for subscriber in list(entity.carrier.subscribers.values()):
+                write(RECORD_CARRIER_SUBSCRIBER, _pack_subscriber(subscriber))
+                counts["subscribers"] += 1
+        for app in _applications(entity):
+            write(RECORD_APPLICATION, _U32.pack(app.application_id))
+            pcc_rules = getattr(app, 'pcc_rules', None)
+            if pcc_rules is not None:
+                # Sessions hold bitsets of rule ids, only valid with these names
+                write(RECORD_PCC_RULES, _pack_strings(pcc_rules.rules.names))
+            # Subscribers first, so sessions can be bound to them on restore
+            for subscriber in app.subscribers.values():
+                write(RECORD_SUBSCRIBER, _pack_subscriber(subscriber))
+                counts["subscribers"] += 1
+            for _, session in app.sessions.iter_items():
+                payload = _pickle_session(session)
+                if payload is not None:
+                    write(RECORD_SESSION, payload)
+                    counts["sessions"] += 1
+        write(RECORD_END, _U32.pack(n_records))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+    logger.info(f"Snapshot of {entity.origin_host} written to {path}: {counts}")
+    return counts
+
+
+def read_snapshot(path: str) -> Iterator[Tuple[int, bytes]]:
+    """
+    Read the records of a snapshot file, one at a time.
+
+    Args:
+        path (str): The snapshot file
+
+    Yields:
+        Tuple[int, bytes]: Record type and payload, up to the END record
+
+    Raises:
+        ValueError: If the file is not a snapshot, or is truncated
+    """
+    with open(path, "rb") as f:
+        header = f.read(_FILE_HEADER.size)
+        if len(header) != _FILE_HEADER.size:
+            raise ValueError(f"{path} is not a snapshot file")
+        magic, version = _FILE_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} is not a version {SNAPSHOT_VERSION} snapshot file")
+        n_records = 0
+        while True:
+            record_header = f.read(_RECORD_HEADER.size)
+            if len(record_header) != _RECORD_HEADER.size:
+                raise ValueError(f"Snapshot {path} is truncated after {n_records} records")
+            record_type, length = _RECORD_HEADER.unpack(record_header)
+            payload = f.read(length)
+            if len(payload) != length:
+                raise ValueError(f"Snapshot {path} is truncated after {n_records} records")
+            if record_type == RECORD_END:
+                if _U32.unpack(payload)[0] != n_records:
+                    raise ValueError(f"Snapshot {path} is inconsistent: {n_records} records read")
+                return
+            n_records += 1
+            yield record_type, payload
+
+
+def _restore(entity, path: str) -> Dict[str, int]:
+    counts = {"sessions": 0, "subscribers": 0, "apns": 0}
+    applications = {app.application_id: app for app in _applications(entity)}
+    app = None
+    rule_ids = None
+    for record_type, payload in read_snapshot(path):
+        if record_type == RECORD_SESSION:
+            if app is None:
+                continue
+            session = pickle.loads(payload)
+            # Idle time restarts with the node
+            session.touch()
+            if rule_ids is not None:
+                session.installed_rules = translate_mask(session.installed_rules, rule_ids)
+            if session.subscriber:
+                session.subscriber = app.subscribers.setdefault(session.subscriber.msisdn, session.subscriber)
+            app.add_session(session)
+            counts["sessions"] += 1
+        elif record_type == RECORD_SUBSCRIBER:
+            if app is not None:
+                app.add_subscriber(_unpack_subscriber(payload))
+                counts["subscribers"] += 1
+        elif record_type == RECORD_APPLICATION:
+            application_id = _U32.unpack(payload)[0]
+            app = applications.get(application_id)
+            rule_ids = None
+            if app is None:
+                logger.warning(f"Snapshot has state for application {application_id}, which {entity.origin_host} does not run")
+        elif record_type == RECORD_PCC_RULES:
+            if app is not None:
+                # The rules may be interned in another order by this process
+                rule_ids = [app.pcc_rules.rules.intern(name) for name in _unpack_strings(payload)]
+        elif record_type == RECORD_CARRIER_SUBSCRIBER:
+            if entity.carrier:
+                entity.carrier.add_subscriber(_unpack_subscriber(payload))
+                counts["subscribers"] += 1
+        elif record_type == RECORD_APN:
+            name, cidr, allocated = _unpack_apn(payload)
+            apn = entity.apns.get(name)
+            if apn is None:
+                apn = entity.apns[name] = APN(name, cidr)
+            apn.restore_allocations(allocated)
+            counts["apns"] += 1
+    logger.info(f"Restored {entity.origin_host} from {path}: {counts}")
+    return counts
+
+
+def restore_snapshot(entity, path: str, background: bool = False):
+    """
+    Restore the application state of an entity from a snapshot file.
+
+    Sessions are added to the applications as they are read, so with
+    `background=True` the node can be started right away and serves the
+    sessions restored so far.
+
+    Args:
+        entity (DiameterEntity): The entity, with its applications created
+        path (str): The snapshot file
+        background (bool, optional): Restore in a background thread
+
+    Returns:
+        Dict[str, int] or threading.Thread: Number of records restored by
+            kind, or the restoring thread if running in the background
+    """
+    if not background:
+        return _restore(entity, path)
+
+    def run():
+        try:
+            _restore(entity, path)
+        except Exception as e:
+            logger.error(f"Could not restore {entity.origin_host} from {path}: {e}")
+    thread = threading.Thread(target=run, name=f"SnapshotRestore-{entity.origin_host}", daemon=True)
+    thread.start()
+    return thread
+
+
+class PeriodicSnapshot:
+    """
+    Writes snapshots of an entity in a background thread.
+
+    Attributes:
+        path (str): The snapshot file
+        interval (float): Seconds between two snapshots
+        write (Callable): Writes a snapshot of the entity to the file,
+            `write_snapshot` by default
+        n_snapshots (int): Snapshots written
+        last_duration (Optional[float]): Seconds taken by the last snapshot
+    """
+
+    def __init__(self, entity, path: str, interval: float = 300, write: Optional[Callable] = None):
+        self.entity = entity
+        self.path = path
+        self.interval = interval
+        self.write = write or write_snapshot
+        self.n_snapshots = 0
+        self.last_duration: Optional[float] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.is_running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=f"PeriodicSnapshot-{self.entity.origin_host}", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 30, final_snapshot: bool = True):
+        """
+        Stop taking snapshots, after a last one by default.
+        """
+        if not self.is_running:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        if final_snapshot:
+            self.snapshot()
+
+    def snapshot(self):
+        start = time.perf_counter()
+        try:
+            self.write(self.entity, self.path)
+        except Exception as e:
+            logger.error(f"Snapshot of {self.entity.origin_host} failed: {e}")
+            return
+        self.last_duration = time.perf_counter() - start
+        self.n_snapshots += 1
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.snapshot()
@@ -0,0 +1,284 @@
+"""
+Pre-encoded Message Templates
+
+This module generates wire-ready requests without building and encoding a
+`Message` for every one of them. A template encodes a message once, records
+where its variable AVPs are, and renders new messages by patching only those
+AVPs into a copy of the encoded bytes.
+
+When every new value has the same length as the template value (fixed width
+integers, IPv4 addresses, fixed width Session-Ids), rendering is a buffer copy
+plus one slice assignment per field. Values of another length are spliced in,
+and the lengths of the AVP, of every grouped AVP around it and of the message
+are recalculated.
+
+Rendered messages are lazily decoded `DiameterMessage` objects, which the
+applications send straight from their raw bytes.
+
+Example:
+    >>> ccr_u = CreditControlRequest()
+    >>> ...  # Set every AVP, once
+    >>> template = MessageTemplate(ccr_u, CCR_FIELDS)
+    >>> request = template.new_message(session_id="pcef;1;42", cc_request_number=3,
+    ...                                msisdn="5511999990001", framed_ip_address=b"\\x0a\\x00\\x00\\x01")
+    >>> answer = pcef.gx_app.send_request_custom(request)
+"""
+
+from typing import Any, Callable, Dict, List, Optional, Union
+from diameter.message import Message
+from diameter.message.avp import (AvpGrouped, AvpInteger32, AvpInteger64, AvpOctetString,
+                                  AvpUnsigned32, AvpUnsigned64, AvpUtf8String)
+from .message import DiameterMessage, HEADER_LENGTH, AVP_FLAG_VENDOR
+from .parse_avp import _avps_by_name
+import logging
+import re
+import struct
+
+logger = logging.getLogger(__name__)
+
+# Default fields of the templates of the common requests. Subscription-Id
+# indexes follow the order the AVPs were set in, usually E.164 then IMSI.
+CCR_FIELDS = {
+    "session_id": "Session-Id",
+    "cc_request_number": "CC-Request-Number",
+    "msisdn": "Subscription-Id[0]/Subscription-Id-Data",
+    "imsi": "Subscription-Id[1]/Subscription-Id-Data",
+    "framed_ip_address": "Framed-IP-Address",
+}
+AAR_FIELDS = {
+    "session_id": "Session-Id",
+    "framed_ip_address": "Framed-IP-Address",
+}
+STR_FIELDS = {
+    "session_id": "Session-Id",
+}
+
+_AVP_HEADER = struct.Struct(">II")
+_VENDOR_ID = struct.Struct(">I")
+_HEADER_IDS = struct.Struct(">II")
+_LENGTH_MASK = 0x00ffffff
+_PATH_ELEMENT = re.compile(r"^([^\[\]]+)(?:\[(\d+)\])?$")
+
+_AVP_ENCODERS: Dict[type, Callable[[Any], bytes]] = {
+    AvpUnsigned32: struct.Struct(">I").pack,
+    AvpInteger32: struct.Struct(">i").pack,
+    AvpUnsigned64: struct.Struct(">Q").pack,
+    AvpInteger64: struct.Struct(">q").pack,
+    AvpUtf8String: lambda value: value.encode('utf-8'),
+    AvpOctetString: bytes,
+}
+
+
+def _avp_encoder(avp_type: type) -> Callable[[Any], bytes]:
+    encoder = _AVP_ENCODERS.get(avp_type)
+    if encoder is not None:
+        return encoder
+
+    def encode(value) -> bytes:
+        avp = avp_type()
+        avp.value = value
+        return avp.payload
+    return encode
+
+
+class _TemplateField:
+    __slots__ = ('name', 'encode', 'header_offset', 'value_offset', 'length', 'padded_length')
+
+    def __init__(self, name: str, encode: Callable[[Any], bytes], header_offset: int, header_length: int, length: int):
+        self.name = name
+        self.encode = encode
+        self.header_offset = header_offset
+        self.value_offset = header_offset + header_length
+        self.length = length
+        self.padded_length = (length + 3) & ~3
+
+
+class _TemplateGroup:
+    """A grouped AVP containing fields, whose length changes with theirs."""
+    __slots__ = ('header_offset', 'length', 'first_field', 'end_field')
+
+    def __init__(self, header_offset: int, length: int):
+        self.header_offset = header_offset
+        self.length = length
+        self.first_field = 0
+        self.end_field = 0
+
+
+class MessageTemplate:
+    """
+    An encoded message whose variable AVPs are patched in place.
+
+    Fields are named AVP paths: AVP names separated by "/", from a top-level
+    AVP down into grouped AVPs, each optionally followed by the index of the
+    occurrence to use, e.g. "Subscription-Id[1]/Subscription-Id-Data".
+    Without an index the first occurrence is used.
+
+    The hop-by-hop and end-to-end identifiers can always be set when
+    rendering; left at 0, they are assigned by the node when sending.
+
+    Attributes:
+        fields (Dict[str, str]): Field name to AVP path
+        data (bytes): The encoded template message
+    """
+
+    def __init__(self, message: Union[Message, DiameterMessage], fields: Dict[str, str]):
+        """
+        Encode a message and locate its fields.
+
+        Args:
+            message: The message to render new messages from
+            fields (Dict[str, str]): Field name to AVP path
+
+        Raises:
+            ValueError: If a path is invalid, names an unknown or grouped AVP,
+                or is not present in the message
+        """
+        self.fields = dict(fields)
+        self.data = message.as_bytes()
+        self._fields: List[_TemplateField] = []
+        self._groups: Dict[int, _TemplateGroup] = {}
+        field_groups = []
+        for name, path in self.fields.items():
+            field, groups = self._locate(name, path)
+            self._fields.append(field)
+            field_groups.append(groups)
+        order = sorted(range(len(self._fields)), key=lambda i: self._fields[i].value_offset)
+        self._fields = [self._fields[i] for i in order]
+        for position, i in enumerate(order):
+            for group in field_groups[i]:
+                group = self._groups.setdefault(group.header_offset, group)
+                if group.end_field == 0:
+                    group.first_field = position
+                group.end_field = position + 1
+        self._field_index = {field.name: i for i, field in enumerate(self._fields)}
+
+    def __repr__(self) -> str:
+        return f"MessageTemplate({self.fields})"
+
+    def _locate(self, name: str, path: str):
+        avps = _avps_by_name()
+        data = self.data
+        start, end = HEADER_LENGTH, len(data)
+        groups = []
+        elements = path.split("/")
+        for depth, element in enumerate(elements):
+            match = _PATH_ELEMENT.match(element)
+            if not match or match.group(1) not in avps:
+                raise ValueError(f"Invalid AVP {element} in path {path}")
+            code, vendor, avp_type = avps[match.group(1)]
+            occurrence = int(match.group(2) or 0)
+            is_leaf = depth == len(elements) - 1
+            if is_leaf == (avp_type is AvpGrouped):
+                raise ValueError(f"AVP path {path} must end in a non-grouped AVP and go through grouped ones")
+            position = _find_avp(data, start, end, code, vendor, occurrence)
+            if position is None:
+                raise ValueError(f"AVP path {path} is not present in the template message")
+            flags_length = _AVP_HEADER.unpack_from(data, position)[1]
+            length = flags_length & _LENGTH_MASK
+            header_length = 12 if flags_length >> 24 & AVP_FLAG_VENDOR else 8
+            if is_leaf:
+                field = _TemplateField(name, _avp_encoder(avp_type), position, header_length, length - header_length)
+                return field, groups
+            groups.append(_TemplateGroup(position, length))
+            start, end = position + header_length, position + length
+
+    def render(self, hop_by_hop_id: int = 0, end_to_end_id: int = 0, **values) -> bytes:
+        """
+        Render a new encoded message.
+
+        Args:
+            hop_by_hop_id (int, optional): Hop-by-hop identifier
+            end_to_end_id (int, optional): End-to-end identifier
+            **values: New value by field name. Fields not given keep their
+                template value
+
+        Returns:
+            bytes: The wire-ready message
+
+        Raises:
+            KeyError: If a value is given for an unknown field
+        """
+        fields = self._fields
+        encoded: List[Optional[bytes]] = [None] * len(fields)
+        same_length = True
+        for name, value in values.items():
+            i = self._field_index[name]
+            payload = fields[i].encode(value)
+            encoded[i] = payload
+            if len(payload) != fields[i].length:
+                same_length = False
+        if same_length:
+            buffer = bytearray(self.data)
+            for field, payload in zip(fields, encoded):
+                if payload is not None:
+                    buffer[field.value_offset:field.value_offset + field.length] = payload
+        else:
+            buffer = self._splice(encoded)
+        _HEADER_IDS.pack_into(buffer, 12, hop_by_hop_id, end_to_end_id)
+        return bytes(buffer)
+
+    def _splice(self, encoded: List[Optional[bytes]]) -> bytearray:
+        data = self.data
+        fields = self._fields
+        pieces = []
+        position = 0
+        growth = 0
+        # Growth of the message before every field, to find the shifted offsets
+        growth_before = [0] * (len(fields) + 1)
+        length_patches = []
+        for i, (field, payload) in enumerate(zip(fields, encoded)):
+            growth_before[i] = growth
+            if payload is None:
+                continue
+            pieces.append(data[position:field.value_offset])
+            pieces.append(payload)
+            pieces.append(b"\x00" * (-len(payload) % 4))
+            position = field.value_offset + field.padded_length
+            if len(payload) != field.length:
+                length_patches.append((field.header_offset + growth, field.value_offset - field.header_offset + len(payload)))
+            growth += ((len(payload) + 3) & ~3) - field.padded_length
+        growth_before[len(fields)] = growth
+        pieces.append(data[position:])
+        buffer = bytearray(b"".join(pieces))
+        for group in self._groups.values():
+            group_growth = growth_before[group.end_field] - growth_before[group.first_field]
+            if group_growth:
+                length_patches.append((group.header_offset + growth_before[group.first_field], group.length + group_growth))
+        for offset, length in length_patches:
+            # AVP length follows the 4-byte code and the flags byte
+            _set_length(buffer, offset + 5, length)
+        _set_length(buffer, 1, len(buffer))
+        return buffer
+
+    def new_message(self, hop_by_hop_id: int = 0, end_to_end_id: int = 0, **values) -> DiameterMessage:
+        """
+        Render a new message, wrapped for sending with the applications.
+
+        Args:
+            hop_by_hop_id (int, optional): Hop-by-hop identifier
+            end_to_end_id (int, optional): End-to-end identifier
+            **values: New value by field name
+
+        Returns:
+            DiameterMessage: The lazily decoded message
+        """
+        return DiameterMessage(self.render(hop_by_hop_id, end_to_end_id, **values))
+
+
+def _find_avp(data: bytes, position: int, end: int, code: int, vendor: int, occurrence: int) -> Optional[int]:
+    while position + 8 <= end:
+        avp_code, flags_length = _AVP_HEADER.unpack_from(data, position)
+        length = flags_length & _LENGTH_MASK
+        if avp_code == code:
+            avp_vendor = _VENDOR_ID.unpack_from(data, position + 8)[0] if flags_length >> 24 & AVP_FLAG_VENDOR else 0
+            if avp_vendor == vendor:
+                if occurrence == 0:
+                    return position
+                occurrence -= 1
+        position += (length + 3) & ~3
+    return None
+
+
+def _set_length(buffer: bytearray, offset: int, length: int):
+    """Write a 24-bit length field at offset."""
+    buffer[offset:offset + 3] = length.to_bytes(3, 'big')
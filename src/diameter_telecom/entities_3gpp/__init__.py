@@ -2,5 +2,6 @@ from .pcef import PCEF
 from .pcrf import PCRF
 from .af import AF
 from .dsc import DSC
+from .sharded_pcrf import ShardedPCRF
 
-__all__ = ["PCEF", "PCRF", "AF", "DSC"]
+__all__ = ["PCEF", "PCRF", "AF", "DSC", "ShardedPCRF"]
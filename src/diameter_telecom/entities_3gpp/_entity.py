@@ -2,6 +2,12 @@ from typing import *
 from diameter.message.constants import *
 from ..diameter.helpers import Node, Peer, create_node
 from ..diameter.app import *
+from ..diameter.recorder import TrafficRecorder
+from ..diameter.session.reaper import SessionReaper
+from ..diameter.session.binding import SessionBindings
+from ..diameter.snapshot import PeriodicSnapshot, write_snapshot, restore_snapshot
+from ..diameter.apn import APN
+from ..diameter.log import summarise_log_categories
 from ..carrier import Carrier
 import logging
 logger = logging.getLogger(__name__)
@@ -16,6 +22,8 @@ def node_peer_uri(node: Node):
 
 
 class DiameterEntity:
+    node_class: Type[Node] = Node
+
     def __init__(self, origin_host: str, realm_name: str,
                  ip_addresses: List[str],
                 #  port: int, sctp: bool = False,
@@ -27,7 +35,7 @@ class DiameterEntity:
         self.tcp_port = tcp_port
         self.sctp_port = sctp_port
         self.vendor_ids = vendor_ids
-        self.node: Node = create_node(origin_host, realm_name, ip_addresses, tcp_port, sctp_port, vendor_ids)
+        self.node: Node = create_node(origin_host, realm_name, ip_addresses, tcp_port, sctp_port, vendor_ids, node_class=self.node_class)
         #
         self.gx_app: GxApplication = None
         self.rx_app: RxApplication = None
@@ -35,6 +43,11 @@ class DiameterEntity:
         self.all_peers: Dict[str, List[Peer]] = {}
         self.all_realms: Dict[str, List[str]] = {}
         self.carrier: Carrier = None
+        self.recorder: TrafficRecorder = None
+        self.reaper: SessionReaper = None
+        self.bindings: SessionBindings = None
+        self.apns: Dict[str, APN] = {}
+        self.snapshots: PeriodicSnapshot = None
 
     @property
     def peer_uri(self):
@@ -74,11 +87,68 @@ class DiameterEntity:
         if self.sy_app and self.sy_peers:
             logger.info(f"Starting SyApplication in node {self.node.origin_host} with {len(self.sy_peers)} peers and {len(self.sy_realms)} realms. Realms: {self.sy_realms}")
             self.node.add_application(self.sy_app, self.sy_peers, self.sy_realms)
+        if self.recorder:
+            self.recorder.start()
+        if self.reaper:
+            self.reaper.start()
+        if self.snapshots:
+            self.snapshots.start()
         self.node.start()
 
     def stop(self):
         if self.node._started:
             self.node.stop()
+        if self.recorder:
+            self.recorder.stop()
+        if self.reaper:
+            self.reaper.stop()
+        if self.snapshots:
+            self.snapshots.stop()
+        if self.bindings:
+            self.bindings.stop()
+        summarise_log_categories()
+
+    def set_recorder(self, recorder: TrafficRecorder):
+        self.recorder = recorder
+        for app in (self.gx_app, self.rx_app, self.sy_app):
+            if app:
+                app.recorder = recorder
+
+    def set_reaper(self, reaper: SessionReaper):
+        self.reaper = reaper
+        for app in (self.gx_app, self.rx_app, self.sy_app):
+            if app:
+                reaper.attach(app)
+
+    def set_bindings(self, bindings: SessionBindings):
+        self.bindings = bindings
+        for app in (self.gx_app, self.rx_app, self.sy_app):
+            if app:
+                bindings.attach(app)
+
+    def set_worker_pool(self, min_workers: int = 1, max_workers: int = 64, **options):
+        # Adaptive request handler pools instead of max_threads, one per application
+        for app in (self.gx_app, self.rx_app, self.sy_app):
+            if app:
+                app.set_worker_pool(min_workers, max_workers, **options)
+
+    def set_overload_control(self, **options):
+        # Admission control for each application, with the same thresholds
+        for app in (self.gx_app, self.rx_app, self.sy_app):
+            if app:
+                app.set_overload_control(**options)
+
+    def add_apn(self, apn: APN):
+        self.apns[apn.apn] = apn
+
+    def snapshot(self, path: str) -> Dict[str, int]:
+        return write_snapshot(self, path)
+
+    def restore(self, path: str, background: bool = False):
+        return restore_snapshot(self, path, background=background)
+
+    def enable_snapshots(self, path: str, interval: float = 300):
+        self.snapshots = PeriodicSnapshot(self, path, interval)
 
     def wait_for_ready(self):
         for app in self.node.applications:
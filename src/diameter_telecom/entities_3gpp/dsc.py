@@ -4,8 +4,11 @@ from ._entity import DiameterEntity
 # from ..diameter.handle_request import handle_request_rx
 from diameter.message import Message
 from ..diameter.app import CustomSimpleThreadingApplication
+from ..diameter.log import LogCategory
 import logging
 logger = logging.getLogger(__name__)
+_routing_log = LogCategory("dsc.routing", logger, logging.INFO, rate=100)
+_routing_error_log = LogCategory("dsc.error", logger, logging.ERROR, rate=10)
 from ..diameter.constants import *
 from diameter.node.peer import PEER_READY_STATES
 import time
@@ -16,36 +19,36 @@ def handle_request_dsc(app: CustomSimpleThreadingApplication, message: Message):
     destination_host = message.destination_host
     destination_realm = message.destination_realm
     #
-    logger.info(f"Received message {message} from {origin_realm} to {destination_realm}")
+    _routing_log.log("Received message %s from %s to %s", message, origin_realm, destination_realm)
     message.route_record.append(origin_host)
     peer_list = []
     for peer in app.node.peers.values():
-        logger.debug(f"Checking peer {peer.node_name} with realm {peer.realm_name}")
+        logger.debug("Checking peer %s with realm %s", peer.node_name, peer.realm_name)
         if peer.realm_name.encode() == destination_realm:
             if peer.connection and peer.connection.state in PEER_READY_STATES:
                 peer_list.append(peer)
     
     if not peer_list:
-        logger.error(f"No available peers found for realm {destination_realm}")
+        _routing_error_log.log("No available peers found for realm %s", destination_realm)
         return False
         
-    logger.debug(f"Found {len(peer_list)} peers for realm {destination_realm}")
+    logger.debug("Found %d peers for realm %s", len(peer_list), destination_realm)
     peer = min(peer_list, key=lambda c: c.counters.requests)
-    logger.info(f"Selected peer {peer.node_name} for routing")
+    _routing_log.log("Selected peer %s for routing", peer.node_name)
     
     try:
         answer = app.node.send_message(peer.connection, message)
         answer = app.send_request(message)
         if answer:
-            logger.info(f"Received answer from {peer.node_name}")
+            _routing_log.log("Received answer from %s", peer.node_name)
             # Route the answer back to the original sender
             app.send_answer(answer)
             return True
         else:
-            logger.error(f"No answer received from {peer.node_name}")
+            _routing_error_log.log("No answer received from %s", peer.node_name)
             return False
     except Exception as e:
-        logger.error(f"Error routing message: {str(e)}")
+        _routing_error_log.log("Error routing message: %s", e)
         return False
 
 # def handle_request_dsc(app: CustomSimpleThreadingApplication, message: Message):
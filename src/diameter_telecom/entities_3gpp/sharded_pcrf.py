@@ -0,0 +1,771 @@
+"""
+Multi-process Sharded PCRF
+
+A `PCRF` is one process, so however many handler threads it has, request
+handling is bound to one core by the GIL. A `ShardedPCRF` spreads the sessions
+over `n_shards` worker processes instead:
+
+- The front process runs the `Node`: it terminates the peer connections
+  (CER/CEA, DWR/DWA) and routes each request to the shard owning its session,
+  as the bytes it received through a shared memory ring (`ShmRing`)
+- Each shard process keeps its own Gx, Rx and Sy applications and sessions,
+  handles the requests with the usual request handlers in an
+  `AdaptiveWorkerPool`, and writes the answers back through a second ring,
+  which the front sends to the peers as they are, without decoding them
+
+The shard of a Gx session is chosen by a hash of its Session-Id, or of its
+Framed-IP-Address or Framed-IPv6-Prefix (`partition`), when its CCR-I
+arrives; later requests of the session follow it. The front keeps a
+longest-prefix match index of the framed IPs of the Gx sessions, so an Rx
+request for a new session is routed to the shard of the Gx session of its UE
+address, where it is bound to it, and torn down with it. Sy sessions are
+placed by Session-Id.
+
+Requests sent by the PCRF itself (RAR, ASR) are not supported in this mode,
+since the shards have no peer connections. The configuration of the entity is
+passed to every shard: subscribers added to the front applications, worker
+pool settings, the timeouts and callbacks of a session reaper, and binding
+policies (TERMINATE_DROP only). Sessions expired by a shard are reported to the
+front, which stops routing them. Snapshots are written by each shard next to
+the snapshot of the front (`shard_snapshot_path`), and restored the same way.
+
+Example:
+    >>> pcrf = ShardedPCRF("pcrf.realm", "realm", ["127.0.0.1"], tcp_port=3868, n_shards=4)
+    >>> pcrf.add_peer(pcef)
+    >>> pcrf.start()
+    >>> pcrf.stats()
+    [{'shard': 0, 'gx_sessions': 2514, ...}, ...]
+"""
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from diameter.message import Message
+from diameter.node.peer import PeerConnection
+from diameter.message.constants import *
+from ..diameter.app import CustomSimpleThreadingApplication, GxApplication, RxApplication, SyApplication, AdaptiveWorkerPool
+from ..diameter.handle_request import handle_request_gx
+from ..diameter.helpers import Node
+from ..diameter.iptrie import IpPrefixIndex, parse_framed_ipv6_prefix, parse_ip_address
+from ..diameter.message import DiameterMessage
+from ..diameter.pcap import _DiameterStream
+from ..diameter.session import RxSession, SessionBindings, SessionReaper
+from ..diameter.session.binding import TERMINATE_DROP
+from ..diameter.session.registry import ShardedDict
+from ..diameter.shm_ring import ShmRing
+from ..diameter.snapshot import PeriodicSnapshot, _pack_subscriber, _unpack_subscriber, restore_snapshot, write_snapshot
+from ..subscriber import Subscriber
+from .pcrf import PCRF
+import json
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+PARTITION_SESSION_ID = "session_id"
+PARTITION_FRAMED_IP = "framed_ip"
+
+_PARTITIONS = (PARTITION_SESSION_ID, PARTITION_FRAMED_IP)
+
+DEFAULT_RING_SIZE = 8 << 20
+
+# Control records start with a zero byte, Diameter messages with their version
+_CONTROL = 0
+_STOP = b"\x00stop"
+_STATS = b"\x00stats"
+_SUBSCRIBER = b"\x00subscriber"
+_SNAPSHOT = b"\x00snapshot"
+_RESTORE = b"\x00restore"
+# Records of the shards to the front, besides the JSON replies
+_OWNERS = b"\x00owners"
+_RELEASED = b"\x00released"
+_OWNERS_BATCH = 1024
+
+_U32 = struct.Struct(">I")
+# Command flags and code, Application-Id, Hop-by-Hop and End-to-End Identifiers
+_IDENTIFIERS = struct.Struct(">IIII")
+_FLAG_REQUEST = 0x80000000
+
+
+def shard_snapshot_path(path: str, index: int) -> str:
+    """
+    Snapshot file of the sessions of a shard, next to the snapshot of the front.
+    """
+    return f"{path}.shard{index}"
+
+
+def _error_answer(message: Message, result_code: int) -> Message:
+    answer = message.to_answer()
+    if hasattr(message, 'session_id'):
+        answer.session_id = message.session_id
+    answer.origin_host = message.destination_host
+    answer.origin_realm = message.destination_realm
+    answer.result_code = result_code
+    return answer
+
+
+class PcrfShard:
+    """
+    Applications and sessions of one shard, in its worker process.
+
+    It is the entity written and restored by the snapshot functions, and
+    reports the sessions it restores or expires to the front, which routes
+    their requests.
+    """
+
+    def __init__(self, index: int, answers: ShmRing, gx_request_handler: Callable,
+                 rx_request_handler: Optional[Callable] = None, sy_request_handler: Optional[Callable] = None,
+                 binding_policies: Optional[Dict[int, str]] = None, reaper_options: Optional[Dict[str, Any]] = None):
+        self.index = index
+        self.answers = answers
+        self.origin_host = f"shard-{index}"
+        self.carrier = None
+        self.apns = {}
+        self.gx_app = GxApplication(request_handler=gx_request_handler)
+        self.rx_app = RxApplication(request_handler=rx_request_handler) if rx_request_handler else None
+        self.sy_app = SyApplication(request_handler=sy_request_handler) if sy_request_handler else None
+        self.applications = {app.application_id: app for app in (self.gx_app, self.rx_app, self.sy_app) if app}
+        # The Rx and Sy sessions of a Gx session are in the same shard, and
+        # are dropped along with it
+        self.bindings = SessionBindings(background=False)
+        for app in self.applications.values():
+            self.bindings.attach(app)
+        for application_id, policy in (binding_policies or {}).items():
+            self.bindings.set_policy(application_id, policy)
+        self.reaper: Optional[SessionReaper] = None
+        self._released: List[str] = []
+        self._released_lock = threading.Lock()
+        if reaper_options is not None:
+            options = dict(reaper_options)
+            callbacks = options.pop("callbacks", ())
+            self.reaper = SessionReaper(**options)
+            for callback in callbacks:
+                self.reaper.add_callback(callback)
+            self.reaper.add_callback(self._reaped)
+            for app in self.applications.values():
+                self.reaper.attach(app)
+
+    def handle(self, data: bytes):
+        message = Message.from_bytes(data)
+        app = self.applications.get(message.header.application_id)
+        if app is None:
+            answer = _error_answer(message, E_RESULT_CODE_DIAMETER_APPLICATION_UNSUPPORTED)
+        else:
+            try:
+                answer = app.handle_request(message)
+            except Exception as e:
+                logger.warning(f"Shard {self.index} message handling failed: {e!r}")
+                answer = _error_answer(message, E_RESULT_CODE_DIAMETER_UNABLE_TO_COMPLY)
+            if app is self.rx_app and answer is not None:
+                self._bind_rx_session(message, answer)
+        if answer is not None:
+            self.answers.put_wait(answer.as_bytes())
+
+    def add_subscriber(self, record: bytes):
+        # A subscriber added to a front application, for its application here
+        application_id = _U32.unpack_from(record, len(_SUBSCRIBER))[0]
+        app = self.applications.get(application_id)
+        if app is not None:
+            app.add_subscriber(_unpack_subscriber(record[len(_SUBSCRIBER) + _U32.size:]))
+
+    def snapshot(self, path: str) -> Dict[str, int]:
+        return write_snapshot(self, path)
+
+    def restore(self, path: str) -> Dict[str, int]:
+        # Sessions restored from the snapshot of this shard, whose requests
+        # the front must route here
+        if not os.path.exists(path):
+            logger.warning(f"Shard {self.index} has no snapshot {path} to restore")
+            return {"sessions": 0, "subscribers": 0, "apns": 0}
+        counts = restore_snapshot(self, path)
+        owners = []
+        for app in self.applications.values():
+            for session_id, session in app.sessions.iter_items():
+                owners.append((session_id, app.application_id,
+                               getattr(session, 'framed_ip_address', None), getattr(session, 'framed_ipv6_prefix', None)))
+                if len(owners) == _OWNERS_BATCH:
+                    self.answers.put_wait(_OWNERS + pickle.dumps((self.index, owners)))
+                    owners = []
+        if owners:
+            self.answers.put_wait(_OWNERS + pickle.dumps((self.index, owners)))
+        return counts
+
+    def flush_released(self):
+        # Sessions expired here, which the front no longer needs to route
+        with self._released_lock:
+            released, self._released = self._released, []
+        if released:
+            self.answers.put_wait(_RELEASED + json.dumps(released).encode())
+
+    def _reaped(self, application, session, reason: str):
+        # Called before the session is removed, with the sessions bound to it
+        released = [session.session_id]
+        if application is self.gx_app:
+            released.extend(session_id for _, session_id in self.bindings.dependents(session.session_id))
+        with self._released_lock:
+            self._released.extend(released)
+
+    def _bind_rx_session(self, request: Message, answer: Message):
+        # An Rx session accepted by the handler without creating it, for the
+        # UE address of a Gx session of this shard
+        session_id = request.session_id
+        if getattr(answer, 'result_code', None) != E_RESULT_CODE_DIAMETER_SUCCESS or self.rx_app.get_session_by_id(session_id):
+            return
+        gx_session = None
+        framed_ip_address = getattr(request, 'framed_ip_address', None)
+        framed_ipv6_prefix = getattr(request, 'framed_ipv6_prefix', None)
+        if framed_ip_address:
+            gx_session = self.gx_app.get_session_by_framed_ip_address(framed_ip_address)
+        if not gx_session and framed_ipv6_prefix:
+            gx_session = self.gx_app.get_session_by_framed_ipv6_prefix(framed_ipv6_prefix)
+        if not gx_session:
+            return
+        rx_session = RxSession(session_id, gx_session_id=gx_session.session_id, subscriber=gx_session.subscriber)
+        for message in (request, answer):
+            diameter_message = DiameterMessage(message)
+            diameter_message.timestamp = time.time()
+            rx_session.add_message(diameter_message)
+        self.rx_app.add_session(rx_session)
+
+    def stats(self, pool: AdaptiveWorkerPool) -> Dict[str, float]:
+        stats = {"shard": self.index, "pid": os.getpid()}
+        for name, app in (("gx", self.gx_app), ("rx", self.rx_app), ("sy", self.sy_app)):
+            if app:
+                stats[f"{name}_sessions"] = len(app.sessions)
+                stats[f"{name}_subscribers"] = len(app.subscribers)
+        if self.reaper is not None:
+            stats["reaped_idle"] = self.reaper.n_reaped_idle
+            stats["reaped_absolute"] = self.reaper.n_reaped_absolute
+        stats.update(pool.metrics())
+        return stats
+
+
+def _run_shard(index: int, requests_name: str, answers_name: str, gx_request_handler: Callable,
+               rx_request_handler: Optional[Callable], sy_request_handler: Optional[Callable],
+               pool_options: Dict[str, Any], subscribers: List[bytes],
+               binding_policies: Dict[int, str], reaper_options: Optional[Dict[str, Any]]):
+    # Main of a shard process
+    requests = ShmRing.attach(requests_name)
+    answers = ShmRing.attach(answers_name)
+    shard = PcrfShard(index, answers, gx_request_handler, rx_request_handler, sy_request_handler,
+                      binding_policies, reaper_options)
+    for record in subscribers:
+        shard.add_subscriber(record)
+    pool = AdaptiveWorkerPool(shard.handle, name=f"PcrfShard-{index}", **pool_options)
+    pool.start()
+    if shard.reaper is not None:
+        shard.reaper.start()
+    parent = multiprocessing.parent_process()
+    try:
+        while True:
+            records = requests.get_wait(1.0)
+            if not records and parent is not None and not parent.is_alive():
+                logger.warning(f"Shard {index} exiting, the front process is gone")
+                return
+            for data in records:
+                if data[0] != _CONTROL:
+                    pool.submit(data)
+                elif data.startswith(_SUBSCRIBER):
+                    shard.add_subscriber(data)
+                elif data == _STATS:
+                    answers.put_wait(b"\x00" + json.dumps(shard.stats(pool)).encode())
+                elif data.startswith(_SNAPSHOT):
+                    # Written aside, while the requests are handled
+                    threading.Thread(target=_snapshot_shard, args=(shard, data[len(_SNAPSHOT):].decode()),
+                                     name=f"PcrfShard-{index}-snapshot", daemon=True).start()
+                elif data.startswith(_RESTORE):
+                    # Restored before the requests queued after it are handled
+                    reply = data[len(_RESTORE)]
+                    counts = shard.restore(data[len(_RESTORE) + 1:].decode())
+                    if reply:
+                        answers.put_wait(b"\x00" + json.dumps({"shard": index, "restored": counts}).encode())
+                elif data == _STOP:
+                    return
+            shard.flush_released()
+    finally:
+        # Queued requests are still answered
+        if shard.reaper is not None:
+            shard.reaper.stop()
+        pool.stop()
+        while pool.size:
+            time.sleep(0.01)
+        requests.close()
+        answers.close()
+
+
+def _snapshot_shard(shard: PcrfShard, path: str):
+    try:
+        counts = shard.snapshot(path)
+    except Exception as e:
+        logger.error(f"Snapshot of shard {shard.index} to {path} failed: {e!r}")
+        counts = None
+    shard.answers.put_wait(b"\x00" + json.dumps({"shard": shard.index, "snapshot": counts}).encode())
+
+
+class ShardFrontNode(Node):
+    """
+    Node of the front process, keeping the bytes of the requests it reads.
+
+    The decoded command classes do not keep their encoding, and encoding them
+    again costs several times their decoding, so each request is forwarded to
+    its shard as it was read from its peer connection.
+
+    Attributes:
+        max_received (int): Requests kept at most until they are forwarded,
+            the oldest are dropped first, e.g. when the node answered them itself
+    """
+
+    def __init__(self, *args, max_received: int = 65536, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_received = max_received
+        self._received: OrderedDict[Tuple[int, int], bytes] = OrderedDict()
+        self._received_lock = threading.Lock()
+
+    def _add_peer_connection(self, conn: PeerConnection, peer_socket, proto: int) -> Optional[str]:
+        ident = super()._add_peer_connection(conn, peer_socket, proto)
+        if ident is not None:
+            stream = _DiameterStream()
+            add_in_bytes = conn.add_in_bytes
+
+            def read(read_bytes: bytes):
+                # Framed here before the connection decodes them in its own thread
+                self._keep(stream.feed(read_bytes))
+                add_in_bytes(read_bytes)
+
+            conn.add_in_bytes = read
+        return ident
+
+    def _keep(self, pdus: List[memoryview]):
+        for pdu in pdus:
+            flags_command, application_id, hop_by_hop, end_to_end = _IDENTIFIERS.unpack_from(pdu, 4)
+            # Base protocol requests (CER, DWR, DPR) are handled by the node itself
+            if not flags_command & _FLAG_REQUEST or application_id == 0:
+                continue
+            with self._received_lock:
+                self._received[(hop_by_hop, end_to_end)] = bytes(pdu)
+                if len(self._received) > self.max_received:
+                    self._received.popitem(last=False)
+
+    def pop_received(self, message: Message) -> Optional[bytes]:
+        """
+        Take the bytes a request was decoded from.
+
+        Args:
+            message (Message): A request received by an application of the node
+
+        Returns:
+            Optional[bytes]: The request as read, or None if it was not kept
+        """
+        header = message.header
+        with self._received_lock:
+            data = self._received.pop((header.hop_by_hop_identifier, header.end_to_end_identifier), None)
+        if data is None or _U32.unpack_from(data, 4)[0] & 0x00ffffff != header.command_code:
+            return None
+        return data
+
+
+class ShardFrontApplication(CustomSimpleThreadingApplication):
+    """
+    Application of the front process, handing its requests to the shards.
+    """
+
+    def __init__(self, application_id: int, router: 'ShardRouter'):
+        super().__init__(application_id=application_id, is_acct_application=False, is_auth_application=True, max_threads=1, request_handler=None)
+        self.router = router
+
+    def receive_request(self, message: Message):
+        data = self.node.pop_received(message) if isinstance(self.node, ShardFrontNode) else None
+        if self.recorder:
+            self.recorder.record(message if data is None else data, inbound=True)
+        if self.overload and not self._admit(message):
+            return
+        self.router.forward(self, message, data)
+
+    def add_subscriber(self, subscriber: Subscriber):
+        # The sessions of the subscriber may be in any shard
+        super().add_subscriber(subscriber)
+        self.router.add_subscriber(self.application_id, subscriber)
+
+
+class ShardRouter:
+    """
+    Session ownership and rings of the shards, in the front process.
+
+    Attributes:
+        n_shards (int): Number of shard processes
+        partition (str): `PARTITION_SESSION_ID` or `PARTITION_FRAMED_IP`
+        ring_timeout (float): Seconds to wait for room in a full ring before
+            answering DIAMETER_TOO_BUSY
+    """
+
+    def __init__(self, n_shards: int, partition: str = PARTITION_SESSION_ID,
+                 ring_size: int = DEFAULT_RING_SIZE, ring_timeout: float = 1.0):
+        if n_shards < 1:
+            raise ValueError(f"n_shards must be positive. Provided: {n_shards}")
+        if partition not in _PARTITIONS:
+            raise ValueError(f"Invalid partition {partition}. Must be one of {_PARTITIONS}")
+        self.n_shards = n_shards
+        self.partition = partition
+        self.ring_timeout = ring_timeout
+        self.applications: Dict[int, ShardFrontApplication] = {}
+        self.request_rings = [ShmRing.create(ring_size) for _ in range(n_shards)]
+        self.answer_rings = [ShmRing.create(ring_size) for _ in range(n_shards)]
+        # Shard of each session, and framed IPs of each Gx session
+        self._owners: ShardedDict[str, int] = ShardedDict()
+        self._framed_ips: ShardedDict[str, Tuple[Optional[bytes], Optional[bytes]]] = ShardedDict()
+        self._by_framed_ip_address = IpPrefixIndex(parse_ip_address)
+        self._by_framed_ipv6_prefix = IpPrefixIndex(parse_framed_ipv6_prefix)
+        self._replies: queue.Queue = queue.Queue()
+        self._requests_lock = threading.Lock()
+        self._collectors: List[threading.Thread] = []
+        self._stopped = threading.Event()
+        # Subscribers added before start, passed to the shard processes as they are spawned
+        self.subscribers: List[bytes] = []
+        self._started = False
+
+    def add_application(self, application_id: int) -> ShardFrontApplication:
+        app = ShardFrontApplication(application_id, self)
+        self.applications[application_id] = app
+        return app
+
+    def add_subscriber(self, application_id: int, subscriber: Subscriber):
+        record = _SUBSCRIBER + _U32.pack(application_id) + _pack_subscriber(subscriber)
+        if not self._started:
+            self.subscribers.append(record)
+            return
+        for index, ring in enumerate(self.request_rings):
+            if not ring.put_wait(record, self.ring_timeout):
+                raise TimeoutError(f"Shard {index} is too busy to add subscriber {subscriber.msisdn}")
+
+    def shard_of_key(self, key: bytes) -> int:
+        return zlib.crc32(key) % self.n_shards
+
+    def shard(self, session_id: str) -> Optional[int]:
+        return self._owners.get(session_id)
+
+    def gx_session_id(self, ip_address) -> Optional[str]:
+        """
+        Session-Id of the Gx session of a UE address or prefix, in any shard.
+        """
+        parsed = parse_ip_address(ip_address)
+        if parsed is not None and parsed[0] == 4:
+            return self._by_framed_ip_address.get(ip_address)
+        return self._by_framed_ipv6_prefix.get(ip_address)
+
+    def route(self, message: Message) -> int:
+        session_id = message.session_id
+        shard = self._owners.get(session_id)
+        application_id = message.header.application_id
+        if application_id == APP_3GPP_GX:
+            if shard is None:
+                shard = self._place_gx_session(message)
+            if getattr(message, 'cc_request_type', None) == E_CC_REQUEST_TYPE_TERMINATION_REQUEST:
+                self._release(session_id)
+            return shard
+        if shard is None:
+            shard = self._place(message)
+        if message.header.command_code == CMD_SESSION_TERMINATION:
+            self._release(session_id)
+        return shard
+
+    def _place_gx_session(self, message: Message) -> int:
+        session_id = message.session_id
+        framed_ip_address = getattr(message, 'framed_ip_address', None)
+        framed_ipv6_prefix = getattr(message, 'framed_ipv6_prefix', None)
+        key = None
+        if self.partition == PARTITION_FRAMED_IP:
+            key = framed_ip_address or framed_ipv6_prefix
+        shard = self.shard_of_key(key or session_id.encode())
+        self._own_gx_session(session_id, shard, framed_ip_address, framed_ipv6_prefix)
+        return shard
+
+    def _own_gx_session(self, session_id: str, shard: int, framed_ip_address, framed_ipv6_prefix):
+        self._owners[session_id] = shard
+        if framed_ip_address or framed_ipv6_prefix:
+            self._framed_ips[session_id] = (framed_ip_address, framed_ipv6_prefix)
+            if framed_ip_address:
+                self._by_framed_ip_address[framed_ip_address] = session_id
+            if framed_ipv6_prefix:
+                self._by_framed_ipv6_prefix[framed_ipv6_prefix] = session_id
+
+    def adopt(self, shard: int, owners: List[tuple]):
+        """
+        Route the requests of sessions restored by a shard to it.
+
+        Args:
+            shard (int): The shard
+            owners (List[tuple]): Session-Id, Application-Id, and for Gx
+                sessions their Framed-IP-Address and Framed-IPv6-Prefix
+        """
+        for session_id, application_id, framed_ip_address, framed_ipv6_prefix in owners:
+            if application_id == APP_3GPP_GX:
+                self._own_gx_session(session_id, shard, framed_ip_address, framed_ipv6_prefix)
+            else:
+                self._owners[session_id] = shard
+
+    def _place(self, message: Message) -> int:
+        # Rx sessions go to the shard of the Gx session of their UE address
+        session_id = message.session_id
+        gx_session_id = None
+        framed_ip_address = getattr(message, 'framed_ip_address', None)
+        framed_ipv6_prefix = getattr(message, 'framed_ipv6_prefix', None)
+        if framed_ip_address:
+            gx_session_id = self._by_framed_ip_address.get(framed_ip_address)
+        if gx_session_id is None and framed_ipv6_prefix:
+            gx_session_id = self._by_framed_ipv6_prefix.get(framed_ipv6_prefix)
+        shard = self._owners.get(gx_session_id) if gx_session_id is not None else None
+        if shard is None:
+            shard = self.shard_of_key(session_id.encode())
+        self._owners[session_id] = shard
+        return shard
+
+    def _release(self, session_id: str):
+        self._owners.pop(session_id, None)
+        framed_ips = self._framed_ips.pop(session_id, None)
+        if framed_ips is not None:
+            framed_ip_address, framed_ipv6_prefix = framed_ips
+            if framed_ip_address:
+                self._by_framed_ip_address.pop_if(framed_ip_address, session_id)
+            if framed_ipv6_prefix:
+                self._by_framed_ipv6_prefix.pop_if(framed_ipv6_prefix, session_id)
+
+    def forward(self, app: ShardFrontApplication, message: Message, data: Optional[bytes] = None):
+        """
+        Hand a request to the shard owning its session.
+
+        Args:
+            app (ShardFrontApplication): The application that received it
+            message (Message): The decoded request
+            data (bytes, optional): The request as received, encoded again
+                from `message` if not given
+        """
+        try:
+            shard = self.route(message)
+        except Exception as e:
+            logger.warning(f"Could not route request to a shard: {e!r}")
+            app.send_answer(app.generate_answer(message, result_code=E_RESULT_CODE_DIAMETER_UNABLE_TO_COMPLY))
+            return
+        if data is None:
+            data = message.as_bytes()
+        if not self.request_rings[shard].put_wait(data, self.ring_timeout):
+            app.send_answer(app.generate_answer(
+                message, result_code=E_RESULT_CODE_DIAMETER_TOO_BUSY,
+                error_message="Insufficient resources to handle the request"))
+
+    def start(self):
+        self._started = True
+        self._stopped.clear()
+        for index in range(self.n_shards):
+            collector = threading.Thread(target=self._collect, args=(index,), name=f"ShardRouter-{index}", daemon=True)
+            collector.start()
+            self._collectors.append(collector)
+
+    def stop(self):
+        self._stopped.set()
+        for collector in self._collectors:
+            collector.join(2)
+        self._collectors.clear()
+
+    def close(self):
+        for ring in self.request_rings + self.answer_rings:
+            ring.close()
+
+    def _collect(self, index: int):
+        ring = self.answer_rings[index]
+        while not self._stopped.is_set():
+            for data in ring.get_wait(0.5):
+                if data[0] == _CONTROL:
+                    if data.startswith(_OWNERS):
+                        self.adopt(*pickle.loads(data[len(_OWNERS):]))
+                    elif data.startswith(_RELEASED):
+                        for session_id in json.loads(data[len(_RELEASED):]):
+                            self._release(session_id)
+                    else:
+                        self._replies.put(json.loads(data[1:]))
+                    continue
+                # Sent as encoded by the shard, never decoded here
+                answer = DiameterMessage(data)
+                app = self.applications.get(answer.header.application_id)
+                if app is None:
+                    logger.warning(f"No application {answer.header.application_id} for answer from shard {index}")
+                    continue
+                try:
+                    app.send_answer(answer)
+                except Exception as e:
+                    logger.warning(f"Could not send answer from shard {index}: {e!r}")
+
+    def stats(self, timeout: float = 5) -> List[Dict[str, float]]:
+        return self.request_all([_STATS] * self.n_shards, timeout)
+
+    def request_all(self, records: List[bytes], timeout: Optional[float] = 5) -> List[Dict[str, Any]]:
+        """
+        Send a control record to each shard and wait for their replies.
+
+        Args:
+            records (List[bytes]): The record of each shard
+            timeout (float, optional): Seconds to wait for the replies, None
+                to wait for all of them
+
+        Returns:
+            List[Dict[str, Any]]: The replies received in time, by shard
+        """
+        with self._requests_lock:
+            for ring, record in zip(self.request_rings, records):
+                ring.put_wait(record, timeout)
+            replies = []
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while len(replies) < self.n_shards:
+                try:
+                    replies.append(self._replies.get(timeout=None if deadline is None else max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+        return sorted(replies, key=lambda reply: reply["shard"])
+
+
+class ShardedPCRF(PCRF):
+    node_class = ShardFrontNode
+
+    def __init__(self, origin_host: str, realm_name: str,
+                 ip_addresses: List[str],
+                 tcp_port: int = None, sctp_port: int = None,
+                 vendor_ids: List[int] = None,
+                 n_shards: int = None,
+                 partition: str = PARTITION_SESSION_ID,
+                 request_handler: Callable = handle_request_gx,
+                 rx_request_handler: Callable = None,
+                 sy_request_handler: Callable = None,
+                 min_workers: int = 1, max_workers: int = 4,
+                 ring_size: int = DEFAULT_RING_SIZE):
+        # Handlers must be importable functions, as they are passed to the shard processes
+        super().__init__(origin_host=origin_host, realm_name=realm_name, ip_addresses=ip_addresses, tcp_port=tcp_port, sctp_port=sctp_port, vendor_ids=vendor_ids)
+        self.router = ShardRouter(n_shards or os.cpu_count() or 1, partition, ring_size)
+        self.gx_app = self.router.add_application(APP_3GPP_GX)
+        if rx_request_handler:
+            self.rx_app = self.router.add_application(APP_3GPP_RX)
+        if sy_request_handler:
+            self.sy_app = self.router.add_application(APP_3GPP_SY)
+        self._handlers = (request_handler, rx_request_handler, sy_request_handler)
+        self._pool_options: Dict[str, Any] = {"min_workers": min_workers, "max_workers": max_workers}
+        self._binding_policies: Dict[int, str] = {}
+        self._reaper_options: Optional[Dict[str, Any]] = None
+        self.processes: List[multiprocessing.Process] = []
+
+    @property
+    def n_shards(self) -> int:
+        return self.router.n_shards
+
+    def start(self):
+        # Shards are spawned before the node threads start, with the
+        # subscribers added so far; later ones reach them through the rings
+        subscribers = list(self.router.subscribers)
+        self.router.start()
+        context = multiprocessing.get_context("spawn")
+        for index in range(self.n_shards):
+            process = context.Process(
+                target=_run_shard, name=f"PcrfShard-{index}", daemon=True,
+                args=(index, self.router.request_rings[index].name, self.router.answer_rings[index].name,
+                      *self._handlers, self._pool_options, subscribers, self._binding_policies, self._reaper_options))
+            process.start()
+            self.processes.append(process)
+        super().start()
+
+    def stop(self):
+        super().stop()
+        for ring in self.router.request_rings:
+            ring.put_wait(_STOP, 5)
+        for process in self.processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+        self.processes.clear()
+        self.router.stop()
+        self.router.close()
+
+    def stats(self, timeout: float = 5) -> List[Dict[str, float]]:
+        # Sessions and worker pool metrics of each shard
+        return self.router.stats(timeout)
+
+    def get_gx_session_id(self, ip_address) -> Optional[str]:
+        return self.router.gx_session_id(ip_address)
+
+    def set_worker_pool(self, min_workers: int = 1, max_workers: int = 64, **options):
+        # Pools of the shard processes, the front applications only forward requests
+        self._before_start("worker pools")
+        self._pool_options = {"min_workers": min_workers, "max_workers": max_workers, **options}
+
+    def set_reaper(self, reaper: SessionReaper):
+        # Each shard runs a reaper with the same timeouts and callbacks, which
+        # must be importable functions; reaped sessions are counted in stats()
+        self._before_start("reaper")
+        self._reaper_options = {"idle_timeout": reaper.idle_timeout, "absolute_timeout": reaper.absolute_timeout,
+                                "resolution": reaper._wheel.resolution, "interval": reaper.interval,
+                                "callbacks": list(reaper.callbacks)}
+
+    def set_bindings(self, bindings: SessionBindings):
+        # Each shard binds its Rx and Sy sessions to its Gx sessions, with the
+        # termination policies of these bindings
+        self._before_start("bindings")
+        for application_id, policy in bindings.policies.items():
+            if policy != TERMINATE_DROP:
+                raise ValueError(f"The shards of a ShardedPCRF have no peer connections to send a {policy.upper()}. "
+                                 f"Only {TERMINATE_DROP} is supported, provided for application {application_id}: {policy}")
+        self._binding_policies = dict(bindings.policies)
+
+    def snapshot(self, path: str, timeout: Optional[float] = 300) -> Dict[str, int]:
+        """
+        Write the state of the front (APNs, carrier and subscribers) to `path`,
+        and the sessions of each shard to `shard_snapshot_path(path, index)`.
+        """
+        counts = write_snapshot(self, path)
+        replies = self.router.request_all([_SNAPSHOT + shard_snapshot_path(path, index).encode() for index in range(self.n_shards)], timeout)
+        if len(replies) != self.n_shards or any(reply["snapshot"] is None for reply in replies):
+            raise RuntimeError(f"Snapshot of {len(replies)} of {self.n_shards} shards to {path} completed")
+        for reply in replies:
+            for name, count in reply["snapshot"].items():
+                counts[name] += count
+        return counts
+
+    def restore(self, path: str, background: bool = False, timeout: Optional[float] = None):
+        """
+        Restore a snapshot written by `snapshot`.
+
+        Each shard restores its sessions before handling the requests queued
+        after the restore, and reports them to the front so their requests are
+        routed to it. Before `start`, the shards restore as they start.
+
+        Returns:
+            Dict[str, int] or threading.Thread: Number of records restored by
+                kind, or the thread waiting for the shards if `background`, or
+                only the front records if the shards were not started yet
+        """
+        counts = restore_snapshot(self, path)
+        reply = 1 if self.processes else 0
+        records = [_RESTORE + bytes([reply]) + shard_snapshot_path(path, index).encode() for index in range(self.n_shards)]
+        if not reply:
+            for ring, record in zip(self.router.request_rings, records):
+                ring.put_wait(record)
+            return counts
+
+        def wait() -> Dict[str, int]:
+            for reply in self.router.request_all(records, timeout):
+                for name, count in reply["restored"].items():
+                    counts[name] += count
+            return counts
+        if not background:
+            return wait()
+        thread = threading.Thread(target=wait, name=f"SnapshotRestore-{self.origin_host}", daemon=True)
+        thread.start()
+        return thread
+
+    def enable_snapshots(self, path: str, interval: float = 300):
+        self.snapshots = PeriodicSnapshot(self, path, interval, write=ShardedPCRF.snapshot)
+
+    def _before_start(self, what: str):
+        if self.processes:
+            raise ValueError(f"The {what} of a ShardedPCRF must be set before it starts")
@@ -2,20 +2,45 @@
 from ..diameter.message import DiameterMessage
 from ..diameter.app import GxApplication, RxApplication
 from ..diameter.constants import APP_3GPP_GX, APP_3GPP_RX
-from ..diameter.session import GxSession, RxSession
+from ..diameter.session import GxSession, RxSession, SessionBindings
 import logging
 logger = logging.getLogger(__name__)
 import time
 
 class VoiceService:
-    def __init__(self, gx_app: GxApplication, rx_app: RxApplication):
+    def __init__(self, gx_app: GxApplication, rx_app: RxApplication, bindings: SessionBindings = None):
         self.gx_app: GxApplication = gx_app
         self.rx_app: RxApplication = rx_app
+        # Rx sessions are bound to their Gx session, and torn down with it
+        self.bindings: SessionBindings = bindings or gx_app.bindings or rx_app.bindings or SessionBindings()
+        for app in (gx_app, rx_app):
+            if app.bindings is not self.bindings:
+                self.bindings.attach(app)
+
+    def get_rx_sessions(self, gx_session_id: str):
+        return self.rx_app.get_sessions_by_gx_session_id(gx_session_id)
+
+    def terminate(self, gx_session_id: str, policy: str = None) -> int:
+        # Terminates the Rx sessions bound to a Gx session
+        return self.bindings.terminate(gx_session_id, policy)
 
     def send_request(self, request: DiameterMessage, timeout=5) -> DiameterMessage:
+        app = self._prepare_request(request)
+        answer: DiameterMessage = app.send_request_custom(request, timeout)
+        logger.debug(f"Got answer: {answer}")
+        return answer
+
+    async def send_request_async(self, request: DiameterMessage, timeout=5) -> DiameterMessage:
+        # With an AsyncGxApplication and an AsyncRxApplication
+        app = self._prepare_request(request)
+        answer: DiameterMessage = await app.send_request_custom(request, timeout)
+        logger.debug(f"Got answer: {answer}")
+        return answer
+
+    def _prepare_request(self, request: DiameterMessage):
+        # Creates and binds the session of the request, returns the application to send it with
         request.timestamp = time.time()
         session_id = request.session_id
-        answer = None
         if request.app_id == APP_3GPP_GX:
             gx_session = self.gx_app.get_session_by_id(session_id)
             if not gx_session:
@@ -23,30 +48,33 @@ class VoiceService:
                 gx_session.add_message(request)
                 self.gx_app.add_session(gx_session)
             logger.debug(f"Sending Gx request: {request}")
-            answer: DiameterMessage = self.gx_app.send_request_custom(request, timeout)
+            return self.gx_app
         elif request.app_id == APP_3GPP_RX:
             rx_session = self.rx_app.get_session_by_id(session_id)
             if not rx_session:
                 logger.debug(f"No rx_session found for session_id: {session_id}. Will create a new one")
                 gx_session = None
-                if request.message.framed_ip_address:
-                    logger.debug(f"Request has framed_ip_address: {request.message.framed_ip_address}. Will try to find gx_session by framed_ip_address")
-                    gx_session = self.gx_app.get_session_by_framed_ip_address(request.message.framed_ip_address)
+                framed_ip = request.message.framed_ip_address or request.message.framed_ipv6_prefix
+                if framed_ip:
+                    if request.message.framed_ip_address:
+                        logger.debug(f"Request has framed_ip_address: {request.message.framed_ip_address}. Will try to find gx_session by framed_ip_address")
+                        gx_session = self.gx_app.get_session_by_framed_ip_address(request.message.framed_ip_address)
+                    if not gx_session and request.message.framed_ipv6_prefix:
+                        # Matched against the prefixes of the Gx sessions
+                        logger.debug(f"Request has framed_ipv6_prefix: {request.message.framed_ipv6_prefix}. Will try to find gx_session by framed_ipv6_prefix")
+                        gx_session = self.gx_app.get_session_by_framed_ipv6_prefix(request.message.framed_ipv6_prefix)
                     if gx_session:
                         logger.debug(f"Found gx_session that rx_session is bind to: {gx_session}")
                         rx_session = RxSession(session_id, gx_session_id=gx_session.session_id, subscriber=gx_session.subscriber)
                     else:
-                        logger.debug(f"No gx_session found for framed_ip_address: {request.message.framed_ip_address}. Will create a new rx_session")
+                        logger.debug(f"No gx_session found for framed IP: {framed_ip}. Will create a new rx_session")
                         rx_session = RxSession(session_id)
                     rx_session.add_message(request)
                     self.rx_app.add_session(rx_session)
             logger.info(f"Found rx_session: {rx_session}")
             logger.debug(f"Sending Rx request: {request}")
-            answer: DiameterMessage = self.rx_app.send_request_custom(request, timeout)
-        else:
-            raise ValueError(f"Invalid app_id: {request.app_id}")
-        logger.debug(f"Got answer: {answer}")
-        return answer
+            return self.rx_app
+        raise ValueError(f"Invalid app_id: {request.app_id}")
 
     def start(self):
         if not self.gx_app.node._started:
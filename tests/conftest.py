@@ -0,0 +1,75 @@
+import itertools
+import os
+import queue
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from diameter.message.avp.grouped import SubscriptionId
+from diameter.message.commands import CreditControlAnswer, CreditControlRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+
+# Message builders shared by the test modules
+
+SESSION_ID = "pcef.realm;1;1"
+
+
+def ccr(request_type: int, number: int, hop_by_hop_id: int) -> CreditControlRequest:
+    request = CreditControlRequest()
+    request.header.application_id = APP_3GPP_GX
+    request.header.hop_by_hop_identifier = hop_by_hop_id
+    request.header.end_to_end_identifier = hop_by_hop_id
+    request.session_id = SESSION_ID
+    request.origin_host = b"pcef.realm"
+    request.origin_realm = b"realm"
+    request.destination_realm = b"realm"
+    request.auth_application_id = APP_3GPP_GX
+    request.cc_request_type = request_type
+    request.cc_request_number = number
+    request.subscription_id = [SubscriptionId(subscription_id_type=E_SUBSCRIPTION_ID_TYPE_END_USER_E164,
+                                              subscription_id_data="5511900000001")]
+    if request_type == E_CC_REQUEST_TYPE_INITIAL_REQUEST:
+        request.framed_ip_address = bytes([10, 0, 0, 1])
+    return request
+
+
+def cca(request: CreditControlRequest) -> CreditControlAnswer:
+    answer = request.to_answer()
+    answer.session_id = SESSION_ID
+    answer.origin_host = b"pcrf.realm"
+    answer.origin_realm = b"realm"
+    answer.auth_application_id = APP_3GPP_GX
+    answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
+    answer.cc_request_type = request.cc_request_type
+    answer.cc_request_number = request.cc_request_number
+    return answer
+
+
+def diameter_message(message, timestamp=1_700_000_000.0):
+    wrapped = DiameterMessage(message)
+    wrapped.timestamp = timestamp
+    return wrapped
+
+
+class Sequence:
+    def __init__(self):
+        self._numbers = itertools.count(1)
+
+    def next_sequence(self) -> int:
+        return next(self._numbers)
+
+
+class RoutingNode:
+    # Routes every request to one peer, and keeps the requests sent
+    def __init__(self, hop_by_hop_ids=None):
+        self.end_to_end_seq = Sequence()
+        self.hop_by_hop_ids = iter(hop_by_hop_ids) if hop_by_hop_ids is not None else itertools.count(1)
+        self.sent = queue.Queue()
+
+    def route_request(self, application, request):
+        request.header.hop_by_hop_identifier = next(self.hop_by_hop_ids)
+        return "pcrf", None
+
+    def send_message(self, peer, request):
+        self.sent.put(request)
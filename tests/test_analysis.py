@@ -0,0 +1,34 @@
+from diameter.message.constants import *
+from diameter_telecom.diameter.analysis import analyze_captures
+from diameter_telecom.diameter.recorder import (EPB_FLAG_INBOUND, EPB_FLAG_OUTBOUND,
+                                                _pcapng_file_header, encode_packet)
+
+from conftest import SESSION_ID, cca, ccr
+
+
+def write_capture(path, messages):
+    with open(path, "wb") as capture:
+        capture.write(_pcapng_file_header())
+        for index, message in enumerate(messages):
+            direction = EPB_FLAG_OUTBOUND if message.header.is_request else EPB_FLAG_INBOUND
+            capture.write(encode_packet(message.as_bytes(), 1_700_000_000 + index * 0.01, direction))
+
+
+def gx_session_capture(path):
+    initial = ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 1)
+    termination = ccr(E_CC_REQUEST_TYPE_TERMINATION_REQUEST, 1, 2)
+    write_capture(path, [initial, cca(initial), termination, cca(termination)])
+
+
+def test_terminated_session_counted_once(tmp_path):
+    gx_session_capture(tmp_path / "gx.pcapng")
+    analysis = analyze_captures([str(tmp_path / "gx.pcapng")], workers=1)
+    assert analysis.n_sessions == {APP_3GPP_GX: 1}
+    assert analysis.n_transactions == 2
+
+
+def test_terminated_session_counted_once_when_kept(tmp_path):
+    gx_session_capture(tmp_path / "gx.pcapng")
+    analysis = analyze_captures([str(tmp_path / "gx.pcapng")], workers=1, keep_sessions=True)
+    assert analysis.n_sessions == {APP_3GPP_GX: 1}
+    assert list(analysis.sessions) == [SESSION_ID]
@@ -0,0 +1,98 @@
+import asyncio
+import threading
+
+import pytest
+
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+from diameter_telecom.diameter.app.asyncio_application import AsyncGxApplication
+
+from conftest import RoutingNode, cca, ccr
+
+
+def async_gx_application() -> AsyncGxApplication:
+    app = AsyncGxApplication()
+    app._node = RoutingNode()
+    app.untracked = []
+    untrack_request = app._untrack_request
+
+    def _untrack_request(request):
+        app.untracked.append(request.session_id)
+        untrack_request(request)
+
+    app._untrack_request = _untrack_request
+    return app
+
+
+def request(number: int = 0) -> DiameterMessage:
+    return DiameterMessage(ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST if number == 0 else E_CC_REQUEST_TYPE_UPDATE_REQUEST,
+                               number, 0))
+
+
+def test_answers_from_the_node_thread_resolve_their_own_coroutine():
+    app = async_gx_application()
+
+    def answer_in_reverse():
+        # Like the node thread, which reads the answers in any order
+        sent = [app.node.sent.get(timeout=1) for _ in range(3)]
+        for message in reversed(sent):
+            answer = cca(message)
+            answer.cc_request_number = message.cc_request_number
+            app.receive_answer(answer)
+
+    async def main():
+        return await asyncio.gather(*(app.send_request_custom(request(number), timeout=1) for number in range(3)))
+
+    answerer = threading.Thread(target=answer_in_reverse)
+    answerer.start()
+    answers = asyncio.run(main())
+    answerer.join()
+    assert [answer.cc_request_number for answer in answers] == [0, 1, 2]
+    assert all(answer.result_code == E_RESULT_CODE_DIAMETER_SUCCESS for answer in answers)
+    assert app.n_pending == 0
+    assert app.untracked == []
+
+
+def test_timed_out_request_is_untracked():
+    app = async_gx_application()
+    message = request(0)
+    with pytest.raises(TimeoutError):
+        asyncio.run(app.send_request_custom(message, timeout=0.05))
+    assert app.n_pending == 0
+    assert app.untracked == [message.session_id]
+    # Too late, handled by the threaded application
+    app.receive_answer(cca(app.node.sent.get(timeout=1)))
+
+
+def test_answer_for_a_closed_event_loop_is_dropped():
+    app = async_gx_application()
+    loop = asyncio.new_event_loop()
+    sent = loop.create_task(app.send_request_async(ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 0)))
+    # Sent, then abandoned with its loop
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+    assert app.n_pending == 1
+    app.receive_answer(cca(app.node.sent.get(timeout=1)))
+    assert app.n_pending == 0
+    assert not sent.done()
+
+
+def test_stop_cancels_the_pending_requests():
+    app = async_gx_application()
+    app.start()
+    stopped = []
+
+    async def main():
+        pending = asyncio.ensure_future(app.send_request_custom(request(0), timeout=5))
+        await asyncio.sleep(0)
+        app.node.sent.get(timeout=1)
+        # From another thread, as the node stops its applications
+        stopper = threading.Thread(target=lambda: stopped.append(app.stop()))
+        stopper.start()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        stopper.join()
+
+    asyncio.run(main())
+    assert stopped and app.n_pending == 0
+    assert len(app.untracked) == 1
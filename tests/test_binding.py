@@ -0,0 +1,109 @@
+import asyncio
+import threading
+
+from diameter.message.commands import AaRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter.app import GxApplication, RxApplication
+from diameter_telecom.diameter.session import GxSession, RetentionPolicy, RxSession, SessionBindings
+from diameter_telecom.diameter.session.binding import TERMINATE_ASR
+
+from conftest import diameter_message
+
+
+class Node:
+    origin_host = "pcrf.realm"
+    realm_name = "realm"
+
+
+class AfFacingRxApplication(RxApplication):
+    node = Node()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.sent = []
+        self.sending = threading.Event()
+
+    def send_request_custom(self, request, timeout=5):
+        self.sent.append((threading.current_thread().name, request.message))
+        self.sending.wait(5)
+
+
+class AsyncioAfFacingRxApplication(RxApplication):
+    node = Node()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.answered = asyncio.Event()
+
+    async def send_request_custom(self, request, timeout=5):
+        await self.answered.wait()
+
+
+def aar(session_id: str, hop_by_hop_id: int) -> AaRequest:
+    request = AaRequest()
+    request.header.application_id = APP_3GPP_RX
+    request.header.hop_by_hop_identifier = hop_by_hop_id
+    request.header.end_to_end_identifier = hop_by_hop_id
+    request.session_id = session_id
+    request.origin_host = b"af.realm"
+    request.origin_realm = b"af-realm"
+    request.destination_realm = b"realm"
+    request.auth_application_id = APP_3GPP_RX
+    return request
+
+
+def bound_sessions(n_sessions: int, retention=None, background=True, rx_class=AfFacingRxApplication):
+    gx = GxApplication()
+    rx = rx_class(retention=retention)
+    bindings = SessionBindings(background=background)
+    bindings.attach(gx)
+    bindings.attach(rx)
+    bindings.set_policy(APP_3GPP_RX, TERMINATE_ASR)
+    for i in range(n_sessions):
+        gx.add_session(GxSession(f"gx;{i}"))
+        rx_session = RxSession(f"af;{i}", gx_session_id=f"gx;{i}")
+        rx.add_session(rx_session)
+        request = aar(f"af;{i}", 1)
+        answer = request.to_answer()
+        answer.session_id = request.session_id
+        answer.origin_host = b"pcrf.realm"
+        answer.origin_realm = b"realm"
+        answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
+        rx_session.add_message(diameter_message(request))
+        rx_session.add_message(diameter_message(answer))
+    return gx, rx, bindings
+
+
+def test_asr_is_addressed_after_the_first_request_was_compacted():
+    gx, rx, bindings = bound_sessions(1, RetentionPolicy(keep_first=0, keep_last=1), background=False)
+    rx.sending.set()
+    assert len(rx.get_session_by_id("af;0").messages) == 1
+    gx.remove_session("gx;0")
+    request = rx.sent[0][1]
+    assert (request.destination_host, request.destination_realm) == (b"af.realm", b"af-realm")
+    assert rx.get_session_by_id("af;0") is None
+
+
+def test_cascades_share_one_background_worker():
+    gx, rx, bindings = bound_sessions(3)
+    for i in range(3):
+        gx.remove_session(f"gx;{i}")
+    assert sum(thread.name == "SessionBindings" for thread in threading.enumerate()) == 1
+    rx.sending.set()
+    bindings.stop()
+    assert [name for name, _ in rx.sent] == ["SessionBindings"] * 3
+    assert len(rx.sessions) == 0
+
+
+def test_asyncio_session_is_removed_once_answered():
+    async def cascade():
+        gx, rx, bindings = bound_sessions(1, background=False, rx_class=AsyncioAfFacingRxApplication)
+        gx.remove_session("gx;0")
+        await asyncio.sleep(0)
+        assert rx.get_session_by_id("af;0") is not None
+        rx.answered.set()
+        for _ in range(3):
+            await asyncio.sleep(0)
+        assert rx.get_session_by_id("af;0") is None
+
+    asyncio.run(cascade())
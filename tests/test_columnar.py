@@ -0,0 +1,86 @@
+import math
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from diameter.message.constants import *
+from diameter_telecom.diameter.columnar import export_messages
+from diameter_telecom.diameter.constants import MessageKind
+from diameter_telecom.subscriber import Subscriber
+
+from conftest import SESSION_ID, cca, ccr, diameter_message
+
+
+def request(hop_by_hop_id: int, timestamp, request_type: int = E_CC_REQUEST_TYPE_INITIAL_REQUEST):
+    return diameter_message(ccr(request_type, 0, hop_by_hop_id), timestamp)
+
+
+def answer(hop_by_hop_id: int, timestamp, result_code: int = E_RESULT_CODE_DIAMETER_SUCCESS,
+           request_type: int = E_CC_REQUEST_TYPE_INITIAL_REQUEST, apn=None):
+    message = cca(ccr(request_type, 0, hop_by_hop_id))
+    message.result_code = result_code
+    wrapped = diameter_message(message, timestamp)
+    wrapped.called_station_id = apn
+    return wrapped
+
+
+def test_messages_become_typed_columns():
+    ccr_i = request(1, 8.0)
+    ccr_i.subscriber = Subscriber(msisdn="5511900000001", imsi="724000000000001")
+    ccr_i.called_station_id = "internet"
+    columns = export_messages([ccr_i, answer(1, 8.5, E_RESULT_CODE_DIAMETER_UNABLE_TO_COMPLY), request(2, None)])
+    assert len(columns) == 3
+    assert {name: array.dtype.name for name, array in columns.as_dict().items()} == {
+        "timestamp": "float64", "kind": "uint8", "is_request": "bool", "app_id": "uint32", "result_code": "int32",
+        "hop_by_hop_id": "uint32", "end_to_end_id": "uint32", "session": "int32", "msisdn": "int32", "apn": "int32"}
+    assert columns.timestamp[:2].tolist() == [8.0, 8.5] and math.isnan(columns.timestamp[2])
+    assert columns.kind.tolist() == [MessageKind.CCR_I, MessageKind.CCA_I, MessageKind.CCR_I]
+    assert columns.is_request.tolist() == [True, False, True]
+    assert columns.result_code.tolist() == [0, E_RESULT_CODE_DIAMETER_UNABLE_TO_COMPLY, 0]
+    assert columns.hop_by_hop_id.tolist() == [1, 1, 2]
+    assert columns.session.tolist() == [0, 0, 0] and columns.session_ids == [SESSION_ID]
+    assert columns.msisdn.tolist() == [0, -1, -1] and columns.msisdns == ["5511900000001"]
+    assert columns.apn.tolist() == [0, -1, -1] and columns.apns == ["internet"]
+
+
+def test_answers_are_matched_with_the_last_transmission_of_their_request():
+    columns = export_messages([
+        answer(1, 9.5),
+        request(3, 8.0),        # Never answered
+        request(1, 9.0),        # Retransmission
+        request(2, 8.5),
+        answer(4, 8.25),        # Of no request
+        request(1, 8.0),
+        answer(2, 8.75),
+    ])
+    requests, answers = columns.transactions()
+    pairs = sorted(zip(columns.hop_by_hop_id[requests].tolist(), columns.timestamp[requests].tolist(),
+                       columns.timestamp[answers].tolist()))
+    assert pairs == [(1, 9.0, 9.5), (2, 8.5, 8.75)]
+    requests, latencies = columns.latency()
+    assert sorted(latencies.tolist()) == [0.25, 0.5]
+
+
+def test_latency_percentiles_by_request_name():
+    messages = []
+    for i, latency in enumerate((0.125, 0.25, 0.375, 0.5, 0.625)):
+        messages += [request(i + 1, 8.0), answer(i + 1, 8.0 + latency)]
+    for i, latency in enumerate((1.0, 2.0)):
+        messages += [request(i + 10, 8.0, E_CC_REQUEST_TYPE_UPDATE_REQUEST),
+                     answer(i + 10, 8.0 + latency, request_type=E_CC_REQUEST_TYPE_UPDATE_REQUEST)]
+    report = export_messages(messages).latency_percentiles((50, 100))
+    assert report == {"CCR-I": {50: 0.375, 100: 0.625}, "CCR-U": {50: 1.5, 100: 2.0}}
+
+
+def test_error_rate_by_apn():
+    columns = export_messages([
+        request(1, 8.0),
+        answer(1, 8.5, apn="internet"),
+        answer(2, 8.5, E_RESULT_CODE_DIAMETER_UNABLE_TO_COMPLY, apn="internet"),
+        answer(3, 8.5, apn="internet"),
+        answer(4, 8.5, apn="internet"),
+        answer(5, 8.5, E_RESULT_CODE_DIAMETER_UNABLE_TO_DELIVER, apn="ims"),
+        answer(6, 8.5),
+    ])
+    assert columns.error_rate_by_apn() == {None: 0.0, "internet": 0.25, "ims": 1.0}
@@ -0,0 +1,35 @@
+import ipaddress
+
+import pytest
+
+from diameter_telecom.diameter.iptrie import IpPrefixIndex, parse_framed_ipv6_prefix
+
+PREFIX = bytes([0, 64]) + ipaddress.IPv6Address("2001:db8:1:2::").packed[:8]
+
+
+def test_framed_ipv6_prefix_rejects_raw_address():
+    with pytest.raises(ValueError):
+        parse_framed_ipv6_prefix(ipaddress.IPv6Address("2001:db8:1:2::5").packed)
+
+
+def test_framed_ipv6_prefix_accepts_padded_prefix():
+    padded = PREFIX.ljust(18, b"\x00")
+    assert parse_framed_ipv6_prefix(padded) == parse_framed_ipv6_prefix(PREFIX)
+
+
+@pytest.mark.parametrize("address", [
+    "2001:db8:1:2::5",
+    ipaddress.IPv6Address("2001:db8:1:2::5"),
+    ipaddress.IPv6Address("2001:db8:1:2::5").packed,
+])
+def test_lookup_by_address_forms(address):
+    index = IpPrefixIndex(parse_framed_ipv6_prefix)
+    index[PREFIX] = "pcef;1;1"
+    assert index.get(address) == "pcef;1;1"
+
+
+def test_lookup_takes_16_bytes_as_address():
+    index = IpPrefixIndex(parse_framed_ipv6_prefix)
+    index["6a::/16"] = "pcef;1;1"
+    # Would pass for the RFC 3162 bytes of ffff:ffff::/106
+    assert index.get(bytes([0, 106]) + b"\xff" * 14) == "pcef;1;1"
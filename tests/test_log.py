@@ -0,0 +1,24 @@
+import logging
+import threading
+
+from diameter_telecom.diameter.log import LogCategory
+
+
+def test_records_are_attributed_to_the_caller(caplog):
+    category = LogCategory("test.caller", logging.getLogger("test.log"))
+    with caplog.at_level(logging.INFO, logger="test.log"):
+        category.log("Answer %d", 1)
+    assert [(record.getMessage(), record.funcName, record.pathname) for record in caplog.records] == [
+        ("Answer 1", "test_records_are_attributed_to_the_caller", __file__)]
+
+
+def test_records_are_counted_from_every_thread(caplog):
+    category = LogCategory("test.threads", logging.getLogger("test.log"), sample_every=4)
+    threads = [threading.Thread(target=lambda: [category.log("Answer") for _ in range(1000)]) for _ in range(8)]
+    with caplog.at_level(logging.INFO, logger="test.log"):
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    assert category.n_emitted == 2000 and category.n_suppressed == 6000
+    assert len(caplog.records) == 2000
@@ -0,0 +1,69 @@
+import pickle
+
+import pytest
+
+from diameter.message import Message
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+from diameter_telecom.diameter.constants import MessageKind
+from diameter_telecom.subscriber import Subscriber
+
+from conftest import SESSION_ID, cca, ccr
+
+
+def raw_ccr(hop_by_hop_id: int = 1) -> bytes:
+    return ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, hop_by_hop_id).as_bytes()
+
+
+def test_wrapper_attributes_are_slots():
+    message = DiameterMessage(raw_ccr())
+    assert not hasattr(message, "__dict__")
+    message.timestamp = 1.0
+    with pytest.raises(AttributeError):
+        message.not_an_avp = 1
+    with pytest.raises(ValueError):
+        message.subscriber = "5511900000001"
+    assert not message.is_decoded
+    # Read from the wrapped message
+    assert message.not_an_avp is None
+
+
+def test_avps_set_on_the_wrapper_leave_the_message_untouched():
+    data = raw_ccr()
+    lazy = DiameterMessage(data)
+    lazy.session_id = "other;1"
+    lazy.cc_request_number = 5
+    assert (lazy.session_id, lazy.cc_request_number) == ("other;1", 5)
+    assert not lazy.is_decoded
+    assert lazy.as_bytes() == data
+    decoded = DiameterMessage(Message.from_bytes(data))
+    decoded.cc_request_number = 5
+    assert decoded.cc_request_number == 5
+    assert decoded.message.cc_request_number == 0
+
+
+def test_equality_by_identifiers():
+    request = ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 7)
+    lazy = DiameterMessage(request.as_bytes())
+    decoded = DiameterMessage(request)
+    assert lazy == decoded and hash(lazy) == hash(decoded)
+    assert lazy != DiameterMessage(raw_ccr(8))
+    # Same identifiers, but the answer
+    assert lazy != DiameterMessage(cca(request))
+    assert len({lazy, decoded, DiameterMessage(cca(request))}) == 2
+    assert lazy != request
+
+
+def test_pickled_lazily_with_the_wrapper_attributes():
+    message = DiameterMessage(Message.from_bytes(raw_ccr()))
+    message.header.hop_by_hop_identifier = 9
+    message.timestamp = 1_700_000_000.0
+    message.subscriber = Subscriber(msisdn="5511900000001", imsi="724000000000001")
+    message.called_station_id = "internet"
+    message.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
+    restored = pickle.loads(pickle.dumps(message))
+    assert not restored.is_decoded
+    assert restored == message and restored.hop_by_hop_id == 9
+    assert (restored.timestamp, restored.msisdn, restored.apn) == (1_700_000_000.0, "5511900000001", "internet")
+    assert restored.result_code == E_RESULT_CODE_DIAMETER_SUCCESS
+    assert restored.session_id == SESSION_ID and restored.kind == MessageKind.CCR_I
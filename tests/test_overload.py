@@ -0,0 +1,132 @@
+import pytest
+import time
+
+from diameter.message import Avp
+from diameter.message.avp.grouped import SubscriptionId
+from diameter.message.constants import *
+from diameter_telecom.diameter.app.overload import OverloadControl, TokenBuckets
+
+from conftest import ccr
+
+
+class Application:
+    queue_depth = 0
+
+    def generate_answer(self, message, result_code):
+        answer = message.to_answer()
+        answer.result_code = result_code
+        return answer
+
+
+def request(hop_by_hop_id: int, origin_host: bytes = b"pcef.realm", msisdn: str = "5511900000001", doic: bool = False):
+    message = ccr(E_CC_REQUEST_TYPE_UPDATE_REQUEST, hop_by_hop_id, hop_by_hop_id)
+    message.origin_host = origin_host
+    message.subscription_id = [SubscriptionId(subscription_id_type=E_SUBSCRIPTION_ID_TYPE_END_USER_E164,
+                                              subscription_id_data=msisdn)]
+    if doic:
+        message.append_avp(Avp.new(AVP_OC_SUPPORTED_FEATURES, value=[
+            Avp.new(AVP_OC_FEATURE_VECTOR, value=1, is_mandatory=False)], is_mandatory=False))
+    return message
+
+
+def update(overload, latency, n_answered=1):
+    # One interval in which n_answered requests took latency seconds each
+    overload._latency_total = latency * n_answered
+    overload._n_answered = n_answered
+    overload._update(time.monotonic())
+
+
+def olr(answer):
+    avps = answer.find_avps((AVP_OC_OLR, 0))
+    return {avp.code: avp.value for avp in avps[0].value} if avps else None
+
+
+def test_requests_are_refused_above_the_queue_depth():
+    app = Application()
+    overload = OverloadControl(max_queue_depth=5)
+    app.queue_depth = 5
+    assert not overload.admit(app, request(1))
+    app.queue_depth = 4
+    assert overload.admit(app, request(2))
+    assert (overload.n_rejected_queue_depth, overload.n_admitted) == (1, 1)
+
+
+def test_reduction_rises_and_falls_with_the_latency():
+    app = Application()
+    overload = OverloadControl(max_latency=0.25, max_reduction=0.8, interval=60)
+    update(overload, 0.75)
+    assert overload.reduction == 0.5
+    # Refused evenly, every other request
+    assert [overload.admit(app, request(i)) for i in range(6)] == [True, False] * 3
+    assert overload.n_rejected_latency == 3
+    update(overload, 2.5)
+    assert overload.reduction == 0.8
+    update(overload, 0.125)
+    assert overload.reduction == pytest.approx(0.675)
+    for _ in range(3):
+        update(overload, 0.0)
+    assert overload.reduction == 0
+    assert all(overload.admit(app, request(i)) for i in range(6, 12))
+
+
+def test_token_buckets_per_origin_host_and_subscriber():
+    app = Application()
+    overload = OverloadControl(origin_host_rate=1, origin_host_burst=2)
+    assert overload.admit(app, request(1)) and overload.admit(app, request(2))
+    assert not overload.admit(app, request(3))
+    assert overload.admit(app, request(4, origin_host=b"other.realm"))
+    assert overload.n_throttled_origin_host == 1
+    overload = OverloadControl(subscriber_rate=1, subscriber_burst=1)
+    assert overload.admit(app, request(1))
+    assert not overload.admit(app, request(2))
+    assert overload.admit(app, request(3, msisdn="5511900000002"))
+    assert overload.n_throttled_subscriber == 1
+
+
+def test_token_buckets_refill_and_are_bounded():
+    buckets = TokenBuckets(rate=2, burst=1, max_buckets=2)
+    assert buckets.take("a", 0) and not buckets.take("a", 0.1)
+    assert buckets.take("a", 0.6)
+    buckets.take("b", 0.6)
+    buckets.take("c", 0.6)
+    assert len(buckets) == 2
+    # Dropped as the least recently used, and back full
+    assert buckets.take("a", 0.6)
+
+
+def test_doic_reports_the_reduction_and_ends_the_report():
+    app = Application()
+    overload = OverloadControl(max_latency=0.1, interval=60, validity_duration=30)
+    sequence_number = overload._sequence_number
+    message = request(1, doic=True)
+    assert overload.admit(app, message)
+    answer = message.to_answer()
+    overload.answered(answer)
+    assert answer.find_avps((AVP_OC_SUPPORTED_FEATURES, 0)) and olr(answer) is None
+    update(overload, 0.3)
+    busy = overload.busy_answer(app, request(2, doic=True))
+    assert busy.result_code == E_RESULT_CODE_DIAMETER_TOO_BUSY
+    assert olr(busy) == {AVP_OC_SEQUENCE_NUMBER: sequence_number + 1,
+                         AVP_OC_REPORT_TYPE: E_OC_REPORT_TYPE_HOST_REPORT,
+                         AVP_OC_REDUCTION_PERCENTAGE: 50,
+                         AVP_OC_VALIDITY_DURATION: 30}
+    # Peers without DOIC get neither AVP
+    busy = overload.busy_answer(app, request(3))
+    assert not busy.find_avps((AVP_OC_SUPPORTED_FEATURES, 0)) and olr(busy) is None
+    update(overload, 0.0)
+    update(overload, 0.0)
+    message = request(4, doic=True)
+    assert overload.admit(app, message)
+    answer = message.to_answer()
+    overload.answered(answer)
+    assert olr(answer) == {AVP_OC_SEQUENCE_NUMBER: sequence_number + 2,
+                           AVP_OC_REPORT_TYPE: E_OC_REPORT_TYPE_HOST_REPORT,
+                           AVP_OC_REDUCTION_PERCENTAGE: 0,
+                           AVP_OC_VALIDITY_DURATION: 0}
+    # No OC-OLR once the ended report would have expired anyway
+    overload._report_until = 0.0
+    message = request(5, doic=True)
+    assert overload.admit(app, message)
+    answer = message.to_answer()
+    overload.answered(answer)
+    assert olr(answer) is None
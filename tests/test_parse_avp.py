@@ -0,0 +1,91 @@
+import pytest
+
+from diameter.message.avp.grouped import (AllocationRetentionPriority, ChargingRuleInstall, ChargingRuleRemove,
+                                          DefaultEpsBearerQos)
+from diameter.message.commands import ReAuthRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter.message import DiameterMessage
+from diameter_telecom.diameter.parse_avp import AvpPlan, check_charging_rules
+from diameter_telecom.diameter.session import GxSession
+from diameter_telecom.diameter.session.pcc import PccRuleIndex
+
+from conftest import SESSION_ID, ccr
+
+PLAN = AvpPlan("Subscription-Id/*", "CC-Request-Number",
+               "Default-EPS-Bearer-QoS/QoS-Class-Identifier",
+               "Default-EPS-Bearer-QoS/Allocation-Retention-Priority/Priority-Level",
+               "Framed-IPv6-Prefix")
+
+
+def ccr_with_qos() -> bytes:
+    request = ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 1)
+    request.default_eps_bearer_qos = DefaultEpsBearerQos(
+        qos_class_identifier=9, allocation_retention_priority=AllocationRetentionPriority(priority_level=2))
+    return request.as_bytes()
+
+
+def rar() -> ReAuthRequest:
+    request = ReAuthRequest()
+    request.header.application_id = APP_3GPP_GX
+    request.header.hop_by_hop_identifier = 1
+    request.header.end_to_end_identifier = 1
+    request.session_id = SESSION_ID
+    request.origin_host = b"pcrf.realm"
+    request.origin_realm = b"realm"
+    request.destination_realm = b"realm"
+    request.destination_host = b"pcef.realm"
+    request.auth_application_id = APP_3GPP_GX
+    request.re_auth_request_type = E_RE_AUTH_REQUEST_TYPE_AUTHORIZE_ONLY
+    request.charging_rule_install = [ChargingRuleInstall(charging_rule_name=[b"video-hd", b"voice"],
+                                                         charging_rule_base_name=["default"])]
+    request.charging_rule_remove = [ChargingRuleRemove(charging_rule_name=[b"video-sd"])]
+    return request
+
+
+def test_plan_extracts_nested_and_expanded_paths():
+    values = PLAN.extract(ccr_with_qos())
+    assert values == {
+        "Subscription-Id/*": [{"Subscription-Id-Type": E_SUBSCRIPTION_ID_TYPE_END_USER_E164,
+                               "Subscription-Id-Data": "5511900000001"}],
+        "CC-Request-Number": [0],
+        "Default-EPS-Bearer-QoS/QoS-Class-Identifier": [9],
+        "Default-EPS-Bearer-QoS/Allocation-Retention-Priority/Priority-Level": [2],
+        "Framed-IPv6-Prefix": [],
+    }
+
+
+def test_plan_reads_lazy_messages_without_encoding_them(monkeypatch):
+    diameter_message = DiameterMessage(ccr_with_qos())
+    diameter_message.header.hop_by_hop_identifier = 7
+
+    def as_bytes(self):
+        raise AssertionError("the message was encoded")
+
+    monkeypatch.setattr(DiameterMessage, "as_bytes", as_bytes)
+    assert PLAN.extract(diameter_message) == PLAN.extract(ccr_with_qos())
+    assert not diameter_message.is_decoded
+
+
+def test_plan_rejects_invalid_paths_and_lengths():
+    for path in ("", "Unknown-AVP", "Subscription-Id/*/Subscription-Id-Data", "Session-Id/Origin-Host"):
+        with pytest.raises(ValueError):
+            AvpPlan(path)
+    data = bytearray(ccr_with_qos())
+    # Length of the first AVP, past the end of the message
+    data[25:28] = len(data).to_bytes(3, "big")
+    with pytest.raises(ValueError):
+        PLAN.extract(data)
+
+
+def test_charging_rules_are_read_in_one_pass():
+    decoded = DiameterMessage(rar())
+    lazy = DiameterMessage(rar().as_bytes())
+    expected = ({b"video-hd", b"voice", "default"}, {b"video-sd"})
+    assert check_charging_rules(decoded) == expected
+    assert check_charging_rules(lazy) == expected
+    pcc_rules = PccRuleIndex()
+    session = GxSession(SESSION_ID)
+    pcc_rules.update(session, install=["video-sd"])
+    pcc_rules.apply(session, lazy)
+    assert sorted(pcc_rules.installed(session)) == ["default", "video-hd", "voice"]
+    assert not lazy.is_decoded
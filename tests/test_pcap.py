@@ -0,0 +1,27 @@
+from diameter.message.commands import DeviceWatchdogRequest
+from diameter_telecom.diameter.pcap import _DiameterStream
+
+
+def dwr(hop_by_hop_id: int) -> bytes:
+    request = DeviceWatchdogRequest()
+    request.header.hop_by_hop_identifier = hop_by_hop_id
+    request.origin_host = b"pcef.realm"
+    request.origin_realm = b"realm"
+    return request.as_bytes()
+
+
+def test_pdu_completed_before_framing_error_is_kept():
+    pdu = dwr(1)
+    stream = _DiameterStream()
+    assert stream.feed(pdu[:20]) == []
+    pdus = stream.feed(pdu[20:] + b"\xff" * 12)
+    assert [bytes(p) for p in pdus] == [pdu]
+    assert not stream.buffer
+
+
+def test_stream_resynchronises_after_framing_error():
+    first, second = dwr(1), dwr(2)
+    stream = _DiameterStream()
+    assert [bytes(p) for p in stream.feed(first + b"\xff" * 12)] == [first]
+    assert stream.feed(second[:10]) == []
+    assert [bytes(p) for p in stream.feed(second[10:])] == [second]
@@ -0,0 +1,116 @@
+import threading
+import time
+
+import pytest
+
+from diameter.message.constants import *
+from diameter_telecom.diameter import DiameterMessage
+from diameter_telecom.diameter.app import GxApplication
+
+from conftest import RoutingNode, cca, ccr
+
+
+def gx_application(hop_by_hop_ids=None, **window) -> GxApplication:
+    app = GxApplication()
+    app._node = RoutingNode(hop_by_hop_ids)
+    app.untracked = []
+    untrack_request = app._untrack_request
+
+    def _untrack_request(request):
+        app.untracked.append(request.session_id)
+        untrack_request(request)
+
+    app._untrack_request = _untrack_request
+    if window:
+        app.set_request_window(**window)
+    return app
+
+
+def request(number: int = 0) -> DiameterMessage:
+    return DiameterMessage(ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST if number == 0 else E_CC_REQUEST_TYPE_UPDATE_REQUEST,
+                               number, 0))
+
+
+def answer_next(app) -> DiameterMessage:
+    sent = app.node.sent.get(timeout=1)
+    app.receive_answer(cca(sent))
+    return sent
+
+
+def test_submit_blocks_while_the_window_is_full():
+    app = gx_application(max_in_flight=2)
+    first = app.submit(request(0))
+    app.submit(request(1))
+    blocked = threading.Thread(target=app.submit, args=(request(2),))
+    blocked.start()
+    blocked.join(0.1)
+    assert blocked.is_alive()
+    assert app.node.sent.qsize() == 2
+    answer_next(app)
+    blocked.join(1)
+    assert not blocked.is_alive()
+    assert first.result(1).result_code == E_RESULT_CODE_DIAMETER_SUCCESS
+    assert app.pipeline.n_in_flight == 2
+    app.pipeline.stop()
+
+
+def test_expired_request_does_not_expire_a_reused_hop_by_hop_id():
+    app = gx_application(hop_by_hop_ids=[7, 7, 8])
+    first = app.submit(request(0), timeout=0.2)
+    answer_next(app)
+    assert first.result(1).hop_by_hop_id == 7
+    # Sent with the identifier of the first, whose deadline passes first
+    second = app.submit(request(1), timeout=5)
+    time.sleep(0.4)
+    assert not second.done()
+    third = app.submit(request(2), timeout=0.05)
+    with pytest.raises(TimeoutError):
+        third.result(1)
+    assert app.pipeline.n_timed_out == 1
+    assert app.untracked == [third.request.session_id]
+    answer_next(app)
+    assert second.result(1).result_code == E_RESULT_CODE_DIAMETER_SUCCESS
+    app.pipeline.stop()
+
+
+def test_stop_fails_the_requests_in_flight():
+    app = gx_application()
+    futures = [app.submit(request(number)) for number in range(3)]
+    app.pipeline.stop()
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(1)
+    assert app.pipeline.n_in_flight == 0
+    assert len(app.untracked) == 3
+
+
+def test_ordered_send_many_yields_in_submission_order():
+    app = gx_application()
+
+    def answer_in_reverse():
+        sent = [app.node.sent.get(timeout=1) for _ in range(3)]
+        for message in reversed(sent):
+            app.receive_answer(cca(message))
+
+    answerer = threading.Thread(target=answer_in_reverse)
+    answerer.start()
+    futures = list(app.send_many([request(number) for number in range(3)], ordered=True))
+    answerer.join()
+    assert [future.sequence for future in futures] == [0, 1, 2]
+    assert [future.completion for future in futures] == [2, 1, 0]
+    app.pipeline.stop()
+
+
+def test_answer_that_can_not_be_wrapped_untracks_the_request():
+    app = gx_application()
+
+    def _wrap_answer(answer):
+        raise ValueError("undecodable answer")
+
+    app._wrap_answer = _wrap_answer
+    future = app.submit(request(0))
+    answer_next(app)
+    with pytest.raises(ValueError):
+        future.result(1)
+    assert app.untracked == [future.request.session_id]
+    app.pipeline.stop()
@@ -0,0 +1,82 @@
+import pickle
+import time
+
+from diameter_telecom.diameter.app import GxApplication
+from diameter_telecom.diameter.session import GxSession, SessionReaper
+from diameter_telecom.diameter.session.reaper import REASON_ABSOLUTE, REASON_IDLE, TimerWheel
+
+
+def expiries(wheel, until):
+    # Time each timer expires at, turning the wheel one tick at a time
+    expired = {}
+    for now in range(1, until + 1):
+        for key in wheel.advance(now):
+            expired[key] = now
+    return expired
+
+
+def test_timers_cascade_down_the_levels():
+    # 4 slots per level: level 0 spans 4 ticks, level 1 16 and level 2 64
+    wheel = TimerWheel(resolution=1, slots=4, levels=3, start=0)
+    for deadline in (3, 4, 10, 17, 40, 63):
+        wheel.schedule(deadline, deadline)
+    assert expiries(wheel, 64) == {deadline: deadline for deadline in (3, 4, 10, 17, 40, 63)}
+    assert len(wheel) == 0
+
+
+def test_timers_beyond_the_wheel_are_parked():
+    wheel = TimerWheel(resolution=1, slots=4, levels=3, start=0)
+    wheel.schedule("far", 200)
+    wheel.schedule("near", 5)
+    assert expiries(wheel, 199) == {"near": 5}
+    assert "far" in wheel
+    assert wheel.advance(200) == ["far"]
+
+
+def test_idle_wheel_jumps_ahead_and_reschedules():
+    wheel = TimerWheel(resolution=1, slots=4, levels=3, start=0)
+    assert wheel.advance(1000) == []
+    wheel.schedule("late", 1000.5)
+    wheel.schedule("key", 1037)
+    assert wheel.cancel("late")
+    wheel.schedule("key", 1021)
+    assert wheel.advance(1020) == []
+    assert wheel.advance(1021) == ["key"]
+    # Already due: expires on the next tick
+    wheel.schedule("due", 900)
+    assert wheel.advance(1022) == ["due"]
+
+
+def reaped_sessions(idle_timeout=None, absolute_timeout=None):
+    app = GxApplication()
+    reaper = SessionReaper(idle_timeout=idle_timeout, absolute_timeout=absolute_timeout)
+    reaped = []
+    reaper.add_callback(lambda application, session, reason: reaped.append((session.session_id, reason)))
+    reaper.attach(app)
+    return app, reaper, reaped
+
+
+def test_absolute_timeout_runs_from_the_session_start():
+    app, reaper, reaped = reaped_sessions(absolute_timeout=100)
+    now = time.monotonic()
+    session = GxSession("gx;1")
+    session.started_at = now - 60
+    # Restored from a snapshot: still expires 100 s after it started
+    app.add_session(pickle.loads(pickle.dumps(session)))
+    assert reaper.reap(now + 39) == 0
+    assert reaper.reap(now + 41) == 1
+    assert reaped == [("gx;1", REASON_ABSOLUTE)]
+    assert app.get_session_by_id("gx;1") is None
+    assert reaper.n_tracked == 0
+
+
+def test_activity_postpones_the_idle_timeout():
+    app, reaper, reaped = reaped_sessions(idle_timeout=10, absolute_timeout=100)
+    now = time.monotonic()
+    session = GxSession("gx;1")
+    session.last_activity = now
+    app.add_session(session)
+    session.last_activity = now + 5
+    assert reaper.reap(now + 11) == 0
+    assert reaper.reap(now + 16) == 1
+    assert reaped == [("gx;1", REASON_IDLE)]
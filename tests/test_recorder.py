@@ -0,0 +1,22 @@
+import glob
+
+from diameter.message.constants import *
+from diameter_telecom.diameter.pcap import read_pcap
+from diameter_telecom.diameter.recorder import TrafficRecorder
+
+from conftest import ccr
+
+
+def test_messages_are_recorded_as_received(tmp_path):
+    recorder = TrafficRecorder(str(tmp_path), flush_interval=0.01)
+    recorder.start()
+    request = ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 1)
+    recorder.record(request, inbound=True)
+    # As a relay forwarding the request does
+    request.route_record.append(b"dra.realm")
+    recorder.record(request, inbound=False)
+    recorder.record(request.as_bytes(), inbound=False)
+    recorder.stop()
+    messages = [message for path in sorted(glob.glob(str(tmp_path / "*"))) for message in read_pcap(path)]
+    assert [list(message.message.route_record) for message in messages] == [[], [b"dra.realm"], [b"dra.realm"]]
+    assert recorder.n_recorded == 3
@@ -0,0 +1,58 @@
+import pickle
+import pytest
+
+from diameter.message.constants import *
+from diameter_telecom.diameter.app import GxApplication
+from diameter_telecom.diameter.session import GxSession, RetentionPolicy
+
+from conftest import ccr, diameter_message
+
+
+def spill_segments(tmp_path):
+    return sorted(path.name for path in tmp_path.iterdir())
+
+
+def policy(tmp_path):
+    # Every spilled CCR-U fills a segment
+    return RetentionPolicy(keep_first=1, keep_last=1, spill_directory=str(tmp_path), segment_size=1)
+
+
+def gx_session(session_id, retention, n_updates=3):
+    session = GxSession(session_id)
+    session.set_retention(retention)
+    session.add_message(diameter_message(ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 1)))
+    for number in range(1, n_updates + 2):
+        session.add_message(diameter_message(ccr(E_CC_REQUEST_TYPE_UPDATE_REQUEST, number, number + 1)))
+    return session
+
+
+def test_segments_are_deleted_with_their_sessions(tmp_path):
+    retention = policy(tmp_path)
+    app = GxApplication(retention=retention)
+    session = gx_session("gx;1", retention)
+    app.sessions.add(session)
+    assert len(session.message_records) == 3
+    assert spill_segments(tmp_path) == ["messages.000000.spill", "messages.000001.spill", "messages.000002.spill"]
+    assert session.load_message(session.message_records[0]).cc_request_number == 1
+    app.remove_session("gx;1")
+    assert spill_segments(tmp_path) == []
+    assert session.load_message(session.message_records[0]) is None
+
+
+def test_unpickled_sessions_share_their_policy(tmp_path):
+    retention = policy(tmp_path)
+    session = pickle.loads(pickle.dumps(gx_session("gx;1", retention)))
+    assert session.retention is retention
+    session.release_records()
+    assert spill_segments(tmp_path) == []
+
+
+def test_policies_do_not_share_spill_segments(tmp_path):
+    gx_retention = policy(tmp_path)
+    with pytest.raises(ValueError):
+        RetentionPolicy(spill_directory=str(tmp_path))
+    rx_retention = RetentionPolicy(keep_first=1, keep_last=1, spill_directory=str(tmp_path), spill_name="rx", segment_size=1)
+    gx = gx_session("gx;1", gx_retention)
+    rx = gx_session("rx;1", rx_retention)
+    rx.release_records()
+    assert gx.load_message(gx.message_records[0]).cc_request_number == 1
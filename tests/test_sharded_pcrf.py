@@ -0,0 +1,104 @@
+import pytest
+
+from diameter.message.commands import AaRequest, CreditControlRequest, SessionTerminationRequest
+from diameter.message.constants import *
+from diameter_telecom.diameter.message import DiameterMessage
+from diameter_telecom.diameter.shm_ring import ShmRing
+from diameter_telecom.entities_3gpp.sharded_pcrf import PcrfShard, ShardRouter
+from diameter_telecom.diameter.session import GxSession
+
+from conftest import ccr
+
+# The /64 of the UE, and one of its addresses as a /128 sent by the AF
+FRAMED_IPV6_PREFIX = bytes.fromhex("0040" "20010db800000001")
+UE_IPV6_PREFIX = bytes.fromhex("0080" "20010db8000000010000000000000001")
+UE_IPV6_ADDRESS = UE_IPV6_PREFIX[2:]
+GX_SESSION_ID = "pcef.realm;1;1"
+RX_SESSION_ID = "af.realm;1;3"
+
+
+def gx_request(request_type: int, number: int) -> CreditControlRequest:
+    request = ccr(request_type, number, number + 1)
+    if request_type == E_CC_REQUEST_TYPE_INITIAL_REQUEST:
+        request.framed_ipv6_prefix = FRAMED_IPV6_PREFIX
+    return request
+
+
+def rx_request(hop_by_hop_id: int = 1) -> AaRequest:
+    request = AaRequest()
+    request.header.application_id = APP_3GPP_RX
+    request.header.hop_by_hop_identifier = hop_by_hop_id
+    request.header.end_to_end_identifier = hop_by_hop_id
+    request.session_id = RX_SESSION_ID
+    request.origin_host = b"af.realm"
+    request.origin_realm = b"af-realm"
+    request.destination_realm = b"realm"
+    request.auth_application_id = APP_3GPP_RX
+    request.framed_ipv6_prefix = UE_IPV6_PREFIX
+    return request
+
+
+def rx_termination() -> SessionTerminationRequest:
+    request = SessionTerminationRequest()
+    request.header.application_id = APP_3GPP_RX
+    request.session_id = RX_SESSION_ID
+    request.origin_host = b"af.realm"
+    request.origin_realm = b"af-realm"
+    request.destination_realm = b"realm"
+    request.auth_application_id = APP_3GPP_RX
+    request.termination_cause = E_TERMINATION_CAUSE_DIAMETER_LOGOUT
+    return request
+
+
+@pytest.fixture
+def router():
+    router = ShardRouter(4, ring_size=4096)
+    yield router
+    router.close()
+
+
+def test_rx_session_follows_its_gx_session(router):
+    assert router.shard_of_key(RX_SESSION_ID.encode()) != router.shard_of_key(GX_SESSION_ID.encode())
+    shard = router.route(gx_request(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0))
+    assert shard == router.shard_of_key(GX_SESSION_ID.encode())
+    assert router.gx_session_id(UE_IPV6_ADDRESS) == GX_SESSION_ID
+    assert router.route(rx_request()) == shard
+    assert router.shard(RX_SESSION_ID) == shard
+
+
+def test_sessions_are_released_when_they_terminate(router):
+    shard = router.route(gx_request(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0))
+    router.route(rx_request())
+    assert router.route(rx_termination()) == shard
+    assert router.shard(RX_SESSION_ID) is None
+    assert router.route(gx_request(E_CC_REQUEST_TYPE_UPDATE_REQUEST, 1)) == shard
+    assert router.route(gx_request(E_CC_REQUEST_TYPE_TERMINATION_REQUEST, 2)) == shard
+    assert router.shard(GX_SESSION_ID) is None
+    assert router.gx_session_id(UE_IPV6_ADDRESS) is None
+    # Without a Gx session for its address, an Rx session is placed by its Session-Id
+    assert router.route(rx_request()) == router.shard_of_key(RX_SESSION_ID.encode())
+
+
+def test_shard_binds_rx_sessions_accepted_by_the_handler():
+    answers = ShmRing.create(4096)
+    shard = PcrfShard(0, answers, gx_request_handler=lambda app, message: None,
+                      rx_request_handler=lambda app, message: None)
+    gx_session = GxSession(GX_SESSION_ID)
+    gx_session.add_message(DiameterMessage(gx_request(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0)))
+    shard.gx_app.add_session(gx_session)
+    request = rx_request()
+    answer = request.to_answer()
+    answer.session_id = RX_SESSION_ID
+    answer.result_code = E_RESULT_CODE_DIAMETER_UNABLE_TO_COMPLY
+    shard._bind_rx_session(request, answer)
+    assert shard.rx_app.get_session_by_id(RX_SESSION_ID) is None
+    answer.result_code = E_RESULT_CODE_DIAMETER_SUCCESS
+    shard._bind_rx_session(request, answer)
+    rx_session = shard.rx_app.get_session_by_id(RX_SESSION_ID)
+    assert rx_session.gx_session_id == GX_SESSION_ID
+    assert rx_session.subscriber.msisdn == "5511900000001"
+    assert len(rx_session.messages) == 2
+    # Bound sessions are dropped with their Gx session
+    shard.gx_app.remove_session(GX_SESSION_ID)
+    assert shard.rx_app.get_session_by_id(RX_SESSION_ID) is None
+    answers.close()
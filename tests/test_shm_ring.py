@@ -0,0 +1,54 @@
+import platform
+import pytest
+
+from diameter_telecom.diameter.shm_ring import ShmRing
+
+
+@pytest.fixture
+def ring():
+    ring = ShmRing.create(64)
+    yield ring
+    ring.close()
+
+
+def test_records_wrap_around_the_end(ring):
+    # 20-byte records take 24 bytes, so the third one is written after a wrap marker
+    for i in range(5):
+        first, second = bytes([i]) * 20, bytes([i + 100]) * 20
+        assert ring.put(first) and ring.put(second)
+        assert ring.get_many() == [first, second]
+    assert len(ring) == 0
+
+
+def test_full_ring_refuses_records(ring):
+    assert ring.put(b"a" * 20) and ring.put(b"b" * 20)
+    assert not ring.put(b"c" * 20)
+    assert not ring.put_wait(b"c" * 20, timeout=0.01)
+    assert ring.get_many(max_records=1) == [b"a" * 20]
+    # Wrapped into the room freed at the start, the bytes at the end are skipped
+    assert ring.put(b"c" * 20)
+    assert len(ring) == 64
+    assert not ring.put(b"d")
+    assert ring.get_wait(timeout=0.01) == [b"b" * 20, b"c" * 20]
+    assert ring.get_wait(timeout=0.01) == []
+
+
+def test_records_larger_than_the_ring(ring):
+    assert ring.put(b"x" * 60)
+    assert ring.get_many() == [b"x" * 60]
+    with pytest.raises(ValueError):
+        ring.put(b"x" * 61)
+
+
+def test_attached_ring_reads_records(ring):
+    other = ShmRing.attach(ring.name)
+    assert ring.put(b"ccr")
+    assert other.get_many() == [b"ccr"]
+    assert len(ring) == 0
+    other.close()
+
+
+def test_rings_are_refused_without_total_store_order(monkeypatch):
+    monkeypatch.setattr(platform, "machine", lambda: "aarch64")
+    with pytest.raises(RuntimeError):
+        ShmRing.create(64)
@@ -0,0 +1,75 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+from diameter_telecom.diameter.apn import APN
+from diameter_telecom.diameter.app import GxApplication
+from diameter_telecom.diameter.session import GxSession
+from diameter_telecom.diameter.snapshot import _pack_apn, _unpack_apn, restore_snapshot, write_snapshot
+from diameter_telecom.subscriber import Subscriber
+
+from conftest import SESSION_ID
+
+
+def entity(apns=None):
+    return SimpleNamespace(origin_host="pcrf.realm", gx_app=GxApplication(), rx_app=None, sy_app=None,
+                           carrier=None, apns=apns if apns is not None else {})
+
+
+def test_snapshot_round_trip(tmp_path):
+    apn = APN("internet", "10.0.0.0/29")
+    allocated = apn.allocate_ip()
+    source = entity({"internet": apn})
+    app = source.gx_app
+    app.add_subscriber(Subscriber(msisdn="5511900000001", imsi="724000000000001"))
+    session = GxSession(SESSION_ID)
+    session.subscriber = Subscriber(msisdn="5511900000001", imsi="724000000000001")
+    app.pcc_rules.update(session, install=["video-hd", "voice", "gaming"], remove=["voice"])
+    app.add_session(session)
+    path = str(tmp_path / "state.snap")
+    assert write_snapshot(source, path) == {"sessions": 1, "subscribers": 1, "apns": 1}
+    assert os.listdir(tmp_path) == ["state.snap"]
+
+    target = entity()
+    restored_app = target.gx_app
+    # Interned in another order by the restarted process
+    for name in ("other", "gaming", "video-hd"):
+        restored_app.pcc_rules.rules.intern(name)
+    assert restore_snapshot(target, path) == {"sessions": 1, "subscribers": 1, "apns": 1}
+    restored = restored_app.get_session_by_id(SESSION_ID)
+    assert sorted(restored_app.get_installed_rules(restored)) == ["gaming", "video-hd"]
+    assert restored_app.get_session_ids_by_rule("video-hd") == {SESSION_ID}
+    assert restored_app.get_session_ids_by_rule("other") == set()
+    assert restored.subscriber is restored_app.subscribers["5511900000001"]
+    assert target.apns["internet"].allocated_ips == {allocated}
+    assert target.apns["internet"].available_ips == 7
+
+
+def test_failed_snapshot_keeps_the_previous_file(tmp_path, monkeypatch):
+    source = entity()
+    source.gx_app.add_session(GxSession(SESSION_ID))
+    path = str(tmp_path / "state.snap")
+    write_snapshot(source, path)
+    with open(path, "rb") as f:
+        previous = f.read()
+    source.gx_app.add_subscriber(Subscriber(msisdn="5511900000001", imsi="724000000000001"))
+
+    def _pack_subscriber(subscriber):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("diameter_telecom.diameter.snapshot._pack_subscriber", _pack_subscriber)
+    with pytest.raises(OSError):
+        write_snapshot(source, path)
+    with open(path, "rb") as f:
+        assert f.read() == previous
+    assert restore_snapshot(entity(), path)["sessions"] == 1
+
+
+def test_apn_allocations_of_both_families_are_packed():
+    for cidr, ips in (("10.0.0.0/24", {"10.0.0.9", "10.0.0.10"}),
+                      ("2001:db8::/64", {"2001:db8::9", "2001:db8::a:0:1"})):
+        apn = SimpleNamespace(apn="internet", ip_pool_cidr=cidr, allocated_ips=ips)
+        name, restored_cidr, allocated = _unpack_apn(_pack_apn(apn))
+        assert (name, restored_cidr) == ("internet", cidr)
+        assert set(allocated) == ips
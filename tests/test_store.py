@@ -0,0 +1,56 @@
+from diameter.message.constants import *
+from diameter_telecom.diameter.app import GxApplication, RxApplication
+from diameter_telecom.diameter.session import GxSession, RxSession
+from diameter_telecom.diameter.session.store import DiskSessionStore
+
+from conftest import cca, ccr, diameter_message
+
+
+def store(tmp_path, capacity=2):
+    return DiskSessionStore(str(tmp_path / "sessions.sqlite"), capacity=capacity, n_shards=1)
+
+
+def test_pinned_session_is_not_evicted(tmp_path):
+    sessions = store(tmp_path)
+    sessions.pin("gx;1")
+    pinned = sessions.add(GxSession("gx;1"))
+    for i in range(2, 6):
+        sessions.add(GxSession(f"gx;{i}"))
+    assert "gx;1" in dict(sessions.hot_items())
+    pinned.origin_host = "pcef.realm"
+    sessions.unpin("gx;1")
+    for i in range(6, 9):
+        sessions.add(GxSession(f"gx;{i}"))
+    assert "gx;1" not in dict(sessions.hot_items())
+    assert sessions.get("gx;1").origin_host == "pcef.realm"
+
+
+def test_iter_cold_streams_disk_sessions(tmp_path):
+    sessions = store(tmp_path)
+    for i in range(10):
+        sessions.add(GxSession(f"gx;{i}"))
+    cold = dict(sessions.iter_cold(batch_size=3))
+    assert len(cold) == 8 and sessions.n_cold == 8
+    assert sorted(session_id for session_id, _ in sessions.iter_items()) == sorted(f"gx;{i}" for i in range(10))
+
+
+def test_rx_sessions_by_gx_session_id_on_disk(tmp_path):
+    rx_app = RxApplication(session_store=store(tmp_path))
+    for i in range(10):
+        rx_app.add_session(RxSession(f"rx;{i}", gx_session_id=f"gx;{i % 2}"))
+    assert rx_app.sessions.n_cold == 8
+    found = rx_app.get_sessions_by_gx_session_id("gx;1")
+    assert sorted(session.session_id for session in found) == [f"rx;{i}" for i in range(1, 10, 2)]
+
+
+def test_session_in_transaction_keeps_its_answer(tmp_path):
+    gx_app = GxApplication(session_store=store(tmp_path))
+    request = ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, 0, 1)
+    gx_session = gx_app._track_request(diameter_message(request))
+    for i in range(5):
+        gx_app.add_session(GxSession(f"gx;{i}"))
+    gx_app._track_answer(gx_session, diameter_message(request), diameter_message(cca(request)))
+    for i in range(5, 10):
+        gx_app.add_session(GxSession(f"gx;{i}"))
+    stored = gx_app.get_session_by_id(request.session_id)
+    assert [message.name for message in stored.messages] == ["CCR-I", "CCA-I"]
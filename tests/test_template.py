@@ -0,0 +1,71 @@
+import pytest
+
+from diameter.message import Message
+from diameter.message.avp.grouped import SubscriptionId
+from diameter.message.constants import *
+from diameter_telecom.diameter.template import CCR_FIELDS, MessageTemplate
+
+from conftest import ccr
+
+
+def ccr_i(session_id="pcef.realm;1;1", cc_request_number=0, msisdn="5511900000001", imsi="724000000000001",
+          framed_ip_address=bytes([10, 0, 0, 1])):
+    request = ccr(E_CC_REQUEST_TYPE_INITIAL_REQUEST, cc_request_number, 0)
+    request.session_id = session_id
+    request.subscription_id = [
+        SubscriptionId(subscription_id_type=E_SUBSCRIPTION_ID_TYPE_END_USER_E164, subscription_id_data=msisdn),
+        SubscriptionId(subscription_id_type=E_SUBSCRIPTION_ID_TYPE_END_USER_IMSI, subscription_id_data=imsi)]
+    request.framed_ip_address = framed_ip_address
+    return request
+
+
+TEMPLATE = MessageTemplate(ccr_i(), CCR_FIELDS)
+
+
+def rendered(**values) -> Message:
+    data = TEMPLATE.render(**values)
+    # Byte for byte the message the values would be encoded into
+    assert data == ccr_i(**values).as_bytes()
+    return Message.from_bytes(data)
+
+
+def subscription_ids(message: Message):
+    return [(avp.subscription_id_type, avp.subscription_id_data) for avp in message.subscription_id]
+
+
+def test_same_length_fields_are_patched_in_place():
+    message = rendered(session_id="pcef.realm;1;2", cc_request_number=7, msisdn="5511900000002",
+                       framed_ip_address=bytes([10, 0, 0, 2]))
+    assert (message.session_id, message.cc_request_number, message.framed_ip_address) == \
+        ("pcef.realm;1;2", 7, bytes([10, 0, 0, 2]))
+    assert subscription_ids(message) == [(E_SUBSCRIPTION_ID_TYPE_END_USER_E164, "5511900000002"),
+                                         (E_SUBSCRIPTION_ID_TYPE_END_USER_IMSI, "724000000000001")]
+
+
+def test_longer_and_shorter_values_fix_up_the_grouped_lengths():
+    for msisdn, imsi in (("551190000000123", "7240000000000012"), ("5511", "72400"), ("5511900", "724000000000001234")):
+        message = rendered(msisdn=msisdn, imsi=imsi)
+        assert subscription_ids(message) == [(E_SUBSCRIPTION_ID_TYPE_END_USER_E164, msisdn),
+                                             (E_SUBSCRIPTION_ID_TYPE_END_USER_IMSI, imsi)]
+        # The AVPs after the spliced ones are still found
+        assert message.framed_ip_address == bytes([10, 0, 0, 1])
+    message = rendered(session_id="pcef.realm;1234567;1", msisdn="55")
+    assert message.session_id == "pcef.realm;1234567;1"
+
+
+def test_header_ids_are_patched():
+    message = TEMPLATE.new_message(hop_by_hop_id=5, end_to_end_id=6, session_id="pcef.realm;1;3")
+    assert not message.is_decoded
+    assert (message.hop_by_hop_id, message.end_to_end_id, message.session_id) == (5, 6, "pcef.realm;1;3")
+    decoded = Message.from_bytes(message.as_bytes())
+    assert (decoded.header.hop_by_hop_identifier, decoded.header.end_to_end_identifier) == (5, 6)
+    # Left for the node to assign
+    assert Message.from_bytes(TEMPLATE.render(msisdn="55")).header.hop_by_hop_identifier == 0
+
+
+def test_invalid_fields_are_rejected():
+    for path in ("Unknown-AVP", "Subscription-Id", "Session-Id/Origin-Host", "Subscription-Id[2]/Subscription-Id-Data"):
+        with pytest.raises(ValueError):
+            MessageTemplate(ccr_i(), {"field": path})
+    with pytest.raises(KeyError):
+        TEMPLATE.render(apn="internet")
@@ -0,0 +1,67 @@
+import threading
+import time
+
+from diameter_telecom.diameter.app.worker_pool import AdaptiveWorkerPool
+
+
+def wait_until(predicate, timeout: float = 2) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_pool_grows_while_requests_wait_in_the_queue():
+    release = threading.Event()
+    pool = AdaptiveWorkerPool(lambda item: release.wait(2), min_workers=1, max_workers=8,
+                              target_wait=0.01, interval=0.05)
+    pool.start()
+    for item in range(20):
+        pool.submit(item)
+    assert wait_until(lambda: pool.size == 8)
+    # Counted once the workers are started, under the condition
+    with pool._condition:
+        assert pool.n_grown == 8
+    release.set()
+    assert wait_until(lambda: pool.n_handled == 20)
+    pool.stop()
+
+
+def test_pool_shrinks_once_idle_for_the_idle_period():
+    pool = AdaptiveWorkerPool(lambda item: None, min_workers=1, max_workers=8, interval=0.05, idle_period=0.2)
+    pool.start()
+    with pool._condition:
+        pool._resize(5)
+    started = time.monotonic()
+    assert wait_until(lambda: pool._size == 1)
+    assert time.monotonic() - started >= 0.2
+    assert (pool.n_grown, pool.n_shrunk) == (5, 4)
+    pool.stop()
+
+
+def test_retiring_workers_are_kept_instead_of_started():
+    pool = AdaptiveWorkerPool(lambda item: None, min_workers=1, max_workers=8, interval=0.05, idle_period=60)
+    pool.start()
+    # Held, so the retiring workers can not exit before they are kept
+    with pool._condition:
+        pool._resize(4)
+        pool._resize(2)
+        pool._resize(4)
+        assert (pool.n_grown, pool.n_shrunk) == (4, 0)
+        assert pool._size == 4 and pool._worker_seq == 4
+    pool.stop()
+
+
+def test_stop_handles_the_queued_items_first():
+    handled = []
+    pool = AdaptiveWorkerPool(lambda item: (time.sleep(0.001), handled.append(item)), min_workers=2,
+                              max_workers=2, interval=0.05, idle_period=60)
+    pool.start()
+    for item in range(50):
+        pool.submit(item)
+    pool.stop()
+    assert wait_until(lambda: pool._size == 0)
+    assert sorted(handled) == list(range(50))
+    assert pool.queue_depth == 0